@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+Async Request Pool
+
+Rate-limited OpenAI requests for the cloud summarization steps, run on one
+asyncio event loop instead of one blocking call at a time:
+
+- Token buckets for requests per minute and tokens per minute. A request is
+  admitted once both buckets have room for it; its token cost is estimated
+  from the prompt plus max_tokens (what the API counts against the limit)
+  and corrected from the response's usage.
+- At most max_in_flight requests are open at once.
+- A 429 pauses admission for the whole pool until the server's retry-after
+  (retry-after-ms, retry-after or x-ratelimit-reset-* headers) has passed,
+  then the request is retried. Connection errors, timeouts and 5xx responses
+  are retried with exponential backoff and jitter.
+
+Callers stay synchronous: create(**request) is a drop-in replacement for
+client.chat.completions.create that runs the request on the pool's loop (in
+a background thread) and blocks until it completes. With the summarizers'
+worker threads feeding it, throughput is bounded by the account's limits
+rather than by round-trip latency.
+
+The API base URL comes from OPENAI_BASE_URL (or base_url), so a run can be
+pointed at scripts/mock_openai_server.py, which simulates rate limits.
+"""
+
+import asyncio
+import os
+import random
+import re
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Dict, Optional
+import logging
+
+from prompt_budget import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+try:
+    import openai
+    OPENAI_AVAILABLE = True
+except ImportError:
+    OPENAI_AVAILABLE = False
+
+# Prompt tokens the API adds per chat message
+MESSAGE_OVERHEAD_TOKENS = 4
+MAX_BACKOFF_SECONDS = 60.0
+DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+DURATION_UNITS = {'ms': 0.001, 's': 1.0, 'm': 60.0, 'h': 3600.0}
+
+
+def _parse_duration(value: str) -> Optional[float]:
+    """Seconds from an OpenAI reset header such as '20ms', '1.5s' or '6m0s'."""
+    parts = DURATION_PART.findall(value or '')
+    if not parts:
+        return None
+    return sum(float(number) * DURATION_UNITS[unit] for number, unit in parts)
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """How long the server asked us to wait after a throttled request, if it said."""
+    response = getattr(error, 'response', None)
+    headers = {str(key).lower(): value for key, value in dict(getattr(response, 'headers', None) or {}).items()}
+    if headers.get('retry-after-ms'):
+        try:
+            return float(headers['retry-after-ms']) / 1000
+        except ValueError:
+            pass
+    if headers.get('retry-after'):
+        try:
+            return float(headers['retry-after'])
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(headers['retry-after']).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+    resets = [_parse_duration(headers.get(name, ''))
+              for name in ('x-ratelimit-reset-requests', 'x-ratelimit-reset-tokens')]
+    resets = [reset for reset in resets if reset is not None]
+    return max(resets) if resets else None
+
+
+def _is_transient(error: Exception) -> bool:
+    """Errors worth retrying after a backoff (other than 429)."""
+    status = getattr(error, 'status_code', None)
+    if status in (408, 409) or (status is not None and status >= 500):
+        return True
+    if isinstance(error, (ConnectionError, asyncio.TimeoutError)):
+        return True
+    return OPENAI_AVAILABLE and isinstance(error, openai.APIConnectionError)
+
+
+class TokenBucket:
+    """Bucket of per_minute units, refilled continuously; used on the pool's loop only."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until amount units are available (amounts over capacity wait for a full bucket)."""
+        self._refill()
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount: float) -> None:
+        """Remove amount units; the level may go negative when a request cost more than estimated."""
+        self._refill()
+        self.level -= amount
+
+    def give_back(self, amount: float) -> None:
+        self._refill()
+        self.level = min(self.capacity, self.level + amount)
+
+
+class AsyncRequestPool:
+    """Runs chat completion requests on an event loop under RPM/TPM limits."""
+
+    def __init__(self, requests_per_minute: Optional[float] = None,
+                 tokens_per_minute: Optional[float] = None,
+                 max_in_flight: int = 8,
+                 max_retries: int = 6,
+                 count_tokens: Callable[[str], int] = estimate_tokens,
+                 base_url: Optional[str] = None,
+                 send: Optional[Callable[..., Awaitable[Any]]] = None):
+        """
+        count_tokens: token counter for prompt text (the target model's
+            tokenizer, or an estimate).
+        send: async callable taking the request's keyword arguments; defaults
+            to an openai.AsyncOpenAI client's chat.completions.create.
+        """
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_retries = max_retries
+        self.count_tokens = count_tokens
+        self.base_url = base_url
+        self._send = send
+        self._client = None
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        # Admission is paused until this monotonic time after a 429
+        self._pause_until = 0.0
+        self._first_request: Optional[float] = None
+        self._last_response: Optional[float] = None
+        self.stats = {'requests': 0, 'failed': 0, 'retries': 0, 'throttled': 0,
+                      'wait_seconds': 0.0, 'tokens_used': 0}
+
+    @classmethod
+    def from_options(cls, requests_per_minute: Optional[float], tokens_per_minute: Optional[float],
+                     max_in_flight: int, count_tokens: Callable[[str], int] = estimate_tokens
+                     ) -> Optional['AsyncRequestPool']:
+        """Pool for the CLI options, falling back to $OPENAI_REQUESTS_PER_MINUTE and
+        $OPENAI_TOKENS_PER_MINUTE; None (plain blocking calls) when neither limit is set."""
+        requests_per_minute = requests_per_minute or float(os.getenv('OPENAI_REQUESTS_PER_MINUTE') or 0)
+        tokens_per_minute = tokens_per_minute or float(os.getenv('OPENAI_TOKENS_PER_MINUTE') or 0)
+        if not requests_per_minute and not tokens_per_minute:
+            return None
+        return cls(requests_per_minute or None, tokens_per_minute or None, max_in_flight,
+                   count_tokens=count_tokens)
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._start_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=loop.run_forever, name="async-request-pool", daemon=True)
+                self._thread.start()
+                asyncio.run_coroutine_threadsafe(self._setup(), loop).result()
+                self._loop = loop
+        return self._loop
+
+    async def _setup(self) -> None:
+        # Loop-bound primitives are created on the loop that uses them
+        self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        self._admission = asyncio.Lock()
+        if self._send is None:
+            if not OPENAI_AVAILABLE:
+                raise RuntimeError("openai is required for the async request pool")
+            self._client = openai.AsyncOpenAI(api_key=os.getenv('OPENAI_API_KEY'), base_url=self.base_url,
+                                              max_retries=0)
+            self._send = self._client.chat.completions.create
+
+    def create(self, **request) -> Any:
+        """Blocking chat completion (same arguments and response as the OpenAI client)."""
+        future = asyncio.run_coroutine_threadsafe(self.acreate(**request), self._ensure_loop())
+        return future.result()
+
+    def _estimate_tokens(self, request: Dict) -> int:
+        prompt = sum(self.count_tokens(message.get('content') or '') + MESSAGE_OVERHEAD_TOKENS
+                     for message in request.get('messages', []))
+        return prompt + (request.get('max_tokens') or 0)
+
+    async def _admit(self, tokens: int) -> None:
+        """Wait until the buckets have room (and no 429 pause is active), then take it."""
+        # One request waits at a time, so admission is first come, first served
+        async with self._admission:
+            while True:
+                wait = self._pause_until - time.monotonic()
+                if self.request_bucket:
+                    wait = max(wait, self.request_bucket.wait_time(1))
+                if self.token_bucket:
+                    wait = max(wait, self.token_bucket.wait_time(tokens))
+                if wait <= 0:
+                    break
+                self.stats['wait_seconds'] += wait
+                await asyncio.sleep(wait)
+            if self.request_bucket:
+                self.request_bucket.take(1)
+            if self.token_bucket:
+                self.token_bucket.take(tokens)
+            if self._first_request is None:
+                self._first_request = time.monotonic()
+
+    def _settle(self, estimate: int, response: Any) -> None:
+        """Correct the token bucket from the tokens the request actually used."""
+        usage = getattr(response, 'usage', None)
+        used = getattr(usage, 'total_tokens', None) if usage is not None else None
+        if used is None and isinstance(usage, dict):
+            used = usage.get('total_tokens')
+        if used is None:
+            return
+        self.stats['tokens_used'] += used
+        if self.token_bucket:
+            if used < estimate:
+                self.token_bucket.give_back(estimate - used)
+            else:
+                self.token_bucket.take(used - estimate)
+
+    def _backoff(self, attempt: int) -> float:
+        return min(MAX_BACKOFF_SECONDS, 2 ** attempt) * (0.5 + random.random() / 2)
+
+    async def acreate(self, **request) -> Any:
+        estimate = self._estimate_tokens(request)
+        attempt = 0
+        while True:
+            async with self._semaphore:
+                await self._admit(estimate)
+                try:
+                    response = await self._send(**request)
+                except Exception as e:
+                    if attempt >= self.max_retries:
+                        self.stats['failed'] += 1
+                        raise
+                    if getattr(e, 'status_code', None) == 429 and getattr(e, 'code', None) != 'insufficient_quota':
+                        # Pause every request until the server's window has reset
+                        delay = retry_after_seconds(e)
+                        if delay is None:
+                            delay = self._backoff(attempt)
+                        self._pause_until = max(self._pause_until, time.monotonic() + delay)
+                        self.stats['throttled'] += 1
+                        logger.debug(f"Rate limited, pausing requests for {delay:.2f}s")
+                        delay = 0.0
+                    elif _is_transient(e):
+                        delay = self._backoff(attempt)
+                        logger.debug(f"Request failed ({e}), retrying in {delay:.2f}s")
+                    else:
+                        self.stats['failed'] += 1
+                        raise
+                else:
+                    self.stats['requests'] += 1
+                    self._last_response = time.monotonic()
+                    self._settle(estimate, response)
+                    return response
+            attempt += 1
+            self.stats['retries'] += 1
+            if delay:
+                await asyncio.sleep(delay)
+
+    def get_stats(self) -> Dict:
+        stats = dict(self.stats)
+        stats['wait_seconds'] = round(stats['wait_seconds'], 2)
+        elapsed = ((self._last_response or 0) - self._first_request) if self._first_request else 0
+        stats.update({
+            'requests_per_minute_limit': self.requests_per_minute,
+            'tokens_per_minute_limit': self.tokens_per_minute,
+            'max_in_flight': self.max_in_flight,
+            'achieved_requests_per_minute': round(stats['requests'] / elapsed * 60, 1) if elapsed > 0 else None,
+            'achieved_tokens_per_minute': round(stats['tokens_used'] / elapsed * 60) if elapsed > 0 else None
+        })
+        return stats
+
+    def log_stats(self) -> None:
+        stats = self.get_stats()
+        logger.info(f"📊 API requests: {stats['requests']} succeeded, {stats['failed']} failed, "
+                    f"{stats['retries']} retries ({stats['throttled']} rate limited), "
+                    f"{stats['achieved_requests_per_minute'] or 0} requests/min and "
+                    f"{stats['achieved_tokens_per_minute'] or 0} tokens/min achieved "
+                    f"(limits {self.requests_per_minute or '-'} / {self.tokens_per_minute or '-'})")
+
+    def close(self) -> None:
+        """Close the client and stop the loop's thread."""
+        with self._start_lock:
+            loop, self._loop = self._loop, None
+        if loop is None:
+            return
+        if self._client is not None:
+            asyncio.run_coroutine_threadsafe(self._client.close(), loop).result()
+            self._client = None
+            self._send = None
+        loop.call_soon_threadsafe(loop.stop)
+        self._thread.join()
+        loop.close()
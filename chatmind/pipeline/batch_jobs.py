@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""
+Batch Jobs
+
+Offline mode for the cloud tagging, embedding and chat summarization steps.
+Instead of sending requests one at a time, a step writes all its pending
+requests into a JSONL job file and hands it to a submitter (--batch-mode
+submit). A later run downloads the results and ingests them through the
+step's usual output and hash bookkeeping (--batch-mode ingest). OpenAI's
+Batch API answers such files within 24 hours at half the price of
+interactive requests, which suits nightly backfills.
+
+Job files use the Batch API format. A request line is
+
+    {"custom_id": ..., "method": "POST", "url": "/v1/chat/completions", "body": {...}}
+
+and a result line is
+
+    {"custom_id": ..., "response": {"status_code": 200, "body": {...}}, "error": null}
+
+Custom IDs are derived from the hashes of the items a request covers, so the
+same pending work always yields the same IDs and work that is already in an
+open job is not submitted twice. Job IDs also carry the submission time, so
+resubmitting items whose job failed starts a new job instead of picking up
+the old job's files.
+
+A step's jobs live in <step_dir>/batch_jobs/<job_id>/:
+
+- requests.jsonl: the request lines as submitted
+- manifest.jsonl: per custom ID, the item hashes and whatever the step needs
+  to turn the result into an output record
+- job.json: state (submitted, ingested or failed), submitter and remote ID
+- results.jsonl: the result lines, once downloaded
+
+Submitters are pluggable. OpenAIBatchSubmitter uploads the file to the Batch
+API. LocalFileSubmitter copies it to <dir>/<job_id>.input.jsonl and treats
+the job as done once <dir>/<job_id>.output.jsonl exists (written by hand, by
+a test, or by scripts/mock_openai_server.py --complete-batches), so the
+round trip runs without an API key.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+import logging
+
+from run_journal import atomic_write
+
+logger = logging.getLogger(__name__)
+
+try:
+    import openai
+    OPENAI_AVAILABLE = True
+except ImportError:
+    OPENAI_AVAILABLE = False
+
+CHAT_COMPLETIONS = "/v1/chat/completions"
+EMBEDDINGS = "/v1/embeddings"
+BATCH_MODES = ('submit', 'ingest')
+SUBMITTERS = ('openai', 'local')
+# Batch API limit on requests per input file
+MAX_REQUESTS_PER_JOB = 50000
+
+# Batch API states: these have (possibly partial) output, 'failed' has none
+OPENAI_DONE_STATES = {'completed', 'expired', 'cancelled'}
+
+
+def custom_id(prefix: str, item_hashes: Iterable[str]) -> str:
+    """Stable custom ID for a request covering the given items."""
+    digest = hashlib.sha256("\n".join(item_hashes).encode('utf-8')).hexdigest()
+    return f"{prefix}-{digest[:24]}"
+
+
+def job_id_for(requests: List[Dict]) -> str:
+    """ID for a new job over the given requests, unique per submission."""
+    digest = custom_id('job', (request['custom_id'] for request in requests))
+    return f"{digest}-{datetime.now().strftime('%Y%m%d%H%M%S%f')}"
+
+
+def batch_request(prefix: str, item_hashes: List[str], body: Dict, **entry) -> Dict:
+    """A request for BatchJobStore.submit; entry is kept in the manifest for ingestion."""
+    return {'custom_id': custom_id(prefix, item_hashes), 'hashes': list(item_hashes), 'body': body, **entry}
+
+
+def completion_text(body: Dict) -> str:
+    """Text of a chat completion response body."""
+    try:
+        return body['choices'][0]['message'].get('content') or ''
+    except (KeyError, IndexError, TypeError, AttributeError):
+        return ''
+
+
+def embedding_vectors(body: Dict) -> List[List[float]]:
+    """Vectors of an embeddings response body, in input order."""
+    data = sorted(body.get('data') or [], key=lambda item: item.get('index', 0))
+    return [item.get('embedding') or [] for item in data]
+
+
+class LocalFileSubmitter:
+    """Stand-in for the Batch API that exchanges job files through a local directory."""
+
+    name = 'local'
+
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _output(self, remote_id: str) -> Path:
+        return self.directory / f"{remote_id}.output.jsonl"
+
+    def submit(self, requests_file: Path, job_id: str, endpoint: str) -> str:
+        # An output left over from an earlier exchange would complete the job at once
+        self._output(job_id).unlink(missing_ok=True)
+        shutil.copyfile(requests_file, self.directory / f"{job_id}.input.jsonl")
+        return job_id
+
+    def status(self, remote_id: str) -> str:
+        return 'completed' if self._output(remote_id).exists() else 'in_progress'
+
+    def download(self, remote_id: str, results_file: Path) -> None:
+        with atomic_write(results_file) as tmp_file:
+            shutil.copyfile(self._output(remote_id), tmp_file)
+
+
+class OpenAIBatchSubmitter:
+    """Submits job files to OpenAI's Batch API."""
+
+    name = 'openai'
+
+    def __init__(self, client=None, completion_window: str = "24h"):
+        if client is None:
+            if not OPENAI_AVAILABLE:
+                raise ImportError("The openai package is required for the 'openai' batch submitter")
+            client = openai.OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+        self.client = client
+        self.completion_window = completion_window
+
+    def submit(self, requests_file: Path, job_id: str, endpoint: str) -> str:
+        with open(requests_file, 'rb') as f:
+            uploaded = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(input_file_id=uploaded.id, endpoint=endpoint,
+                                           completion_window=self.completion_window,
+                                           metadata={'job_id': job_id})
+        return batch.id
+
+    def status(self, remote_id: str) -> str:
+        status = self.client.batches.retrieve(remote_id).status
+        if status in OPENAI_DONE_STATES:
+            return 'completed'
+        return 'failed' if status == 'failed' else 'in_progress'
+
+    def download(self, remote_id: str, results_file: Path) -> None:
+        # Successful results and per-request errors come in separate files
+        batch = self.client.batches.retrieve(remote_id)
+        with atomic_write(results_file) as tmp_file, open(tmp_file, 'wb') as f:
+            for file_id in (batch.output_file_id, batch.error_file_id):
+                if file_id:
+                    content = self.client.files.content(file_id).content
+                    f.write(content if content.endswith(b"\n") or not content else content + b"\n")
+
+
+def make_submitter(name: str, local_dir: Path):
+    """Submitter by name; local_dir is where the local submitter exchanges files."""
+    if name == 'local':
+        return LocalFileSubmitter(local_dir)
+    if name == 'openai':
+        return OpenAIBatchSubmitter()
+    raise ValueError(f"Unknown batch submitter: {name} (expected one of {', '.join(SUBMITTERS)})")
+
+
+class BatchJob:
+    """One submitted job file and its bookkeeping."""
+
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+        with open(self.directory / "job.json", 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+
+    @property
+    def id(self) -> str:
+        return self.meta['job_id']
+
+    @property
+    def state(self) -> str:
+        return self.meta['state']
+
+    @property
+    def results_file(self) -> Path:
+        return self.directory / "results.jsonl"
+
+    def save(self, **changes) -> None:
+        self.meta.update(changes, updated_at=datetime.now().isoformat())
+        with atomic_write(self.directory / "job.json") as tmp_file, open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(self.meta, f, indent=2)
+
+    def manifest(self) -> List[Dict]:
+        with open(self.directory / "manifest.jsonl", 'r', encoding='utf-8') as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def results(self) -> Iterator[Tuple[Dict, Optional[Dict], Optional[str]]]:
+        """(manifest entry, response body or None, error or None) for every request in the job."""
+        responses = {}
+        if self.results_file.exists():
+            with open(self.results_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        result = json.loads(line)
+                        responses[result.get('custom_id')] = result
+        for entry in self.manifest():
+            result = responses.get(entry['custom_id'])
+            if result is None:
+                yield entry, None, "no result"
+                continue
+            response = result.get('response') or {}
+            if result.get('error') or response.get('status_code') != 200:
+                error = result.get('error') or (response.get('body') or {}).get('error') or response.get('status_code')
+                yield entry, None, json.dumps(error) if isinstance(error, dict) else str(error)
+            else:
+                yield entry, response.get('body') or {}, None
+
+
+class BatchJobStore:
+    """Batch jobs of one pipeline step, kept in <step_dir>/batch_jobs/."""
+
+    def __init__(self, step_dir: Path, submitter):
+        self.directory = Path(step_dir) / "batch_jobs"
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.submitter = submitter
+        self.stats = {'submitted_jobs': 0, 'submitted_requests': 0, 'already_open_requests': 0,
+                      'ingested_jobs': 0, 'ingested_items': 0, 'failed_items': 0,
+                      'failed_jobs': 0, 'pending_jobs': 0}
+
+    @classmethod
+    def from_options(cls, step_dir: Path, submitter: str = 'openai',
+                     local_dir: Optional[str] = None) -> 'BatchJobStore':
+        """Store for a step's CLI options; the local submitter defaults to $CHATMIND_BATCH_DIR
+        or <processed_dir>/batch_exchange."""
+        local_dir = local_dir or os.getenv('CHATMIND_BATCH_DIR') or Path(step_dir).parent / "batch_exchange"
+        return cls(step_dir, make_submitter(submitter, Path(local_dir)))
+
+    def jobs(self, state: Optional[str] = None) -> List[BatchJob]:
+        jobs = []
+        for job_file in sorted(self.directory.glob("*/job.json")):
+            job = BatchJob(job_file.parent)
+            if state is None or job.state == state:
+                jobs.append(job)
+        return jobs
+
+    def open_hashes(self) -> Set[str]:
+        """Hashes of items in submitted jobs that have not been ingested yet."""
+        return {item_hash for job in self.jobs('submitted') for entry in job.manifest()
+                for item_hash in entry['hashes']}
+
+    def submit(self, endpoint: str, requests: List[Dict]) -> List[BatchJob]:
+        """Write requests (from batch_request) into job files and submit them."""
+        open_ids = {entry['custom_id'] for job in self.jobs('submitted') for entry in job.manifest()}
+        pending = [request for request in requests if request['custom_id'] not in open_ids]
+        self.stats['already_open_requests'] += len(requests) - len(pending)
+
+        submitted = []
+        for start in range(0, len(pending), MAX_REQUESTS_PER_JOB):
+            part = pending[start:start + MAX_REQUESTS_PER_JOB]
+            job_id = job_id_for(part)
+            job_dir = self.directory / job_id
+            job_dir.mkdir(parents=True, exist_ok=True)
+            with atomic_write(job_dir / "requests.jsonl") as tmp_file, open(tmp_file, 'w', encoding='utf-8') as f:
+                for request in part:
+                    f.write(json.dumps({'custom_id': request['custom_id'], 'method': 'POST',
+                                        'url': endpoint, 'body': request['body']}, ensure_ascii=False) + "\n")
+            with atomic_write(job_dir / "manifest.jsonl") as tmp_file, open(tmp_file, 'w', encoding='utf-8') as f:
+                for request in part:
+                    f.write(json.dumps({key: value for key, value in request.items() if key != 'body'},
+                                       ensure_ascii=False) + "\n")
+
+            job_file = job_dir / "job.json"
+            with atomic_write(job_file) as tmp_file, open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump({'job_id': job_id, 'state': 'created', 'endpoint': endpoint,
+                           'submitter': self.submitter.name, 'requests': len(part),
+                           'created_at': datetime.now().isoformat()}, f, indent=2)
+            job = BatchJob(job_dir)
+            remote_id = self.submitter.submit(job_dir / "requests.jsonl", job_id, endpoint)
+            job.save(state='submitted', remote_id=remote_id, submitted_at=datetime.now().isoformat())
+            logger.info(f"📦 Submitted batch job {job_id} ({len(part)} requests, {self.submitter.name} submitter)")
+            submitted.append(job)
+
+        self.stats['submitted_jobs'] += len(submitted)
+        self.stats['submitted_requests'] += len(pending)
+        return submitted
+
+    def collect(self) -> List[BatchJob]:
+        """Submitted jobs whose results are ready, with their results downloaded."""
+        ready = []
+        for job in self.jobs('submitted'):
+            if job.meta.get('submitter') != self.submitter.name:
+                logger.warning(f"Batch job {job.id} was submitted with the {job.meta.get('submitter')} "
+                               f"submitter, skipping it")
+                self.stats['pending_jobs'] += 1
+                continue
+            status = self.submitter.status(job.meta['remote_id'])
+            if status == 'completed':
+                self.submitter.download(job.meta['remote_id'], job.results_file)
+                ready.append(job)
+            elif status == 'failed':
+                # Its items are no longer open and are submitted again next time
+                logger.warning(f"Batch job {job.id} failed, its requests will be resubmitted")
+                job.save(state='failed')
+                self.stats['failed_jobs'] += 1
+            else:
+                self.stats['pending_jobs'] += 1
+        logger.info(f"📦 {len(ready)} batch job(s) ready to ingest, {self.stats['pending_jobs']} still running")
+        return ready
+
+    def mark_ingested(self, jobs: List[BatchJob], ingested: int, failed: int) -> None:
+        """Close jobs once the step has saved their results.
+
+        ingested and failed count items; failed items are no longer open and
+        are submitted again next time.
+        """
+        for job in jobs:
+            job.save(state='ingested', ingested_at=datetime.now().isoformat())
+        self.stats['ingested_jobs'] += len(jobs)
+        self.stats['ingested_items'] += ingested
+        self.stats['failed_items'] += failed
+
+    def get_stats(self) -> Dict:
+        return {'submitter': self.submitter.name, **self.stats}
+
+    def log_stats(self) -> None:
+        stats = self.stats
+        logger.info(f"📊 Batch jobs: {stats['submitted_jobs']} submitted ({stats['submitted_requests']} requests, "
+                    f"{stats['already_open_requests']} already open), {stats['ingested_jobs']} ingested "
+                    f"({stats['ingested_items']} items, {stats['failed_items']} failed), "
+                    f"{stats['pending_jobs']} pending, {stats['failed_jobs']} failed jobs")
@@ -10,17 +10,36 @@ import json
 import jsonlines
 import click
 from pathlib import Path
-from typing import Dict, List, Set, Optional, Union
+from collections import ChainMap, Counter
+from typing import Dict, List, Set, Optional, Tuple, Union
 import logging
 from tqdm import tqdm
 import hashlib
 import pickle
+import threading
+import time
 from datetime import datetime
 import openai
 import os
 import re
 import unicodedata
 
+# Import shared pipeline modules
+import sys
+sys.path.append(str(Path(__file__).parent.parent.parent))
+from llm_cache import open_prompt_cache, cached_chat_completion
+from run_journal import RunJournal, atomic_write
+from summary_store import SummaryStore, open_summary_store
+from work_scheduler import WorkScheduler, PRIORITIES
+from worker_pool import map_reduce_ordered
+from async_request_pool import AsyncRequestPool
+from batch_jobs import BatchJobStore, BATCH_MODES, SUBMITTERS, CHAT_COMPLETIONS, batch_request, completion_text
+from chat_summarization.incremental import MessageIndex, plan_incremental_update
+from chat_summarization.extractive import compress_conversation, load_message_vectors
+from chat_summarization.composed import ChatComposer
+from prompt_budget import PromptBudget
+from triage import ChatTriage, TRIVIAL_MAX_TURNS, TRIVIAL_MAX_CHARS
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -28,15 +47,56 @@ logger = logging.getLogger(__name__)
 class CloudChatSummarizer:
     """Creates chat summaries using OpenAI API."""
     
-    def __init__(self, chats_file: str = "../../data/processed/ingestion/chats.jsonl"):
+    def __init__(self, chats_file: str = "../../data/processed/ingestion/chats.jsonl",
+                 incremental: bool = True,
+                 incremental_threshold: float = 0.3,
+                 compression: bool = True,
+                 composed: bool = False,
+                 composed_min_coverage: float = 0.6,
+                 triage: bool = False,
+                 triage_max_turns: int = TRIVIAL_MAX_TURNS,
+                 triage_max_chars: int = TRIVIAL_MAX_CHARS,
+                 context_window: Optional[int] = None,
+                 context_fraction: float = 0.75,
+                 max_workers: int = 1,
+                 request_pool: Optional[AsyncRequestPool] = None,
+                 scheduler: Optional[WorkScheduler] = None):
         self.chats_file = Path(chats_file)
+        # Chats summarized concurrently
+        self.max_workers = max(1, max_workers)
+        # Chat order and the per-run time/token budget
+        self.scheduler = scheduler or WorkScheduler()
         
         # Use modular directory structure
         self.output_dir = Path("../../data/processed/chat_summarization")
         self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.cache = open_prompt_cache(self.output_dir.parent)
+        
+        # Grown chats update their previous summary unless the new part exceeds the threshold
+        self.incremental = incremental
+        self.incremental_threshold = incremental_threshold
+        self.message_index = MessageIndex(self.output_dir / "message_index.pkl")
+        # Long chats are compressed extractively to fit one prompt before falling back to chunking
+        self.compression = compression
+        self._message_vectors: Optional[Dict] = None
+        self._vectors_lock = threading.Lock()
+        # Well-clustered chats are summarized from their cluster summaries and tags instead of the transcript
+        self.composer = ChatComposer(self.output_dir.parent, composed_min_coverage) if composed else None
+        self.composition_fallbacks = Counter()
+        self._fallbacks_lock = threading.Lock()
+        # Trivial chats get a template summary instead of an LLM summary
+        self.triage = ChatTriage(triage_max_turns, triage_max_chars) if triage else None
+        # Prompts are packed by token count to a share of the model's context window
+        self.budget = PromptBudget('gpt-4o-mini', context_window, context_fraction)
         
-        # Initialize OpenAI client
+        # Initialize OpenAI client; with a request pool, calls run on its event loop under RPM/TPM limits
         self.client = openai.OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+        self.request_pool = request_pool
+        self.create = self.client.chat.completions.create
+        if request_pool:
+            # Pool admission counts prompt tokens with the model's tokenizer
+            request_pool.count_tokens = self.budget.count
+            self.create = request_pool.create
         
     def _generate_chat_hash(self, chat_id: str, messages: List[Dict]) -> str:
         """Generate a hash for a chat to track if it's been processed."""
@@ -66,7 +126,7 @@ class CloudChatSummarizer:
         """Save hashes of processed chats."""
         hash_file = self.output_dir / "hashes.pkl"
         try:
-            with open(hash_file, 'wb') as f:
+            with atomic_write(hash_file) as tmp_file, open(tmp_file, 'wb') as f:
                 pickle.dump(hashes, f)
             logger.info(f"Saved {len(hashes)} processed chat hashes")
         except Exception as e:
@@ -88,17 +148,11 @@ class CloudChatSummarizer:
         except Exception as e:
             logger.error(f"Failed to save metadata: {e}")
     
-    def _load_existing_summaries(self, summaries_file: Path) -> Dict:
-        """Load existing summaries from output file."""
-        summaries = {}
-        if summaries_file.exists():
-            try:
-                with open(summaries_file, 'r') as f:
-                    summaries = json.load(f)
-                logger.info(f"Loaded {len(summaries)} existing summaries")
-            except Exception as e:
-                logger.warning(f"Failed to load existing summaries: {e}")
-        return summaries
+    def _load_existing_summaries(self) -> SummaryStore:
+        """Open the summary store; existing summaries are read from it on demand."""
+        store = open_summary_store(self.output_dir, "chat_summaries")
+        logger.info(f"Found {len(store)} existing summaries")
+        return store
     
     def _load_chats(self) -> List[Dict]:
         """Load chats from JSONL file."""
@@ -121,8 +175,7 @@ class CloudChatSummarizer:
         
         # Format conversation (limit to avoid token limits)
         conversation_lines = []
-        total_chars = 0
-        max_chars = 200000  # Much higher limit for GPT-4o-mini (128k tokens ≈ 400k chars)
+        total_tokens = 0
         
         for msg in messages:
             role = msg.get('role', 'unknown')
@@ -130,12 +183,13 @@ class CloudChatSummarizer:
             if content:
                 sanitized_content = self._sanitize_text(content)
                 line = f"{role.upper()}: {sanitized_content}"
-                if total_chars + len(line) > max_chars:
+                line_tokens = self.budget.count(line) + 2
+                if total_tokens + line_tokens > self.budget.max_tokens:
                     # Add truncation indicator
                     conversation_lines.append("... (conversation truncated)")
                     break
                 conversation_lines.append(line)
-                total_chars += len(line)
+                total_tokens += line_tokens
         
         if not conversation_lines:
             return ""
@@ -218,84 +272,87 @@ Respond only with valid JSON."""
         
         return text
     
-    def _get_summary_from_openai(self, prompt: str) -> Optional[Dict]:
-        """Get summary from OpenAI API."""
+    def _summary_messages(self, prompt: str) -> List[Dict]:
+        """Chat messages of a summary request."""
+        return [
+            {"role": "system", "content": "You are a helpful assistant that creates comprehensive summaries of conversation content. Always respond with valid JSON."},
+            {"role": "user", "content": prompt}
+        ]
+    
+    def _is_complete_summary_response(self, response_text: str) -> bool:
+        """Whether a response holds a summary with all required fields (and may be cached)."""
+        start_idx = response_text.find('{')
+        end_idx = response_text.rfind('}') + 1
+        if start_idx == -1 or end_idx <= start_idx:
+            return False
         try:
-            response = self.client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant that creates comprehensive summaries of conversation content. Always respond with valid JSON."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.3,
-                max_tokens=1500
-            )
-            
-            response_text = response.choices[0].message.content.strip()
+            summary = json.loads(response_text[start_idx:end_idx])
+        except json.JSONDecodeError:
+            return False
+        required_fields = ['summary', 'key_topics', 'participants', 'conversation_type',
+                           'key_decisions', 'outcomes', 'complexity', 'domain', 'confidence']
+        return isinstance(summary, dict) and all(field in summary for field in required_fields)
+    
+    def _parse_summary_response(self, response_text: str) -> Dict:
+        """Summary from a response's JSON, or a fallback summary if it has none or misses fields."""
+        try:
+            # Find JSON in the response
+            start_idx = response_text.find('{')
+            end_idx = response_text.rfind('}') + 1
             
-            # Try to extract JSON from response
-            try:
-                # Find JSON in the response
-                start_idx = response_text.find('{')
-                end_idx = response_text.rfind('}') + 1
+            if start_idx != -1 and end_idx > start_idx:
+                json_str = response_text[start_idx:end_idx]
+                summary = json.loads(json_str)
                 
-                if start_idx != -1 and end_idx > start_idx:
-                    json_str = response_text[start_idx:end_idx]
-                    summary = json.loads(json_str)
-                    
-                    # Validate required fields
-                    required_fields = ['summary', 'key_topics', 'participants', 'conversation_type', 
-                                    'key_decisions', 'outcomes', 'complexity', 'domain', 'confidence']
-                    if all(field in summary for field in required_fields):
-                        return summary
-                    else:
-                        logger.warning(f"Missing required fields in summary: {summary}")
-                        # Try to create a fallback summary
-                        return self._create_fallback_summary(summary)
+                # Validate required fields
+                required_fields = ['summary', 'key_topics', 'participants', 'conversation_type', 
+                                'key_decisions', 'outcomes', 'complexity', 'domain', 'confidence']
+                if all(field in summary for field in required_fields):
+                    return summary
                 else:
-                    logger.warning(f"No JSON found in response: {response_text}")
-                    return self._create_fallback_summary({})
-                    
-            except json.JSONDecodeError as e:
-                logger.warning(f"Failed to parse JSON from response: {e}")
-                logger.warning(f"Response: {response_text}")
+                    logger.warning(f"Missing required fields in summary: {summary}")
+                    # Try to create a fallback summary
+                    return self._create_fallback_summary(summary)
+            else:
+                logger.warning(f"No JSON found in response: {response_text}")
                 return self._create_fallback_summary({})
-        
+                
+        except json.JSONDecodeError as e:
+            logger.warning(f"Failed to parse JSON from response: {e}")
+            logger.warning(f"Response: {response_text}")
+            return self._create_fallback_summary({})
+    
+    def _get_summary_from_openai(self, prompt: str) -> Optional[Dict]:
+        """Get summary from OpenAI API."""
+        try:
+            response_text = cached_chat_completion(
+                self.create,
+                self.cache,
+                "gpt-4o-mini",
+                self._summary_messages(prompt),
+                temperature=0.3,
+                # Only complete summaries are cached; malformed replies are asked for again
+                accept=lambda text: self._is_complete_summary_response(text.strip()),
+                max_tokens=1500
+            ).strip()
         except Exception as e:
             logger.error(f"Error calling OpenAI API: {e}")
+            return None
         
-        return None
+        # Try to extract JSON from response
+        return self._parse_summary_response(response_text)
+    
+    def _turn_text(self, msg: Dict) -> str:
+        """A message as it appears in a summary prompt."""
+        return f"{msg.get('role', 'unknown').upper()}: {msg.get('content', '')}"
     
     def _should_chunk_conversation(self, messages: List[Dict]) -> bool:
-        """Determine if conversation should be chunked based on size."""
-        total_chars = sum(len(msg.get('content', '')) for msg in messages)
-        return total_chars > 200000  # Much higher limit for GPT-4o-mini (128k tokens ≈ 400k chars)
+        """Determine if conversation should be chunked based on its size in tokens."""
+        return not self.budget.fits([self._turn_text(msg) for msg in messages])
     
-    def _create_chunks(self, messages: List[Dict], max_chars: int = 200000) -> List[List[Dict]]:
-        """Split conversation into manageable chunks."""
-        chunks = []
-        current_chunk = []
-        current_chars = 0
-        
-        for msg in messages:
-            msg_content = msg.get('content', '')
-            msg_line = f"{msg.get('role', 'unknown').upper()}: {msg_content}"
-            
-            if current_chars + len(msg_line) > max_chars and current_chunk:
-                # Start new chunk
-                chunks.append(current_chunk)
-                current_chunk = [msg]
-                current_chars = len(msg_line)
-            else:
-                # Add to current chunk
-                current_chunk.append(msg)
-                current_chars += len(msg_line)
-        
-        # Add final chunk
-        if current_chunk:
-            chunks.append(current_chunk)
-        
-        return chunks
+    def _create_chunks(self, messages: List[Dict]) -> List[List[Dict]]:
+        """Split conversation into chunks that each fit one prompt."""
+        return self.budget.pack(messages, self._turn_text)
     
     def _summarize_chunk(self, chunk: List[Dict], chunk_index: int, total_chunks: int) -> Optional[Dict]:
         """Summarize a single chunk of the conversation."""
@@ -310,7 +367,8 @@ Respond only with valid JSON."""
         if not conversation_lines:
             return None
         
-        conversation_text = "\n\n".join(conversation_lines)
+        # A single message larger than the budget is cut to fit
+        conversation_text = self.budget.truncate("\n\n".join(conversation_lines), self.budget.max_tokens)
         
         prompt = f"""Summarize this conversation chunk ({chunk_index + 1} of {total_chunks}) in JSON format:
 
@@ -336,11 +394,9 @@ Respond with JSON only:
         ])
         
         # Check if combined summaries exceed token limit
-        total_chars = len(summaries_text)
-        max_chars = 80000  # Higher limit for GPT-4o-mini (128k tokens ≈ 400k chars)
-        
-        if total_chars > max_chars:
-            logger.warning(f"Combined chunk summaries ({total_chars} chars) exceed limit ({max_chars} chars)")
+        total_tokens = self.budget.count(summaries_text)
+        if total_tokens > self.budget.max_tokens:
+            logger.warning(f"Combined chunk summaries ({total_tokens} tokens) exceed limit ({self.budget.max_tokens} tokens)")
             return self._create_hierarchical_summary_prompt(chunk_summaries)
         
         prompt = f"""Combine these conversation chunk summaries into a comprehensive summary:
@@ -365,9 +421,8 @@ Respond with JSON only:
     
     def _create_hierarchical_summary_prompt(self, chunk_summaries: List[Dict]) -> str:
         """Create hierarchical summary when too many chunks exist."""
-        # Group chunks into manageable batches
-        batch_size = 10  # Process 10 chunks at a time (higher for GPT-4o-mini)
-        batches = [chunk_summaries[i:i + batch_size] for i in range(0, len(chunk_summaries), batch_size)]
+        # Group chunk summaries into batches that each fit one prompt
+        batches = self.budget.pack(chunk_summaries, lambda summary: f"Chunk 00: {summary.get('summary', '')}")
         
         logger.info(f"Creating hierarchical summary from {len(chunk_summaries)} chunks in {len(batches)} batches")
         
@@ -477,19 +532,124 @@ Respond with JSON only:
         
         logger.info(f"Summarizing chat {chat_id} with {len(messages)} messages")
         
+        if self.composer:
+            summary = self._summarize_chat_composed(chat)
+            if summary:
+                return summary
+        
         # Check if conversation needs chunking
         if self._should_chunk_conversation(messages):
+            if self.compression:
+                summary = self._summarize_chat_compressed(chat)
+                if summary:
+                    return summary
             logger.info(f"Chat {chat_id} is large, using chunked summarization")
             return self._summarize_chat_chunked(chat)
         else:
             # Use original single-pass summarization
             return self._summarize_chat_single_pass(chat)
     
+    def _create_composed_prompt(self, digest: str) -> str:
+        """Create a prompt for summarizing a chat from its digest of cluster summaries and tags."""
+        prompt = f"""You are a conversation summarizer. Instead of the transcript, you get a digest of a conversation: its opening request, summaries of the topic clusters its messages belong to, and tags of its messages. Provide a JSON summary of the conversation.
+
+DIGEST:
+{digest}
+
+INSTRUCTIONS:
+- Summarize this conversation, not the clusters in general
+- Weigh clusters by their share of the conversation
+- Only state decisions and outcomes the digest supports
+- Avoid trailing commas in arrays
+- Ensure all JSON syntax is correct
+
+JSON FORMAT (use exactly these field names):
+{{
+    "summary": "Brief comprehensive summary of the conversation",
+    "key_topics": ["topic1", "topic2", "topic3"],
+    "participants": ["user", "assistant"],
+    "conversation_type": "technical_discussion|casual_chat|problem_solving|tutorial|brainstorming|other",
+    "key_decisions": ["decision1", "decision2"],
+    "outcomes": "What was accomplished or learned",
+    "complexity": "beginner|intermediate|advanced",
+    "domain": "technical|personal|business|academic|creative|other",
+    "confidence": 0.85
+}}
+
+RESPOND WITH JSON ONLY:"""
+
+        return prompt
+    
+    def _count_fallback(self, reason: str) -> None:
+        """Count a chat that could not be composed (called from worker threads)."""
+        with self._fallbacks_lock:
+            self.composition_fallbacks[reason] += 1
+    
+    def _summarize_chat_composed(self, chat: Dict) -> Optional[Dict]:
+        """Summarize a well-clustered chat from its cluster summaries and tags instead of its transcript."""
+        chat_id = chat.get('content_hash', chat.get('chat_id', 'unknown'))
+        messages = chat.get('messages', [])
+        
+        clusters, reason = self.composer.load().plan(chat_id)
+        if clusters is None:
+            self._count_fallback(reason)
+            return None
+        digest = self.composer.digest(chat, clusters, self.budget.truncate)
+        if self.budget.count(digest) >= self.budget.total([self._turn_text(msg) for msg in messages]):
+            # Short chats are cheaper to summarize from the transcript
+            self._count_fallback('transcript_smaller')
+            return None
+        
+        summary = self._get_summary_from_openai(self._create_composed_prompt(digest))
+        if not summary:
+            logger.warning(f"Failed to compose summary of chat {chat_id}, summarizing the transcript")
+            self._count_fallback('llm_failed')
+            return None
+        
+        summary['chat_id'] = chat_id
+        summary['message_count'] = len(messages)
+        summary['timestamp'] = datetime.now().isoformat()
+        summary['model'] = 'gpt-4o-mini'
+        summary['processing_method'] = 'composed'
+        summary['cluster_ids'] = [cluster_id for cluster_id, _ in clusters]
+        summary['cluster_coverage'] = round(sum(share for _, share in clusters), 3)
+        summary['duration_minutes'] = None
+        if 'timestamp' in messages[0] and 'timestamp' in messages[-1]:
+            try:
+                start_time = datetime.fromisoformat(messages[0]['timestamp'].replace('Z', '+00:00'))
+                end_time = datetime.fromisoformat(messages[-1]['timestamp'].replace('Z', '+00:00'))
+                summary['duration_minutes'] = round((end_time - start_time).total_seconds() / 60, 1)
+            except (AttributeError, TypeError, ValueError):
+                pass
+        return summary
+    
+    def _summarize_chat_compressed(self, chat: Dict) -> Optional[Dict]:
+        """Summarize a long chat in one pass from an extractive compression of its turns."""
+        chat_id = chat.get('content_hash', chat.get('chat_id', 'unknown'))
+        messages = chat.get('messages', [])
+        
+        with self._vectors_lock:
+            if self._message_vectors is None:
+                self._message_vectors = load_message_vectors(self.output_dir.parent / "embedding" / "embeddings.jsonl")
+        compressed, stats = compress_conversation(messages, self._message_vectors, self.budget.max_tokens,
+                                                  cost=lambda msg: self.budget.count(self._turn_text(msg)) + 2)
+        if not compressed:
+            logger.info(f"Chat {chat_id} could not be compressed to one prompt ({stats['method']})")
+            return None
+        logger.info(f"Compressed chat {chat_id} from {stats['original_size']} to "
+                    f"{stats['compressed_size']} tokens ({stats['method']})")
+        
+        summary = self._summarize_chat_single_pass({**chat, 'messages': compressed})
+        if summary:
+            summary['message_count'] = len(messages)
+            summary['processing_method'] = 'compressed_single_pass'
+            summary['compression'] = stats
+        return summary
+    
     def _summarize_chat_single_pass(self, chat: Dict) -> Optional[Dict]:
         """Summarize chat using single pass (original method)."""
         # Use content_hash as chat_id, fallback to 'unknown' if not available
         chat_id = chat.get('content_hash', chat.get('chat_id', 'unknown'))
-        messages = chat.get('messages', [])
         
         # Create prompt
         prompt = self._create_summary_prompt(chat)
@@ -501,35 +661,37 @@ Respond with JSON only:
         summary = self._get_summary_from_openai(prompt)
         
         if summary:
-            # Add metadata
-            summary['chat_id'] = chat_id
-            summary['message_count'] = len(messages)
-            summary['timestamp'] = datetime.now().isoformat()
-            summary['model'] = 'gpt-4o-mini'
-            summary['processing_method'] = 'single_pass'
-            
-            # Calculate duration if timestamps are available
-            if messages:
-                first_msg = messages[0]
-                last_msg = messages[-1]
-                if 'timestamp' in first_msg and 'timestamp' in last_msg:
-                    try:
-                        from datetime import datetime
-                        start_time = datetime.fromisoformat(first_msg['timestamp'].replace('Z', '+00:00'))
-                        end_time = datetime.fromisoformat(last_msg['timestamp'].replace('Z', '+00:00'))
-                        duration_minutes = (end_time - start_time).total_seconds() / 60
-                        summary['duration_minutes'] = round(duration_minutes, 1)
-                    except:
-                        summary['duration_minutes'] = None
-                else:
-                    summary['duration_minutes'] = None
-            
             logger.info(f"Successfully summarized chat {chat_id}")
-            return summary
+            return self._add_single_pass_metadata(summary, chat)
         else:
             logger.warning(f"Failed to summarize chat {chat_id}")
             return None
     
+    def _add_single_pass_metadata(self, summary: Dict, chat: Dict) -> Dict:
+        """Add the chat's metadata to a single-pass summary."""
+        messages = chat.get('messages', [])
+        summary['chat_id'] = chat.get('content_hash', chat.get('chat_id', 'unknown'))
+        summary['message_count'] = len(messages)
+        summary['timestamp'] = datetime.now().isoformat()
+        summary['model'] = 'gpt-4o-mini'
+        summary['processing_method'] = 'single_pass'
+        
+        # Calculate duration if timestamps are available
+        if messages:
+            first_msg = messages[0]
+            last_msg = messages[-1]
+            if 'timestamp' in first_msg and 'timestamp' in last_msg:
+                try:
+                    start_time = datetime.fromisoformat(first_msg['timestamp'].replace('Z', '+00:00'))
+                    end_time = datetime.fromisoformat(last_msg['timestamp'].replace('Z', '+00:00'))
+                    duration_minutes = (end_time - start_time).total_seconds() / 60
+                    summary['duration_minutes'] = round(duration_minutes, 1)
+                except:
+                    summary['duration_minutes'] = None
+            else:
+                summary['duration_minutes'] = None
+        return summary
+    
     def _summarize_chat_chunked(self, chat: Dict) -> Optional[Dict]:
         """Summarize chat using chunked approach for large conversations."""
         # Use content_hash as chat_id, fallback to 'unknown' if not available
@@ -575,7 +737,6 @@ Respond with JSON only:
                 last_msg = messages[-1]
                 if 'timestamp' in first_msg and 'timestamp' in last_msg:
                     try:
-                        from datetime import datetime
                         start_time = datetime.fromisoformat(first_msg['timestamp'].replace('Z', '+00:00'))
                         end_time = datetime.fromisoformat(last_msg['timestamp'].replace('Z', '+00:00'))
                         duration_minutes = (end_time - start_time).total_seconds() / 60
@@ -591,13 +752,115 @@ Respond with JSON only:
             logger.warning(f"Failed to create comprehensive summary for chat {chat_id}")
             return None
     
+    def _create_incremental_prompt(self, previous_summary: Dict, new_messages: List[Dict]) -> str:
+        """Create a prompt that updates a chat's previous summary with the messages added since."""
+        conversation_lines = []
+        for msg in new_messages:
+            content = msg.get('content', '').strip()
+            if content:
+                conversation_lines.append(f"{msg.get('role', 'unknown').upper()}: {self._sanitize_text(content)}")
+        
+        if not conversation_lines:
+            return ""
+        
+        previous = json.dumps({
+            field: previous_summary.get(field)
+            for field in ('summary', 'key_topics', 'conversation_type', 'key_decisions', 'outcomes',
+                          'complexity', 'domain')
+        }, indent=2)
+        conversation_text = "\n\n".join(conversation_lines)
+        
+        prompt = f"""You are a conversation summarizer. A conversation you summarized before has continued. Update its JSON summary with the new messages.
+
+PREVIOUS SUMMARY:
+{previous}
+
+NEW MESSAGES:
+{conversation_text}
+
+INSTRUCTIONS:
+- Keep everything from the previous summary that is still accurate
+- Add the topics, decisions and outcomes of the new messages
+- Correct anything the new messages change
+- Avoid trailing commas in arrays
+- Ensure all JSON syntax is correct
+
+JSON FORMAT (use exactly these field names):
+{{
+    "summary": "Brief comprehensive summary of the whole conversation",
+    "key_topics": ["topic1", "topic2", "topic3"],
+    "participants": ["user", "assistant"],
+    "conversation_type": "technical_discussion|casual_chat|problem_solving|tutorial|brainstorming|other",
+    "key_decisions": ["decision1", "decision2"],
+    "outcomes": "What was accomplished or learned",
+    "complexity": "beginner|intermediate|advanced",
+    "domain": "technical|personal|business|academic|creative|other",
+    "confidence": 0.85
+}}
+
+RESPOND WITH JSON ONLY:"""
+
+        return prompt
+    
+    def _plan_incremental_update(self, chat_id: str, messages: List[Dict],
+                                 summaries: Dict[str, Dict]) -> Optional[Tuple[str, List[Dict], int]]:
+        """(previous chat_id, new messages, incremental chars) if the chat can update an earlier summary."""
+        previous = self.message_index.find_previous(chat_id, messages, summaries)
+        if not previous:
+            return None
+        previous_id, new_messages = previous
+        if not self.budget.fits([json.dumps(summaries[previous_id])] + [self._turn_text(msg) for msg in new_messages]):
+            logger.info(f"New messages of chat {chat_id} do not fit one prompt, re-summarizing in full")
+            return None
+        incremental_chars = plan_incremental_update(messages, new_messages, summaries[previous_id],
+                                                    self.incremental_threshold)
+        if incremental_chars is None:
+            logger.info(f"Chat {chat_id} grew too much since {previous_id}, re-summarizing in full")
+            return None
+        return previous_id, new_messages, incremental_chars
+    
+    def _summarize_chat_incremental(self, chat: Dict, previous_id: str, previous_summary: Dict,
+                                    new_messages: List[Dict], incremental_chars: int) -> Optional[Dict]:
+        """Update a grown chat's previous summary from the new messages only."""
+        chat_id = chat.get('content_hash', chat.get('chat_id', 'unknown'))
+        messages = chat.get('messages', [])
+        
+        logger.info(f"Updating summary of chat {chat_id} with {len(new_messages)} new messages (was {previous_id})")
+        prompt = self._create_incremental_prompt(previous_summary, new_messages)
+        if not prompt:
+            return None
+        
+        summary = self._get_summary_from_openai(prompt)
+        if not summary:
+            logger.warning(f"Failed to update summary of chat {chat_id}, falling back to a full summary")
+            return None
+        
+        summary['chat_id'] = chat_id
+        summary['message_count'] = len(messages)
+        summary['timestamp'] = datetime.now().isoformat()
+        summary['model'] = 'gpt-4o-mini'
+        summary['processing_method'] = 'incremental'
+        summary['previous_chat_id'] = previous_id
+        summary['new_message_count'] = len(new_messages)
+        # Characters folded in since the last full summary; bounds drift across repeated updates
+        summary['incremental_chars'] = incremental_chars
+        summary['duration_minutes'] = previous_summary.get('duration_minutes')
+        if 'timestamp' in messages[0] and 'timestamp' in messages[-1]:
+            try:
+                start_time = datetime.fromisoformat(messages[0]['timestamp'].replace('Z', '+00:00'))
+                end_time = datetime.fromisoformat(messages[-1]['timestamp'].replace('Z', '+00:00'))
+                summary['duration_minutes'] = round((end_time - start_time).total_seconds() / 60, 1)
+            except (AttributeError, TypeError, ValueError):
+                pass
+        return summary
+    
     def process_chats_to_summaries(self, force_reprocess: bool = False) -> Dict:
         """Process chats into summaries."""
         logger.info("🚀 Starting chat summarization...")
         
-        # Load existing summaries
-        summaries_file = self.output_dir / "chat_summaries.json"
-        existing_summaries = self._load_existing_summaries(summaries_file)
+        # Existing summaries, looked up in the store as needed
+        existing_summaries = self._load_existing_summaries()
+        existing_count = len(existing_summaries)
         
         # Load processed hashes
         processed_hashes = set()
@@ -605,62 +868,262 @@ Respond with JSON only:
             processed_hashes = self._load_processed_chat_hashes()
             logger.info(f"Found {len(processed_hashes)} existing processed hashes")
         
-        # Load chats
-        chats = self._load_chats()
+        # Load chats, highest-priority first
+        chats = self.scheduler.order_chats(self._load_chats())
         
         if not chats:
             logger.warning("No chats found")
             return {'status': 'no_chats'}
         
-        # Process each chat
+        # Process each chat, starting from summaries journaled by an interrupted run
         new_summaries = {}
         processed_chat_hashes = set()
+        journal = RunJournal(self.output_dir / "chat_summaries.journal.jsonl")
+        self.message_index.load()
+        for record in journal.replay():
+            new_summaries[record['result']['chat_id']] = record['result']['summary']
+            processed_chat_hashes.add(record['hash'])
+            self.message_index.record(record['result']['chat_id'], record['result'].get('message_ids', []))
+        recovered_summaries = len(new_summaries)
+        
+        # Message IDs of summarized chats, including those summarized before the index existed
+        for chat in chats:
+            chat_id = chat.get('content_hash', chat.get('chat_id', 'unknown'))
+            if chat_id in existing_summaries and chat_id not in self.message_index.chats:
+                self.message_index.record(chat_id, [msg.get('id') for msg in chat.get('messages', []) if msg.get('id')])
+        summaries = ChainMap(new_summaries, existing_summaries)
+        incremental_updates = 0
         
+        jobs = []
         for chat in chats:
             # Use content_hash as chat_id, fallback to 'unknown' if not available
             chat_id = chat.get('content_hash', chat.get('chat_id', 'unknown'))
-            messages = chat.get('messages', [])
             
             # Generate chat hash
-            chat_hash = self._generate_chat_hash(chat_id, messages)
+            chat_hash = self._generate_chat_hash(chat_id, chat.get('messages', []))
             
-            # Check if already processed
+            # Check if already processed (or recovered from the journal)
+            if chat_hash in processed_chat_hashes:
+                continue
             if chat_hash not in processed_hashes or force_reprocess:
+                jobs.append((chat, chat_id, chat_hash))
+            else:
+                logger.info(f"Chat {chat_id} already processed, skipping")
+        
+        # Shared state is touched by worker threads when max_workers > 1
+        state_lock = threading.Lock()
+        if self.composer:
+            self.composer.load()
+        
+        def plan(job: Tuple[Dict, str, str]) -> Optional[List[Tuple]]:
+            chat, chat_id, _ = job
+            messages = chat.get('messages', [])
+            triage_reason = self.triage.assess(messages) if self.triage else None
+            if triage_reason:
+                # Trivial chat: template summary, no API call and no budget spent
+                return [(chat, triage_reason, None)]
+            update = None
+            if self.incremental and not force_reprocess:
+                with state_lock:
+                    update = self._plan_incremental_update(chat_id, messages, summaries)
+                    if update:
+                        update = (*update, summaries[update[0]])
+            prompt_messages = update[1] if update else messages
+            if not self.scheduler.try_start(sum(self.budget.count(m.get('content', '')) for m in prompt_messages)):
+                # Budget spent; the chat is left for the next run
+                return None
+            return [(chat, None, update)]
+        
+        def summarize(item: Tuple) -> Optional[Dict]:
+            chat, triage_reason, update = item
+            if triage_reason:
+                self.triage.record_saved()
+                return self.triage.template_summary(chat, triage_reason)
+            started = time.perf_counter()
+            summary = None
+            if update:
+                previous_id, new_messages, incremental_chars, previous_summary = update
+                summary = self._summarize_chat_incremental(chat, previous_id, previous_summary,
+                                                           new_messages, incremental_chars)
+            if not summary:
                 summary = self._summarize_chat(chat)
-                if summary:
+            if summary and self.triage:
+                self.triage.record_llm(time.perf_counter() - started)
+            return summary
+        
+        def record(job: Tuple[Dict, str, str], results: List[Optional[Dict]]) -> Optional[Dict]:
+            nonlocal incremental_updates
+            chat, chat_id, chat_hash = job
+            summary = results[0]
+            if summary:
+                message_ids = [msg.get('id') for msg in chat.get('messages', []) if msg.get('id')]
+                with state_lock:
                     new_summaries[chat_id] = summary
                     processed_chat_hashes.add(chat_hash)
-            else:
-                logger.info(f"Chat {chat_id} already processed, skipping")
+                    self.message_index.record(chat_id, message_ids)
+                    incremental_updates += summary.get('processing_method') == 'incremental'
+                journal.append(chat_hash, {'chat_id': chat_id, 'summary': summary, 'message_ids': message_ids})
+            return summary
+        
+        # Up to max_workers chats in flight; with a request pool their API calls are paced
+        # by its requests/min and tokens/min limits
+        with journal:
+            map_reduce_ordered(plan, summarize, record, jobs, max_workers=self.max_workers,
+                               desc="Summarizing chats")
         
         if not new_summaries and not force_reprocess:
             logger.info("No new chats to process")
+            # Keep the last run's stats, but record what this run deferred
+            self.scheduler.update_metadata(self.output_dir / "metadata.json")
+            self.scheduler.log_stats()
             return {'status': 'no_new_chats'}
         
-        # Combine existing and new summaries
-        all_summaries = {**existing_summaries, **new_summaries}
-        
-        # Save summaries
-        with open(summaries_file, 'w') as f:
-            json.dump(all_summaries, f, indent=2)
+        # Save only new and changed summaries
+        written_summaries = existing_summaries.put_many(new_summaries)
+        logger.info(f"Saved {written_summaries} new or changed summaries")
         
         # Save hashes and metadata
         all_processed_hashes = processed_hashes.union(processed_chat_hashes)
         self._save_processed_chat_hashes(all_processed_hashes)
+        self.message_index.save()
+        journal.finish()
+        
+        # How each new summary was produced
+        summary_paths = Counter(summary.get('processing_method', 'unknown') for summary in new_summaries.values())
+        logger.info("📊 Summary paths: " + ", ".join(f"{path} {count}" for path, count in summary_paths.most_common()))
+        if self.composition_fallbacks:
+            logger.info("📊 Not composed: " + ", ".join(
+                f"{reason} {count}" for reason, count in self.composition_fallbacks.most_common()))
+        if self.triage:
+            logger.info(f"📊 Triaged: {self.triage.describe()}")
         
         # Calculate statistics
         stats = {
             'status': 'success',
-            'total_chats': len(all_summaries),
+            'total_chats': len(existing_summaries),
             'new_summaries': len(new_summaries),
-            'existing_summaries': len(existing_summaries),
-            'processed_chats': len(processed_chat_hashes)
+            'existing_summaries': existing_count,
+            'written_summaries': written_summaries,
+            'processed_chats': len(processed_chat_hashes),
+            'recovered_summaries': recovered_summaries,
+            'incremental_updates': incremental_updates,
+            'summary_paths': dict(summary_paths),
+            'composition_fallbacks': dict(self.composition_fallbacks),
+            'triage': self.triage.get_stats() if self.triage else None,
+            'prompt_budget': self.budget.get_stats(),
+            'scheduler': self.scheduler.get_stats(),
+            'max_workers': self.max_workers,
+            'request_pool': self.request_pool.get_stats() if self.request_pool else None,
+            'llm_cache': self.cache.get_stats() if self.cache else None
         }
         
         self._save_metadata(stats)
+        self.scheduler.log_stats()
+        if self.request_pool:
+            self.request_pool.log_stats()
         
         logger.info(f"✅ Chat summarization complete: {len(new_summaries)} new summaries created")
         return stats
+    
+    def submit_batch_jobs(self, jobs: BatchJobStore) -> Dict:
+        """Write summary prompts for all new chats into batch jobs and submit them.
+        
+        Chats that fit one prompt are summarized in full (single pass). Trivial
+        chats need no API call, and compressed and chunked summaries take
+        several dependent calls, so those chats are left to the interactive run.
+        """
+        logger.info("🚀 Submitting chat summarization as batch jobs...")
+        # Chats waiting in earlier jobs are not submitted again
+        skipped_hashes = self._load_processed_chat_hashes() | jobs.open_hashes()
+        
+        requests = []
+        left_for_interactive = Counter()
+        for chat in self._load_chats():
+            chat_id = chat.get('content_hash', chat.get('chat_id', 'unknown'))
+            messages = chat.get('messages', [])
+            chat_hash = self._generate_chat_hash(chat_id, messages)
+            if chat_hash in skipped_hashes:
+                continue
+            if self.triage and self.triage.assess(messages):
+                left_for_interactive['trivial'] += 1
+                continue
+            if self._should_chunk_conversation(messages):
+                left_for_interactive['over_one_prompt'] += 1
+                continue
+            prompt = self._create_summary_prompt(chat)
+            if not prompt:
+                left_for_interactive['no_content'] += 1
+                continue
+            body = {'model': 'gpt-4o-mini', 'messages': self._summary_messages(prompt),
+                    'temperature': 0.3, 'max_tokens': 1500}
+            # Only what ingestion needs for the summary's metadata and the message index
+            chat_record = {key: chat[key] for key in ('content_hash', 'chat_id', 'title') if key in chat}
+            chat_record['messages'] = [{key: msg[key] for key in ('id', 'timestamp') if key in msg}
+                                       for msg in messages]
+            requests.append(batch_request('chat', [chat_hash], body, chat=chat_record))
+        
+        if left_for_interactive:
+            logger.info("📊 Left for the interactive run: " + ", ".join(
+                f"{reason} {count}" for reason, count in left_for_interactive.most_common()))
+        submitted = jobs.submit(CHAT_COMPLETIONS, requests)
+        jobs.log_stats()
+        return {'status': 'success', 'submitted_jobs': [job.id for job in submitted],
+                'left_for_interactive': dict(left_for_interactive), 'batch_jobs': jobs.get_stats()}
+    
+    def ingest_batch_jobs(self, jobs: BatchJobStore) -> Dict:
+        """Add the summaries from finished batch jobs to the store and hashes, as an interactive run would.
+        
+        Chats without a result stay unprocessed and are picked up by the next
+        submission or interactive run.
+        """
+        logger.info("🚀 Ingesting chat summarization batch jobs...")
+        ready = jobs.collect()
+        if not ready:
+            jobs.log_stats()
+            return {'status': 'success', 'new_summaries': 0, 'batch_jobs': jobs.get_stats()}
+        
+        existing_summaries = self._load_existing_summaries()
+        processed_hashes = self._load_processed_chat_hashes()
+        self.message_index.load()
+        
+        new_summaries = {}
+        failed = 0
+        for job in ready:
+            for entry, body, error in job.results():
+                chat_hash, chat = entry['hashes'][0], entry['chat']
+                # Summarized meanwhile by an interactive run
+                if chat_hash in processed_hashes:
+                    continue
+                response_text = completion_text(body).strip() if body else ''
+                if error or not response_text:
+                    logger.warning(f"Batch request {entry['custom_id']} failed: {error or 'empty response'}")
+                    failed += 1
+                    continue
+                summary = self._add_single_pass_metadata(self._parse_summary_response(response_text), chat)
+                new_summaries[summary['chat_id']] = summary
+                processed_hashes.add(chat_hash)
+                self.message_index.record(summary['chat_id'],
+                                          [msg.get('id') for msg in chat['messages'] if msg.get('id')])
+        
+        written_summaries = existing_summaries.put_many(new_summaries)
+        logger.info(f"Saved {written_summaries} new or changed summaries")
+        self._save_processed_chat_hashes(processed_hashes)
+        self.message_index.save()
+        jobs.mark_ingested(ready, len(new_summaries), failed)
+        
+        stats = {
+            'status': 'success',
+            'total_chats': len(existing_summaries),
+            'new_summaries': len(new_summaries),
+            'written_summaries': written_summaries,
+            'failed_chats': failed,
+            'batch_jobs': jobs.get_stats()
+        }
+        self._save_metadata(stats)
+        jobs.log_stats()
+        
+        logger.info(f"✅ Chat summarization batch ingested: {len(new_summaries)} new summaries")
+        return stats
 
 
 @click.command()
@@ -668,8 +1131,48 @@ Respond with JSON only:
               default='../../data/processed/ingestion/chats.jsonl',
               help='Input chats file')
 @click.option('--force', is_flag=True, help='Force reprocess all chats')
+@click.option('--incremental/--no-incremental', default=True,
+              help='Update the summary of a grown chat from its new messages instead of re-summarizing it')
+@click.option('--incremental-threshold', default=0.3, type=float,
+              help='Re-summarize in full once this share of a chat was added since its last full summary')
+@click.option('--compression/--no-compression', default=True,
+              help='Compress long chats extractively into one prompt instead of summarizing them in chunks')
+@click.option('--composed', is_flag=True,
+              help='Summarize well-clustered chats from their cluster summaries and tags instead of the transcript')
+@click.option('--composed-min-coverage', default=0.6, type=float,
+              help='Share of a chat\'s chunks that must be in summarized clusters for it to be composed')
+@click.option('--triage/--no-triage', default=False,
+              help='Give trivial chats (few, short or repeated turns) a template summary instead of an LLM summary (off by default)')
+@click.option('--triage-max-turns', default=TRIVIAL_MAX_TURNS, type=int,
+              help='Most distinct turns a trivial chat has')
+@click.option('--triage-max-chars', default=TRIVIAL_MAX_CHARS, type=int,
+              help='Most characters in the distinct turns of a trivial chat')
+@click.option('--context-window', default=None, type=int, help='Model context window in tokens (default: known size for the model)')
+@click.option('--context-fraction', default=0.75, type=float, help='Share of the context window prompts are packed to')
+@click.option('--max-workers', default=1, type=int, help='Number of chats summarized concurrently')
+@click.option('--requests-per-minute', default=None, type=float,
+              help='Run API calls on an async request pool limited to this many requests/min (default: $OPENAI_REQUESTS_PER_MINUTE)')
+@click.option('--tokens-per-minute', default=None, type=float,
+              help='Run API calls on an async request pool limited to this many tokens/min (default: $OPENAI_TOKENS_PER_MINUTE)')
+@click.option('--priority', default='file', type=click.Choice(PRIORITIES),
+              help='Order of chats: file order, most recent first or shortest first')
+@click.option('--pin', 'pins', multiple=True, help='Chat ID to summarize before all others (repeatable)')
+@click.option('--time-budget', default=None, type=float, help='Stop starting new API calls after this many minutes')
+@click.option('--token-budget', default=None, type=int, help='Stop starting new API calls after about this many prompt tokens')
+@click.option('--batch-mode', default=None, type=click.Choice(BATCH_MODES),
+              help='Submit the summary prompts of new chats as batch jobs, or ingest finished batch jobs')
+@click.option('--batch-submitter', default='openai', type=click.Choice(SUBMITTERS),
+              help='Where batch jobs go: the OpenAI Batch API or a local directory')
+@click.option('--batch-dir', default=None,
+              help='Exchange directory of the local batch submitter (default: $CHATMIND_BATCH_DIR or <processed>/batch_exchange)')
 @click.option('--check-only', is_flag=True, help='Only check setup, don\'t process')
-def main(chats_file: str, force: bool, check_only: bool):
+def main(chats_file: str, force: bool, incremental: bool, incremental_threshold: float, compression: bool,
+         composed: bool, composed_min_coverage: float,
+         triage: bool, triage_max_turns: int, triage_max_chars: int,
+         max_workers: int, requests_per_minute: Optional[float], tokens_per_minute: Optional[float],
+         context_window: Optional[int], context_fraction: float, priority: str, pins: Tuple[str, ...], time_budget: Optional[float],
+         token_budget: Optional[int], batch_mode: Optional[str], batch_submitter: str, batch_dir: Optional[str],
+         check_only: bool):
     """Run cloud chat summarization."""
     if check_only:
         logger.info("🔍 Checking setup...")
@@ -690,8 +1193,27 @@ def main(chats_file: str, force: bool, check_only: bool):
         return 0
     
     # Run summarization
-    summarizer = CloudChatSummarizer(chats_file)
-    result = summarizer.process_chats_to_summaries(force_reprocess=force)
+    request_pool = AsyncRequestPool.from_options(requests_per_minute, tokens_per_minute, max_workers)
+    summarizer = CloudChatSummarizer(chats_file, incremental=incremental,
+                                     incremental_threshold=incremental_threshold, compression=compression,
+                                     composed=composed, composed_min_coverage=composed_min_coverage,
+                                     triage=triage, triage_max_turns=triage_max_turns,
+                                     triage_max_chars=triage_max_chars,
+                                     context_window=context_window, context_fraction=context_fraction,
+                                     max_workers=max_workers, request_pool=request_pool,
+                                     scheduler=WorkScheduler.from_options(priority, pins, time_budget, token_budget))
+    try:
+        if batch_mode:
+            jobs = BatchJobStore.from_options(summarizer.output_dir, batch_submitter, batch_dir)
+            if batch_mode == 'submit':
+                result = summarizer.submit_batch_jobs(jobs)
+            else:
+                result = summarizer.ingest_batch_jobs(jobs)
+        else:
+            result = summarizer.process_chats_to_summaries(force_reprocess=force)
+    finally:
+        if request_pool:
+            request_pool.close()
     
     if result.get('status') == 'success':
         logger.info("✅ Chat summarization completed successfully")
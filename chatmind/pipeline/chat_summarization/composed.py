@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Composed Chat Summaries
+
+By the time chats are summarized, the cluster summaries and the per-message
+tags already describe most of a conversation. A chat whose chunks fall
+mostly into summarized clusters can be summarized from a compact digest of
+those artifacts instead of its transcript:
+
+- the chat's title, size and opening request,
+- the summaries of its clusters, weighted by the share of its chunks in each,
+- its message tags, topics, domains and intents, aggregated over messages.
+
+Chats that cluster poorly (too many chunks in the noise cluster or in
+clusters without a summary) are summarized from the transcript as before,
+and so are chats whose transcript is no longer than the digest would be.
+"""
+
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Callable, Dict, List, Mapping, Optional, Tuple
+import logging
+
+import jsonlines
+
+from summary_store import open_summary_store
+
+logger = logging.getLogger(__name__)
+
+NOISE_CLUSTER = '-1'
+
+# Limits that keep the digest compact
+MAX_CLUSTERS = 5
+MAX_TAGS = 12
+OPENING_TOKENS = 200
+
+
+class ChatComposer:
+    """Plans and builds chat digests from cluster summaries and message tags."""
+
+    def __init__(self, processed_dir: Path, min_coverage: float = 0.6):
+        """
+        processed_dir: the pipeline's data/processed directory.
+        min_coverage: share of a chat's chunks that must be in summarized
+            clusters for the chat to be composed.
+        """
+        self.processed_dir = Path(processed_dir)
+        self.min_coverage = min_coverage
+        self.chat_clusters: Dict[str, Counter] = defaultdict(Counter)
+        self.chat_tags: Dict[str, Dict[str, Counter]] = {}
+        self.cluster_summaries: Mapping[str, Dict] = {}
+        self._loaded = False
+
+    def load(self) -> 'ChatComposer':
+        if self._loaded:
+            return self
+        self._loaded = True
+
+        store = open_summary_store(self.processed_dir / "cluster_summarization", "cluster_summaries", create=False)
+        if store is not None:
+            self.cluster_summaries = store
+        else:
+            logger.warning("Cluster summaries not found, chats are summarized from transcripts")
+
+        clustered_file = self.processed_dir / "clustering" / "clustered_embeddings.jsonl"
+        if clustered_file.exists():
+            with jsonlines.open(clustered_file) as reader:
+                for chunk in reader:
+                    if chunk.get('chat_id'):
+                        self.chat_clusters[chunk['chat_id']][str(chunk.get('cluster_id', NOISE_CLUSTER))] += 1
+
+        # Mapped tags from post-processing when available
+        tags_file = self.processed_dir / "tagging" / "processed_tags.jsonl"
+        if not tags_file.exists():
+            tags_file = self.processed_dir / "tagging" / "tags.jsonl"
+        if tags_file.exists():
+            with jsonlines.open(tags_file) as reader:
+                for entry in reader:
+                    chat_id = entry.get('chat_id')
+                    if not chat_id:
+                        continue
+                    profile = self.chat_tags.setdefault(chat_id, defaultdict(Counter))
+                    profile['tags'].update(entry.get('tags') or [])
+                    profile['topics'].update(entry.get('topics') or [])
+                    for field in ('domain', 'complexity', 'intent'):
+                        if entry.get(field):
+                            profile[field][entry[field]] += 1
+
+        logger.info(f"Loaded {len(self.cluster_summaries)} cluster summaries, clusters of "
+                    f"{len(self.chat_clusters)} chats and tags of {len(self.chat_tags)} chats")
+        return self
+
+    def plan(self, chat_id: str) -> Tuple[Optional[List[Tuple[str, float]]], str]:
+        """(summarized clusters with their share of the chat's chunks, or None; reason)."""
+        clusters = self.chat_clusters.get(chat_id)
+        if not clusters:
+            return None, 'no_cluster_data'
+        total = sum(clusters.values())
+        covered = [(cluster_id, count / total) for cluster_id, count in clusters.most_common()
+                   if cluster_id != NOISE_CLUSTER and cluster_id in self.cluster_summaries]
+        if sum(share for _, share in covered) < self.min_coverage:
+            return None, 'poorly_clustered'
+        return covered, 'composed'
+
+    def digest(self, chat: Dict, clusters: List[Tuple[str, float]],
+               truncate: Callable[[str, int], str]) -> str:
+        """Compact description of a chat from its clusters and tags.
+
+        truncate(text, max_tokens) shortens the opening request.
+        """
+        chat_id = chat.get('content_hash', chat.get('chat_id', 'unknown'))
+        messages = chat.get('messages', [])
+        roles = Counter(msg.get('role', 'unknown') for msg in messages)
+        lines = [
+            f"TITLE: {chat.get('title') or 'Untitled'}",
+            f"MESSAGES: {len(messages)} ({', '.join(f'{role} {n}' for role, n in roles.most_common())})"
+        ]
+
+        opening = next((msg.get('content', '').strip() for msg in messages
+                        if msg.get('role') == 'user' and msg.get('content', '').strip()), '')
+        if opening:
+            lines.append(f"OPENING REQUEST: {truncate(opening, OPENING_TOKENS)}")
+
+        lines.append("TOPIC CLUSTERS (share of this conversation):")
+        for cluster_id, share in clusters[:MAX_CLUSTERS]:
+            cluster = self.cluster_summaries[cluster_id]
+            topics = ', '.join(cluster.get('key_topics', [])[:5])
+            lines.append(f"- {share:.0%}: {cluster.get('summary', '')} "
+                         f"(topics: {topics}; domain: {cluster.get('domain', 'other')})")
+
+        profile = self.chat_tags.get(chat_id)
+        if profile:
+            for field in ('tags', 'topics'):
+                if profile[field]:
+                    lines.append(f"MESSAGE {field.upper()}: " + ', '.join(
+                        f"{value} ({n})" for value, n in profile[field].most_common(MAX_TAGS)))
+            for field in ('domain', 'complexity', 'intent'):
+                if profile[field]:
+                    lines.append(f"MESSAGE {field.upper()}: " + ', '.join(
+                        f"{value} ({n})" for value, n in profile[field].most_common(3)))
+
+        return "\n".join(lines)
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Extractive Pre-Compression of Long Conversations
+
+Conversations over the prompt limit used to be split into chunks and
+summarized in several LLM passes. Most of that text carries little
+information, so this module shrinks a conversation until it fits one
+prompt instead:
+
+1. Cheap filters: acknowledgement turns ("thanks!", "ok") are dropped,
+   code blocks already shown earlier in the conversation are replaced by a
+   short marker, and assistant boilerplate sentences are removed.
+2. TextRank: if the text is still too long, turns are ranked by centrality
+   in a cosine-similarity graph of their embeddings (the mean of the turn's
+   chunk embeddings from the embedding step) and the least central turns
+   are dropped. The opening request and the closing turns are always kept.
+
+Kept turns stay in their original order, and omitted stretches are marked
+so the model knows the conversation was shortened.
+"""
+
+import hashlib
+import re
+from collections import defaultdict
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+import logging
+
+import jsonlines
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+ACKNOWLEDGEMENT = re.compile(
+    r"^(\W*(ok(ay)?|k|thanks?( you)?( so much| a lot)?|thx|ty|great|perfect|cool|nice|awesome|got it|"
+    r"sounds good|makes sense|sure|understood|will do|continue|go on|"
+    r"that works|this works|it works( now)?))+\W*$",
+    re.IGNORECASE
+)
+BOILERPLATE = re.compile(
+    r"[^.!?\n]{0,200}(as an ai( language model)?|i hope (this|that) helps|let me know if you (have|need)|"
+    r"feel free to (ask|reach out)|is there anything else|happy to help|i'?m here to help|"
+    r"if you have any (other|more|further) questions)[^.!?\n]{0,200}[.!?]?",
+    re.IGNORECASE
+)
+CODE_BLOCK = re.compile(r"```.*?```", re.DOTALL)
+
+# Turns always kept at the start and the end of the conversation
+KEEP_FIRST = 1
+KEEP_LAST = 2
+
+
+def turn_chars(message: Dict) -> int:
+    """Characters a message takes up in a summary prompt ("ROLE: content" plus separator)."""
+    return len(message.get('role', 'unknown')) + len(message.get('content', '')) + 4
+
+
+def load_message_vectors(embeddings_file: Path) -> Dict[str, np.ndarray]:
+    """Mean chunk embedding per message_id from the embedding step."""
+    sums: Dict[str, np.ndarray] = {}
+    counts: Dict[str, int] = defaultdict(int)
+    if not Path(embeddings_file).exists():
+        logger.warning(f"Chunk embeddings not found: {embeddings_file}, compression uses filters only")
+        return {}
+    with jsonlines.open(embeddings_file) as reader:
+        for chunk in reader:
+            message_id = chunk.get('message_id')
+            embedding = chunk.get('embedding')
+            if not message_id or not embedding:
+                continue
+            vector = np.asarray(embedding, dtype=np.float32)
+            sums[message_id] = sums[message_id] + vector if message_id in sums else vector
+            counts[message_id] += 1
+    logger.info(f"Loaded embeddings for {len(sums)} messages")
+    return {message_id: vector / counts[message_id] for message_id, vector in sums.items()}
+
+
+def _filter_turns(messages: List[Dict]) -> List[Dict]:
+    """Drop acknowledgements, repeated code blocks and boilerplate sentences."""
+    seen_code = set()
+    filtered = []
+
+    def replace_code(match: re.Match) -> str:
+        block = match.group(0)
+        digest = hashlib.md5(re.sub(r'\s+', ' ', block).encode()).hexdigest()
+        if digest in seen_code:
+            return "[code block repeated from earlier]"
+        seen_code.add(digest)
+        return block
+
+    for message in messages:
+        content = message.get('content', '').strip()
+        if not content or (len(content) < 80 and ACKNOWLEDGEMENT.match(content)):
+            continue
+        content = CODE_BLOCK.sub(replace_code, content)
+        if message.get('role') == 'assistant':
+            content = BOILERPLATE.sub('', content).strip()
+        if content:
+            filtered.append({**message, 'content': content})
+    return filtered
+
+
+def _with_omission_markers(turns: List[Dict], keep: set) -> List[Dict]:
+    """Kept turns in order, with a note wherever turns were left out."""
+    compressed = []
+    omitted = 0
+    for i, turn in enumerate(turns):
+        if i not in keep:
+            omitted += 1
+            continue
+        if omitted:
+            compressed.append({'role': 'note', 'content': f"[... {omitted} less central turns omitted ...]"})
+            omitted = 0
+        compressed.append(turn)
+    if omitted:
+        compressed.append({'role': 'note', 'content': f"[... {omitted} less central turns omitted ...]"})
+    return compressed
+
+
+def textrank(vectors: np.ndarray, damping: float = 0.85, iterations: int = 50) -> np.ndarray:
+    """PageRank centrality over the cosine-similarity graph of the rows of vectors."""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    unit = vectors / np.where(norms == 0, 1.0, norms)
+    weights = np.clip(unit @ unit.T, 0.0, None)
+    np.fill_diagonal(weights, 0.0)
+    out_weight = weights.sum(axis=1, keepdims=True)
+    transition = np.divide(weights, out_weight, out=np.zeros_like(weights), where=out_weight > 0)
+    scores = np.full(len(vectors), 1.0 / len(vectors))
+    for _ in range(iterations):
+        updated = (1 - damping) / len(vectors) + damping * transition.T @ scores
+        if np.abs(updated - scores).sum() < 1e-6:
+            return updated
+        scores = updated
+    return scores
+
+
+def compress_conversation(messages: List[Dict], vectors: Dict[str, np.ndarray], budget: int,
+                          cost: Callable[[Dict], int] = turn_chars) -> Tuple[Optional[List[Dict]], Dict]:
+    """Messages shortened to fit budget, or None if they cannot be; plus compression stats.
+
+    cost is the size of a turn in the prompt, in the budget's unit (prompt
+    characters by default, or tokens). vectors maps message_id to its
+    embedding; turns without one are ranked at the median centrality.
+    """
+    turns = _filter_turns(messages)
+    stats = {
+        'original_size': sum(cost(m) for m in messages),
+        'original_turns': len(messages),
+        'filtered_turns': len(messages) - len(turns),
+        'method': 'filters'
+    }
+
+    # A single turn larger than a quarter of the prompt is cut down to about that size
+    turn_limit = budget // 4
+    for i, turn in enumerate(turns):
+        size = cost(turn)
+        if size > turn_limit:
+            keep_chars = len(turn['content']) * turn_limit // size
+            turns[i] = {**turn, 'content': turn['content'][:keep_chars] + " ... (truncated)"}
+
+    if sum(cost(m) for m in turns) > budget:
+        embedded = [i for i, m in enumerate(turns) if m.get('id') in vectors]
+        if len(embedded) < 2:
+            stats['method'] = 'unavailable'
+            return None, stats
+        stats['method'] = 'textrank'
+        centrality = np.zeros(len(turns))
+        centrality[embedded] = textrank(np.stack([vectors[turns[i]['id']] for i in embedded]))
+        missing = sorted(set(range(len(turns))) - set(embedded))
+        centrality[missing] = np.median(centrality[embedded])
+
+        pinned = set(range(min(KEEP_FIRST, len(turns)))) | set(range(max(0, len(turns) - KEEP_LAST), len(turns)))
+        keep = set(pinned)
+        spent = sum(cost(turns[i]) for i in pinned)
+        for i in map(int, np.argsort(-centrality)):
+            if i not in keep and spent + cost(turns[i]) <= budget:
+                keep.add(i)
+                spent += cost(turns[i])
+
+        # Make room for the omission markers, least central turns first
+        turns_by_centrality = [i for i in map(int, np.argsort(centrality)) if i in keep and i not in pinned]
+        compressed = _with_omission_markers(turns, keep)
+        while sum(cost(m) for m in compressed) > budget and turns_by_centrality:
+            keep.discard(turns_by_centrality.pop(0))
+            compressed = _with_omission_markers(turns, keep)
+        if sum(cost(m) for m in compressed) > budget:
+            return None, stats
+        turns = compressed
+        stats['dropped_turns'] = len(centrality) - len(keep)
+
+    stats['compressed_size'] = sum(cost(m) for m in turns)
+    return turns, stats
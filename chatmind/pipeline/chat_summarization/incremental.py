@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Incremental Chat Summary Updates
+
+A conversation that gets new messages is re-exported as a new chat record
+(its content_hash changes), so it would be summarized from scratch. This
+module finds the summary the grown chat continues and decides whether the
+new messages can be folded into it:
+
+- MessageIndex remembers the message IDs of every summarized chat. A chat
+  whose message IDs contain all of a summarized chat's IDs (and more) is a
+  continuation of that chat; the extra messages are the delta.
+- plan_incremental_update accepts the update while the text summarized
+  incrementally since the last full summary stays below a share of the
+  whole conversation. Past that, the chat is re-summarized in full so
+  summaries do not drift. Callers also check that the update fits one
+  prompt.
+"""
+
+import pickle
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+import logging
+
+from run_journal import atomic_write
+
+logger = logging.getLogger(__name__)
+
+
+def _message_chars(messages: List[Dict]) -> int:
+    return sum(len(msg.get('content', '')) for msg in messages)
+
+
+class MessageIndex:
+    """Message IDs of each summarized chat, to find the summary a grown chat continues."""
+
+    def __init__(self, index_file: Path):
+        self.index_file = Path(index_file)
+        self.chats: Dict[str, Tuple[str, ...]] = {}
+        self._by_message: Optional[Dict[str, Set[str]]] = None
+
+    def load(self) -> 'MessageIndex':
+        if self.index_file.exists():
+            try:
+                with open(self.index_file, 'rb') as f:
+                    self.chats = pickle.load(f)
+                logger.info(f"Loaded message index for {len(self.chats)} summarized chats")
+            except Exception as e:
+                logger.warning(f"Failed to load message index: {e}")
+        return self
+
+    def save(self) -> None:
+        try:
+            with atomic_write(self.index_file) as tmp_file, open(tmp_file, 'wb') as f:
+                pickle.dump(self.chats, f)
+        except Exception as e:
+            logger.error(f"Failed to save message index: {e}")
+
+    def record(self, chat_id: str, message_ids: List[str]) -> None:
+        self.chats[chat_id] = tuple(message_ids)
+        if self._by_message is not None:
+            for message_id in message_ids:
+                self._by_message[message_id].add(chat_id)
+
+    def find_previous(self, chat_id: str, messages: List[Dict],
+                      summaries: Dict[str, Dict]) -> Optional[Tuple[str, List[Dict]]]:
+        """(previous chat_id, new messages) for the largest summarized chat this one extends, if any."""
+        message_ids = [msg.get('id') for msg in messages if msg.get('id')]
+        if not message_ids:
+            return None
+        if self._by_message is None:
+            self._by_message = defaultdict(set)
+            for indexed_id, indexed_messages in self.chats.items():
+                for message_id in indexed_messages:
+                    self._by_message[message_id].add(indexed_id)
+
+        overlap: Dict[str, int] = defaultdict(int)
+        for message_id in set(message_ids):
+            for indexed_id in self._by_message.get(message_id, ()):
+                overlap[indexed_id] += 1
+
+        best = None
+        for indexed_id, shared in overlap.items():
+            indexed_count = len(set(self.chats[indexed_id]))
+            # Every message of the earlier chat must still be there, plus at least one new one
+            if (indexed_id != chat_id and indexed_id in summaries
+                    and shared == indexed_count < len(set(message_ids))):
+                if best is None or indexed_count > len(set(self.chats[best])):
+                    best = indexed_id
+        if best is None:
+            return None
+        known = set(self.chats[best])
+        return best, [msg for msg in messages if msg.get('id') not in known]
+
+
+def plan_incremental_update(messages: List[Dict], new_messages: List[Dict], previous_summary: Dict,
+                            threshold: float) -> Optional[int]:
+    """Characters summarized incrementally after this update, or None if a full re-summarize is due.
+
+    threshold is the largest share of the conversation (by characters) that
+    may have been added incrementally since the last full summary.
+    """
+    new_chars = _message_chars(new_messages)
+    if not new_chars:
+        return None
+    incremental_chars = previous_summary.get('incremental_chars', 0) + new_chars
+    if incremental_chars > threshold * max(1, _message_chars(messages)):
+        return None
+    return incremental_chars
@@ -10,17 +10,31 @@ import json
 import jsonlines
 import click
 from pathlib import Path
-from typing import Dict, List, Set, Optional, Union
+from collections import ChainMap, Counter
+from typing import Dict, List, Set, Optional, Tuple, Union
 import logging
 from tqdm import tqdm
 import hashlib
 import pickle
+import time
 from datetime import datetime
 import subprocess
 import sys
 import re
 import unicodedata
-import requests
+
+sys.path.append(str(Path(__file__).parent.parent.parent))
+from llm_client import LocalLLMClient, LLMClientError
+from json_stream import JSONStreamScanner
+from llm_cache import open_prompt_cache
+from run_journal import RunJournal, atomic_write
+from summary_store import SummaryStore, open_summary_store
+from work_scheduler import WorkScheduler, PRIORITIES
+from chat_summarization.incremental import MessageIndex, plan_incremental_update
+from chat_summarization.extractive import compress_conversation, load_message_vectors
+from chat_summarization.composed import ChatComposer
+from prompt_budget import PromptBudget
+from triage import ChatTriage, TRIVIAL_MAX_TURNS, TRIVIAL_MAX_CHARS
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -29,13 +43,53 @@ logger = logging.getLogger(__name__)
 class LocalChatSummarizer:
     """Creates chat summaries using local LLM."""
     
-    def __init__(self, chats_file: str = "data/processed/ingestion/chats.jsonl"):
+    def __init__(self, chats_file: str = "data/processed/ingestion/chats.jsonl",
+                 model: str = "gemma:2b",
+                 ollama_url: Optional[str] = None,
+                 max_concurrency: Optional[int] = None,
+                 incremental: bool = True,
+                 incremental_threshold: float = 0.3,
+                 compression: bool = True,
+                 composed: bool = False,
+                 composed_min_coverage: float = 0.6,
+                 triage: bool = False,
+                 triage_max_turns: int = TRIVIAL_MAX_TURNS,
+                 triage_max_chars: int = TRIVIAL_MAX_CHARS,
+                 context_window: Optional[int] = None,
+                 context_fraction: float = 0.75,
+                 scheduler: Optional[WorkScheduler] = None):
         self.chats_file = Path(chats_file)
+        self.model = model
+        # Chat order and the per-run time/token budget
+        self.scheduler = scheduler or WorkScheduler()
         
         # Use modular directory structure
         self.output_dir = Path("data/processed/chat_summarization")
         self.output_dir.mkdir(parents=True, exist_ok=True)
         
+        # Grown chats update their previous summary unless the new part exceeds the threshold
+        self.incremental = incremental
+        self.incremental_threshold = incremental_threshold
+        self.message_index = MessageIndex(self.output_dir / "message_index.pkl")
+        # Long chats are compressed extractively to fit one prompt before falling back to chunking
+        self.compression = compression
+        self._message_vectors: Optional[Dict] = None
+        # Well-clustered chats are summarized from their cluster summaries and tags instead of the transcript
+        self.composer = ChatComposer(self.output_dir.parent, composed_min_coverage) if composed else None
+        self.composition_fallbacks = Counter()
+        # Trivial chats get a template summary instead of an LLM summary
+        self.triage = ChatTriage(triage_max_turns, triage_max_chars) if triage else None
+        # Prompts are packed by token count to a share of the model's context window
+        self.budget = PromptBudget(model, context_window, context_fraction)
+        
+        self.llm_client = LocalLLMClient(
+            model=model,
+            base_url=ollama_url,
+            max_concurrency=max_concurrency,
+            timeout=180,
+            cache=open_prompt_cache(self.output_dir.parent)
+        )
+
     def _generate_chat_hash(self, chat_id: str, messages: List[Dict]) -> str:
         """Generate a hash for a chat to track if it's been processed."""
         # Create a normalized version for hashing
@@ -64,7 +118,7 @@ class LocalChatSummarizer:
         """Save hashes of processed chats."""
         hash_file = self.output_dir / "hashes.pkl"
         try:
-            with open(hash_file, 'wb') as f:
+            with atomic_write(hash_file) as tmp_file, open(tmp_file, 'wb') as f:
                 pickle.dump(hashes, f)
             logger.info(f"Saved {len(hashes)} processed chat hashes")
         except Exception as e:
@@ -86,17 +140,11 @@ class LocalChatSummarizer:
         except Exception as e:
             logger.error(f"Failed to save metadata: {e}")
     
-    def _load_existing_summaries(self, summaries_file: Path) -> Dict:
-        """Load existing summaries from output file."""
-        summaries = {}
-        if summaries_file.exists():
-            try:
-                with open(summaries_file, 'r') as f:
-                    summaries = json.load(f)
-                logger.info(f"Loaded {len(summaries)} existing summaries")
-            except Exception as e:
-                logger.warning(f"Failed to load existing summaries: {e}")
-        return summaries
+    def _load_existing_summaries(self) -> SummaryStore:
+        """Open the summary store; existing summaries are read from it on demand."""
+        store = open_summary_store(self.output_dir, "chat_summaries")
+        logger.info(f"Found {len(store)} existing summaries")
+        return store
     
     def _load_chats(self) -> List[Dict]:
         """Load chats from JSONL file."""
@@ -119,8 +167,7 @@ class LocalChatSummarizer:
         
         # Format conversation (limit to avoid token limits)
         conversation_lines = []
-        total_chars = 0
-        max_chars = 24000  # Increased for Gemma-2B (8k tokens ≈ 24k chars)
+        total_tokens = 0
         
         for msg in messages:
             role = msg.get('role', 'unknown')
@@ -128,12 +175,13 @@ class LocalChatSummarizer:
             if content:
                 sanitized_content = self._sanitize_text(content)
                 line = f"{role.upper()}: {sanitized_content}"
-                if total_chars + len(line) > max_chars:
+                line_tokens = self.budget.count(line) + 2
+                if total_tokens + line_tokens > self.budget.max_tokens:
                     # Add truncation indicator
                     conversation_lines.append("... (conversation truncated)")
                     break
                 conversation_lines.append(line)
-                total_chars += len(line)
+                total_tokens += line_tokens
         
         if not conversation_lines:
             return ""
@@ -217,9 +265,7 @@ RESPOND WITH JSON ONLY:"""
         return text
     
     def _get_summary_from_llm(self, prompt: str) -> Optional[Dict]:
-        """Get summary from local LLM using Ollama HTTP API with retry logic."""
-        import requests
-        
+        """Get summary from local LLM through the shared Ollama client."""
         # Try different prompt variations if the first attempt fails
         prompt_variations = [
             prompt,  # Original prompt
@@ -231,38 +277,23 @@ RESPOND WITH JSON ONLY:"""
             try:
                 logger.debug(f"🔄 Attempt {attempt}/{len(prompt_variations)} with prompt variation")
                 
-                # Use Ollama HTTP API with Gemma-2B model
-                url = "http://localhost:11434/api/chat"
-                
                 # Adjust temperature based on attempt
                 temperature = 0.3 if attempt == 1 else 0.1  # Lower temperature for retries
                 
-                # Prepare request for modern Ollama API
-                request_data = {
-                    "model": "gemma:2b",
-                    "messages": [
-                        {"role": "user", "content": current_prompt}
-                    ],
-                    "stream": False,
-                    "options": {
-                        "temperature": temperature,
+                response_text = self.llm_client.chat(
+                    current_prompt,
+                    temperature=temperature,
+                    options={
                         "top_p": 0.9,
                         "num_predict": 500,
+                        "num_ctx": self.budget.context_window,  # Ollama otherwise truncates at its default
                         "stop": ["```", "```json", "```\n"]  # Stop at code blocks
-                    }
-                }
-                
-                response = requests.post(url, json=request_data, timeout=180)
-                response.raise_for_status()
-                
-                response_json = response.json()
-                
-                # Extract content from the response
-                if 'message' in response_json and 'content' in response_json['message']:
-                    response_text = response_json['message']['content'].strip()
-                else:
-                    logger.error(f"Unexpected response format: {response_json}")
-                    continue
+                    },
+                    accept=lambda r: self._extract_and_parse_json(r.strip()) is not None,
+                    # Stop once the summary object closes; no prefix limit, since
+                    # _extract_and_parse_json can also rebuild key/value output
+                    json_stream=lambda: JSONStreamScanner(root='{', max_prefix_chars=None, max_tokens=500)
+                ).strip()
                 
                 # Try to extract and parse JSON from response
                 summary = self._extract_and_parse_json(response_text)
@@ -274,7 +305,7 @@ RESPOND WITH JSON ONLY:"""
                     logger.warning(f"❌ Failed to extract valid JSON on attempt {attempt}")
                     continue
                     
-            except requests.exceptions.RequestException as e:
+            except LLMClientError as e:
                 logger.error(f"Ollama API request failed on attempt {attempt}: {e}")
             except Exception as e:
                 logger.error(f"Error calling Ollama API on attempt {attempt}: {e}")
@@ -590,36 +621,17 @@ JSON:"""
             }
             return fallback
     
+    def _turn_text(self, msg: Dict) -> str:
+        """A message as it appears in a summary prompt."""
+        return f"{msg.get('role', 'unknown').upper()}: {msg.get('content', '')}"
+    
     def _should_chunk_conversation(self, messages: List[Dict]) -> bool:
-        """Determine if conversation should be chunked based on size."""
-        total_chars = sum(len(msg.get('content', '')) for msg in messages)
-        return total_chars > 24000  # Our current limit
+        """Determine if conversation should be chunked based on its size in tokens."""
+        return not self.budget.fits([self._turn_text(msg) for msg in messages])
     
-    def _create_chunks(self, messages: List[Dict], max_chars: int = 24000) -> List[List[Dict]]:
-        """Split conversation into manageable chunks."""
-        chunks = []
-        current_chunk = []
-        current_chars = 0
-        
-        for msg in messages:
-            msg_content = msg.get('content', '')
-            msg_line = f"{msg.get('role', 'unknown').upper()}: {msg_content}"
-            
-            if current_chars + len(msg_line) > max_chars and current_chunk:
-                # Start new chunk
-                chunks.append(current_chunk)
-                current_chunk = [msg]
-                current_chars = len(msg_line)
-            else:
-                # Add to current chunk
-                current_chunk.append(msg)
-                current_chars += len(msg_line)
-        
-        # Add final chunk
-        if current_chunk:
-            chunks.append(current_chunk)
-        
-        return chunks
+    def _create_chunks(self, messages: List[Dict]) -> List[List[Dict]]:
+        """Split conversation into chunks that each fit one prompt."""
+        return self.budget.pack(messages, self._turn_text)
     
     def _summarize_chunk(self, chunk: List[Dict], chunk_index: int, total_chunks: int) -> Optional[Dict]:
         """Summarize a single chunk of the conversation."""
@@ -634,7 +646,8 @@ JSON:"""
         if not conversation_lines:
             return None
         
-        conversation_text = "\n\n".join(conversation_lines)
+        # A single message larger than the budget is cut to fit
+        conversation_text = self.budget.truncate("\n\n".join(conversation_lines), self.budget.max_tokens)
         
         prompt = f"""Summarize this conversation chunk ({chunk_index + 1} of {total_chunks}) in JSON format:
 
@@ -660,11 +673,9 @@ Respond with JSON only:
         ])
         
         # Check if combined summaries exceed token limit
-        total_chars = len(summaries_text)
-        max_chars = 20000  # Conservative limit for final summary prompt
-        
-        if total_chars > max_chars:
-            logger.warning(f"Combined chunk summaries ({total_chars} chars) exceed limit ({max_chars} chars)")
+        total_tokens = self.budget.count(summaries_text)
+        if total_tokens > self.budget.max_tokens:
+            logger.warning(f"Combined chunk summaries ({total_tokens} tokens) exceed limit ({self.budget.max_tokens} tokens)")
             return self._create_hierarchical_summary_prompt(chunk_summaries)
         
         prompt = f"""Combine these conversation chunk summaries into a comprehensive summary:
@@ -689,9 +700,8 @@ Respond with JSON only:
     
     def _create_hierarchical_summary_prompt(self, chunk_summaries: List[Dict]) -> str:
         """Create hierarchical summary when too many chunks exist."""
-        # Group chunks into manageable batches
-        batch_size = 5  # Process 5 chunks at a time
-        batches = [chunk_summaries[i:i + batch_size] for i in range(0, len(chunk_summaries), batch_size)]
+        # Group chunk summaries into batches that each fit one prompt
+        batches = self.budget.pack(chunk_summaries, lambda summary: f"Chunk 00: {summary.get('summary', '')}")
         
         logger.info(f"Creating hierarchical summary from {len(chunk_summaries)} chunks in {len(batches)} batches")
         
@@ -786,14 +796,114 @@ Respond with JSON only:
         
         logger.info(f"Summarizing chat {chat_id} with {len(messages)} messages")
         
+        if self.composer:
+            summary = self._summarize_chat_composed(chat)
+            if summary:
+                return summary
+        
         # Check if conversation needs chunking
         if self._should_chunk_conversation(messages):
+            if self.compression:
+                summary = self._summarize_chat_compressed(chat)
+                if summary:
+                    return summary
             logger.info(f"Chat {chat_id} is large, using chunked summarization")
             return self._summarize_chat_chunked(chat)
         else:
             # Use original single-pass summarization
             return self._summarize_chat_single_pass(chat)
     
+    def _create_composed_prompt(self, digest: str) -> str:
+        """Create a prompt for summarizing a chat from its digest of cluster summaries and tags."""
+        prompt = f"""You are a conversation summarizer. Instead of the transcript, you get a digest of a conversation: its opening request, summaries of the topic clusters its messages belong to, and tags of its messages. Provide a JSON summary of the conversation.
+
+DIGEST:
+{digest}
+
+INSTRUCTIONS:
+- Summarize this conversation, not the clusters in general
+- Weigh clusters by their share of the conversation
+- Only state decisions and outcomes the digest supports
+- Avoid trailing commas in arrays
+- Ensure all JSON syntax is correct
+
+JSON FORMAT (use exactly these field names):
+{{
+    "summary": "Brief comprehensive summary of the conversation",
+    "key_topics": ["topic1", "topic2", "topic3"],
+    "participants": ["user", "assistant"],
+    "conversation_type": "technical_discussion|casual_chat|problem_solving|tutorial|brainstorming|other",
+    "key_decisions": ["decision1", "decision2"],
+    "outcomes": "What was accomplished or learned",
+    "complexity": "beginner|intermediate|advanced",
+    "domain": "technical|personal|business|academic|creative|other",
+    "confidence": 0.85
+}}
+
+RESPOND WITH JSON ONLY:"""
+
+        return prompt
+    
+    def _summarize_chat_composed(self, chat: Dict) -> Optional[Dict]:
+        """Summarize a well-clustered chat from its cluster summaries and tags instead of its transcript."""
+        chat_id = chat.get('content_hash', chat.get('chat_id', 'unknown'))
+        messages = chat.get('messages', [])
+        
+        clusters, reason = self.composer.load().plan(chat_id)
+        if clusters is None:
+            self.composition_fallbacks[reason] += 1
+            return None
+        digest = self.composer.digest(chat, clusters, self.budget.truncate)
+        if self.budget.count(digest) >= self.budget.total([self._turn_text(msg) for msg in messages]):
+            # Short chats are cheaper to summarize from the transcript
+            self.composition_fallbacks['transcript_smaller'] += 1
+            return None
+        
+        summary = self._get_summary_from_llm(self._create_composed_prompt(digest))
+        if not summary:
+            logger.warning(f"Failed to compose summary of chat {chat_id}, summarizing the transcript")
+            self.composition_fallbacks['llm_failed'] += 1
+            return None
+        
+        summary['chat_id'] = chat_id
+        summary['message_count'] = len(messages)
+        summary['timestamp'] = datetime.now().isoformat()
+        summary['model'] = self.model
+        summary['processing_method'] = 'composed'
+        summary['cluster_ids'] = [cluster_id for cluster_id, _ in clusters]
+        summary['cluster_coverage'] = round(sum(share for _, share in clusters), 3)
+        summary['duration_minutes'] = None
+        if 'timestamp' in messages[0] and 'timestamp' in messages[-1]:
+            try:
+                start_time = datetime.fromisoformat(messages[0]['timestamp'].replace('Z', '+00:00'))
+                end_time = datetime.fromisoformat(messages[-1]['timestamp'].replace('Z', '+00:00'))
+                summary['duration_minutes'] = round((end_time - start_time).total_seconds() / 60, 1)
+            except (AttributeError, TypeError, ValueError):
+                pass
+        return summary
+    
+    def _summarize_chat_compressed(self, chat: Dict) -> Optional[Dict]:
+        """Summarize a long chat in one pass from an extractive compression of its turns."""
+        chat_id = chat.get('content_hash', chat.get('chat_id', 'unknown'))
+        messages = chat.get('messages', [])
+        
+        if self._message_vectors is None:
+            self._message_vectors = load_message_vectors(self.output_dir.parent / "embedding" / "embeddings.jsonl")
+        compressed, stats = compress_conversation(messages, self._message_vectors, self.budget.max_tokens,
+                                                  cost=lambda msg: self.budget.count(self._turn_text(msg)) + 2)
+        if not compressed:
+            logger.info(f"Chat {chat_id} could not be compressed to one prompt ({stats['method']})")
+            return None
+        logger.info(f"Compressed chat {chat_id} from {stats['original_size']} to "
+                    f"{stats['compressed_size']} tokens ({stats['method']})")
+        
+        summary = self._summarize_chat_single_pass({**chat, 'messages': compressed})
+        if summary:
+            summary['message_count'] = len(messages)
+            summary['processing_method'] = 'compressed_single_pass'
+            summary['compression'] = stats
+        return summary
+    
     def _summarize_chat_single_pass(self, chat: Dict) -> Optional[Dict]:
         """Summarize chat using single pass (original method)."""
         # Use content_hash as chat_id, fallback to 'unknown' if not available
@@ -814,7 +924,7 @@ Respond with JSON only:
             summary['chat_id'] = chat_id
             summary['message_count'] = len(messages)
             summary['timestamp'] = datetime.now().isoformat()
-            summary['model'] = 'gemma:2b'
+            summary['model'] = self.model
             summary['processing_method'] = 'single_pass'
             
             # Calculate duration if timestamps are available
@@ -872,11 +982,10 @@ Respond with JSON only:
             comprehensive_summary['chat_id'] = chat_id
             comprehensive_summary['message_count'] = len(messages)
             comprehensive_summary['timestamp'] = datetime.now().isoformat()
-            comprehensive_summary['model'] = 'gemma:2b'
+            comprehensive_summary['model'] = self.model
             
             # Determine processing method based on whether hierarchical was used
-            total_chars = sum(len(summary.get('summary', '')) for summary in chunk_summaries)
-            if total_chars > 20000:
+            if not self.budget.fits([summary.get('summary', '') for summary in chunk_summaries]):
                 comprehensive_summary['processing_method'] = 'hierarchical_chunked'
                 logger.info(f"Used hierarchical summarization for large chat {chat_id}")
             else:
@@ -906,13 +1015,115 @@ Respond with JSON only:
             logger.warning(f"Failed to create comprehensive summary for chat {chat_id}")
             return None
     
+    def _create_incremental_prompt(self, previous_summary: Dict, new_messages: List[Dict]) -> str:
+        """Create a prompt that updates a chat's previous summary with the messages added since."""
+        conversation_lines = []
+        for msg in new_messages:
+            content = msg.get('content', '').strip()
+            if content:
+                conversation_lines.append(f"{msg.get('role', 'unknown').upper()}: {self._sanitize_text(content)}")
+        
+        if not conversation_lines:
+            return ""
+        
+        previous = json.dumps({
+            field: previous_summary.get(field)
+            for field in ('summary', 'key_topics', 'conversation_type', 'key_decisions', 'outcomes',
+                          'complexity', 'domain')
+        }, indent=2)
+        conversation_text = "\n\n".join(conversation_lines)
+        
+        prompt = f"""You are a conversation summarizer. A conversation you summarized before has continued. Update its JSON summary with the new messages.
+
+PREVIOUS SUMMARY:
+{previous}
+
+NEW MESSAGES:
+{conversation_text}
+
+INSTRUCTIONS:
+- Keep everything from the previous summary that is still accurate
+- Add the topics, decisions and outcomes of the new messages
+- Correct anything the new messages change
+- Avoid trailing commas in arrays
+- Ensure all JSON syntax is correct
+
+JSON FORMAT (use exactly these field names):
+{{
+    "summary": "Brief comprehensive summary of the whole conversation",
+    "key_topics": ["topic1", "topic2", "topic3"],
+    "participants": ["user", "assistant"],
+    "conversation_type": "technical_discussion|casual_chat|problem_solving|tutorial|brainstorming|other",
+    "key_decisions": ["decision1", "decision2"],
+    "outcomes": "What was accomplished or learned",
+    "complexity": "beginner|intermediate|advanced",
+    "domain": "technical|personal|business|academic|creative|other",
+    "confidence": 0.85
+}}
+
+RESPOND WITH JSON ONLY:"""
+
+        return prompt
+    
+    def _plan_incremental_update(self, chat_id: str, messages: List[Dict],
+                                 summaries: Dict[str, Dict]) -> Optional[Tuple[str, List[Dict], int]]:
+        """(previous chat_id, new messages, incremental chars) if the chat can update an earlier summary."""
+        previous = self.message_index.find_previous(chat_id, messages, summaries)
+        if not previous:
+            return None
+        previous_id, new_messages = previous
+        if not self.budget.fits([json.dumps(summaries[previous_id])] + [self._turn_text(msg) for msg in new_messages]):
+            logger.info(f"New messages of chat {chat_id} do not fit one prompt, re-summarizing in full")
+            return None
+        incremental_chars = plan_incremental_update(messages, new_messages, summaries[previous_id],
+                                                    self.incremental_threshold)
+        if incremental_chars is None:
+            logger.info(f"Chat {chat_id} grew too much since {previous_id}, re-summarizing in full")
+            return None
+        return previous_id, new_messages, incremental_chars
+    
+    def _summarize_chat_incremental(self, chat: Dict, previous_id: str, previous_summary: Dict,
+                                    new_messages: List[Dict], incremental_chars: int) -> Optional[Dict]:
+        """Update a grown chat's previous summary from the new messages only."""
+        chat_id = chat.get('content_hash', chat.get('chat_id', 'unknown'))
+        messages = chat.get('messages', [])
+        
+        logger.info(f"Updating summary of chat {chat_id} with {len(new_messages)} new messages (was {previous_id})")
+        prompt = self._create_incremental_prompt(previous_summary, new_messages)
+        if not prompt:
+            return None
+        
+        summary = self._get_summary_from_llm(prompt)
+        if not summary:
+            logger.warning(f"Failed to update summary of chat {chat_id}, falling back to a full summary")
+            return None
+        
+        summary['chat_id'] = chat_id
+        summary['message_count'] = len(messages)
+        summary['timestamp'] = datetime.now().isoformat()
+        summary['model'] = self.model
+        summary['processing_method'] = 'incremental'
+        summary['previous_chat_id'] = previous_id
+        summary['new_message_count'] = len(new_messages)
+        # Characters folded in since the last full summary; bounds drift across repeated updates
+        summary['incremental_chars'] = incremental_chars
+        summary['duration_minutes'] = previous_summary.get('duration_minutes')
+        if 'timestamp' in messages[0] and 'timestamp' in messages[-1]:
+            try:
+                start_time = datetime.fromisoformat(messages[0]['timestamp'].replace('Z', '+00:00'))
+                end_time = datetime.fromisoformat(messages[-1]['timestamp'].replace('Z', '+00:00'))
+                summary['duration_minutes'] = round((end_time - start_time).total_seconds() / 60, 1)
+            except (AttributeError, TypeError, ValueError):
+                pass
+        return summary
+    
     def process_chats_to_summaries(self, force_reprocess: bool = False) -> Dict:
         """Process chats into summaries."""
         logger.info("🚀 Starting chat summarization...")
         
-        # Load existing summaries
-        summaries_file = self.output_dir / "chat_summaries.json"
-        existing_summaries = self._load_existing_summaries(summaries_file)
+        # Existing summaries, looked up in the store as needed
+        existing_summaries = self._load_existing_summaries()
+        existing_count = len(existing_summaries)
         
         # Load processed hashes
         processed_hashes = set()
@@ -920,82 +1131,154 @@ Respond with JSON only:
             processed_hashes = self._load_processed_chat_hashes()
             logger.info(f"Found {len(processed_hashes)} existing processed hashes")
         
-        # Load chats
-        chats = self._load_chats()
+        # Load chats, highest-priority first
+        chats = self.scheduler.order_chats(self._load_chats())
         
         if not chats:
             logger.warning("No chats found")
             return {'status': 'no_chats'}
         
-        # Process each chat
+        # Process each chat, starting from summaries journaled by an interrupted run
         new_summaries = {}
         processed_chat_hashes = set()
+        journal = RunJournal(self.output_dir / "chat_summaries.journal.jsonl")
+        self.message_index.load()
+        for record in journal.replay():
+            new_summaries[record['result']['chat_id']] = record['result']['summary']
+            processed_chat_hashes.add(record['hash'])
+            self.message_index.record(record['result']['chat_id'], record['result'].get('message_ids', []))
+        recovered_summaries = len(new_summaries)
+        
+        # Message IDs of summarized chats, including those summarized before the index existed
+        for chat in chats:
+            chat_id = chat.get('content_hash', chat.get('chat_id', 'unknown'))
+            if chat_id in existing_summaries and chat_id not in self.message_index.chats:
+                self.message_index.record(chat_id, [msg.get('id') for msg in chat.get('messages', []) if msg.get('id')])
+        summaries = ChainMap(new_summaries, existing_summaries)
+        incremental_updates = 0
         
         # Track statistics
         total_chats = len(chats)
         successful_summaries = 0
         failed_summaries = 0
         skipped_chats = 0
+        deferred_chats = 0
         
-        for i, chat in enumerate(chats, 1):
-            # Use content_hash as chat_id, fallback to 'unknown' if not available
-            chat_id = chat.get('content_hash', chat.get('chat_id', 'unknown'))
-            messages = chat.get('messages', [])
-            
-            # Generate chat hash
-            chat_hash = self._generate_chat_hash(chat_id, messages)
-            
-            # Check if already processed
-            if chat_hash not in processed_hashes or force_reprocess:
-                logger.info(f"Processing chat {i}/{total_chats}: {chat_id} with {len(messages)} messages")
-                summary = self._summarize_chat(chat)
-                if summary:
-                    new_summaries[chat_id] = summary
-                    processed_chat_hashes.add(chat_hash)  # Only save hash if summary was successful
-                    successful_summaries += 1
-                    logger.info(f"✅ Successfully summarized chat {chat_id}")
+        with journal:
+            for i, chat in enumerate(chats, 1):
+                # Use content_hash as chat_id, fallback to 'unknown' if not available
+                chat_id = chat.get('content_hash', chat.get('chat_id', 'unknown'))
+                messages = chat.get('messages', [])
+                
+                # Generate chat hash
+                chat_hash = self._generate_chat_hash(chat_id, messages)
+                
+                # Check if already processed (or recovered from the journal)
+                if chat_hash in processed_chat_hashes:
+                    continue
+                if chat_hash not in processed_hashes or force_reprocess:
+                    triage_reason = self.triage.assess(messages) if self.triage else None
+                    if triage_reason:
+                        # Trivial chat: template summary, no LLM call and no budget spent
+                        summary = self.triage.template_summary(chat, triage_reason)
+                        self.triage.record_saved()
+                        logger.info(f"Triaged chat {i}/{total_chats}: {chat_id} ({triage_reason})")
+                    else:
+                        update = None
+                        if self.incremental and not force_reprocess:
+                            update = self._plan_incremental_update(chat_id, messages, summaries)
+                        prompt_messages = update[1] if update else messages
+                        if not self.scheduler.try_start(sum(self.budget.count(m.get('content', '')) for m in prompt_messages)):
+                            # Budget spent; the chat is left for the next run
+                            deferred_chats += 1
+                            continue
+                        logger.info(f"Processing chat {i}/{total_chats}: {chat_id} with {len(messages)} messages")
+                        started = time.perf_counter()
+                        summary = None
+                        if update:
+                            previous_id, new_messages, incremental_chars = update
+                            summary = self._summarize_chat_incremental(chat, previous_id, summaries[previous_id],
+                                                                       new_messages, incremental_chars)
+                            incremental_updates += bool(summary)
+                        if not summary:
+                            summary = self._summarize_chat(chat)
+                        if summary and self.triage:
+                            self.triage.record_llm(time.perf_counter() - started)
+                    if summary:
+                        message_ids = [msg.get('id') for msg in messages if msg.get('id')]
+                        new_summaries[chat_id] = summary
+                        processed_chat_hashes.add(chat_hash)  # Only save hash if summary was successful
+                        self.message_index.record(chat_id, message_ids)
+                        journal.append(chat_hash, {'chat_id': chat_id, 'summary': summary, 'message_ids': message_ids})
+                        successful_summaries += 1
+                        logger.info(f"✅ Successfully summarized chat {chat_id}")
+                    else:
+                        failed_summaries += 1
+                        logger.warning(f"❌ Failed to summarize chat {chat_id}, will retry on next run")
                 else:
-                    failed_summaries += 1
-                    logger.warning(f"❌ Failed to summarize chat {chat_id}, will retry on next run")
-            else:
-                skipped_chats += 1
-                logger.debug(f"⏭️ Chat {chat_id} already processed, skipping")
+                    skipped_chats += 1
+                    logger.debug(f"⏭️ Chat {chat_id} already processed, skipping")
         
         # Log summary statistics
         logger.info(f"📊 Processing Summary:")
         logger.info(f"  Total chats: {total_chats}")
         logger.info(f"  Successful: {successful_summaries}")
+        logger.info(f"  Recovered from journal: {recovered_summaries}")
         logger.info(f"  Failed: {failed_summaries}")
         logger.info(f"  Skipped: {skipped_chats}")
+        logger.info(f"  Incremental updates: {incremental_updates}")
+        # How each new summary was produced
+        summary_paths = Counter(summary.get('processing_method', 'unknown') for summary in new_summaries.values())
+        if summary_paths:
+            logger.info("  Summary paths: " + ", ".join(f"{path} {count}" for path, count in summary_paths.most_common()))
+        if self.composition_fallbacks:
+            logger.info("  Not composed: " + ", ".join(
+                f"{reason} {count}" for reason, count in self.composition_fallbacks.most_common()))
+        if self.triage:
+            logger.info(f"  Triaged: {self.triage.describe()}")
+        if deferred_chats:
+            logger.info(f"  Deferred to next run: {deferred_chats}")
         if total_chats > 0:
             success_rate = (successful_summaries / total_chats) * 100
             logger.info(f"  Success rate: {success_rate:.1f}%")
         
         if not new_summaries and not force_reprocess:
             logger.info("No new chats to process")
+            # Keep the last run's stats, but record what this run deferred
+            self.scheduler.update_metadata(self.output_dir / "metadata.json")
             return {'status': 'no_new_chats'}
         
-        # Combine existing and new summaries
-        all_summaries = {**existing_summaries, **new_summaries}
-        
-        # Save summaries
-        with open(summaries_file, 'w') as f:
-            json.dump(all_summaries, f, indent=2)
+        # Save only new and changed summaries
+        written_summaries = existing_summaries.put_many(new_summaries)
+        logger.info(f"Saved {written_summaries} new or changed summaries")
         
         # Save hashes and metadata
         all_processed_hashes = processed_hashes.union(processed_chat_hashes)
         self._save_processed_chat_hashes(all_processed_hashes)
+        self.message_index.save()
+        journal.finish()
         
         # Calculate statistics
         stats = {
             'status': 'success',
-            'total_chats': len(all_summaries),
+            'total_chats': len(existing_summaries),
             'new_summaries': len(new_summaries),
-            'existing_summaries': len(existing_summaries),
-            'processed_chats': len(processed_chat_hashes)
+            'existing_summaries': existing_count,
+            'written_summaries': written_summaries,
+            'processed_chats': len(processed_chat_hashes),
+            'recovered_summaries': recovered_summaries,
+            'incremental_updates': incremental_updates,
+            'summary_paths': dict(summary_paths),
+            'composition_fallbacks': dict(self.composition_fallbacks),
+            'triage': self.triage.get_stats() if self.triage else None,
+            'prompt_budget': self.budget.get_stats(),
+            'deferred_chats': deferred_chats,
+            'scheduler': self.scheduler.get_stats(),
+            'llm_metrics': self.llm_client.get_metrics()
         }
         
         self._save_metadata(stats)
+        self.llm_client.log_metrics()
         
         logger.info(f"✅ Chat summarization complete: {len(new_summaries)} new summaries created")
         return stats
@@ -1006,8 +1289,38 @@ Respond with JSON only:
               default='data/processed/ingestion/chats.jsonl',
               help='Input chats file')
 @click.option('--force', is_flag=True, help='Force reprocess all chats')
+@click.option('--ollama-url', default=None, help='Ollama server URL (default: $OLLAMA_URL or http://localhost:11434)')
+@click.option('--max-concurrency', default=None, type=int, help='Maximum concurrent Ollama requests (default: $OLLAMA_MAX_CONCURRENCY or 1)')
+@click.option('--incremental/--no-incremental', default=True,
+              help='Update the summary of a grown chat from its new messages instead of re-summarizing it')
+@click.option('--incremental-threshold', default=0.3, type=float,
+              help='Re-summarize in full once this share of a chat was added since its last full summary')
+@click.option('--compression/--no-compression', default=True,
+              help='Compress long chats extractively into one prompt instead of summarizing them in chunks')
+@click.option('--composed', is_flag=True,
+              help='Summarize well-clustered chats from their cluster summaries and tags instead of the transcript')
+@click.option('--composed-min-coverage', default=0.6, type=float,
+              help='Share of a chat\'s chunks that must be in summarized clusters for it to be composed')
+@click.option('--triage/--no-triage', default=False,
+              help='Give trivial chats (few, short or repeated turns) a template summary instead of an LLM summary (off by default)')
+@click.option('--triage-max-turns', default=TRIVIAL_MAX_TURNS, type=int,
+              help='Most distinct turns a trivial chat has')
+@click.option('--triage-max-chars', default=TRIVIAL_MAX_CHARS, type=int,
+              help='Most characters in the distinct turns of a trivial chat')
+@click.option('--context-window', default=None, type=int, help='Model context window in tokens (default: known size for the model)')
+@click.option('--context-fraction', default=0.75, type=float, help='Share of the context window prompts are packed to')
+@click.option('--priority', default='file', type=click.Choice(PRIORITIES),
+              help='Order of chats: file order, most recent first or shortest first')
+@click.option('--pin', 'pins', multiple=True, help='Chat ID to summarize before all others (repeatable)')
+@click.option('--time-budget', default=None, type=float, help='Stop starting new summaries after this many minutes')
+@click.option('--token-budget', default=None, type=int, help='Stop starting new summaries after about this many prompt tokens')
 @click.option('--check-only', is_flag=True, help='Only check setup, don\'t process')
-def main(chats_file: str, force: bool, check_only: bool):
+def main(chats_file: str, force: bool, ollama_url: Optional[str], max_concurrency: Optional[int],
+         incremental: bool, incremental_threshold: float, compression: bool,
+         composed: bool, composed_min_coverage: float,
+         triage: bool, triage_max_turns: int, triage_max_chars: int,
+         context_window: Optional[int], context_fraction: float, priority: str, pins: Tuple[str, ...], time_budget: Optional[float], token_budget: Optional[int],
+         check_only: bool):
     """Run local chat summarization."""
     if check_only:
         logger.info("🔍 Checking setup...")
@@ -1035,7 +1348,15 @@ def main(chats_file: str, force: bool, check_only: bool):
         return 0
     
     # Run summarization
-    summarizer = LocalChatSummarizer(chats_file)
+    scheduler = WorkScheduler.from_options(priority, pins, time_budget, token_budget)
+    summarizer = LocalChatSummarizer(chats_file, ollama_url=ollama_url, max_concurrency=max_concurrency,
+                                     incremental=incremental, incremental_threshold=incremental_threshold,
+                                     compression=compression, composed=composed,
+                                     composed_min_coverage=composed_min_coverage, triage=triage,
+                                     triage_max_turns=triage_max_turns, triage_max_chars=triage_max_chars,
+                                     context_window=context_window,
+                                     context_fraction=context_fraction,
+                                     scheduler=scheduler)
     result = summarizer.process_chats_to_summaries(force_reprocess=force)
     
     if result.get('status') == 'success':
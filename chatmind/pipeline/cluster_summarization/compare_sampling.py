@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Representative Sampling Comparison
+
+Summarizes a fixed, seeded sample of large clusters twice - from every chunk
+(hierarchical map-reduce where needed) and from a representative sample - and
+reports prompt tokens and how closely the two summaries agree:
+
+- token_reduction: full prompt tokens / sampled prompt tokens
+- topic_jaccard: overlap of the key_topics lists
+- summary_similarity: cosine of the summary embeddings (all-MiniLM-L6-v2),
+  or word Jaccard if sentence-transformers is not installed
+- coverage: share of the cluster's chunks with a sampled chunk at cosine >= 0.8
+
+The report is written to data/processed/cluster_summarization/sampling_comparison.json.
+Summary outputs and hashes of the regular step are not touched.
+"""
+
+import json
+import random
+import re
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import logging
+
+import click
+import numpy as np
+
+import sys
+sys.path.append(str(Path(__file__).parent.parent))
+from cluster_summarization.representative_sample import sample_coverage
+from run_journal import atomic_write
+
+try:
+    from sentence_transformers import SentenceTransformer
+    SENTENCE_TRANSFORMERS_AVAILABLE = True
+except ImportError:
+    SENTENCE_TRANSFORMERS_AVAILABLE = False
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def _load_summarizer(method: str, sampling: str, sample_token_budget: int):
+    if method == 'cloud':
+        from cluster_summarization.cloud_api.enhanced_cluster_summarizer import CloudClusterSummarizer
+        return CloudClusterSummarizer(sampling=sampling, sample_token_budget=sample_token_budget)
+    from cluster_summarization.local.local_enhanced_cluster_summarizer import LocalClusterSummarizer
+    return LocalClusterSummarizer(sampling=sampling, sample_token_budget=sample_token_budget)
+
+
+def _summarize(summarizer, cluster_id: str,
+               cluster_chunks: List[Dict]) -> Tuple[Optional[Dict], List[Dict], int]:
+    """Summarize one cluster serially; returns the summary, the chunks it was prompted with and the prompt tokens."""
+    llm_method = '_get_summary_from_openai' if hasattr(summarizer, '_get_summary_from_openai') else '_get_summary_from_llm'
+    llm = getattr(summarizer, llm_method)
+    tokens = 0
+
+    def counted(prompt: str) -> Optional[Dict]:
+        nonlocal tokens
+        tokens += summarizer.budget.count(prompt)
+        return llm(prompt)
+
+    # Route the reduce step's call through the counter too
+    setattr(summarizer, llm_method, counted)
+    try:
+        prompt_chunks, batch_prompts = summarizer._plan_cluster(cluster_chunks)
+        batch_summaries = [counted(prompt) for prompt in batch_prompts]
+        summary = summarizer._reduce_cluster(cluster_id, cluster_chunks, prompt_chunks, batch_summaries)
+    finally:
+        delattr(summarizer, llm_method)
+    return summary, prompt_chunks, tokens
+
+
+def _word_jaccard(a: str, b: str) -> float:
+    words_a = set(re.findall(r'\w+', a.lower()))
+    words_b = set(re.findall(r'\w+', b.lower()))
+    if not words_a or not words_b:
+        return 0.0
+    return len(words_a & words_b) / len(words_a | words_b)
+
+
+def _topic_jaccard(a: List[str], b: List[str]) -> float:
+    topics_a = {t.strip().lower() for t in a or []}
+    topics_b = {t.strip().lower() for t in b or []}
+    if not topics_a or not topics_b:
+        return 0.0
+    return len(topics_a & topics_b) / len(topics_a | topics_b)
+
+
+@click.command()
+@click.option('--method', type=click.Choice(['local', 'cloud']), default='local', help='Summarizer to compare with')
+@click.option('--clusters', 'cluster_count', default=10, type=int, help='Number of large clusters to compare')
+@click.option('--min-chunks', default=30, type=int, help='Only sample clusters with at least this many chunks')
+@click.option('--sample-token-budget', default=5000, type=int, help='Prompt tokens for a representative sample')
+@click.option('--seed', default=42, type=int, help='Seed for the fixed cluster sample')
+def main(method: str, cluster_count: int, min_chunks: int, sample_token_budget: int, seed: int):
+    """Compare representative-sample cluster summaries with full summaries."""
+    full = _load_summarizer(method, 'full', sample_token_budget)
+    sampled = _load_summarizer(method, 'representative', sample_token_budget)
+
+    clusters = sampled._group_chunks_by_cluster(sampled._load_clustered_embeddings(), sampled._load_chunks())
+    large = sorted((cluster_id for cluster_id, chunks in clusters.items()
+                    if len(chunks) >= min_chunks and str(cluster_id) != '-1'), key=str)
+    if not large:
+        logger.warning(f"No clusters with at least {min_chunks} chunks")
+        return
+    selected = random.Random(seed).sample(large, min(cluster_count, len(large)))
+    logger.info(f"Comparing {len(selected)} of {len(large)} large clusters")
+
+    embedder = SentenceTransformer('all-MiniLM-L6-v2') if SENTENCE_TRANSFORMERS_AVAILABLE else None
+
+    results = []
+    for cluster_id in selected:
+        cluster_chunks = clusters[cluster_id]
+        full_summary, _, full_tokens = _summarize(full, cluster_id, cluster_chunks)
+        sampled_summary, sample, sampled_tokens = _summarize(sampled, cluster_id, cluster_chunks)
+        if not full_summary or not sampled_summary:
+            logger.warning(f"Skipping cluster {cluster_id}: a summary failed")
+            continue
+
+        if embedder is not None:
+            a, b = embedder.encode([full_summary['summary'], sampled_summary['summary']], normalize_embeddings=True)
+            similarity = float(np.dot(a, b))
+        else:
+            similarity = _word_jaccard(full_summary['summary'], sampled_summary['summary'])
+
+        embedded = [c for c in cluster_chunks if c.get('chunk_hash') in sampled.chunk_vectors]
+        sample_hashes = {c['chunk_hash'] for c in sample}
+        coverage = sample_coverage(np.asarray([sampled.chunk_vectors[c['chunk_hash']] for c in embedded]),
+                                   [row for row, c in enumerate(embedded) if c['chunk_hash'] in sample_hashes])
+
+        results.append({
+            'cluster_id': cluster_id,
+            'chunk_count': len(cluster_chunks),
+            'sampled_chunk_count': len(sample),
+            'full_tokens': full_tokens,
+            'sampled_tokens': sampled_tokens,
+            'token_reduction': round(full_tokens / max(1, sampled_tokens), 1),
+            'topic_jaccard': round(_topic_jaccard(full_summary.get('key_topics'), sampled_summary.get('key_topics')), 3),
+            'summary_similarity': round(similarity, 3),
+            'coverage': round(coverage, 3)
+        })
+        logger.info(f"Cluster {cluster_id}: {full_tokens} → {sampled_tokens} tokens, "
+                    f"similarity {similarity:.2f}")
+
+    if not results:
+        logger.warning("No clusters could be compared")
+        return
+
+    report = {
+        'method': method,
+        'seed': seed,
+        'sample_token_budget': sample_token_budget,
+        'similarity_measure': 'embedding_cosine' if embedder is not None else 'word_jaccard',
+        'clusters': results,
+        'totals': {
+            'full_tokens': sum(r['full_tokens'] for r in results),
+            'sampled_tokens': sum(r['sampled_tokens'] for r in results),
+            'mean_topic_jaccard': round(float(np.mean([r['topic_jaccard'] for r in results])), 3),
+            'mean_summary_similarity': round(float(np.mean([r['summary_similarity'] for r in results])), 3)
+        }
+    }
+    report['totals']['token_reduction'] = round(
+        report['totals']['full_tokens'] / max(1, report['totals']['sampled_tokens']), 1)
+
+    report_file = sampled.output_dir / "sampling_comparison.json"
+    with atomic_write(report_file) as tmp_file, open(tmp_file, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    logger.info("✅ Sampling comparison complete!")
+    logger.info(f"  Tokens: {report['totals']['full_tokens']} full vs "
+                f"{report['totals']['sampled_tokens']} sampled ({report['totals']['token_reduction']}x fewer)")
+    logger.info(f"  Mean topic overlap: {report['totals']['mean_topic_jaccard']}, "
+                f"mean summary similarity: {report['totals']['mean_summary_similarity']}")
+    logger.info(f"  Report: {report_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -10,7 +10,7 @@ import json
 import jsonlines
 import click
 from pathlib import Path
-from typing import Dict, List, Set, Optional, Union
+from typing import Dict, List, Set, Optional, Tuple, Union
 import logging
 from tqdm import tqdm
 import hashlib
@@ -21,6 +21,17 @@ import subprocess
 import sys
 import re
 
+sys.path.append(str(Path(__file__).parent.parent.parent))
+from llm_client import LocalLLMClient, LLMClientError
+from json_stream import JSONStreamScanner
+from llm_cache import open_prompt_cache
+from run_journal import RunJournal, atomic_write
+from summary_store import SummaryStore, open_summary_store
+from worker_pool import map_reduce_ordered
+from cluster_summarization.representative_sample import select_representative_chunks
+from work_scheduler import WorkScheduler, PRIORITIES
+from prompt_budget import PromptBudget
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -29,13 +40,41 @@ class LocalClusterSummarizer:
     """Creates cluster summaries using local LLM."""
     
     def __init__(self, clustered_embeddings_file: str = "../../data/processed/clustering/clustered_embeddings.jsonl",
-                 chunks_file: str = "../../data/processed/chunking/chunks.jsonl"):
+                 chunks_file: str = "../../data/processed/chunking/chunks.jsonl",
+                 model: str = "gemma:2b",
+                 ollama_url: Optional[str] = None,
+                 max_concurrency: Optional[int] = None,
+                 max_workers: int = 1,
+                 sampling: str = "full",
+                 sample_token_budget: int = 5000,
+                 context_window: Optional[int] = None,
+                 context_fraction: float = 0.75,
+                 scheduler: Optional[WorkScheduler] = None):
         self.clustered_embeddings_file = Path(clustered_embeddings_file)
         self.chunks_file = Path(chunks_file)
+        self.model = model
+        # Concurrent LLM calls shared by the map and reduce steps
+        self.max_workers = max(1, max_workers)
+        # 'representative' summarizes large clusters from an embedding-selected subset of chunks
+        self.sampling = sampling
+        self.sample_token_budget = sample_token_budget
+        self.chunk_vectors: Dict[str, List[float]] = {}
+        # Prompts are packed by token count to a share of the model's context window
+        self.budget = PromptBudget(model, context_window, context_fraction)
+        # Cluster order and the per-run time/token budget
+        self.scheduler = scheduler or WorkScheduler()
         
         # Use modular directory structure
         self.output_dir = Path("../../data/processed/cluster_summarization")
         self.output_dir.mkdir(parents=True, exist_ok=True)
+        
+        self.llm_client = LocalLLMClient(
+            model=model,
+            base_url=ollama_url,
+            max_concurrency=max_concurrency or self.max_workers,
+            timeout=120,
+            cache=open_prompt_cache(self.output_dir.parent)
+        )
     
     def _sanitize_text(self, text: str) -> str:
         """Sanitize text to remove problematic Unicode characters."""
@@ -111,7 +150,7 @@ class LocalClusterSummarizer:
         """Save hashes of processed clusters."""
         hash_file = self.output_dir / "hashes.pkl"
         try:
-            with open(hash_file, 'wb') as f:
+            with atomic_write(hash_file) as tmp_file, open(tmp_file, 'wb') as f:
                 pickle.dump(hashes, f)
             logger.info(f"Saved {len(hashes)} processed cluster hashes")
         except Exception as e:
@@ -133,17 +172,11 @@ class LocalClusterSummarizer:
         except Exception as e:
             logger.error(f"Failed to save metadata: {e}")
     
-    def _load_existing_summaries(self, summaries_file: Path) -> Dict:
-        """Load existing summaries from output file."""
-        summaries = {}
-        if summaries_file.exists():
-            try:
-                with open(summaries_file, 'r') as f:
-                    summaries = json.load(f)
-                logger.info(f"Loaded {len(summaries)} existing summaries")
-            except Exception as e:
-                logger.warning(f"Failed to load existing summaries: {e}")
-        return summaries
+    def _load_existing_summaries(self) -> SummaryStore:
+        """Open the summary store; existing summaries are read from it on demand."""
+        store = open_summary_store(self.output_dir, "cluster_summaries")
+        logger.info(f"Found {len(store)} existing summaries")
+        return store
     
     def _load_clustered_embeddings(self) -> List[Dict]:
         """Load clustered embeddings with cluster_id."""
@@ -191,15 +224,16 @@ class LocalClusterSummarizer:
                 chunk['umap_x'] = embedding.get('umap_x', 0.0)
                 chunk['umap_y'] = embedding.get('umap_y', 0.0)
                 clusters[cluster_id].append(chunk)
+                if self.sampling == 'representative' and embedding.get('embedding'):
+                    self.chunk_vectors[chunk_hash] = embedding['embedding']
             else:
                 logger.warning(f"Chunk not found for hash: {chunk_hash}")
         
         logger.info(f"Grouped chunks into {len(clusters)} clusters")
         return dict(clusters)
     
-    def _create_summary_prompt(self, cluster_chunks: List[Dict]) -> str:
-        """Create a prompt for summarizing a cluster of chunks."""
-        # Extract content from chunks and sanitize
+    def _chunk_contents(self, cluster_chunks: List[Dict]) -> List[str]:
+        """Sanitized, non-empty chunk contents of a cluster."""
         contents = []
         for chunk in cluster_chunks:
             content = chunk.get('content', '').strip()
@@ -207,18 +241,40 @@ class LocalClusterSummarizer:
                 sanitized_content = self._sanitize_text(content)
                 if sanitized_content:
                     contents.append(sanitized_content)
-        
+        return contents
+    
+    def _plan_cluster(self, cluster_chunks: List[Dict]) -> Tuple[List[Dict], List[str]]:
+        """Chunks for the single-pass prompt, and map-step prompts if the cluster needs batching.
+
+        With representative sampling, a cluster over the sample budget is cut
+        down to a representative subset that fits one prompt. Otherwise a
+        cluster too large for a single prompt gets one map-step prompt per
+        batch of chunks.
+        """
+        if self.sampling == 'representative':
+            total_tokens = sum(self.budget.count(chunk.get('content', '')) for chunk in cluster_chunks)
+            if total_tokens > self.sample_token_budget:
+                sample = select_representative_chunks(cluster_chunks, self.chunk_vectors, self.sample_token_budget,
+                                                      count_tokens=self.budget.count)
+                if sample:
+                    logger.info(f"Sampled {len(sample)} of {len(cluster_chunks)} chunks "
+                                f"(~{total_tokens} tokens) to fit {self.sample_token_budget} tokens")
+                    return sample, []
+        
+        total_tokens = self.budget.total(self._chunk_contents(cluster_chunks))
+        if total_tokens <= self.budget.max_tokens:
+            return cluster_chunks, []
+        logger.warning(f"Cluster content ({total_tokens} tokens) exceeds limit ({self.budget.max_tokens} tokens), "
+                       f"using hierarchical approach")
+        return cluster_chunks, self._create_batch_prompts(cluster_chunks)
+    
+    def _create_summary_prompt(self, cluster_chunks: List[Dict]) -> str:
+        """Create a single-pass prompt for summarizing a cluster of chunks."""
+        contents = self._chunk_contents(cluster_chunks)
         if not contents:
             return ""
         
-        # Check if combined content exceeds token limit
         combined_content = "\n\n".join(contents)
-        total_chars = len(combined_content)
-        max_chars = 24000  # Conservative limit for Gemma-2B
-        
-        if total_chars > max_chars:
-            logger.warning(f"Cluster content ({total_chars} chars) exceeds limit ({max_chars} chars), using hierarchical approach")
-            return self._create_hierarchical_cluster_prompt(cluster_chunks)
         
         prompt = f"""Analyze the following content and create a comprehensive summary. The content appears to be from a conversation or discussion.
 
@@ -246,28 +302,18 @@ Respond only with valid JSON."""
 
         return prompt
     
-    def _create_hierarchical_cluster_prompt(self, cluster_chunks: List[Dict]) -> str:
-        """Create hierarchical summary when cluster content is too large."""
-        # Group chunks into manageable batches
-        batch_size = 5  # Process 5 chunks at a time
-        batches = [cluster_chunks[i:i + batch_size] for i in range(0, len(cluster_chunks), batch_size)]
+    def _create_batch_prompts(self, cluster_chunks: List[Dict]) -> List[str]:
+        """Create the intermediate (map step) prompts for a cluster too large for one prompt."""
+        # Group chunk contents into batches that each fit one prompt
+        batches = self.budget.pack(self._chunk_contents(cluster_chunks), lambda content: content)
         
         logger.info(f"Creating hierarchical cluster summary from {len(cluster_chunks)} chunks in {len(batches)} batches")
         
-        # Create intermediate summaries for each batch
-        intermediate_summaries = []
+        prompts = []
         for i, batch in enumerate(batches):
-            batch_contents = []
-            for chunk in batch:
-                content = chunk.get('content', '').strip()
-                if content:
-                    sanitized_content = self._sanitize_text(content)
-                    if sanitized_content:
-                        batch_contents.append(sanitized_content)
-            
-            batch_text = "\n\n".join(batch_contents)
+            batch_text = self.budget.truncate("\n\n".join(batch), self.budget.max_tokens)
             
-            intermediate_prompt = f"""Summarize this batch of cluster chunks ({i+1} of {len(batches)}):
+            prompts.append(f"""Summarize this batch of cluster chunks ({i+1} of {len(batches)}):
 
 {batch_text}
 
@@ -277,21 +323,26 @@ Respond with JSON only:
     "key_topics": ["topic1", "topic2"],
     "domain": "technical|personal|medical|business|academic",
     "confidence": 0.85
-}}"""
-            
-            intermediate_summary = self._get_summary_from_llm(intermediate_prompt)
+}}""")
+        
+        return prompts
+    
+    def _create_reduce_prompt(self, batch_summaries: List[Optional[Dict]]) -> str:
+        """Combine the intermediate summaries of a cluster into the final prompt (empty if all failed)."""
+        intermediate_summaries = []
+        for i, intermediate_summary in enumerate(batch_summaries):
             if intermediate_summary:
                 intermediate_summary['batch_index'] = i
-                intermediate_summary['total_batches'] = len(batches)
+                intermediate_summary['total_batches'] = len(batch_summaries)
                 intermediate_summaries.append(intermediate_summary)
         
-        # Now combine the intermediate summaries
+        if not intermediate_summaries:
+            return ""
         if len(intermediate_summaries) == 1:
             # Only one batch, use it directly
             return self._create_final_cluster_summary_from_intermediates(intermediate_summaries[0])
-        else:
-            # Multiple batches, combine them
-            return self._create_final_cluster_summary_from_intermediates(intermediate_summaries)
+        # Multiple batches, combine them
+        return self._create_final_cluster_summary_from_intermediates(intermediate_summaries)
     
     def _create_final_cluster_summary_from_intermediates(self, intermediate_summaries: Union[Dict, List[Dict]]) -> str:
         """Create final cluster summary from intermediate summaries."""
@@ -334,69 +385,62 @@ Respond with JSON only:
         
         return prompt
     
-    def _get_summary_from_llm(self, prompt: str) -> Optional[Dict]:
-        """Get summary from local LLM using Ollama."""
+    def _parse_summary_response(self, response: str) -> Optional[Dict]:
+        """Extract and validate the summary JSON from a model response."""
         try:
-            # Use Ollama with Gemma-2B model
-            cmd = [
-                "ollama", "run", "gemma:2b",
-                prompt
-            ]
-            
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                timeout=120  # 2 minute timeout
-            )
+            # Find JSON in the response
+            start_idx = response.find('{')
+            end_idx = response.rfind('}') + 1
             
-            if result.returncode == 0:
-                response = result.stdout.strip()
+            if start_idx != -1 and end_idx > start_idx:
+                json_str = response[start_idx:end_idx]
+                summary = json.loads(json_str)
                 
-                # Try to extract JSON from response
-                try:
-                    # Find JSON in the response
-                    start_idx = response.find('{')
-                    end_idx = response.rfind('}') + 1
-                    
-                    if start_idx != -1 and end_idx > start_idx:
-                        json_str = response[start_idx:end_idx]
-                        summary = json.loads(json_str)
-                        
-                        # Validate required fields
-                        required_fields = ['summary', 'domain', 'key_topics', 'complexity', 'sample_questions', 'confidence']
-                        if all(field in summary for field in required_fields):
-                            return summary
-                        else:
-                            logger.warning(f"Missing required fields in summary: {summary}")
-                    else:
-                        logger.warning(f"No JSON found in response: {response}")
-                        
-                except json.JSONDecodeError as e:
-                    logger.warning(f"Failed to parse JSON from response: {e}")
-                    logger.warning(f"Response: {response}")
-            
+                # Validate required fields
+                required_fields = ['summary', 'domain', 'key_topics', 'complexity', 'sample_questions', 'confidence']
+                if all(field in summary for field in required_fields):
+                    return summary
+                else:
+                    logger.warning(f"Missing required fields in summary: {summary}")
             else:
-                logger.error(f"Ollama command failed: {result.stderr}")
+                logger.warning(f"No JSON found in response: {response}")
                 
-        except subprocess.TimeoutExpired:
-            logger.error("Ollama command timed out")
+        except json.JSONDecodeError as e:
+            logger.warning(f"Failed to parse JSON from response: {e}")
+            logger.warning(f"Response: {response}")
+        
+        return None
+    
+    def _get_summary_from_llm(self, prompt: str) -> Optional[Dict]:
+        """Get summary from local LLM through the shared Ollama client."""
+        try:
+            # Only valid summaries are cached, so a bad response is retried on the next run
+            response = self.llm_client.chat(
+                prompt,
+                options={"num_ctx": self.budget.context_window},  # Ollama otherwise truncates at its default
+                accept=lambda r: self._parse_summary_response(r.strip()) is not None,
+                json_stream=lambda: JSONStreamScanner(root='{', max_prefix_chars=300, max_tokens=1024)
+            ).strip()
+            return self._parse_summary_response(response)
+                
+        except LLMClientError as e:
+            logger.error(f"Ollama request failed: {e}")
         except Exception as e:
             logger.error(f"Error calling Ollama: {e}")
         
         return None
     
-    def _summarize_cluster(self, cluster_id: str, cluster_chunks: List[Dict]) -> Optional[Dict]:
-        """Summarize a cluster of chunks."""
-        logger.info(f"Summarizing cluster {cluster_id} with {len(cluster_chunks)} chunks")
-        
-        # Create prompt
-        prompt = self._create_summary_prompt(cluster_chunks)
+    def _reduce_cluster(self, cluster_id: str, cluster_chunks: List[Dict], prompt_chunks: List[Dict],
+                        batch_summaries: List[Optional[Dict]]) -> Optional[Dict]:
+        """Reduce step: final summary from the batch summaries, or a single pass over prompt_chunks."""
+        if batch_summaries:
+            prompt = self._create_reduce_prompt(batch_summaries)
+        else:
+            prompt = self._create_summary_prompt(prompt_chunks)
         if not prompt:
             logger.warning(f"No content to summarize for cluster {cluster_id}")
             return None
         
-        # Get summary from LLM
         summary = self._get_summary_from_llm(prompt)
         
         if summary:
@@ -405,13 +449,13 @@ Respond with JSON only:
             summary['chunk_count'] = len(cluster_chunks)
             summary['chunk_hashes'] = [chunk.get('chunk_hash', '') for chunk in cluster_chunks]
             summary['timestamp'] = datetime.now().isoformat()
-            summary['model'] = 'gemma:2b'
+            summary['model'] = self.model
             
-            # Determine processing method based on whether hierarchical was used
-            total_chars = sum(len(chunk.get('content', '')) for chunk in cluster_chunks)
-            if total_chars > 24000:
+            if batch_summaries:
                 summary['processing_method'] = 'hierarchical_cluster'
-                logger.info(f"Used hierarchical summarization for large cluster {cluster_id}")
+            elif len(prompt_chunks) < len(cluster_chunks):
+                summary['processing_method'] = 'representative_sample'
+                summary['sampled_chunk_count'] = len(prompt_chunks)
             else:
                 summary['processing_method'] = 'single_pass'
             
@@ -425,9 +469,9 @@ Respond with JSON only:
         """Process clusters into summaries."""
         logger.info("🚀 Starting cluster summarization...")
         
-        # Load existing summaries
-        summaries_file = self.output_dir / "cluster_summaries.json"
-        existing_summaries = self._load_existing_summaries(summaries_file)
+        # Existing summaries, looked up in the store as needed
+        existing_summaries = self._load_existing_summaries()
+        existing_count = len(existing_summaries)
         
         # Load processed hashes
         processed_hashes = set()
@@ -454,49 +498,94 @@ Respond with JSON only:
             logger.warning("No valid clusters found")
             return {'status': 'no_clusters'}
         
-        # Process each cluster
+        # Process each cluster (highest-priority first), starting from summaries journaled by an interrupted run
         new_summaries = {}
         processed_cluster_hashes = set()
-        
-        for cluster_id, cluster_chunks in clusters.items():
+        journal = RunJournal(self.output_dir / "cluster_summaries.journal.jsonl")
+        for record in journal.replay():
+            new_summaries[record['result']['cluster_id']] = record['result']['summary']
+            processed_cluster_hashes.add(record['hash'])
+        recovered_summaries = len(new_summaries)
+        
+        jobs = []
+        for cluster_id, cluster_chunks in self.scheduler.order_clusters(clusters):
             # Generate cluster hash
             chunk_hashes = [chunk.get('chunk_hash', '') for chunk in cluster_chunks]
             cluster_hash = self._generate_cluster_hash(cluster_id, chunk_hashes)
             
-            # Check if already processed
+            # Check if already processed (or recovered from the journal)
+            if cluster_hash in processed_cluster_hashes:
+                continue
             if cluster_hash not in processed_hashes or force_reprocess:
-                summary = self._summarize_cluster(cluster_id, cluster_chunks)
-                if summary:
-                    new_summaries[cluster_id] = summary  # cluster_id is already a string
-                    processed_cluster_hashes.add(cluster_hash)
+                jobs.append((cluster_id, cluster_chunks, cluster_hash))
             else:
                 logger.info(f"Cluster {cluster_id} already processed, skipping")
         
+        # Chunks each planned cluster is summarized from (all of them, or a representative sample)
+        prompt_chunks: Dict[str, List[Dict]] = {}
+        
+        def plan(job: Tuple[str, List[Dict], str]) -> Optional[List[str]]:
+            cluster_id, cluster_chunks, _ = job
+            if not self.scheduler.try_start(sum(self.budget.count(c.get('content', '')) for c in cluster_chunks)):
+                # Budget spent; the cluster is left for the next run
+                return None
+            logger.info(f"Summarizing cluster {cluster_id} with {len(cluster_chunks)} chunks")
+            prompt_chunks[cluster_id], batch_prompts = self._plan_cluster(cluster_chunks)
+            return batch_prompts
+        
+        def reduce(job: Tuple[str, List[Dict], str], batch_summaries: List[Optional[Dict]]) -> Optional[Dict]:
+            cluster_id, cluster_chunks, cluster_hash = job
+            summary = self._reduce_cluster(cluster_id, cluster_chunks, prompt_chunks.pop(cluster_id),
+                                           batch_summaries)
+            if summary:
+                journal.append(cluster_hash, {'cluster_id': cluster_id, 'summary': summary})
+            return summary
+        
+        # Map step: batch summaries of all clusters share max_workers; reduce step: each
+        # cluster's final summary starts as soon as its own batches are done
+        with journal:
+            summaries = map_reduce_ordered(plan, self._get_summary_from_llm, reduce, jobs,
+                                           max_workers=self.max_workers, desc="Summarizing clusters")
+        for (cluster_id, _, cluster_hash), summary in zip(jobs, summaries):
+            if summary:
+                new_summaries[cluster_id] = summary  # cluster_id is already a string
+                processed_cluster_hashes.add(cluster_hash)
+        
         if not new_summaries and not force_reprocess:
             logger.info("No new clusters to process")
+            # Keep the last run's stats, but record what this run deferred
+            self.scheduler.update_metadata(self.output_dir / "metadata.json")
+            self.scheduler.log_stats()
             return {'status': 'no_new_clusters'}
         
-        # Combine existing and new summaries
-        all_summaries = {**existing_summaries, **new_summaries}
-        
-        # Save summaries
-        with open(summaries_file, 'w') as f:
-            json.dump(all_summaries, f, indent=2)
+        # Save only new and changed summaries
+        written_summaries = existing_summaries.put_many(new_summaries)
+        logger.info(f"Saved {written_summaries} new or changed summaries")
         
         # Save hashes and metadata
         all_processed_hashes = processed_hashes.union(processed_cluster_hashes)
         self._save_processed_cluster_hashes(all_processed_hashes)
+        journal.finish()
         
         # Calculate statistics
         stats = {
             'status': 'success',
-            'total_clusters': len(all_summaries),
+            'total_clusters': len(existing_summaries),
             'new_summaries': len(new_summaries),
-            'existing_summaries': len(existing_summaries),
-            'processed_clusters': len(processed_cluster_hashes)
+            'existing_summaries': existing_count,
+            'written_summaries': written_summaries,
+            'processed_clusters': len(processed_cluster_hashes),
+            'recovered_summaries': recovered_summaries,
+            'max_workers': self.max_workers,
+            'sampling': self.sampling,
+            'prompt_budget': self.budget.get_stats(),
+            'scheduler': self.scheduler.get_stats(),
+            'llm_metrics': self.llm_client.get_metrics()
         }
         
         self._save_metadata(stats)
+        self.scheduler.log_stats()
+        self.llm_client.log_metrics()
         
         logger.info(f"✅ Summarization complete: {len(new_summaries)} new summaries created")
         return stats
@@ -510,8 +599,25 @@ Respond with JSON only:
               default='../../data/processed/chunking/chunks.jsonl',
               help='Input chunks file')
 @click.option('--force', is_flag=True, help='Force reprocess all clusters')
+@click.option('--ollama-url', default=None, help='Ollama server URL (default: $OLLAMA_URL or http://localhost:11434)')
+@click.option('--max-concurrency', default=None, type=int, help='Maximum concurrent Ollama requests (default: $OLLAMA_MAX_CONCURRENCY or 1)')
+@click.option('--sampling', default='full', type=click.Choice(['full', 'representative']),
+              help='Summarize large clusters from all chunks or from a representative sample')
+@click.option('--sample-token-budget', default=5000, type=int, help='Prompt tokens for a representative sample')
+@click.option('--context-window', default=None, type=int, help='Model context window in tokens (default: known size for the model)')
+@click.option('--context-fraction', default=0.75, type=float, help='Share of the context window prompts are packed to')
+@click.option('--max-workers', default=1, type=int, help='Number of batch and cluster summaries run concurrently')
+@click.option('--priority', default='file', type=click.Choice(PRIORITIES),
+              help='Order of clusters: file order, most recent first or smallest first')
+@click.option('--pin', 'pins', multiple=True, help='Cluster or chat ID whose clusters are summarized first (repeatable)')
+@click.option('--time-budget', default=None, type=float, help='Stop starting new summaries after this many minutes')
+@click.option('--token-budget', default=None, type=int, help='Stop starting new summaries after about this many prompt tokens')
 @click.option('--check-only', is_flag=True, help='Only check setup, don\'t process')
-def main(clustered_embeddings_file: str, chunks_file: str, force: bool, check_only: bool):
+def main(clustered_embeddings_file: str, chunks_file: str, force: bool, ollama_url: Optional[str],
+         max_concurrency: Optional[int], max_workers: int,
+         sampling: str, sample_token_budget: int, context_window: Optional[int], context_fraction: float,
+         priority: str, pins: Tuple[str, ...], time_budget: Optional[float],
+         token_budget: Optional[int], check_only: bool):
     """Run local cluster summarization."""
     if check_only:
         logger.info("🔍 Checking setup...")
@@ -544,7 +650,12 @@ def main(clustered_embeddings_file: str, chunks_file: str, force: bool, check_on
         return 0
     
     # Run summarization
-    summarizer = LocalClusterSummarizer(clustered_embeddings_file, chunks_file)
+    scheduler = WorkScheduler.from_options(priority, pins, time_budget, token_budget)
+    summarizer = LocalClusterSummarizer(clustered_embeddings_file, chunks_file,
+                                        ollama_url=ollama_url, max_concurrency=max_concurrency,
+                                        max_workers=max_workers, sampling=sampling,
+                                        sample_token_budget=sample_token_budget, context_window=context_window,
+                                        context_fraction=context_fraction, scheduler=scheduler)
     result = summarizer.process_clusters_to_summaries(force_reprocess=force)
     
     if result.get('status') == 'success':
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Representative Sampling for Large Clusters
+
+Chunks in a tight cluster are largely redundant, so summarizing every one of
+them (hierarchically, in many LLM calls) mostly pays for repetition. This
+module picks a small, diverse subset from the chunk embeddings that already
+exist, sized to fit one prompt:
+
+1. Core: maximal marginal relevance (MMR) starting from the medoid. Relevance
+   is similarity to the cluster centroid, redundancy is similarity to the
+   chunks already picked.
+2. Boundary: the remaining share of the budget goes to peripheral chunks
+   (far from the centroid) chosen farthest-point first, so sub-topics at the
+   cluster's edge are not lost.
+
+Selected chunks are returned in their original order so the prompt keeps
+the conversational flow.
+"""
+
+from typing import Callable, Dict, List, Optional, Sequence
+import logging
+
+import numpy as np
+
+from prompt_budget import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1.0, norms)
+
+
+def sample_coverage(vectors: np.ndarray, selected: Sequence[int], threshold: float = 0.8) -> float:
+    """Share of chunks with a selected chunk at cosine similarity >= threshold."""
+    if len(vectors) == 0 or not selected:
+        return 0.0
+    unit = _normalize_rows(np.asarray(vectors, dtype=np.float32))
+    best = (unit @ unit[list(selected)].T).max(axis=1)
+    return float((best >= threshold).mean())
+
+
+def select_representative_chunks(chunks: List[Dict],
+                                 vectors: Dict[str, Sequence[float]],
+                                 token_budget: int,
+                                 diversity: float = 0.3,
+                                 boundary_fraction: float = 0.2,
+                                 min_coverage: float = 0.5,
+                                 count_tokens: Callable[[str], int] = estimate_tokens) -> Optional[List[Dict]]:
+    """Pick chunks whose content fits token_budget and best represents the cluster.
+
+    vectors maps chunk_hash to its embedding. diversity (0-1) weighs
+    redundancy against relevance in MMR; boundary_fraction of the budget is
+    kept for peripheral chunks. count_tokens measures chunk content (the
+    target model's tokenizer, or an estimate). Returns None when too few
+    chunks have embeddings (less than min_coverage) to sample reliably.
+    """
+    indexed = [chunk for chunk in chunks
+               if chunk.get('content', '').strip() and chunk.get('chunk_hash') in vectors]
+    if not indexed or len(indexed) < min_coverage * len(chunks):
+        return None
+
+    unit = _normalize_rows(np.asarray([vectors[chunk['chunk_hash']] for chunk in indexed], dtype=np.float32))
+    costs = [count_tokens(chunk['content']) for chunk in indexed]
+    centroid = unit.mean(axis=0)
+    centroid /= np.linalg.norm(centroid) or 1.0
+    relevance = unit @ centroid
+
+    selected: List[int] = []
+    # Highest similarity to any selected chunk, per candidate
+    redundancy = np.full(len(indexed), -np.inf, dtype=np.float32)
+    available = np.ones(len(indexed), dtype=bool)
+    spent = 0
+
+    def take(row: int) -> None:
+        nonlocal spent, redundancy
+        selected.append(row)
+        available[row] = False
+        spent += costs[row]
+        redundancy = np.maximum(redundancy, unit @ unit[row])
+
+    def fits(row: int, budget: int) -> bool:
+        return spent + costs[row] <= budget
+
+    # Core: MMR from the medoid (the chunk closest to the centroid)
+    core_budget = int(token_budget * (1 - boundary_fraction))
+    while True:
+        penalty = redundancy if selected else 0.0
+        scores = (1 - diversity) * relevance - diversity * penalty
+        candidates = [row for row in np.argsort(-scores) if available[row] and fits(row, core_budget)]
+        if not candidates:
+            break
+        take(candidates[0])
+
+    # Boundary: peripheral chunks, farthest from everything selected so far
+    peripheral = relevance <= np.quantile(relevance, 0.25)
+    while True:
+        candidates = [row for row in np.argsort(redundancy)
+                      if available[row] and peripheral[row] and fits(row, token_budget)]
+        if not candidates:
+            break
+        take(candidates[0])
+
+    if not selected:
+        return None
+    return [indexed[row] for row in sorted(selected)]
@@ -76,6 +76,39 @@ class EmbeddingClusterer:
         except Exception as e:
             logger.error(f"Failed to save processed hashes: {e}")
     
+    def _load_umap_reducer(self, dim: int) -> Optional[object]:
+        """Load the persisted UMAP reducer if it matches the embedding dimension."""
+        reducer_file = self.output_dir / "umap_reducer.pkl"
+        if not reducer_file.exists():
+            return None
+        try:
+            with open(reducer_file, 'rb') as f:
+                state = pickle.load(f)
+        except Exception as e:
+            logger.warning(f"Failed to load UMAP reducer: {e}")
+            return None
+        if state.get('dim') != dim:
+            logger.info(f"Persisted UMAP reducer expects dim {state.get('dim')}, got {dim}; refitting")
+            return None
+        logger.info(f"Loaded UMAP reducer fitted on {state.get('n_fit', 0)} embeddings")
+        return state['reducer']
+    
+    def _save_umap_reducer(self, reducer: object, dim: int, n_fit: int) -> None:
+        """Persist the fitted UMAP reducer so later runs can transform() new points."""
+        reducer_file = self.output_dir / "umap_reducer.pkl"
+        state = {
+            'reducer': reducer,
+            'dim': dim,
+            'n_fit': n_fit,
+            'fitted_at': datetime.now().isoformat()
+        }
+        try:
+            with open(reducer_file, 'wb') as f:
+                pickle.dump(state, f)
+            logger.info(f"Saved UMAP reducer to {reducer_file}")
+        except Exception as e:
+            logger.error(f"Failed to save UMAP reducer: {e}")
+    
     def _save_metadata(self, stats: Dict) -> None:
         """Save processing metadata."""
         metadata = {
@@ -112,8 +145,14 @@ class EmbeddingClusterer:
         logger.info(f"Loaded {len(embeddings)} embeddings from {embeddings_file}")
         return embeddings
     
-    def _cluster_embeddings(self, embeddings: List[Dict], min_cluster_size: int = 5, min_samples: int = 3) -> List[Dict]:
-        """Cluster embeddings using HDBSCAN and UMAP."""
+    def _cluster_embeddings(self, embeddings: List[Dict], min_cluster_size: int = 5, min_samples: int = 3,
+                            refit_umap: bool = False) -> List[Dict]:
+        """Cluster embeddings using HDBSCAN and UMAP.
+        
+        Embeddings that already carry UMAP coordinates keep them and only the
+        remaining points are projected with the persisted reducer, unless
+        refit_umap is set or no compatible reducer exists.
+        """
         if not embeddings:
             logger.warning("No embeddings to cluster")
             return []
@@ -135,14 +174,29 @@ class EmbeddingClusterer:
         cluster_labels = clusterer.fit_predict(embedding_vectors)
         
         # Perform UMAP dimensionality reduction
-        logger.info("Performing UMAP dimensionality reduction...")
-        umap_reducer = umap.UMAP(
-            n_components=2,
-            random_state=42,
-            n_neighbors=15,
-            min_dist=0.1
-        )
-        umap_embeddings = umap_reducer.fit_transform(embedding_vectors)
+        dim = embedding_vectors.shape[1]
+        umap_reducer = None if refit_umap else self._load_umap_reducer(dim)
+        known = [i for i, emb in enumerate(embeddings) if 'umap_x' in emb and 'umap_y' in emb]
+        
+        if umap_reducer is not None and known:
+            known_set = set(known)
+            unknown = [i for i in range(len(embeddings)) if i not in known_set]
+            logger.info(f"Projecting {len(unknown)} new embeddings with persisted UMAP reducer...")
+            umap_embeddings = np.zeros((len(embeddings), 2))
+            for i in known:
+                umap_embeddings[i] = (embeddings[i]['umap_x'], embeddings[i]['umap_y'])
+            if unknown:
+                umap_embeddings[unknown] = umap_reducer.transform(embedding_vectors[unknown])
+        else:
+            logger.info("Performing UMAP dimensionality reduction...")
+            umap_reducer = umap.UMAP(
+                n_components=2,
+                random_state=42,
+                n_neighbors=15,
+                min_dist=0.1
+            )
+            umap_embeddings = umap_reducer.fit_transform(embedding_vectors)
+            self._save_umap_reducer(umap_reducer, dim, len(embedding_vectors))
         
         # Add clustering info to embeddings
         clustered_embeddings = []
@@ -156,7 +210,8 @@ class EmbeddingClusterer:
         logger.info(f"Clustering complete: {len(set(cluster_labels))} clusters found")
         return clustered_embeddings
     
-    def process_embeddings_to_clusters(self, min_cluster_size: int = 5, min_samples: int = 3, force_reprocess: bool = False) -> Dict:
+    def process_embeddings_to_clusters(self, min_cluster_size: int = 5, min_samples: int = 3, force_reprocess: bool = False,
+                                       refit_umap: bool = False) -> Dict:
         """Process embeddings into clusters."""
         logger.info("🚀 Starting embedding clustering...")
         
@@ -186,13 +241,14 @@ class EmbeddingClusterer:
                 new_embeddings.append(embedding)
                 processed_hashes.add(embedding_hash)
         
-        if not new_embeddings and not force_reprocess:
+        if not new_embeddings and not force_reprocess and not refit_umap:
             logger.info("No new embeddings to process")
             return {'status': 'no_new_embeddings'}
         
         # Cluster all embeddings (existing + new)
         all_embeddings = existing_clusters + new_embeddings
-        clustered_embeddings = self._cluster_embeddings(all_embeddings, min_cluster_size, min_samples)
+        clustered_embeddings = self._cluster_embeddings(all_embeddings, min_cluster_size, min_samples,
+                                                        refit_umap=refit_umap or force_reprocess)
         
         if not clustered_embeddings:
             logger.warning("No clusters created")
@@ -240,8 +296,9 @@ class EmbeddingClusterer:
 @click.option('--min-cluster-size', default=5, help='Minimum cluster size for HDBSCAN')
 @click.option('--min-samples', default=3, help='Minimum samples for HDBSCAN')
 @click.option('--force', is_flag=True, help='Force reprocess all embeddings')
+@click.option('--refit-umap', is_flag=True, help='Refit the persisted UMAP reducer instead of projecting new points')
 @click.option('--check-only', is_flag=True, help='Only check setup, don\'t process')
-def main(input_file: str, min_cluster_size: int, min_samples: int, force: bool, check_only: bool):
+def main(input_file: str, min_cluster_size: int, min_samples: int, force: bool, refit_umap: bool, check_only: bool):
     """Create semantic clusters from embeddings."""
     
     if check_only:
@@ -257,7 +314,8 @@ def main(input_file: str, min_cluster_size: int, min_samples: int, force: bool,
     stats = clusterer.process_embeddings_to_clusters(
         min_cluster_size=min_cluster_size,
         min_samples=min_samples,
-        force_reprocess=force
+        force_reprocess=force,
+        refit_umap=refit_umap
     )
     
     if stats['status'] == 'success':
@@ -26,10 +26,14 @@ from openai import OpenAI
 import sys
 sys.path.append(str(Path(__file__).parent.parent.parent))
 from config import get_openai_config
+from batch_jobs import BatchJobStore, BATCH_MODES, SUBMITTERS, EMBEDDINGS, batch_request, embedding_vectors
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Chunks embedded by one request of a batch job
+BATCH_INPUTS_PER_REQUEST = 100
+
 
 class CloudChunkEmbedder:
     """Embeds chunks using OpenAI embeddings."""
@@ -293,6 +297,90 @@ class CloudChunkEmbedder:
         logger.info(f"  New chunks: {stats['new_chunks']}")
         
         return stats
+    
+    def submit_batch_jobs(self, chunks_file: Path, state_file: Path, jobs: BatchJobStore) -> Dict:
+        """Write embedding requests for all new chunks into batch jobs and submit them.
+        
+        Chunks without content need no API call and are left to the
+        interactive run, which gives them a zero vector.
+        """
+        logger.info("🚀 Submitting cloud chunk embedding as batch jobs...")
+        # Chunks waiting in earlier jobs are not submitted again
+        skipped_hashes = self._load_processed_chunk_hashes(state_file) | jobs.open_hashes()
+        new_chunks = [chunk for chunk in self._identify_new_chunks(self._load_chunks(chunks_file), skipped_hashes)
+                      if chunk.get('content', '').strip()]
+        
+        requests = []
+        for start in range(0, len(new_chunks), BATCH_INPUTS_PER_REQUEST):
+            group = new_chunks[start:start + BATCH_INPUTS_PER_REQUEST]
+            body = {'model': self.model_name, 'input': [chunk['content'].strip() for chunk in group]}
+            requests.append(batch_request('embed', [self._generate_chunk_hash(chunk) for chunk in group], body,
+                                          chunks=group))
+        
+        submitted = jobs.submit(EMBEDDINGS, requests)
+        jobs.log_stats()
+        return {'status': 'success', 'submitted_jobs': [job.id for job in submitted],
+                'batch_jobs': jobs.get_stats()}
+    
+    def ingest_batch_jobs(self, state_file: Path, jobs: BatchJobStore) -> Dict:
+        """Add the embeddings from finished batch jobs to the output and state, as an interactive run would.
+        
+        Chunks without a result stay unprocessed and are picked up by the next
+        submission or interactive run.
+        """
+        logger.info("🚀 Ingesting cloud chunk embedding batch jobs...")
+        ready = jobs.collect()
+        if not ready:
+            jobs.log_stats()
+            return {'status': 'no_finished_jobs', 'batch_jobs': jobs.get_stats()}
+        
+        embeddings_file = self.embedding_dir / "embeddings.jsonl"
+        existing_embeddings = self._load_existing_embeddings(embeddings_file)
+        processed_hashes = self._load_processed_chunk_hashes(state_file)
+        
+        embedded_new_chunks = []
+        failed = 0
+        for job in ready:
+            for entry, body, error in job.results():
+                chunks = entry['chunks']
+                vectors = embedding_vectors(body) if body else []
+                if error or len(vectors) != len(chunks):
+                    logger.warning(f"Batch request {entry['custom_id']} failed: {error or 'incomplete response'}")
+                    failed += len(chunks)
+                    continue
+                self.stats['total_tokens'] += (body.get('usage') or {}).get('total_tokens', 0)
+                for chunk, chunk_hash, vector in zip(chunks, entry['hashes'], vectors):
+                    # Embedded meanwhile by an interactive run
+                    if chunk_hash in processed_hashes:
+                        continue
+                    chunk_with_embedding = chunk.copy()
+                    chunk_with_embedding['embedding'] = vector
+                    chunk_with_embedding['embedding_hash'] = self._generate_embedding_hash(vector)
+                    embedded_new_chunks.append(chunk_with_embedding)
+                    processed_hashes.add(chunk_hash)
+        
+        all_embedded_chunks = existing_embeddings + embedded_new_chunks
+        self._save_embeddings(all_embedded_chunks)
+        self._save_processed_chunk_hashes(processed_hashes, state_file)
+        jobs.mark_ingested(ready, len(embedded_new_chunks), failed)
+        
+        stats = {
+            'status': 'success',
+            'total_chunks': len(all_embedded_chunks),
+            'new_chunks': len(embedded_new_chunks),
+            'existing_chunks': len(existing_embeddings),
+            'embedding_dimension': len(embedded_new_chunks[0]['embedding']) if embedded_new_chunks else 0,
+            'failed_chunks': failed,
+            'total_tokens': self.stats['total_tokens'],
+            'batch_jobs': jobs.get_stats()
+        }
+        self._save_metadata(stats)
+        
+        logger.info("✅ Cloud batch embedding ingested!")
+        logger.info(f"  New chunks: {stats['new_chunks']}")
+        logger.info(f"  Failed chunks: {failed}")
+        jobs.log_stats()
+        return stats
 
 
 @click.command()
@@ -300,7 +388,14 @@ class CloudChunkEmbedder:
 @click.option('--state-file', required=True, help='Path to state file for tracking progress')
 @click.option('--force', is_flag=True, help='Force reprocess all chunks')
 @click.option('--model', default='text-embedding-3-small', help='OpenAI embedding model to use')
-def main(chunks_file: str, state_file: str, force: bool, model: str):
+@click.option('--batch-mode', default=None, type=click.Choice(BATCH_MODES),
+              help='Submit new chunks as batch jobs, or ingest finished batch jobs')
+@click.option('--batch-submitter', default='openai', type=click.Choice(SUBMITTERS),
+              help='Where batch jobs go: the OpenAI Batch API or a local directory')
+@click.option('--batch-dir', default=None,
+              help='Exchange directory of the local batch submitter (default: $CHATMIND_BATCH_DIR or <processed>/batch_exchange)')
+def main(chunks_file: str, state_file: str, force: bool, model: str,
+         batch_mode: Optional[str], batch_submitter: str, batch_dir: Optional[str]):
     """Run cloud embedding on chunks."""
     # Load OpenAI config
     openai_config = get_openai_config()
@@ -314,12 +409,19 @@ def main(chunks_file: str, state_file: str, force: bool, model: str):
     # Initialize embedder
     embedder = CloudChunkEmbedder(model_name=model)
     
-    # Process chunks
-    result = embedder.process_chunks_to_embeddings(
-        chunks_file=Path(chunks_file),
-        state_file=Path(state_file),
-        force_reprocess=force
-    )
+    # Process chunks, or hand them to / take them from batch jobs
+    if batch_mode:
+        jobs = BatchJobStore.from_options(embedder.embedding_dir, batch_submitter, batch_dir)
+        if batch_mode == 'submit':
+            result = embedder.submit_batch_jobs(Path(chunks_file), Path(state_file), jobs)
+        else:
+            result = embedder.ingest_batch_jobs(Path(state_file), jobs)
+    else:
+        result = embedder.process_chunks_to_embeddings(
+            chunks_file=Path(chunks_file),
+            state_file=Path(state_file),
+            force_reprocess=force
+        )
     
     if result['status'] == 'success':
         logger.info("✅ Cloud embedding completed successfully!")
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Endpoint Health Tracking
+
+Per-endpoint circuit breaker and adaptive timeouts for the local LLM client.
+
+- Timeouts follow observed latency: once enough calls have succeeded, the
+  request timeout is a multiple of the p95 latency (bounded by the
+  configured timeout), so a hung request is given up on long before a
+  fixed 60-120s timeout would expire. A timeout counts as a latency sample
+  and doubles the timeout (up to the configured one), which decays again
+  as calls succeed, so long calls are not cut off over and over once short
+  ones have narrowed the window.
+- After failure_threshold consecutive failures (timeouts, connection errors,
+  5xx/429) the circuit opens and every caller on that endpoint waits instead
+  of burning its retries on an overloaded or reloading server.
+- While open, a single caller sends a cheap probe after the cooldown. If it
+  succeeds the circuit closes and the whole stage resumes; otherwise the
+  cooldown doubles (up to max_cooldown).
+
+State is shared per base URL within the process (get_endpoint_health).
+"""
+
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict
+import logging
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# Limit on how far timeouts widen the adaptive timeout (the ceiling still applies)
+MAX_TIMEOUT_BACKOFF = 64.0
+# Share of the widening kept after each success
+TIMEOUT_BACKOFF_DECAY = 0.9
+
+
+class EndpointHealth:
+    """Circuit breaker plus latency-based timeouts for one endpoint."""
+
+    def __init__(self,
+                 name: str = "",
+                 failure_threshold: int = 5,
+                 cooldown: float = 15.0,
+                 max_cooldown: float = 300.0,
+                 min_timeout: float = 10.0,
+                 timeout_multiplier: float = 3.0,
+                 min_samples: int = 20,
+                 window: int = 200):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.min_timeout = min_timeout
+        self.timeout_multiplier = timeout_multiplier
+        self.min_samples = min_samples
+
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.cooldown = cooldown
+        self.opened_at = 0.0
+        self._latencies = deque(maxlen=window)
+        self._timeout_backoff = 1.0
+        self._condition = threading.Condition()
+        self.stats = {'circuit_opens': 0, 'probes': 0, 'failed_probes': 0, 'open_seconds': 0.0}
+
+    def adaptive_timeout(self, ceiling: float) -> float:
+        """Timeout for the next request: timeout_multiplier x p95 latency, widened after
+        timeouts, within [min_timeout, ceiling]."""
+        with self._condition:
+            if len(self._latencies) < self.min_samples:
+                return ceiling
+            latencies = sorted(self._latencies)
+            backoff = self._timeout_backoff
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        return max(self.min_timeout, min(ceiling, p95 * self.timeout_multiplier * backoff))
+
+    def record_success(self, latency: float) -> None:
+        with self._condition:
+            self._latencies.append(latency)
+            self.consecutive_failures = 0
+            self._timeout_backoff = max(1.0, self._timeout_backoff * TIMEOUT_BACKOFF_DECAY)
+
+    def record_timeout(self, timeout: float) -> None:
+        """A request gave up after timeout seconds: it took at least that long, so count it
+        as a latency sample and widen the next timeouts. Call record_failure as well."""
+        with self._condition:
+            self._latencies.append(timeout)
+            self._timeout_backoff = min(MAX_TIMEOUT_BACKOFF, self._timeout_backoff * 2)
+
+    def record_failure(self) -> None:
+        """Count an endpoint failure; opens the circuit at the threshold."""
+        with self._condition:
+            self.consecutive_failures += 1
+            if self.state == CLOSED and self.consecutive_failures >= self.failure_threshold:
+                self._open()
+
+    def _open(self) -> None:
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        self.stats['circuit_opens'] += 1
+        logger.warning(f"🔌 Circuit open for {self.name} after {self.consecutive_failures} consecutive failures; "
+                       f"pausing requests, probing in {self.cooldown:.0f}s")
+
+    @property
+    def is_open(self) -> bool:
+        return self.state != CLOSED
+
+    def wait_until_available(self, probe: Callable[[], bool]) -> None:
+        """Block while the circuit is open; one waiting caller probes after each cooldown."""
+        with self._condition:
+            while self.state != CLOSED:
+                if self.state == HALF_OPEN:
+                    # Another caller is probing
+                    self._condition.wait()
+                    continue
+                remaining = self.opened_at + self.cooldown - time.monotonic()
+                if remaining > 0:
+                    self._condition.wait(remaining)
+                    continue
+                self.state = HALF_OPEN
+                self._condition.release()
+                try:
+                    healthy = self._run_probe(probe)
+                finally:
+                    self._condition.acquire()
+                self._finish_probe(healthy)
+
+    def _run_probe(self, probe: Callable[[], bool]) -> bool:
+        self.stats['probes'] += 1
+        try:
+            return bool(probe())
+        except Exception as e:
+            logger.debug(f"Probe of {self.name} failed: {e}")
+            return False
+
+    def _finish_probe(self, healthy: bool) -> None:
+        now = time.monotonic()
+        if healthy:
+            self.stats['open_seconds'] += now - self.opened_at
+            logger.info(f"🔌 Probe succeeded, closing circuit for {self.name} "
+                        f"after {now - self.opened_at:.0f}s")
+            self.state = CLOSED
+            self.consecutive_failures = 0
+            self.cooldown = self.base_cooldown
+        else:
+            self.stats['failed_probes'] += 1
+            self.stats['open_seconds'] += now - self.opened_at
+            self.cooldown = min(self.max_cooldown, self.cooldown * 2)
+            self.state = OPEN
+            self.opened_at = now
+            logger.warning(f"🔌 Probe of {self.name} failed, next probe in {self.cooldown:.0f}s")
+        self._condition.notify_all()
+
+    def get_stats(self) -> Dict:
+        with self._condition:
+            stats = dict(self.stats)
+            stats['state'] = self.state
+            stats['latency_samples'] = len(self._latencies)
+            stats['timeout_backoff'] = round(self._timeout_backoff, 2)
+        return stats
+
+
+_registry: Dict[str, EndpointHealth] = {}
+_registry_lock = threading.Lock()
+
+
+def get_endpoint_health(base_url: str, **kwargs) -> EndpointHealth:
+    """Shared EndpointHealth for a base URL (kwargs only apply on first use)."""
+    with _registry_lock:
+        if base_url not in _registry:
+            _registry[base_url] = EndpointHealth(name=base_url, **kwargs)
+        return _registry[base_url]
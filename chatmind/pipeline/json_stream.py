@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Incremental JSON Scanner
+
+Watches a streamed LLM response token by token and decides as early as
+possible whether generation can stop:
+
+- complete: the top-level JSON object/array has closed, so anything the
+  model would still generate (explanations, a second object) is wasted.
+- invalid: the output has left the expected shape - no JSON has started
+  within max_prefix_chars, a bracket closes the wrong structure, or the
+  token cap is reached before the JSON closes.
+
+The scanner only tracks structure (strings, escapes, bracket nesting); the
+callers' existing parsers still validate the final text.
+"""
+
+from typing import List, Optional
+
+PENDING = 'pending'
+COMPLETE = 'complete'
+INVALID = 'invalid'
+
+_CLOSERS = {'{': '}', '[': ']'}
+
+
+class JSONStreamScanner:
+    """Structural scanner for one streamed JSON response."""
+
+    def __init__(self, root: Optional[str] = '{', max_prefix_chars: Optional[int] = 200,
+                 max_tokens: Optional[int] = None):
+        """
+        root: '{' or '[' for the expected top-level type, or None for either.
+        max_prefix_chars: chatter allowed before the JSON starts (None = no limit).
+        max_tokens: stream chunks allowed before giving up (None = no cap).
+        """
+        if root not in ('{', '[', None):
+            raise ValueError(f"Unsupported JSON root: {root!r}")
+        self.root = root
+        self.max_prefix_chars = max_prefix_chars
+        self.max_tokens = max_tokens
+
+        self.text = ''
+        self.tokens = 0
+        self.state = PENDING
+        self.reason = ''
+        self.end: Optional[int] = None
+
+        self._position = 0
+        self._started = False
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escaped = False
+
+    def feed(self, chunk: str) -> str:
+        """Consume one streamed chunk and return the scanner state."""
+        if self.state != PENDING:
+            return self.state
+
+        self.text += chunk
+        self.tokens += 1
+        while self._position < len(self.text):
+            char = self.text[self._position]
+            self._position += 1
+            if not self._started:
+                self._scan_prefix(char)
+            else:
+                self._scan_json(char)
+            if self.state != PENDING:
+                return self.state
+
+        if not self._started and self.max_prefix_chars is not None and len(self.text) > self.max_prefix_chars:
+            return self._fail(f"no JSON within the first {self.max_prefix_chars} characters")
+        if self.max_tokens is not None and self.tokens >= self.max_tokens:
+            return self._fail(f"token cap of {self.max_tokens} reached before the JSON closed")
+        return self.state
+
+    def result(self) -> str:
+        """Response text up to the end of the JSON (everything, if it never closed)."""
+        return self.text[:self.end] if self.end is not None else self.text
+
+    def _fail(self, reason: str) -> str:
+        self.state = INVALID
+        self.reason = reason
+        return self.state
+
+    def _scan_prefix(self, char: str) -> None:
+        if char in _CLOSERS and (self.root is None or char == self.root):
+            self._started = True
+            self._stack.append(_CLOSERS[char])
+
+    def _scan_json(self, char: str) -> None:
+        if self._in_string:
+            if self._escaped:
+                self._escaped = False
+            elif char == '\\':
+                self._escaped = True
+            elif char == '"':
+                self._in_string = False
+            return
+
+        if char == '"':
+            self._in_string = True
+        elif char in _CLOSERS:
+            self._stack.append(_CLOSERS[char])
+        elif char in ('}', ']'):
+            if char != self._stack[-1]:
+                self._fail(f"unexpected '{char}' while expecting '{self._stack[-1]}'")
+                return
+            self._stack.pop()
+            if not self._stack:
+                self.state = COMPLETE
+                self.end = self._position
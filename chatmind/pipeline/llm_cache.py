@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+LLM Response Cache
+
+Content-addressed, on-disk cache for LLM calls shared by the tagging and
+summarization steps (local and cloud). Entries are keyed on a SHA256 of
+(model, system prompt, prompt, temperature, extra request options), so a
+re-run after a crash or a --force on a downstream step answers
+byte-identical prompts from disk instead of the model.
+
+Storage is a single SQLite file; once it grows past max_bytes the least
+recently used entries are evicted.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_MB = 512
+
+
+class PromptCache:
+    """SQLite-backed prompt/response cache with LRU size eviction."""
+
+    def __init__(self, db_path: Path, max_bytes: int = DEFAULT_MAX_MB * 1024 * 1024):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.stats = {'hits': 0, 'misses': 0, 'writes': 0, 'evictions': 0}
+
+        # One connection shared by worker threads, serialized by a lock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " model TEXT,"
+            " response TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses(last_access)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(model: str, system_prompt: str, prompt: str, temperature: Optional[float],
+                 extra: Optional[Dict] = None) -> str:
+        """Stable key for a request; extra holds any other options that change the output."""
+        payload = json.dumps({
+            'model': model,
+            'system': system_prompt or '',
+            'prompt': prompt,
+            'temperature': temperature,
+            'extra': extra or {}
+        }, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached response for a key, or None."""
+        with self._lock:
+            row = self._conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.stats['misses'] += 1
+                return None
+            self.stats['hits'] += 1
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            return row[0]
+
+    def put(self, key: str, response: str, model: str = "") -> None:
+        """Store a response and evict old entries if the cache is over its size limit."""
+        now = time.time()
+        size = len(response.encode('utf-8'))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, size, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, response, size, now, now)
+            )
+            self.stats['writes'] += 1
+            self._evict()
+            self._conn.commit()
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        """Drop least recently used entries until the cache is back under 90% of max_bytes."""
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        target = int(self.max_bytes * 0.9)
+        evicted = 0
+        for key, size in self._conn.execute(
+                "SELECT key, size FROM responses ORDER BY last_access ASC").fetchall():
+            if total <= target:
+                break
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            evicted += 1
+        self.stats['evictions'] += evicted
+        logger.info(f"LLM cache over {self.max_bytes} bytes, evicted {evicted} entries")
+
+    def get_stats(self) -> Dict:
+        """Hit/miss counters plus current entry count and size."""
+        with self._lock:
+            entries, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+            stats = dict(self.stats)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        stats['entries'] = entries
+        stats['size_bytes'] = total
+        return stats
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def open_prompt_cache(processed_dir: Optional[Path] = None) -> Optional[PromptCache]:
+    """Open the shared response cache, or return None if it is disabled.
+
+    CHATMIND_LLM_CACHE overrides the location (set it to "off" to disable);
+    otherwise the cache lives in <processed_dir>/llm_cache/responses.sqlite.
+    CHATMIND_LLM_CACHE_MAX_MB sets the eviction threshold.
+    """
+    location = os.getenv('CHATMIND_LLM_CACHE', '')
+    if location.lower() in ('off', 'false', '0', 'none'):
+        return None
+
+    if location:
+        db_path = Path(location)
+    else:
+        db_path = Path(processed_dir or "data/processed") / "llm_cache" / "responses.sqlite"
+
+    max_mb = float(os.getenv('CHATMIND_LLM_CACHE_MAX_MB', DEFAULT_MAX_MB))
+    try:
+        return PromptCache(db_path, max_bytes=int(max_mb * 1024 * 1024))
+    except sqlite3.Error as e:
+        logger.warning(f"Could not open LLM cache at {db_path}, continuing without it: {e}")
+        return None
+
+
+def cached_chat_completion(create, cache: Optional[PromptCache], model: str, messages: list,
+                           temperature: Optional[float], accept=None, **kwargs) -> str:
+    """OpenAI chat completion that goes through the cache; returns the response text.
+
+    create is called like openai's client.chat.completions.create (callers
+    may wrap it, e.g. with rate limiting). kwargs such as max_tokens are
+    passed through and included in the cache key.
+    """
+    key = None
+    if cache is not None:
+        system_prompt = "\n".join(m['content'] for m in messages if m['role'] == 'system')
+        prompt = "\n".join(m['content'] for m in messages if m['role'] != 'system')
+        key = cache.make_key(model, system_prompt, prompt, temperature, kwargs)
+        cached = cache.get(key)
+        if cached is not None and (accept is None or accept(cached)):
+            return cached
+
+    response = create(
+        model=model,
+        messages=messages,
+        temperature=temperature,
+        **kwargs
+    )
+    content = response.choices[0].message.content or ''
+    if key and content.strip() and (accept is None or accept(content)):
+        cache.put(key, content, model)
+    return content
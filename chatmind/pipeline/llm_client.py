@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+"""
+Local LLM Client
+
+Shared Ollama client used by the local tagging and summarization steps.
+Keeps HTTP connections alive through a pooled session, bounds the number of
+in-flight requests, retries with jittered exponential backoff and records
+latency, token and error metrics for every call. Timeouts adapt to observed
+latency, and a per-endpoint circuit breaker (endpoint_health) pauses all
+callers while the server is failing.
+
+The HTTP layer is a pluggable transport, so the client can be pointed at a
+local stub server (via base_url) or given an in-process transport in tests.
+An optional PromptCache (llm_cache) answers repeated prompts from disk.
+
+Callers that expect JSON can pass a JSONStreamScanner factory (json_stream);
+the response is then streamed and the connection closed as soon as the JSON
+is complete, or abandoned early when it goes off the rails.
+"""
+
+import json
+import os
+import random
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+import logging
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from json_stream import JSONStreamScanner, COMPLETE, INVALID
+from endpoint_health import EndpointHealth, get_endpoint_health
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OLLAMA_URL = "http://localhost:11434"
+
+# Status codes worth retrying: rate limiting and server-side failures
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+class LLMClientError(Exception):
+    """Raised when an LLM call fails after all retries."""
+
+
+class RequestsTransport:
+    """HTTP transport backed by a pooled requests.Session (keep-alive)."""
+
+    def __init__(self, pool_size: int = 4):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def post(self, url: str, payload: Dict, timeout: float) -> Tuple[int, Dict]:
+        """POST a JSON payload and return (status code, decoded JSON body)."""
+        response = self.session.post(url, json=payload, timeout=timeout)
+        try:
+            body = response.json()
+        except ValueError:
+            body = {'error': response.text}
+        return response.status_code, body
+
+    @contextmanager
+    def post_stream(self, url: str, payload: Dict, timeout: float) -> Iterator[Tuple[int, Iterator[Dict]]]:
+        """POST a streaming request and yield (status code, iterator of JSON lines).
+
+        Leaving the block closes the connection, which makes Ollama stop
+        generating even if the stream was not read to the end.
+        """
+        response = self.session.post(url, json=payload, timeout=timeout, stream=True)
+
+        def lines() -> Iterator[Dict]:
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    yield {'error': line.decode('utf-8', 'replace')}
+
+        try:
+            yield response.status_code, lines()
+        finally:
+            response.close()
+
+    def get(self, url: str, timeout: float) -> Tuple[int, Dict]:
+        """GET a URL and return (status code, decoded JSON body)."""
+        response = self.session.get(url, timeout=timeout)
+        try:
+            body = response.json()
+        except ValueError:
+            body = {'error': response.text}
+        return response.status_code, body
+
+    def close(self) -> None:
+        self.session.close()
+
+
+class LocalLLMClient:
+    """Pooled, rate-bounded client for the Ollama chat API."""
+
+    def __init__(self,
+                 model: str = "gemma:2b",
+                 base_url: Optional[str] = None,
+                 max_concurrency: Optional[int] = None,
+                 max_retries: int = 3,
+                 timeout: float = 120.0,
+                 backoff_base: float = 0.5,
+                 backoff_max: float = 30.0,
+                 transport=None,
+                 rate_limiter=None,
+                 cache=None,
+                 stream: Optional[bool] = None,
+                 health: Optional[EndpointHealth] = None):
+        self.model = model
+        self.base_url = (base_url or os.getenv('OLLAMA_URL', DEFAULT_OLLAMA_URL)).rstrip('/')
+        self.max_concurrency = max(1, int(max_concurrency or os.getenv('OLLAMA_MAX_CONCURRENCY', 1)))
+        self.max_retries = max(1, max_retries)
+        self.timeout = timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.transport = transport or RequestsTransport(pool_size=self.max_concurrency)
+        # Optional AdaptiveRateLimiter (worker_pool) paced per attempt
+        self.rate_limiter = rate_limiter
+        # Optional PromptCache (llm_cache) consulted before any request is sent
+        self.cache = cache
+        # Stream JSON responses when the caller supplies a scanner (OLLAMA_STREAM=0 disables)
+        if stream is None:
+            stream = os.getenv('OLLAMA_STREAM', '1').lower() not in ('0', 'false', 'off', 'no')
+        self.stream = stream and hasattr(self.transport, 'post_stream')
+        # Circuit breaker and latency-based timeouts, shared by all clients of this endpoint
+        self.health = health or get_endpoint_health(self.base_url)
+
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        self._lock = threading.Lock()
+        self._latencies: List[float] = []
+        self._errors = Counter()
+        self.metrics = {
+            'calls': 0,
+            'cache_hits': 0,
+            'successful_calls': 0,
+            'failed_calls': 0,
+            'retries': 0,
+            'prompt_tokens': 0,
+            'completion_tokens': 0,
+            'total_latency_seconds': 0.0,
+            'stream_early_stops': 0,
+            'stream_aborts': 0
+        }
+
+    def _backoff_delay(self, attempt: int) -> float:
+        """Full-jitter exponential backoff for the given (0-based) attempt."""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _endpoint_failed(self) -> bool:
+        """Record an endpoint failure; True if the circuit is open, so the attempt is not charged."""
+        self.health.record_failure()
+        return self.health.is_open
+
+    def _probe(self) -> bool:
+        """Cheap one-token request used to decide whether an open circuit can close."""
+        payload = {
+            "model": self.model,
+            "messages": [{"role": "user", "content": "ping"}],
+            "stream": False,
+            "options": {"num_predict": 1}
+        }
+        status, _ = self.transport.post(f"{self.base_url}/api/chat", payload,
+                                        self.health.adaptive_timeout(self.timeout))
+        return status == 200
+
+    def _record_error(self, kind: str) -> None:
+        with self._lock:
+            self._errors[kind] += 1
+
+    def _record_success(self, latency: float, body: Dict) -> None:
+        with self._lock:
+            self._latencies.append(latency)
+            self.metrics['successful_calls'] += 1
+            self.metrics['total_latency_seconds'] += latency
+            self.metrics['prompt_tokens'] += int(body.get('prompt_eval_count') or 0)
+            self.metrics['completion_tokens'] += int(body.get('eval_count') or 0)
+
+    def _post_streaming(self, url: str, payload: Dict, timeout: float,
+                        scanner: JSONStreamScanner) -> Tuple[int, Dict]:
+        """Stream one request through the scanner; returns (status, body) like transport.post.
+
+        The body carries the text up to the end of the JSON. If the scanner
+        gives up, body['stream_abort'] holds the reason.
+        """
+        body: Dict = {}
+        with self.transport.post_stream(url, dict(payload, stream=True), timeout) as (status, lines):
+            if status != 200:
+                return status, next(lines, {'error': ''})
+
+            for line in lines:
+                if line.get('error'):
+                    return 500, line
+                state = scanner.feed((line.get('message') or {}).get('content', ''))
+                if line.get('done'):
+                    body = line
+                    break
+                if state == COMPLETE:
+                    with self._lock:
+                        self.metrics['stream_early_stops'] += 1
+                    break
+                if state == INVALID:
+                    break
+
+        body = dict(body, message={'role': 'assistant', 'content': scanner.result()})
+        body.setdefault('eval_count', scanner.tokens)
+        if scanner.state == INVALID:
+            body['stream_abort'] = scanner.reason
+        return status, body
+
+    def chat(self, prompt: str, system_prompt: str = "", temperature: Optional[float] = None,
+             options: Optional[Dict] = None, model: Optional[str] = None,
+             timeout: Optional[float] = None,
+             accept: Optional[Callable[[str], bool]] = None,
+             json_stream: Optional[Callable[[], JSONStreamScanner]] = None) -> str:
+        """Send a chat request and return the response content.
+
+        Transport errors, retryable status codes and empty responses are
+        retried with jittered backoff. Raises LLMClientError when every
+        attempt fails. When a cache is configured, responses for identical
+        requests are served from it; accept (if given) decides whether a
+        response is good enough to cache or to reuse from the cache.
+        json_stream (if given and streaming is enabled) builds a fresh
+        scanner per attempt; generation stops once the JSON is complete and
+        an attempt the scanner rejects is retried like an empty response.
+        """
+        messages = []
+        if system_prompt:
+            messages.append({"role": "system", "content": system_prompt})
+        messages.append({"role": "user", "content": prompt})
+
+        request_options = dict(options or {})
+        if temperature is not None:
+            request_options['temperature'] = temperature
+        payload = {
+            "model": model or self.model,
+            "messages": messages,
+            "stream": False,
+            "options": request_options
+        }
+        url = f"{self.base_url}/api/chat"
+
+        cache_key = None
+        if self.cache is not None:
+            extra = {k: v for k, v in request_options.items() if k != 'temperature'}
+            cache_key = self.cache.make_key(payload['model'], system_prompt, prompt,
+                                            request_options.get('temperature'), extra)
+            cached = self.cache.get(cache_key)
+            if cached is not None and (accept is None or accept(cached)):
+                with self._lock:
+                    self.metrics['cache_hits'] += 1
+                return cached
+
+        with self._lock:
+            self.metrics['calls'] += 1
+
+        last_error = "unknown error"
+        attempt = 0
+        circuit_waits = 0
+        while attempt < self.max_retries:
+            if self.health.is_open:
+                # Endpoint is down: wait for a successful probe instead of spending retries
+                self.health.wait_until_available(self._probe)
+            elif attempt > 0:
+                with self._lock:
+                    self.metrics['retries'] += 1
+                time.sleep(self._backoff_delay(attempt - 1))
+            attempt += 1
+
+            if self.rate_limiter:
+                self.rate_limiter.acquire()
+            request_timeout = self.health.adaptive_timeout(timeout or self.timeout)
+            try:
+                with self._slots:
+                    start = time.perf_counter()
+                    if json_stream and self.stream:
+                        status, body = self._post_streaming(url, payload, request_timeout, json_stream())
+                    else:
+                        status, body = self.transport.post(url, payload, request_timeout)
+                    latency = time.perf_counter() - start
+            except requests.exceptions.Timeout:
+                self._record_error('timeout')
+                self.health.record_timeout(request_timeout)
+                if self.rate_limiter:
+                    self.rate_limiter.on_throttle()
+                last_error = f"request timed out after {request_timeout:.0f}s"
+                logger.warning(f"LLM call timed out after {request_timeout:.0f}s (attempt {attempt}/{self.max_retries})")
+                if self._endpoint_failed() and circuit_waits < self.max_retries:
+                    circuit_waits += 1
+                    attempt -= 1
+                continue
+            except requests.exceptions.RequestException as e:
+                self._record_error('connection')
+                last_error = str(e)
+                logger.warning(f"LLM call failed (attempt {attempt}/{self.max_retries}): {e}")
+                if self._endpoint_failed() and circuit_waits < self.max_retries:
+                    circuit_waits += 1
+                    attempt -= 1
+                continue
+
+            if status != 200:
+                self._record_error(f"http_{status}")
+                last_error = f"HTTP {status}: {body.get('error', '')}"
+                logger.warning(f"LLM call returned {last_error} (attempt {attempt}/{self.max_retries})")
+                if status in RETRYABLE_STATUS_CODES:
+                    if self.rate_limiter and status in (429, 503):
+                        self.rate_limiter.on_throttle()
+                    if self._endpoint_failed() and circuit_waits < self.max_retries:
+                        circuit_waits += 1
+                        attempt -= 1
+                    continue
+                break
+
+            # The endpoint answered; anything wrong from here on is the model's output
+            self.health.record_success(latency)
+
+            if body.get('stream_abort'):
+                self._record_error('stream_aborted')
+                with self._lock:
+                    self.metrics['stream_aborts'] += 1
+                last_error = f"stream aborted: {body['stream_abort']}"
+                logger.warning(f"Stopped generation early, {body['stream_abort']} (attempt {attempt}/{self.max_retries})")
+                continue
+
+            content = (body.get('message') or {}).get('content', '')
+            if not content.strip():
+                self._record_error('empty_response')
+                last_error = "empty response"
+                logger.warning(f"Empty response from model (attempt {attempt}/{self.max_retries})")
+                continue
+
+            self._record_success(latency, body)
+            if self.rate_limiter:
+                self.rate_limiter.on_success()
+            if cache_key and (accept is None or accept(content)):
+                self.cache.put(cache_key, content, payload['model'])
+            return content
+
+        with self._lock:
+            self.metrics['failed_calls'] += 1
+        raise LLMClientError(f"LLM call failed after {self.max_retries} attempts: {last_error}")
+
+    def list_models(self) -> List[str]:
+        """Names of the models available on the server."""
+        status, body = self.transport.get(f"{self.base_url}/api/tags", self.timeout)
+        if status != 200:
+            raise LLMClientError(f"Cannot list models at {self.base_url}: HTTP {status}")
+        return [model['name'] for model in body.get('models', [])]
+
+    def get_metrics(self) -> Dict:
+        """Snapshot of call, latency, token and error metrics."""
+        with self._lock:
+            metrics = dict(self.metrics)
+            latencies = sorted(self._latencies)
+            metrics['errors'] = dict(self._errors)
+
+        if latencies:
+            metrics['latency_p50_seconds'] = latencies[len(latencies) // 2]
+            metrics['latency_p95_seconds'] = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+            metrics['latency_max_seconds'] = latencies[-1]
+        metrics['max_concurrency'] = self.max_concurrency
+        metrics['endpoint'] = self.health.get_stats()
+        metrics['current_timeout_seconds'] = self.health.adaptive_timeout(self.timeout)
+        if self.cache is not None:
+            metrics['cache'] = self.cache.get_stats()
+        return metrics
+
+    def log_metrics(self) -> None:
+        """Log a one-line summary of the client metrics."""
+        metrics = self.get_metrics()
+        logger.info(
+            f"LLM calls: {metrics['successful_calls']}/{metrics['calls']} succeeded, "
+            f"{metrics['cache_hits']} served from cache, "
+            f"{metrics['retries']} retries, "
+            f"{metrics['prompt_tokens']} prompt / {metrics['completion_tokens']} completion tokens, "
+            f"p50 latency {metrics.get('latency_p50_seconds', 0):.2f}s"
+        )
+
+    def close(self) -> None:
+        if hasattr(self.transport, 'close'):
+            self.transport.close()
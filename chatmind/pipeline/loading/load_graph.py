@@ -22,6 +22,8 @@ import pickle
 import sys
 sys.path.append(str(Path(__file__).parent.parent))
 from config import get_neo4j_config
+from summary_store import open_summary_store
+from similarity.sparse_edges import iter_sparse_edges, read_checksum, file_checksum
 
 try:
     from neo4j import GraphDatabase
@@ -80,6 +82,9 @@ class HybridNeo4jGraphLoader:
         self.loading_dir = self.processed_dir / "loading"
         self.loading_dir.mkdir(parents=True, exist_ok=True)
         
+        # Whole-artifact checksums for binary inputs (used instead of per-item hashes)
+        self.artifact_checksums = {}
+        
         if NEO4J_AVAILABLE:
             self.driver = GraphDatabase.driver(self.uri, auth=(self.user, self.password))
         else:
@@ -128,19 +133,41 @@ class HybridNeo4jGraphLoader:
             logger.warning(f"⚠️  {description} file not found: {file_path}")
         return data
     
-    def _load_json_file(self, file_path: Path, description: str) -> Dict:
-        """Load data from a JSON file with error handling."""
-        data = {}
-        if file_path.exists():
-            try:
-                with open(file_path, 'r') as f:
-                    data = json.load(f)
-                logger.info(f"✅ Loaded {description}")
-            except Exception as e:
-                logger.error(f"❌ Failed to load {description}: {e}")
-        else:
-            logger.warning(f"⚠️  {description} file not found: {file_path}")
-        return data
+    def _load_summaries(self, step: str, name: str, description: str,
+                        keys: Optional[List[str]] = None) -> Dict:
+        """Load summaries from a step's summary store (only the given keys, if any)."""
+        store = open_summary_store(self.processed_dir / step, name, create=False)
+        if store is None:
+            logger.warning(f"⚠️  {description} not found in {self.processed_dir / step}")
+            return {}
+        try:
+            summaries = store.get_many(keys) if keys is not None else dict(store.items())
+            logger.info(f"✅ Loaded {len(summaries)} {description}")
+            return summaries
+        except Exception as e:
+            logger.error(f"❌ Failed to load {description}: {e}")
+            return {}
+        finally:
+            store.close()
+    
+    def _load_similarity_edges(self, data_type: str, id_keys: Tuple[str, str], description: str) -> List[Tuple[str, str, float]]:
+        """Load similarity edges as (id1, id2, similarity) from the sparse edge file.
+        
+        Falls back to the legacy JSONL format when no .npz edge file exists.
+        """
+        edges_file = self.processed_dir / "similarity" / f"{data_type}.npz"
+        if not edges_file.exists():
+            legacy = self._load_data_file(self.processed_dir / "similarity" / f"{data_type}.jsonl", description)
+            return [(item.get(id_keys[0], ''), item.get(id_keys[1], ''), item.get('similarity', 0.0)) for item in legacy]
+        
+        edges = []
+        try:
+            edges = list(iter_sparse_edges(edges_file))
+            self.artifact_checksums[data_type] = read_checksum(edges_file) or file_checksum(edges_file)
+            logger.info(f"✅ Loaded {len(edges)} {description}")
+        except Exception as e:
+            logger.error(f"❌ Failed to load {description}: {e}")
+        return edges
     
     def _load_all_pipeline_data(self) -> Dict[str, any]:
         """Load all data from the modular pipeline (excluding embeddings)."""
@@ -172,13 +199,11 @@ class HybridNeo4jGraphLoader:
             ),
             
             # Summarization data
-            'cluster_summaries': self._load_json_file(
-                self.processed_dir / "cluster_summarization" / "cluster_summaries.json", 
-                "cluster summaries"
+            'cluster_summaries': self._load_summaries(
+                "cluster_summarization", "cluster_summaries", "cluster summaries"
             ),
-            'chat_summaries': self._load_json_file(
-                self.processed_dir / "chat_summarization" / "chat_summaries.json", 
-                "chat summaries"
+            'chat_summaries': self._load_summaries(
+                "chat_summarization", "chat_summaries", "chat summaries"
             ),
             
             # Positioning data
@@ -192,12 +217,12 @@ class HybridNeo4jGraphLoader:
             ),
             
             # Similarity data
-            'chat_similarities': self._load_data_file(
-                self.processed_dir / "similarity" / "chat_similarities.jsonl", 
+            'chat_similarities': self._load_similarity_edges(
+                "chat_similarities", ('chat1_id', 'chat2_id'),
                 "chat similarities"
             ),
-            'cluster_similarities': self._load_data_file(
-                self.processed_dir / "similarity" / "cluster_similarities.jsonl", 
+            'cluster_similarities': self._load_similarity_edges(
+                "cluster_similarities", ('cluster1_id', 'cluster2_id'),
                 "cluster similarities"
             ),
         }
@@ -605,8 +630,12 @@ class HybridNeo4jGraphLoader:
         
         logger.info("Created positioning data")
     
-    def _create_similarity_relationships(self, session, chat_similarities: List[Dict], cluster_similarities: List[Dict]) -> None:
-        """Create similarity relationships with threshold filtering for optimal visualization."""
+    def _create_similarity_relationships(self, session, chat_similarities: List[Tuple[str, str, float]],
+                                         cluster_similarities: List[Tuple[str, str, float]]) -> None:
+        """Create similarity relationships with threshold filtering for optimal visualization.
+        
+        Similarities are (id1, id2, similarity) edges as read from the sparse edge files.
+        """
         
         # Filter for high-quality similarities (threshold: 0.7)
         high_threshold = 0.7
@@ -616,11 +645,7 @@ class HybridNeo4jGraphLoader:
         high_similarities = 0
         medium_similarities = 0
         
-        for similarity in tqdm(chat_similarities, desc="Creating Chat Similarity relationships"):
-            chat1_id = similarity.get('chat1_id', '')
-            chat2_id = similarity.get('chat2_id', '')
-            similarity_score = similarity.get('similarity', 0.0)
-            
+        for chat1_id, chat2_id, similarity_score in tqdm(chat_similarities, desc="Creating Chat Similarity relationships"):
             # Only create relationships for meaningful similarities
             if similarity_score >= medium_threshold:
                 # Use different queries for different relationship types
@@ -659,11 +684,8 @@ class HybridNeo4jGraphLoader:
         cluster_high_similarities = 0
         cluster_medium_similarities = 0
         
-        for similarity in tqdm(cluster_similarities, desc="Creating Cluster Similarity relationships"):
-            cluster1_id = similarity.get('cluster1_id', '')  # Keep as string to match cluster nodes
-            cluster2_id = similarity.get('cluster2_id', '')  # Keep as string to match cluster nodes
-            similarity_score = similarity.get('similarity', 0.0)
-            
+        # Cluster ids stay strings to match cluster nodes
+        for cluster1_id, cluster2_id, similarity_score in tqdm(cluster_similarities, desc="Creating Cluster Similarity relationships"):
             # Only create relationships for meaningful similarities
             if similarity_score >= medium_threshold:
                 # Use different queries for different relationship types
@@ -840,7 +862,12 @@ class HybridNeo4jGraphLoader:
         # Generate current hashes by data type
         current_hashes = {}
         for data_type, items in data.items():
-            if isinstance(items, list):
+            if data_type in self.artifact_checksums:
+                # Binary artifacts carry one checksum instead of per-item hashes
+                current_hashes[data_type] = hashlib.sha256(
+                    f"{data_type}_{self.artifact_checksums[data_type]}".encode()
+                ).hexdigest()
+            elif isinstance(items, list):
                 current_hashes[data_type] = self._generate_data_type_hash(data_type, items)
             elif isinstance(items, dict):
                 # For JSON files, create hash from all items
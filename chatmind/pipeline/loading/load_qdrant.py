@@ -23,6 +23,7 @@ import numpy as np
 import sys
 sys.path.append(str(Path(__file__).parent.parent))
 from config import get_neo4j_config
+from summary_store import open_summary_store
 
 try:
     from qdrant_client import QdrantClient
@@ -125,20 +126,22 @@ class QdrantVectorLoader:
             logger.warning(f"⚠️  {description} file not found: {file_path}")
         return data
     
-    def _load_json_file(self, file_path: Path, description: str) -> Dict:
-        """Load data from JSON file."""
-        if not file_path.exists():
-            logger.warning(f"⚠️  {description} file not found: {file_path}")
+    def _load_summaries(self, step: str, name: str, description: str,
+                        keys: Optional[List[str]] = None) -> Dict:
+        """Load summaries from a step's summary store (only the given keys, if any)."""
+        store = open_summary_store(self.processed_dir / step, name, create=False)
+        if store is None:
+            logger.warning(f"⚠️  {description} not found in {self.processed_dir / step}")
             return {}
-        
         try:
-            with open(file_path, 'r') as f:
-                data = json.load(f)
-            logger.info(f"✅ Loaded {description}")
-            return data
+            summaries = store.get_many(keys) if keys is not None else dict(store.items())
+            logger.info(f"✅ Loaded {len(summaries)} {description}")
+            return summaries
         except Exception as e:
             logger.error(f"❌ Failed to load {description}: {e}")
             return {}
+        finally:
+            store.close()
     
     def _load_embeddings_data(self) -> Dict[str, any]:
         """Load embeddings and related data for Qdrant."""
@@ -164,21 +167,23 @@ class QdrantVectorLoader:
                 self.processed_dir / "positioning" / "cluster_summary_embeddings.jsonl", 
                 "cluster summary embeddings"
             ),
-            'cluster_summaries': self._load_json_file(
-                self.processed_dir / "cluster_summarization" / "cluster_summaries.json", 
-                "cluster summaries"
-            ),
             # Chat summary embeddings data
             'chat_summary_embeddings': self._load_data_file(
                 self.processed_dir / "positioning" / "chat_summary_embeddings.jsonl", 
                 "chat summary embeddings"
             ),
-            'chat_summaries': self._load_json_file(
-                self.processed_dir / "chat_summarization" / "chat_summaries.json", 
-                "chat summaries"
-            ),
         }
         
+        # Only summaries with an embedding become points, so only those are read
+        data['cluster_summaries'] = self._load_summaries(
+            "cluster_summarization", "cluster_summaries", "cluster summaries",
+            [embedding.get('cluster_id', '') for embedding in data['cluster_summary_embeddings']]
+        )
+        data['chat_summaries'] = self._load_summaries(
+            "chat_summarization", "chat_summaries", "chat summaries",
+            [embedding.get('chat_id', '') for embedding in data['chat_summary_embeddings']]
+        )
+        
         return data
     
     def _create_collection(self) -> bool:
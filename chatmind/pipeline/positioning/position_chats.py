@@ -18,6 +18,10 @@ import hashlib
 import pickle
 from datetime import datetime
 import numpy as np
+import sys
+
+sys.path.append(str(Path(__file__).parent.parent))
+from summary_store import open_summary_store
 from collections import defaultdict
 
 logging.basicConfig(level=logging.INFO)
@@ -28,12 +32,13 @@ class ChatPositioner:
     """Creates 2D coordinates for chats using their summaries."""
     
     def __init__(self, 
-                 chat_summaries_file: str = "data/processed/chat_summarization/chat_summaries.json"):
+                 chat_summaries_file: str = "data/processed/chat_summarization/chat_summaries.sqlite"):
         self.chat_summaries_file = Path(chat_summaries_file)
         
         # Use modular directory structure
         self.output_dir = Path("data/processed/positioning")
         self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.layout_refitted = False
     
     def _generate_positioning_hash(self, chat_id: str, summary_hash: str) -> str:
         """Generate a hash for chat positioning to track if it's been processed."""
@@ -68,6 +73,39 @@ class ChatPositioner:
         except Exception as e:
             logger.error(f"Failed to save positioning hashes: {e}")
     
+    def _load_umap_reducer(self, dim: int) -> Optional[object]:
+        """Load the persisted chat UMAP reducer if it matches the embedding dimension."""
+        reducer_file = self.output_dir / "chat_umap_reducer.pkl"
+        if not reducer_file.exists():
+            return None
+        try:
+            with open(reducer_file, 'rb') as f:
+                state = pickle.load(f)
+        except Exception as e:
+            logger.warning(f"Failed to load chat UMAP reducer: {e}")
+            return None
+        if state.get('dim') != dim:
+            logger.info(f"Persisted chat UMAP reducer expects dim {state.get('dim')}, got {dim}; refitting")
+            return None
+        logger.info(f"Loaded chat UMAP reducer fitted on {state.get('n_fit', 0)} chats")
+        return state['reducer']
+    
+    def _save_umap_reducer(self, reducer: object, dim: int, n_fit: int) -> None:
+        """Persist the fitted chat UMAP reducer so later runs can transform() new chats."""
+        reducer_file = self.output_dir / "chat_umap_reducer.pkl"
+        state = {
+            'reducer': reducer,
+            'dim': dim,
+            'n_fit': n_fit,
+            'fitted_at': datetime.now().isoformat()
+        }
+        try:
+            with open(reducer_file, 'wb') as f:
+                pickle.dump(state, f)
+            logger.info(f"Saved chat UMAP reducer to {reducer_file}")
+        except Exception as e:
+            logger.error(f"Failed to save chat UMAP reducer: {e}")
+    
     def _save_metadata(self, stats: Dict) -> None:
         """Save processing metadata."""
         metadata_file = self.output_dir / "chat_positioning_metadata.json"
@@ -97,11 +135,12 @@ class ChatPositioner:
         return positions
     
     def _load_chat_summaries(self) -> Dict:
-        """Load chat summaries from file."""
+        """Load all chat summaries from the summary store (a legacy .json file is imported first)."""
         summaries = {}
-        if self.chat_summaries_file.exists():
-            with open(self.chat_summaries_file, 'r') as f:
-                summaries = json.load(f)
+        store = open_summary_store(self.chat_summaries_file.parent, self.chat_summaries_file.stem, create=False)
+        if store is not None:
+            summaries = dict(store.items())
+            store.close()
             logger.info(f"Loaded {len(summaries)} chat summaries")
         return summaries
     
@@ -267,30 +306,51 @@ class ChatPositioner:
         logger.info(f"Computed embeddings using TF-IDF: {embeddings_array.shape}")
         return chat_embeddings, chat_ids
     
-    def _apply_umap_reduction(self, chat_embeddings: Dict[str, np.ndarray], chat_ids: List[str]) -> Dict[str, Tuple[float, float]]:
-        """Apply UMAP dimensionality reduction to get 2D coordinates."""
+    def _apply_umap_reduction(self, chat_embeddings: Dict[str, np.ndarray], chat_ids: List[str],
+                              known_coordinates: Optional[Dict[str, Tuple[float, float]]] = None,
+                              refit: bool = False) -> Dict[str, Tuple[float, float]]:
+        """Apply UMAP dimensionality reduction to get 2D coordinates.
+        
+        Chats in known_coordinates keep their position and only the remaining
+        chats are projected with the persisted reducer. The reducer is refitted
+        on all chats when refit is set or no compatible reducer exists, in which
+        case self.layout_refitted is set so callers rewrite every position.
+        """
+        self.layout_refitted = False
         if len(chat_embeddings) == 0:
             logger.warning("No embeddings available, using random coordinates")
             return {cid: (np.random.uniform(-1, 1), np.random.uniform(-1, 1)) for cid in chat_ids}
         
         # Convert to numpy array for UMAP
         embeddings_array = np.array([chat_embeddings[chat_id] for chat_id in chat_ids])
+        known_coordinates = known_coordinates or {}
         
         try:
             # Import UMAP
             try:
                 import umap
-                reducer = umap.UMAP(
-                    n_components=2,
-                    random_state=42,
-                    n_neighbors=min(15, len(embeddings_array) - 1),
-                    min_dist=0.1
-                )
-                coords = reducer.fit_transform(embeddings_array)
-                logger.info("Applied UMAP reduction successfully")
+                reducer = None if refit or not known_coordinates else self._load_umap_reducer(embeddings_array.shape[1])
+                if reducer is not None:
+                    new_idx = [i for i, chat_id in enumerate(chat_ids) if chat_id not in known_coordinates]
+                    coords = np.array([known_coordinates.get(chat_id, (0.0, 0.0)) for chat_id in chat_ids], dtype=float)
+                    if new_idx:
+                        coords[new_idx] = reducer.transform(embeddings_array[new_idx])
+                    logger.info(f"Projected {len(new_idx)} new chats with persisted UMAP reducer")
+                else:
+                    reducer = umap.UMAP(
+                        n_components=2,
+                        random_state=42,
+                        n_neighbors=min(15, len(embeddings_array) - 1),
+                        min_dist=0.1
+                    )
+                    coords = reducer.fit_transform(embeddings_array)
+                    self._save_umap_reducer(reducer, embeddings_array.shape[1], len(embeddings_array))
+                    self.layout_refitted = True
+                    logger.info("Applied UMAP reduction successfully")
             except ImportError:
                 # Fallback to random coordinates
                 coords = np.random.uniform(-1, 1, (len(embeddings_array), 2))
+                self.layout_refitted = True
                 logger.warning("UMAP not available, using random coordinates")
             
             # Create mapping from chat_id to coordinates
@@ -348,7 +408,19 @@ class ChatPositioner:
         
         return positioning_data
     
-    def process_chats_to_positions(self, force_reprocess: bool = False) -> Dict:
+    def _get_known_coordinates(self, summaries: Dict, existing_positions: Dict, processed_hashes: Set[str]) -> Dict[str, Tuple[float, float]]:
+        """Return coordinates of chats whose existing position is still valid for their summary."""
+        known_coordinates = {}
+        for chat_id, position in existing_positions.items():
+            if chat_id not in summaries:
+                continue
+            summary_content = json.dumps(summaries[chat_id], sort_keys=True)
+            summary_hash = hashlib.sha256(summary_content.encode()).hexdigest()
+            if position.get('summary_hash') == summary_hash and position.get('positioning_hash') in processed_hashes:
+                known_coordinates[chat_id] = (position['x'], position['y'])
+        return known_coordinates
+    
+    def process_chats_to_positions(self, force_reprocess: bool = False, refit_umap: bool = False) -> Dict:
         """Process chats into 2D positions using their summaries."""
         logger.info("🚀 Starting chat positioning using summaries...")
         
@@ -385,13 +457,19 @@ class ChatPositioner:
         # Save embeddings
         self._save_chat_summary_embeddings(chat_embeddings)
 
-        # Apply dimensionality reduction
-        coordinates = self._apply_umap_reduction(chat_embeddings, chat_ids)
+        # Apply dimensionality reduction, keeping still-valid positions stable
+        refit = force_reprocess or refit_umap
+        known_coordinates = {} if refit else self._get_known_coordinates(summaries, existing_positions, processed_hashes)
+        coordinates = self._apply_umap_reduction(chat_embeddings, chat_ids, known_coordinates, refit)
         
         if not coordinates:
             logger.warning("No coordinates computed")
             return {'status': 'no_coordinates'}
         
+        # A refitted layout moves every chat, so all positions are rewritten
+        if self.layout_refitted:
+            processed_hashes = set()
+        
         # Create positioning data
         positioning_data = self._create_positioning_data(summaries, coordinates)
         
@@ -412,8 +490,11 @@ class ChatPositioner:
             logger.info("No new chats to position")
             return {'status': 'no_new_positions'}
         
-        # Combine existing and new positions
-        all_positions = list(existing_positions.values()) + new_positions
+        # Combine existing and new positions (new positions replace stale ones)
+        merged_positions = {} if self.layout_refitted else dict(existing_positions)
+        for position in new_positions:
+            merged_positions[position['chat_id']] = position
+        all_positions = list(merged_positions.values())
         
         # Save positions
         with jsonlines.open(positions_file, mode='w') as writer:
@@ -430,7 +511,8 @@ class ChatPositioner:
             'total_chats': len(all_positions),
             'new_positions': len(new_positions),
             'existing_positions': len(existing_positions),
-            'processed_chats': len(processed_positioning_hashes)
+            'processed_chats': len(processed_positioning_hashes),
+            'layout_refitted': self.layout_refitted
         }
         
         self._save_metadata(stats)
@@ -441,8 +523,8 @@ class ChatPositioner:
 
 @click.command()
 @click.option('--chat-summaries-file', 
-              default='data/processed/chat_summarization/chat_summaries.json',
-              help='Input chat summaries file')
+              default='data/processed/chat_summarization/chat_summaries.sqlite',
+              help='Input chat summary store (a legacy .json file is imported)')
 # @click.option('--chats-file', 
 #               default='data/processed/ingestion/chats.jsonl', # This option is no longer needed
 #               help='Input chats file')
@@ -450,8 +532,9 @@ class ChatPositioner:
 #               default='data/processed/clustering/clustered_embeddings.jsonl', # This option is no longer needed
 #               help='Input clustered embeddings file')
 @click.option('--force', is_flag=True, help='Force reprocess all chats')
+@click.option('--refit-umap', is_flag=True, help='Refit the persisted UMAP reducer instead of projecting new chats')
 @click.option('--check-only', is_flag=True, help='Only check setup, don\'t process')
-def main(chat_summaries_file: str, force: bool, check_only: bool):
+def main(chat_summaries_file: str, force: bool, refit_umap: bool, check_only: bool):
     """Run chat positioning using summaries."""
     if check_only:
         logger.info("🔍 Checking setup...")
@@ -461,7 +544,7 @@ def main(chat_summaries_file: str, force: bool, check_only: bool):
         # chats_path = Path(chats_file) # This line is no longer needed
         # clustered_path = Path(clustered_embeddings_file) # This line is no longer needed
         
-        if not summaries_path.exists():
+        if not summaries_path.exists() and not summaries_path.with_suffix('.json').exists():
             logger.error(f"❌ Chat summaries file not found: {summaries_path}")
             return
         
@@ -477,7 +560,7 @@ def main(chat_summaries_file: str, force: bool, check_only: bool):
     
     # Run positioning
     positioner = ChatPositioner(chat_summaries_file)
-    result = positioner.process_chats_to_positions(force)
+    result = positioner.process_chats_to_positions(force, refit_umap)
     
     if result['status'] == 'success':
         logger.info("🎉 Chat positioning completed successfully!")
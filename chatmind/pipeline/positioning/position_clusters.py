@@ -18,6 +18,10 @@ import hashlib
 import pickle
 from datetime import datetime
 import numpy as np
+import sys
+
+sys.path.append(str(Path(__file__).parent.parent))
+from summary_store import open_summary_store
 
 # Import for dimensionality reduction
 try:
@@ -41,12 +45,13 @@ logger = logging.getLogger(__name__)
 class ClusterPositioner:
     """Creates 2D coordinates for clusters using their summaries."""
     
-    def __init__(self, cluster_summaries_file: str = "data/processed/cluster_summarization/cluster_summaries.json"):
+    def __init__(self, cluster_summaries_file: str = "data/processed/cluster_summarization/cluster_summaries.sqlite"):
         self.cluster_summaries_file = Path(cluster_summaries_file)
         
         # Use modular directory structure
         self.output_dir = Path("data/processed/positioning")
         self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.layout_refitted = False
     
     def _generate_positioning_hash(self, cluster_id: str, summary_hash: str) -> str:
         """Generate a hash for cluster positioning to track if it's been processed."""
@@ -81,6 +86,39 @@ class ClusterPositioner:
         except Exception as e:
             logger.error(f"Failed to save positioning hashes: {e}")
     
+    def _load_umap_reducer(self, dim: int) -> Optional[object]:
+        """Load the persisted cluster UMAP reducer if it matches the embedding dimension."""
+        reducer_file = self.output_dir / "cluster_umap_reducer.pkl"
+        if not reducer_file.exists():
+            return None
+        try:
+            with open(reducer_file, 'rb') as f:
+                state = pickle.load(f)
+        except Exception as e:
+            logger.warning(f"Failed to load cluster UMAP reducer: {e}")
+            return None
+        if state.get('dim') != dim:
+            logger.info(f"Persisted cluster UMAP reducer expects dim {state.get('dim')}, got {dim}; refitting")
+            return None
+        logger.info(f"Loaded cluster UMAP reducer fitted on {state.get('n_fit', 0)} clusters")
+        return state['reducer']
+    
+    def _save_umap_reducer(self, reducer: object, dim: int, n_fit: int) -> None:
+        """Persist the fitted cluster UMAP reducer so later runs can transform() new clusters."""
+        reducer_file = self.output_dir / "cluster_umap_reducer.pkl"
+        state = {
+            'reducer': reducer,
+            'dim': dim,
+            'n_fit': n_fit,
+            'fitted_at': datetime.now().isoformat()
+        }
+        try:
+            with open(reducer_file, 'wb') as f:
+                pickle.dump(state, f)
+            logger.info(f"Saved cluster UMAP reducer to {reducer_file}")
+        except Exception as e:
+            logger.error(f"Failed to save cluster UMAP reducer: {e}")
+    
     def _save_metadata(self, stats: Dict) -> None:
         """Save processing metadata."""
         metadata_file = self.output_dir / "cluster_positioning_metadata.json"
@@ -110,11 +148,12 @@ class ClusterPositioner:
         return positions
     
     def _load_cluster_summaries(self) -> Dict:
-        """Load cluster summaries from file."""
+        """Load all cluster summaries from the summary store (a legacy .json file is imported first)."""
         summaries = {}
-        if self.cluster_summaries_file.exists():
-            with open(self.cluster_summaries_file, 'r') as f:
-                summaries = json.load(f)
+        store = open_summary_store(self.cluster_summaries_file.parent, self.cluster_summaries_file.stem, create=False)
+        if store is not None:
+            summaries = dict(store.items())
+            store.close()
             logger.info(f"Loaded {len(summaries)} cluster summaries")
         return summaries
     
@@ -243,17 +282,37 @@ class ClusterPositioner:
         logger.info(f"Computed embeddings using TF-IDF: {embeddings_array.shape}")
         return cluster_embeddings, cluster_ids
     
-    def _apply_umap_reduction(self, cluster_embeddings: Dict[str, np.ndarray], cluster_ids: List[str]) -> Dict[str, Tuple[float, float]]:
-        """Apply UMAP dimensionality reduction to get 2D coordinates."""
+    def _apply_umap_reduction(self, cluster_embeddings: Dict[str, np.ndarray], cluster_ids: List[str],
+                              known_coordinates: Optional[Dict[str, Tuple[float, float]]] = None,
+                              refit: bool = False) -> Dict[str, Tuple[float, float]]:
+        """Apply UMAP dimensionality reduction to get 2D coordinates.
+        
+        Clusters in known_coordinates keep their position and only the remaining
+        clusters are projected with the persisted reducer. Any other path lays
+        out every cluster again and sets self.layout_refitted.
+        """
+        self.layout_refitted = False
         if len(cluster_embeddings) == 0:
             logger.warning("No embeddings available, using random coordinates")
             return {cid: (np.random.uniform(-1, 1), np.random.uniform(-1, 1)) for cid in cluster_ids}
         
         # Convert to numpy array for UMAP
         embeddings_array = np.array([cluster_embeddings[cluster_id] for cluster_id in cluster_ids])
+        known_coordinates = known_coordinates or {}
         
         try:
-            if UMAP_AVAILABLE:
+            reducer = None
+            if UMAP_AVAILABLE and known_coordinates and not refit:
+                reducer = self._load_umap_reducer(embeddings_array.shape[1])
+            
+            if reducer is not None:
+                # Project only new clusters into the existing layout
+                new_idx = [i for i, cluster_id in enumerate(cluster_ids) if cluster_id not in known_coordinates]
+                coords = np.array([known_coordinates.get(cluster_id, (0.0, 0.0)) for cluster_id in cluster_ids], dtype=float)
+                if new_idx:
+                    coords[new_idx] = reducer.transform(embeddings_array[new_idx])
+                logger.info(f"Projected {len(new_idx)} new clusters with persisted UMAP reducer")
+            elif UMAP_AVAILABLE:
                 # Use UMAP for dimensionality reduction
                 reducer = umap.UMAP(
                     n_components=2,
@@ -262,15 +321,19 @@ class ClusterPositioner:
                     min_dist=0.1
                 )
                 coords = reducer.fit_transform(embeddings_array)
+                self._save_umap_reducer(reducer, embeddings_array.shape[1], len(embeddings_array))
+                self.layout_refitted = True
                 logger.info("Applied UMAP reduction successfully")
             elif SKLEARN_AVAILABLE:
-                # Use TSNE as fallback
+                # Use TSNE as fallback (no transform(), so the layout is always refitted)
                 reducer = TSNE(n_components=2, random_state=42)
                 coords = reducer.fit_transform(embeddings_array)
+                self.layout_refitted = True
                 logger.info("Applied TSNE reduction successfully")
             else:
                 # Random fallback
                 coords = np.random.uniform(-1, 1, (len(embeddings_array), 2))
+                self.layout_refitted = True
                 logger.warning("Using random coordinates as fallback")
             
             # Create mapping from cluster_id to coordinates
@@ -283,6 +346,7 @@ class ClusterPositioner:
         except Exception as e:
             logger.error(f"Dimensionality reduction failed: {e}")
             # Fallback to random coordinates
+            self.layout_refitted = True
             return {cid: (np.random.uniform(-1, 1), np.random.uniform(-1, 1)) for cid in cluster_ids}
     
     def _create_positioning_data(self, summaries: Dict, coordinates: Dict[str, Tuple[float, float]]) -> List[Dict]:
@@ -318,7 +382,19 @@ class ClusterPositioner:
         
         return positioning_data
     
-    def process_clusters_to_positions(self, force_reprocess: bool = False) -> Dict:
+    def _get_known_coordinates(self, summaries: Dict, existing_positions: Dict, processed_hashes: Set[str]) -> Dict[str, Tuple[float, float]]:
+        """Return coordinates of clusters whose existing position is still valid for their summary."""
+        known_coordinates = {}
+        for cluster_id, position in existing_positions.items():
+            if cluster_id not in summaries:
+                continue
+            summary_content = json.dumps(summaries[cluster_id], sort_keys=True)
+            summary_hash = hashlib.sha256(summary_content.encode()).hexdigest()
+            if position.get('summary_hash') == summary_hash and position.get('positioning_hash') in processed_hashes:
+                known_coordinates[cluster_id] = (position['x'], position['y'])
+        return known_coordinates
+    
+    def process_clusters_to_positions(self, force_reprocess: bool = False, refit_umap: bool = False) -> Dict:
         """Process clusters into 2D positions."""
         logger.info("🚀 Starting cluster positioning...")
         
@@ -346,8 +422,14 @@ class ClusterPositioner:
             logger.warning("No embeddings computed")
             return {'status': 'no_embeddings'}
         
-        # Apply dimensionality reduction
-        coordinates = self._apply_umap_reduction(cluster_embeddings, cluster_ids)
+        # Apply dimensionality reduction, keeping still-valid positions stable
+        refit = force_reprocess or refit_umap
+        known_coordinates = {} if refit else self._get_known_coordinates(summaries, existing_positions, processed_hashes)
+        coordinates = self._apply_umap_reduction(cluster_embeddings, cluster_ids, known_coordinates, refit)
+        
+        # A refitted layout moves every cluster, so all positions are rewritten
+        if self.layout_refitted:
+            processed_hashes = set()
         
         # Save embeddings
         self._save_cluster_summary_embeddings(cluster_embeddings)
@@ -372,8 +454,11 @@ class ClusterPositioner:
             logger.info("No new clusters to position")
             return {'status': 'no_new_positions'}
         
-        # Combine existing and new positions
-        all_positions = list(existing_positions.values()) + new_positions
+        # Combine existing and new positions (new positions replace stale ones)
+        merged_positions = {} if self.layout_refitted else dict(existing_positions)
+        for position in new_positions:
+            merged_positions[position['cluster_id']] = position
+        all_positions = list(merged_positions.values())
         
         # Save positions
         with jsonlines.open(positions_file, mode='w') as writer:
@@ -390,7 +475,8 @@ class ClusterPositioner:
             'total_clusters': len(all_positions),
             'new_positions': len(new_positions),
             'existing_positions': len(existing_positions),
-            'processed_clusters': len(processed_positioning_hashes)
+            'processed_clusters': len(processed_positioning_hashes),
+            'layout_refitted': self.layout_refitted
         }
         
         self._save_metadata(stats)
@@ -401,18 +487,19 @@ class ClusterPositioner:
 
 @click.command()
 @click.option('--cluster-summaries-file', 
-              default='data/processed/cluster_summarization/cluster_summaries.json',
-              help='Input cluster summaries file')
+              default='data/processed/cluster_summarization/cluster_summaries.sqlite',
+              help='Input cluster summary store (a legacy .json file is imported)')
 @click.option('--force', is_flag=True, help='Force reprocess all clusters')
+@click.option('--refit-umap', is_flag=True, help='Refit the persisted UMAP reducer instead of projecting new clusters')
 @click.option('--check-only', is_flag=True, help='Only check setup, don\'t process')
-def main(cluster_summaries_file: str, force: bool, check_only: bool):
+def main(cluster_summaries_file: str, force: bool, refit_umap: bool, check_only: bool):
     """Run cluster positioning."""
     if check_only:
         logger.info("🔍 Checking setup...")
         
         # Check input files
         summaries_file = Path(cluster_summaries_file)
-        if not summaries_file.exists():
+        if not summaries_file.exists() and not summaries_file.with_suffix('.json').exists():
             logger.error(f"❌ Cluster summaries file not found: {summaries_file}")
             return
         
@@ -421,7 +508,7 @@ def main(cluster_summaries_file: str, force: bool, check_only: bool):
     
     # Run positioning
     positioner = ClusterPositioner(cluster_summaries_file)
-    result = positioner.process_clusters_to_positions(force)
+    result = positioner.process_clusters_to_positions(force, refit_umap)
     
     if result['status'] == 'success':
         logger.info("🎉 Cluster positioning completed successfully!")
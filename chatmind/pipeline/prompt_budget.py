@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+Prompt Budgeting
+
+Token counts and prompt packing for the summarizers, measured with the
+target model's tokenizer instead of a fixed characters-per-token ratio:
+
+- OpenAI models are counted with tiktoken.
+- Ollama models are counted with their Hugging Face tokenizer when the
+  tokenizer can be loaded (see TOKENIZER_REPOS, or pass a repo or the path
+  of a tokenizer.json explicitly). The repos listed are public mirrors, so
+  no Hugging Face login is needed; the tokenizer is downloaded once and
+  cached by huggingface_hub.
+- Otherwise estimate_tokens counts words and punctuation separately. Code
+  and other symbol-heavy text then costs more tokens per character than
+  prose, which chars/4 gets badly wrong in both directions. The work
+  scheduler and the request pools use the same estimate.
+
+Counts are cached per text, so a message that is re-packed for another
+pass (or appears in several prompts) is only tokenized once.
+
+PromptBudget packs content into prompts that fill a configurable fraction
+of the context window, after reserving room for the prompt template and
+the response.
+"""
+
+import hashlib
+import os
+import re
+import threading
+from typing import Callable, Dict, List, Optional, TypeVar
+import logging
+
+logger = logging.getLogger(__name__)
+
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    TIKTOKEN_AVAILABLE = False
+
+try:
+    from tokenizers import Tokenizer
+    TOKENIZERS_AVAILABLE = True
+except ImportError:
+    TOKENIZERS_AVAILABLE = False
+
+T = TypeVar('T')
+
+# Context window per model (tokens); the first matching prefix wins
+CONTEXT_WINDOWS = {
+    'gpt-4o': 128000,
+    'gpt-4-turbo': 128000,
+    'gpt-4': 8192,
+    'gpt-3.5-turbo': 16385,
+    'gemma2': 8192,
+    'gemma': 8192,
+    'tinyllama': 2048,
+    'codellama': 16384,
+    'mistral': 32768,
+    'llama3': 8192,
+}
+DEFAULT_CONTEXT_WINDOW = 8192
+
+# Hugging Face tokenizer for Ollama model families; the gemma and mistral
+# entries are ungated mirrors of the (gated) upstream repos
+TOKENIZER_REPOS = {
+    'gemma2': 'unsloth/gemma-2-2b',
+    'gemma': 'unsloth/gemma-2b',
+    'tinyllama': 'TinyLlama/TinyLlama-1.1B-Chat-v1.0',
+    'codellama': 'codellama/CodeLlama-7b-hf',
+    'mistral': 'unsloth/mistral-7b-v0.3',
+}
+
+_TOKEN_PIECES = re.compile(r"[A-Za-z]+|\d|[^\sA-Za-z\d]")
+
+
+def _lookup(table: Dict[str, T], model: str) -> Optional[T]:
+    name = model.lower().split('/')[-1]
+    for prefix in sorted(table, key=len, reverse=True):
+        if name.startswith(prefix):
+            return table[prefix]
+    return None
+
+
+def estimate_tokens(text: str) -> int:
+    """Tokenizer-free estimate: words (long ones split every ~6 letters), digits and symbols.
+
+    The one token estimate of the pipeline: budgets, request pools and
+    prompt packing all use it when no tokenizer is available.
+    """
+    tokens = 0
+    for piece in _TOKEN_PIECES.findall(text or ''):
+        tokens += 1 + (len(piece) - 1) // 6 if piece[0].isalpha() else 1
+    return max(1, tokens)
+
+
+class TokenCounter:
+    """Counts tokens with the target model's tokenizer, caching counts per text."""
+
+    def __init__(self, model: str, tokenizer: Optional[str] = None, cache_size: int = 200000):
+        self.model = model
+        self.cache_size = cache_size
+        self._cache: Dict[bytes, int] = {}
+        self._lock = threading.Lock()
+        self._encode: Callable[[str], int] = estimate_tokens
+        self.backend = 'estimate'
+        self._load_tokenizer(tokenizer)
+
+    def _load_tokenizer(self, tokenizer: Optional[str]) -> None:
+        if TIKTOKEN_AVAILABLE and not tokenizer and self.model.startswith(('gpt-', 'o1', 'o3', 'text-embedding')):
+            try:
+                encoding = tiktoken.encoding_for_model(self.model)
+            except KeyError:
+                encoding = tiktoken.get_encoding('o200k_base')
+            self._encode = lambda text: len(encoding.encode(text, disallowed_special=()))
+            self.backend = f"tiktoken:{encoding.name}"
+            return
+
+        repo = tokenizer or _lookup(TOKENIZER_REPOS, self.model)
+        if TOKENIZERS_AVAILABLE and repo:
+            try:
+                if os.path.isfile(repo):
+                    hf_tokenizer = Tokenizer.from_file(repo)
+                else:
+                    hf_tokenizer = Tokenizer.from_pretrained(repo)
+                self._encode = lambda text: len(hf_tokenizer.encode(text, add_special_tokens=False).ids)
+                self.backend = f"huggingface:{repo}"
+                return
+            except Exception as e:
+                logger.info(f"Tokenizer {repo} unavailable ({e}), estimating token counts")
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        key = hashlib.blake2b(text.encode('utf-8', 'ignore'), digest_size=16).digest()
+        with self._lock:
+            cached = self._cache.get(key)
+        if cached is not None:
+            return cached
+        tokens = self._encode(text)
+        with self._lock:
+            if len(self._cache) >= self.cache_size:
+                self._cache.clear()
+            self._cache[key] = tokens
+        return tokens
+
+
+class PromptBudget:
+    """How much content fits one prompt for a model, and packing of content into prompts."""
+
+    def __init__(self,
+                 model: str,
+                 context_window: Optional[int] = None,
+                 fraction: float = 0.75,
+                 reserved_tokens: int = 1000,
+                 tokenizer: Optional[str] = None):
+        """
+        context_window: model context in tokens (default: CONTEXT_WINDOWS).
+        fraction: share of the context window prompts are packed to.
+        reserved_tokens: room kept for the prompt template and instructions.
+        """
+        self.model = model
+        self.context_window = context_window or _lookup(CONTEXT_WINDOWS, model) or DEFAULT_CONTEXT_WINDOW
+        self.fraction = fraction
+        self.max_tokens = max(256, int(self.context_window * fraction) - reserved_tokens)
+        self.counter = TokenCounter(model, tokenizer)
+        self.packed_prompts = 0
+
+    def count(self, text: str) -> int:
+        return self.counter.count(text)
+
+    def total(self, texts: List[str]) -> int:
+        """Tokens of texts joined with blank lines."""
+        return sum(self.count(text) + 2 for text in texts)
+
+    def fits(self, texts: List[str]) -> bool:
+        return self.total(texts) <= self.max_tokens
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Longest prefix of text within max_tokens."""
+        if self.count(text) <= max_tokens:
+            return text
+        # Prefixes are counted uncached; they are never looked up again
+        encode = self.counter._encode
+        low, high = 0, len(text)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if encode(text[:middle]) <= max_tokens:
+                low = middle
+            else:
+                high = middle - 1
+        return text[:low]
+
+    def pack(self, items: List[T], text: Callable[[T], str], max_tokens: Optional[int] = None) -> List[List[T]]:
+        """Split items, in order, into groups whose texts fit max_tokens (default: the budget).
+
+        An item that is too large on its own gets a group to itself; callers
+        truncate it when building the prompt.
+        """
+        limit = max_tokens or self.max_tokens
+        groups: List[List[T]] = []
+        current: List[T] = []
+        used = 0
+        for item in items:
+            tokens = self.count(text(item)) + 2
+            if current and used + tokens > limit:
+                groups.append(current)
+                current, used = [], 0
+            current.append(item)
+            used += tokens
+        if current:
+            groups.append(current)
+        self.packed_prompts += len(groups)
+        return groups
+
+    def get_stats(self) -> Dict:
+        return {
+            'model': self.model,
+            'tokenizer': self.counter.backend,
+            'context_window': self.context_window,
+            'fraction': self.fraction,
+            'max_prompt_tokens': self.max_tokens,
+            'packed_prompts': self.packed_prompts
+        }
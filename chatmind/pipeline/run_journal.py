@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Run Journal
+
+Append-only, crash-safe record of the work items an LLM step has finished.
+The tagging and summarization steps only write their outputs and hash files
+at the end of a run; each result is also appended to a journal as soon as
+it completes, so a crash or Ctrl-C loses nothing. On the next run the
+journal is replayed, finished items are skipped, and the journal is removed
+once the outputs and hashes have been saved.
+
+Every record is flushed to the OS immediately (safe against process
+crashes) and fsynced in small batches (safe against power loss).
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class RunJournal:
+    """JSONL journal of completed (hash, result) pairs for one pipeline step."""
+
+    def __init__(self, path: Path, commit_every: int = 10, commit_seconds: float = 5.0):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.commit_every = max(1, commit_every)
+        self.commit_seconds = commit_seconds
+        self._lock = threading.Lock()
+        self._file = None
+        self._pending = 0
+        self._last_commit = time.monotonic()
+        self.appended = 0
+
+    def replay(self) -> List[Dict]:
+        """Records left by an interrupted run, in completion order.
+
+        Each record is {'hash': ..., 'result': ...}. A torn last line (from a
+        crash mid-write) is ignored.
+        """
+        if not self.path.exists():
+            return []
+
+        records = []
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line_number, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    logger.warning(f"Ignoring incomplete journal line {line_number} in {self.path}")
+        if records:
+            logger.info(f"♻️ Resuming from journal: {len(records)} results recovered from {self.path}")
+        return records
+
+    def append(self, item_hash: str, result: Any) -> None:
+        """Record a finished item; safe to call from worker threads."""
+        line = json.dumps({'hash': item_hash, 'result': result}, ensure_ascii=False)
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, 'a', encoding='utf-8')
+                if self._file.tell() and not self._ends_with_newline():
+                    # Terminate a torn line left by a crash so it cannot swallow this record
+                    self._file.write("\n")
+            self._file.write(line + "\n")
+            self._file.flush()
+            self._pending += 1
+            self.appended += 1
+            if (self._pending >= self.commit_every
+                    or time.monotonic() - self._last_commit >= self.commit_seconds):
+                self._commit_locked()
+
+    def _ends_with_newline(self) -> bool:
+        with open(self.path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def _commit_locked(self) -> None:
+        if self._file is not None and self._pending:
+            os.fsync(self._file.fileno())
+        self._pending = 0
+        self._last_commit = time.monotonic()
+
+    def commit(self) -> None:
+        """Force pending records to disk."""
+        with self._lock:
+            self._commit_locked()
+
+    def close(self) -> None:
+        with self._lock:
+            self._commit_locked()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def finish(self) -> None:
+        """Remove the journal once the step's outputs and hashes are saved."""
+        self.close()
+        if self.path.exists():
+            self.path.unlink()
+
+    def __enter__(self) -> "RunJournal":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        # Keep the journal on errors (including KeyboardInterrupt) so the next run resumes
+        self.close()
+
+
+@contextmanager
+def atomic_write(path: Path) -> Iterator[Path]:
+    """Yield a temporary path that replaces path only if the block succeeds.
+
+    A crash while an output file is being rewritten then leaves the previous
+    version intact instead of a truncated file.
+    """
+    path = Path(path)
+    tmp_path = path.with_name(path.name + ".tmp")
+    try:
+        yield tmp_path
+        with open(tmp_path, 'rb') as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
@@ -44,6 +44,17 @@ class PipelineRunner:
         
         return True
     
+    def _has_deferred_work(self, step_name: str) -> bool:
+        """Whether the step's last run stopped at its time/token budget with items left over."""
+        metadata_file = self.processed_dir / step_name / "metadata.json"
+        try:
+            with open(metadata_file, 'r') as f:
+                metadata = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return False
+        scheduler_stats = metadata.get('stats', metadata).get('scheduler') or {}
+        return scheduler_stats.get('deferred_items', 0) > 0
+    
     def _run_step(self, step_name: str, command: List[str], description: str) -> bool:
         """Run a pipeline step and return success status."""
         logger.info(f"🚀 {description}")
@@ -91,9 +102,11 @@ class PipelineRunner:
         
         return self._run_step("chunking", command, "Running chunking step")
     
-    def run_embedding(self, method: str = "local", force: bool = False) -> bool:
+    def run_embedding(self, method: str = "local", force: bool = False,
+                      batch_args: Optional[List[str]] = None) -> bool:
         """Run the embedding step."""
-        if not force and self._check_step_output("embedding", ["embeddings.jsonl", "metadata.json"]):
+        if (not force and not (method == "cloud" and batch_args)
+                and self._check_step_output("embedding", ["embeddings.jsonl", "metadata.json"])):
             logger.info("ℹ️ Embedding already completed, skipping...")
             return True
         
@@ -106,7 +119,7 @@ class PipelineRunner:
                 str(self.python_executable), str(cloud_script),
                 "--chunks-file", str(self.processed_dir / "chunking" / "chunks.jsonl"),
                 "--state-file", str(self.processed_dir / "embedding" / "hashes.pkl")
-            ]
+            ] + (batch_args or [])
         else:
             # Default to local method
             command = [
@@ -120,9 +133,9 @@ class PipelineRunner:
         
         return self._run_step("embedding", command, f"Running embedding step ({method})")
     
-    def run_clustering(self, force: bool = False) -> bool:
+    def run_clustering(self, force: bool = False, refit_umap: bool = False) -> bool:
         """Run the clustering step."""
-        if not force and self._check_step_output("clustering", ["clustered_embeddings.jsonl", "metadata.json"]):
+        if not force and not refit_umap and self._check_step_output("clustering", ["clustered_embeddings.jsonl", "metadata.json"]):
             logger.info("ℹ️ Clustering already completed, skipping...")
             return True
         
@@ -133,12 +146,51 @@ class PipelineRunner:
         
         if force:
             command.append("--force")
+        if refit_umap:
+            command.append("--refit-umap")
         
         return self._run_step("clustering", command, "Running clustering step")
     
-    def run_tagging(self, method: str = "local", force: bool = False) -> bool:
+    @staticmethod
+    def _scheduler_args(priority: str = "file", pins: Optional[List[str]] = None,
+                        time_budget: Optional[float] = None, token_budget: Optional[int] = None) -> List[str]:
+        """Command-line options for the work scheduler of the LLM steps."""
+        args = ["--priority", priority]
+        for pin in pins or []:
+            args.extend(["--pin", pin])
+        if time_budget:
+            args.extend(["--time-budget", str(time_budget)])
+        if token_budget:
+            args.extend(["--token-budget", str(token_budget)])
+        return args
+    
+    @staticmethod
+    def _rate_limit_args(requests_per_minute: Optional[float] = None,
+                         tokens_per_minute: Optional[float] = None) -> List[str]:
+        """Command-line options for the async request pool of the cloud summarization steps."""
+        args = []
+        if requests_per_minute:
+            args.extend(["--requests-per-minute", str(requests_per_minute)])
+        if tokens_per_minute:
+            args.extend(["--tokens-per-minute", str(tokens_per_minute)])
+        return args
+    
+    @staticmethod
+    def _batch_args(batch_mode: Optional[str] = None, batch_submitter: str = "openai") -> List[str]:
+        """Command-line options for the batch-job mode of the cloud tagging, embedding and chat summarization steps."""
+        if not batch_mode:
+            return []
+        return ["--batch-mode", batch_mode, "--batch-submitter", batch_submitter]
+    
+    def run_tagging(self, method: str = "local", force: bool = False, max_workers: int = 1,
+                    batch_size: int = 1, fast_path: bool = False,
+                    scheduler_args: Optional[List[str]] = None, triage: bool = False,
+                    batch_args: Optional[List[str]] = None) -> bool:
         """Run the tagging step."""
-        if not force and self._check_step_output("tagging", ["tags.jsonl", "metadata.json"]):
+        # Batch submissions and ingestion run even when the step's outputs exist
+        if (not force and not (method == "cloud" and batch_args)
+                and self._check_step_output("tagging", ["tags.jsonl", "metadata.json"])
+                and not self._has_deferred_work("tagging")):
             logger.info("ℹ️ Tagging already completed, skipping...")
             return True
         
@@ -151,7 +203,7 @@ class PipelineRunner:
                 str(self.python_executable), str(cloud_script),
                 "--input-file", str(self.processed_dir / "ingestion" / "chats.jsonl"),
                 "--output-file", str(self.processed_dir / "tagging" / "tags.jsonl")
-            ]
+            ] + (batch_args or [])
         else:
             # Default to local method
             command = [
@@ -159,7 +211,13 @@ class PipelineRunner:
                 "--input-file", str(self.processed_dir / "ingestion" / "chats.jsonl"),
                 "--output-file", str(self.processed_dir / "tagging" / "tags.jsonl")
             ]
+            if fast_path:
+                command.append("--fast-path")
         
+        command.extend(["--max-workers", str(max_workers), "--batch-size", str(batch_size)])
+        if triage:
+            command.append("--triage")
+        command.extend(scheduler_args or [])
         if force:
             command.append("--force")
         
@@ -181,9 +239,12 @@ class PipelineRunner:
     
 
     
-    def run_cluster_summarization(self, method: str = "local", force: bool = False) -> bool:
+    def run_cluster_summarization(self, method: str = "local", force: bool = False,
+                                  scheduler_args: Optional[List[str]] = None, max_workers: int = 1,
+                                  sampling: str = "full", rate_limit_args: Optional[List[str]] = None) -> bool:
         """Run the cluster summarization step."""
-        if not force and self._check_step_output("cluster_summarization", ["cluster_summaries.json", "metadata.json"]):
+        if (not force and self._check_step_output("cluster_summarization", ["cluster_summaries.sqlite", "metadata.json"])
+                and not self._has_deferred_work("cluster_summarization")):
             logger.info("ℹ️ Cluster summarization already completed, skipping...")
             return True
         
@@ -196,7 +257,7 @@ class PipelineRunner:
                 str(self.python_executable), str(cloud_script),
                 "--clustered-embeddings-file", str(self.processed_dir / "clustering" / "clustered_embeddings.jsonl"),
                 "--chunks-file", str(self.processed_dir / "chunking" / "chunks.jsonl")
-            ]
+            ] + (rate_limit_args or [])
         else:
             # Default to local method
             command = [
@@ -205,14 +266,22 @@ class PipelineRunner:
                 "--chunks-file", str(self.processed_dir / "chunking" / "chunks.jsonl")
             ]
         
+        command.extend(["--max-workers", str(max_workers), "--sampling", sampling])
+        command.extend(scheduler_args or [])
         if force:
             command.append("--force")
         
         return self._run_step("cluster_summarization", command, f"Running cluster summarization step ({method})")
     
-    def run_chat_summarization(self, method: str = "local", force: bool = False) -> bool:
+    def run_chat_summarization(self, method: str = "local", force: bool = False,
+                               scheduler_args: Optional[List[str]] = None, composed: bool = False,
+                               triage: bool = False, max_workers: int = 1,
+                               rate_limit_args: Optional[List[str]] = None,
+                               batch_args: Optional[List[str]] = None) -> bool:
         """Run the chat summarization step."""
-        if not force and self._check_step_output("chat_summarization", ["chat_summaries.json", "metadata.json"]):
+        if (not force and not (method == "cloud" and batch_args)
+                and self._check_step_output("chat_summarization", ["chat_summaries.sqlite", "metadata.json"])
+                and not self._has_deferred_work("chat_summarization")):
             logger.info("ℹ️ Chat summarization already completed, skipping...")
             return True
         
@@ -223,8 +292,9 @@ class PipelineRunner:
         if method == "cloud" and cloud_script.exists():
             command = [
                 str(self.python_executable), str(cloud_script),
-                "--chats-file", str(self.processed_dir / "ingestion" / "chats.jsonl")
-            ]
+                "--chats-file", str(self.processed_dir / "ingestion" / "chats.jsonl"),
+                "--max-workers", str(max_workers)
+            ] + (rate_limit_args or []) + (batch_args or [])
         else:
             # Default to local method
             command = [
@@ -232,14 +302,19 @@ class PipelineRunner:
                 "--chats-file", str(self.processed_dir / "ingestion" / "chats.jsonl")
             ]
         
+        if composed:
+            command.append("--composed")
+        if triage:
+            command.append("--triage")
+        command.extend(scheduler_args or [])
         if force:
             command.append("--force")
         
         return self._run_step("chat_summarization", command, f"Running chat summarization step ({method})")
     
-    def run_positioning(self, force: bool = False) -> bool:
+    def run_positioning(self, force: bool = False, refit_umap: bool = False) -> bool:
         """Run the positioning step (both cluster and chat positioning)."""
-        if not force and self._check_step_output("positioning", [
+        if not force and not refit_umap and self._check_step_output("positioning", [
             "cluster_positions.jsonl", "chat_positions.jsonl", 
             "cluster_positioning_metadata.json", "chat_positioning_metadata.json",
             "cluster_summary_embeddings.jsonl", "chat_summary_embeddings.jsonl"
@@ -250,22 +325,26 @@ class PipelineRunner:
         # Run cluster positioning
         cluster_command = [
             str(self.python_executable), str(self.pipeline_dir / "positioning" / "position_clusters.py"),
-            "--cluster-summaries-file", str(self.processed_dir / "cluster_summarization" / "cluster_summaries.json")
+            "--cluster-summaries-file", str(self.processed_dir / "cluster_summarization" / "cluster_summaries.sqlite")
         ]
         
         if force:
             cluster_command.append("--force")
+        if refit_umap:
+            cluster_command.append("--refit-umap")
         
         cluster_success = self._run_step("cluster_positioning", cluster_command, "Running cluster positioning step")
         
         # Run chat positioning
         chat_command = [
             str(self.python_executable), str(self.pipeline_dir / "positioning" / "position_chats.py"),
-            "--chat-summaries-file", str(self.processed_dir / "chat_summarization" / "chat_summaries.json")
+            "--chat-summaries-file", str(self.processed_dir / "chat_summarization" / "chat_summaries.sqlite")
         ]
         
         if force:
             chat_command.append("--force")
+        if refit_umap:
+            chat_command.append("--refit-umap")
         
         chat_success = self._run_step("chat_positioning", chat_command, "Running chat positioning step")
         
@@ -273,15 +352,8 @@ class PipelineRunner:
     
     def run_similarity(self, force: bool = False) -> bool:
         """Run the similarity steps (chat and cluster)."""
-        # Check if both similarity steps are already completed
-        chat_similarity_complete = self._check_step_output("similarity", ["chat_similarities.jsonl", "chat_similarity_hashes.pkl"])
-        cluster_similarity_complete = self._check_step_output("similarity", ["cluster_similarities.jsonl", "cluster_similarity_hashes.pkl"])
-        
-        if not force and chat_similarity_complete and cluster_similarity_complete:
-            logger.info("ℹ️ Similarity calculations already completed, skipping...")
-            return True
-        
-        # Run chat similarity
+        # Run chat similarity (always invoked: it only computes rows for new or
+        # changed chats and skips itself when nothing changed)
         chat_command = [
             str(self.python_executable), str(self.pipeline_dir / "similarity" / "calculate_chat_similarities.py"),
             "--embeddings-file", str(self.processed_dir / "positioning" / "chat_summary_embeddings.jsonl")
@@ -295,6 +367,10 @@ class PipelineRunner:
             return False
         
         # Run cluster similarity
+        if not force and self._check_step_output("similarity", ["cluster_similarities.npz", "cluster_similarity_hashes.pkl"]):
+            logger.info("ℹ️ Cluster similarity already completed, skipping...")
+            return True
+        
         cluster_command = [
             str(self.python_executable), str(self.pipeline_dir / "similarity" / "calculate_cluster_similarities.py"),
             "--embeddings-file", str(self.processed_dir / "positioning" / "cluster_summary_embeddings.jsonl")
@@ -341,22 +417,53 @@ class PipelineRunner:
                     tagging_method: str = "local",
                     summarization_method: str = "local",
                     force: bool = False,
-                    steps: List[str] = None) -> Dict:
+                    steps: List[str] = None,
+                    refit_umap: bool = False,
+                    tagging_workers: int = 1,
+                    tagging_batch_size: int = 1,
+                    tagging_fast_path: bool = False,
+                    summarization_workers: int = 1,
+                    requests_per_minute: Optional[float] = None,
+                    tokens_per_minute: Optional[float] = None,
+                    batch_mode: Optional[str] = None,
+                    batch_submitter: str = "openai",
+                    cluster_sampling: str = "full",
+                    chat_composed: bool = False,
+                    triage: bool = False,
+                    priority: str = "file",
+                    pins: Optional[List[str]] = None,
+                    time_budget: Optional[float] = None,
+                    token_budget: Optional[int] = None) -> Dict:
         """Run the complete pipeline or specified steps."""
         logger.info("🚀 Starting ChatMind Pipeline")
         logger.info("=" * 50)
         
+        # Work order and per-step budget for tagging and summarization
+        scheduler_args = self._scheduler_args(priority, pins, time_budget, token_budget)
+        # API rate limits for the cloud summarization steps
+        rate_limit_args = self._rate_limit_args(requests_per_minute, tokens_per_minute)
+        # Offline batch jobs instead of interactive requests for the cloud steps that support them
+        batch_args = self._batch_args(batch_mode, batch_submitter)
+        
         # Define pipeline steps in order
         pipeline_steps = [
             ("ingestion", self.run_ingestion),
             ("chunking", self.run_chunking),
-            ("embedding", lambda f: self.run_embedding(embedding_method, f)),
-            ("clustering", self.run_clustering),
-            ("tagging", lambda f: self.run_tagging(tagging_method, f)),
+            ("embedding", lambda f: self.run_embedding(embedding_method, f, batch_args)),
+            ("clustering", lambda f: self.run_clustering(f, refit_umap)),
+            ("tagging", lambda f: self.run_tagging(tagging_method, f, tagging_workers, tagging_batch_size,
+                                                       tagging_fast_path, scheduler_args, triage, batch_args)),
             ("tag_post_processing", self.run_tag_post_processing),
-            ("cluster_summarization", lambda f: self.run_cluster_summarization(summarization_method, f)),
-            ("chat_summarization", lambda f: self.run_chat_summarization(summarization_method, f)),
-            ("positioning", self.run_positioning),
+            ("cluster_summarization", lambda f: self.run_cluster_summarization(summarization_method, f,
+                                                                               scheduler_args,
+                                                                               summarization_workers,
+                                                                               cluster_sampling,
+                                                                               rate_limit_args)),
+            ("chat_summarization", lambda f: self.run_chat_summarization(summarization_method, f,
+                                                                         scheduler_args, chat_composed, triage,
+                                                                         summarization_workers,
+                                                                         rate_limit_args, batch_args)),
+            ("positioning", lambda f: self.run_positioning(f, refit_umap)),
             ("similarity", self.run_similarity),
             ("loading", self.run_loading)
         ]
@@ -415,6 +522,30 @@ class PipelineRunner:
               default='local',
               help='Summarization method to use')
 @click.option('--force', is_flag=True, help='Force reprocess all steps')
+@click.option('--refit-umap', is_flag=True, help='Refit persisted UMAP reducers for clustering and positioning (new points are otherwise projected into the existing layout)')
+@click.option('--tagging-workers', default=1, type=int, help='Number of messages tagged concurrently (local and cloud tagging)')
+@click.option('--tagging-batch-size', default=1, type=int, help='Short messages packed into one tagging prompt (1 disables batching)')
+@click.option('--tagging-fast-path', is_flag=True, help='Tag confident messages from chunk embeddings without the LLM (local tagging)')
+@click.option('--summarization-workers', default=1, type=int, help='Batch and cluster summaries run concurrently (cluster summarization), and chats summarized concurrently (cloud chat summarization)')
+@click.option('--requests-per-minute', default=None, type=float,
+              help='Run cloud summarization API calls on an async request pool limited to this many requests/min')
+@click.option('--tokens-per-minute', default=None, type=float,
+              help='Run cloud summarization API calls on an async request pool limited to this many tokens/min')
+@click.option('--batch-mode', default=None, type=click.Choice(['submit', 'ingest']),
+              help='Submit cloud tagging, embedding and chat summarization requests as batch jobs, or ingest finished jobs')
+@click.option('--batch-submitter', default='openai', type=click.Choice(['openai', 'local']),
+              help='Where batch jobs go: the OpenAI Batch API or a local directory')
+@click.option('--cluster-sampling', default='full', type=click.Choice(['full', 'representative']),
+              help='Summarize large clusters from all chunks or from a representative sample')
+@click.option('--chat-composed', is_flag=True,
+              help='Summarize well-clustered chats from their cluster summaries and tags instead of the transcript')
+@click.option('--triage/--no-triage', default=False,
+              help='Give trivial chats a template summary and a one-prompt tag pass (tagging and chat summarization; off by default)')
+@click.option('--priority', default='file', type=click.Choice(['file', 'recent', 'shortest']),
+              help='Order of chats for tagging and summarization: file order, most recent first or shortest first')
+@click.option('--pin', 'pins', multiple=True, help='Chat ID to tag and summarize before all others (repeatable)')
+@click.option('--time-budget', default=None, type=float, help='Minutes each tagging/summarization step may start new LLM calls for')
+@click.option('--token-budget', default=None, type=int, help='Approximate prompt tokens each tagging/summarization step may use')
 @click.option('--steps', 
               multiple=True,
               type=click.Choice(['ingestion', 'chunking', 'embedding', 'clustering', 
@@ -423,7 +554,11 @@ class PipelineRunner:
               help='Specific steps to run (can specify multiple)')
 @click.option('--check-only', is_flag=True, help='Only check setup, don\'t run pipeline')
 def main(local: bool, embedding_method: str, tagging_method: str, summarization_method: str, 
-         force: bool, steps: List[str], check_only: bool):
+         force: bool, refit_umap: bool, tagging_workers: int, tagging_batch_size: int,
+         tagging_fast_path: bool, summarization_workers: int,
+         requests_per_minute: Optional[float], tokens_per_minute: Optional[float],
+         batch_mode: Optional[str], batch_submitter: str, cluster_sampling: str, chat_composed: bool, triage: bool, priority: str, pins: List[str], time_budget: Optional[float],
+         token_budget: Optional[int], steps: List[str], check_only: bool):
     """
     Run the complete ChatMind pipeline.
     
@@ -455,6 +590,40 @@ def main(local: bool, embedding_method: str, tagging_method: str, summarization_
     
     # Force reprocess everything
     python3 chatmind/pipeline/run_pipeline.py --force
+    
+    # Recompute the 2D layout from scratch (otherwise new points are projected)
+    python3 chatmind/pipeline/run_pipeline.py --steps clustering positioning --refit-umap
+    
+    # Tag with 4 requests in flight
+    python3 chatmind/pipeline/run_pipeline.py --steps tagging --tagging-workers 4
+    
+    # Pack up to 8 short messages into each tagging prompt
+    python3 chatmind/pipeline/run_pipeline.py --steps tagging --tagging-batch-size 8
+    
+    # Tag confident messages from their embeddings, the rest with the LLM
+    python3 chatmind/pipeline/run_pipeline.py --local --steps tagging --tagging-fast-path
+    
+    # Summarize clusters with 4 LLM calls in flight
+    python3 chatmind/pipeline/run_pipeline.py --steps cluster_summarization --summarization-workers 4
+    
+    # Cloud summarization at up to 500 requests and 200k tokens per minute, 32 requests in flight
+    python3 chatmind/pipeline/run_pipeline.py --summarization-method cloud --summarization-workers 32 --requests-per-minute 500 --tokens-per-minute 200000
+    
+    # Nightly backfill: ingest yesterday's batch jobs, then submit what is still pending
+    python3 chatmind/pipeline/run_pipeline.py --embedding-method cloud --tagging-method cloud --summarization-method cloud --steps embedding tagging chat_summarization --batch-mode ingest
+    python3 chatmind/pipeline/run_pipeline.py --embedding-method cloud --tagging-method cloud --summarization-method cloud --steps embedding tagging chat_summarization --batch-mode submit
+    
+    # Summarize large clusters from a representative sample of their chunks
+    python3 chatmind/pipeline/run_pipeline.py --steps cluster_summarization --cluster-sampling representative
+    
+    # Summarize well-clustered chats from cluster summaries and tags
+    python3 chatmind/pipeline/run_pipeline.py --steps chat_summarization --chat-composed
+    
+    # Template summaries and one-prompt tagging for trivial chats instead of full LLM work
+    python3 chatmind/pipeline/run_pipeline.py --steps tagging chat_summarization --triage
+    
+    # Newest chats first, at most 30 minutes of LLM work per step
+    python3 chatmind/pipeline/run_pipeline.py --priority recent --time-budget 30
     """
     
     # If --local flag is used, override all methods to local
@@ -493,7 +662,23 @@ def main(local: bool, embedding_method: str, tagging_method: str, summarization_
         tagging_method=tagging_method,
         summarization_method=summarization_method,
         force=force,
-        steps=list(steps) if steps else None
+        steps=list(steps) if steps else None,
+        refit_umap=refit_umap,
+        tagging_workers=tagging_workers,
+        tagging_batch_size=tagging_batch_size,
+        tagging_fast_path=tagging_fast_path,
+        summarization_workers=summarization_workers,
+        requests_per_minute=requests_per_minute,
+        tokens_per_minute=tokens_per_minute,
+        batch_mode=batch_mode,
+        batch_submitter=batch_submitter,
+        cluster_sampling=cluster_sampling,
+        chat_composed=chat_composed,
+        triage=triage,
+        priority=priority,
+        pins=list(pins),
+        time_budget=time_budget,
+        token_budget=token_budget
     )
     
     if result['status'] == 'success':
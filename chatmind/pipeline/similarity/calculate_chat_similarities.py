@@ -5,6 +5,7 @@ Chat Similarity Calculator
 Calculates chat-level similarities using pre-computed chat summary embeddings.
 Uses embeddings from positioning step to avoid duplicate computation.
 Uses modular directory structure: data/processed/similarity/
+Edges are stored as a CSR .npz edge list with a single artifact checksum.
 """
 
 import json
@@ -13,11 +14,22 @@ import pickle
 import hashlib
 import numpy as np
 from pathlib import Path
-from typing import Dict, List, Tuple, Optional
+from typing import Dict, List, Set, Tuple, Optional
 import click
 from tqdm import tqdm
 import logging
 from datetime import datetime
+import sys
+
+# Import shared similarity engine and edge storage
+try:
+    from .similarity_engine import SimilarityEngine
+    from .sparse_edges import save_sparse_edges, iter_sparse_edges
+except ImportError:
+    # Fallback for direct execution
+    sys.path.append(str(Path(__file__).parent))
+    from similarity_engine import SimilarityEngine
+    from sparse_edges import save_sparse_edges, iter_sparse_edges
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -26,8 +38,18 @@ logger = logging.getLogger(__name__)
 class ChatSimilarityCalculator:
     """Calculate chat similarities from pre-computed chat summary embeddings."""
     
-    def __init__(self, embeddings_file: str = "data/processed/positioning/chat_summary_embeddings.jsonl"):
+    def __init__(self, embeddings_file: str = "data/processed/positioning/chat_summary_embeddings.jsonl",
+                 block_size: int = 1024, num_threads: Optional[int] = None,
+                 mode: str = 'threshold', top_k: int = 10, min_similarity: float = 0.5,
+                 ann_method: str = 'auto'):
         self.embeddings_file = Path(embeddings_file)
+        self.engine = SimilarityEngine(block_size=block_size, num_threads=num_threads)
+        
+        # 'threshold' keeps every pair above the threshold, 'topk' keeps each chat's k nearest neighbours
+        self.mode = mode
+        self.top_k = top_k
+        self.min_similarity = min_similarity
+        self.ann_method = ann_method
         
         # Use modular directory structure
         self.output_dir = Path("data/processed/similarity")
@@ -70,103 +92,147 @@ class ChatSimilarityCalculator:
         except Exception as e:
             logger.error(f"Failed to save metadata: {e}")
     
-    def _load_chat_summary_embeddings(self) -> Dict[str, np.ndarray]:
-        """Load pre-computed chat summary embeddings from positioning step."""
+    def _load_metadata(self) -> Dict:
+        """Load metadata from the previous run, if any."""
+        metadata_file = self.output_dir / "metadata.json"
+        if metadata_file.exists():
+            try:
+                with open(metadata_file, 'r') as f:
+                    return json.load(f)
+            except Exception as e:
+                logger.warning(f"Failed to load metadata: {e}")
+        return {}
+    
+    def _has_existing_similarities(self) -> bool:
+        """Check whether a previous run left an edge file (sparse or legacy JSONL)."""
+        return (self.output_dir / "chat_similarities.npz").exists() or \
+            (self.output_dir / "chat_similarities.jsonl").exists()
+    
+    def _load_existing_similarities(self) -> List[Dict]:
+        """Load similarity relationships from the previous run."""
+        edges_file = self.output_dir / "chat_similarities.npz"
+        legacy_file = self.output_dir / "chat_similarities.jsonl"
+        similarities = []
+        if edges_file.exists():
+            try:
+                for id1, id2, sim in iter_sparse_edges(edges_file):
+                    similarities.append({'chat1_id': id1, 'chat2_id': id2, 'similarity': sim})
+            except Exception as e:
+                logger.warning(f"Failed to load existing similarities: {e}")
+                return []
+        elif legacy_file.exists():
+            with jsonlines.open(legacy_file) as reader:
+                for sim in reader:
+                    similarities.append(sim)
+        if similarities:
+            logger.info(f"Loaded {len(similarities)} existing similarities")
+        return similarities
+    
+    def _load_chat_summary_embeddings(self) -> Tuple[Dict[str, np.ndarray], Dict[str, str]]:
+        """Load pre-computed chat summary embeddings and their hashes from positioning step."""
         logger.info(f"📖 Loading chat summary embeddings from {self.embeddings_file}")
         
         if not self.embeddings_file.exists():
             logger.error(f"❌ Chat summary embeddings file not found: {self.embeddings_file}")
             logger.error("Please run the positioning step first to generate embeddings")
-            return {}
+            return {}, {}
         
         chat_embeddings = {}
-        chat_hashes = set()
+        chat_hashes = {}
         
         try:
             with jsonlines.open(self.embeddings_file) as reader:
                 for item in tqdm(reader, desc="Loading embeddings"):
                     chat_id = item.get('chat_id')
                     embedding = item.get('embedding')
-                    item_hash = item.get('hash', '')
+                    item_hash = item.get('hash') or self._generate_content_hash({
+                        'chat_id': chat_id,
+                        'embedding': embedding
+                    })
                     
                     if chat_id and embedding is not None:
                         chat_embeddings[chat_id] = np.array(embedding, dtype=float)
-                        chat_hashes.add(item_hash)
+                        chat_hashes[chat_id] = item_hash
             
             logger.info(f"✅ Loaded {len(chat_embeddings)} chat summary embeddings")
             return chat_embeddings, chat_hashes
             
         except Exception as e:
             logger.error(f"❌ Failed to load chat summary embeddings: {e}")
-            return {}, set()
+            return {}, {}
     
     def calculate_similarities(self, chat_embeddings: Dict[str, np.ndarray], 
                              similarity_threshold: float = 0.8) -> List[Dict]:
-        """Calculate similarities between all chat pairs."""
-        logger.info(f"🔗 Calculating similarities (threshold: {similarity_threshold})...")
+        """Calculate similarities between chat pairs (all pairs above threshold, or top-k neighbours)."""
+        if self.mode == 'topk':
+            logger.info(f"🔗 Building top-{self.top_k} neighbour graph (min similarity: {self.min_similarity})...")
+            edges = self.engine.topk_edges(chat_embeddings, self.top_k, self.min_similarity, self.ann_method)
+        else:
+            # Blocked, vectorized cosine similarity over normalized embeddings
+            logger.info(f"🔗 Calculating similarities (threshold: {similarity_threshold})...")
+            edges = self.engine.threshold_edges(chat_embeddings, similarity_threshold)
         
-        chat_ids = list(chat_embeddings.keys())
-        n = len(chat_ids)
         similarities = []
         
-        # Calculate similarities for all pairs
-        for i in tqdm(range(n), desc="Calculating similarities"):
-            id1 = chat_ids[i]
-            v1 = chat_embeddings[id1]
-            norm1 = np.linalg.norm(v1)
-            
-            if norm1 == 0:
-                continue
-                
-            for j in range(i + 1, n):
-                id2 = chat_ids[j]
-                v2 = chat_embeddings[id2]
-                norm2 = np.linalg.norm(v2)
-                
-                if norm2 == 0:
-                    continue
-                    
-                # Calculate cosine similarity
-                sim = float(np.dot(v1, v2) / (norm1 * norm2))
-                
-                if sim >= similarity_threshold:
-                    similarities.append({
-                        'chat1_id': id1,
-                        'chat2_id': id2,
-                        'similarity': sim,
-                        'hash': self._generate_content_hash({
-                            'chat1_id': id1,
-                            'chat2_id': id2,
-                            'similarity': sim
-                        })
-                    })
+        for id1, id2, sim in edges:
+            similarities.append({
+                'chat1_id': id1,
+                'chat2_id': id2,
+                'similarity': sim
+            })
         
         logger.info(f"✅ Found {len(similarities)} similarity relationships")
         return similarities
     
-    def save_similarities(self, similarities: List[Dict]) -> None:
-        """Save similarity relationships."""
-        output_file = self.output_dir / "chat_similarities.jsonl"
+    def calculate_incremental_similarities(self, chat_embeddings: Dict[str, np.ndarray],
+                                           existing_similarities: List[Dict], changed_ids: Set[str],
+                                           similarity_threshold: float = 0.8) -> Tuple[List[Dict], int]:
+        """Merge existing edges with freshly computed rows for new or changed chats.
         
-        with jsonlines.open(output_file, 'w') as writer:
-            for sim in similarities:
-                writer.write(sim)
+        Edges touching a changed or removed chat are retracted, then only the
+        changed chats' rows are computed against the full embedding matrix.
+        Returns the merged similarities and the number of retracted edges.
+        """
+        stale_ids = set(changed_ids)
+        for sim in existing_similarities:
+            for chat_id in (sim.get('chat1_id'), sim.get('chat2_id')):
+                if chat_id not in chat_embeddings:
+                    stale_ids.add(chat_id)
         
-        logger.info(f"💾 Saved {len(similarities)} similarities to {output_file}")
+        similarities = [
+            sim for sim in existing_similarities
+            if sim.get('chat1_id') not in stale_ids and sim.get('chat2_id') not in stale_ids
+        ]
+        retracted = len(existing_similarities) - len(similarities)
+        
+        logger.info(f"🔗 Calculating similarities for {len(changed_ids)} new/changed chats "
+                    f"against {len(chat_embeddings)} chats (threshold: {similarity_threshold})...")
+        new_count = 0
+        for id1, id2, sim in self.engine.query_threshold_edges(chat_embeddings, changed_ids, similarity_threshold):
+            similarities.append({
+                'chat1_id': id1,
+                'chat2_id': id2,
+                'similarity': sim
+            })
+            new_count += 1
+        
+        logger.info(f"✅ Retracted {retracted} and added {new_count} similarity relationships")
+        return similarities, retracted
+    
+    def save_similarities(self, similarities: List[Dict]) -> str:
+        """Save similarity relationships as a sparse edge list and return its checksum."""
+        output_file = self.output_dir / "chat_similarities.npz"
+        
+        edges = ((sim['chat1_id'], sim['chat2_id'], sim['similarity']) for sim in similarities)
+        edge_count, checksum = save_sparse_edges(output_file, edges)
+        
+        logger.info(f"💾 Saved {edge_count} similarities to {output_file} (sha256 {checksum[:12]})")
+        return checksum
     
     def process(self, similarity_threshold: float = 0.8, force_reprocess: bool = False) -> Dict:
         """Main processing function."""
         logger.info("🚀 Starting chat similarity calculation from pre-computed embeddings...")
         
-        # Check if already processed
-        if not force_reprocess:
-            existing_hashes = self._get_processed_chat_hashes()
-            if existing_hashes:
-                logger.info(f"📋 Found {len(existing_hashes)} existing processed hashes")
-                # Could implement incremental processing here
-                logger.info("⏭️ Skipping (use --force to reprocess)")
-                return {'status': 'skipped', 'reason': 'already_processed'}
-        
         # Load pre-computed embeddings
         chat_embeddings, chat_hashes = self._load_chat_summary_embeddings()
         
@@ -174,21 +240,56 @@ class ChatSimilarityCalculator:
             logger.error("❌ No chat summary embeddings found")
             return {'status': 'failed', 'reason': 'no_embeddings'}
         
-        # Calculate similarities
-        similarities = self.calculate_similarities(chat_embeddings, similarity_threshold)
+        # Detect new or changed chats by embedding hash
+        existing_hashes = set() if force_reprocess else self._get_processed_chat_hashes()
+        changed_ids = {chat_id for chat_id, item_hash in chat_hashes.items() if item_hash not in existing_hashes}
+        existing_similarities = self._load_existing_similarities() if existing_hashes else []
+        
+        # Incremental updates need a previous threshold-mode run with the same threshold;
+        # top-k neighbour lists of existing chats change with every new chat, so topk always rebuilds
+        previous_stats = self._load_metadata().get('stats', {})
+        incremental = (
+            bool(existing_hashes)
+            and self._has_existing_similarities()
+            and self.mode == 'threshold'
+            and previous_stats.get('mode', 'threshold') == 'threshold'
+            and previous_stats.get('similarity_threshold') == similarity_threshold
+        )
+        
+        if incremental:
+            logger.info(f"📋 Found {len(existing_hashes)} existing processed hashes, {len(changed_ids)} new/changed chats")
+            if not changed_ids and existing_hashes <= set(chat_hashes.values()):
+                logger.info("⏭️ No new or changed chats (use --force to reprocess)")
+                return {'status': 'skipped', 'reason': 'already_processed'}
+            similarities, retracted = self.calculate_incremental_similarities(
+                chat_embeddings, existing_similarities, changed_ids, similarity_threshold
+            )
+        else:
+            if existing_hashes:
+                logger.info("Previous run used different settings, recomputing all pairs")
+            similarities = self.calculate_similarities(chat_embeddings, similarity_threshold)
+            changed_ids = set(chat_embeddings.keys())
+            retracted = 0
         
         # Save results
-        self.save_similarities(similarities)
+        edges_checksum = self.save_similarities(similarities)
         
         # Save hashes for tracking
-        self._save_processed_chat_hashes(chat_hashes)
+        self._save_processed_chat_hashes(set(chat_hashes.values()))
         
         # Calculate statistics
         stats = {
             'status': 'success',
             'chats_processed': len(chat_embeddings),
             'similarities_found': len(similarities),
+            'edges_checksum': edges_checksum,
+            'incremental': incremental,
+            'chats_recomputed': len(changed_ids),
+            'similarities_retracted': retracted,
             'similarity_threshold': similarity_threshold,
+            'mode': self.mode,
+            'top_k': self.top_k if self.mode == 'topk' else None,
+            'min_similarity': self.min_similarity if self.mode == 'topk' else None,
             'avg_similarity': np.mean([s['similarity'] for s in similarities]) if similarities else 0,
             'high_similarities': len([s for s in similarities if s['similarity'] > 0.9]),
             'medium_similarities': len([s for s in similarities if 0.7 <= s['similarity'] <= 0.9]),
@@ -213,11 +314,25 @@ class ChatSimilarityCalculator:
               help='Input file with chat summary embeddings from positioning step')
 @click.option('--similarity-threshold', default=0.8, show_default=True,
               help='Similarity threshold [0,1]')
-@click.option('--force', is_flag=True, help='Force reprocess even if already done')
-def main(embeddings_file: str, similarity_threshold: float, force: bool):
+@click.option('--block-size', default=1024, show_default=True,
+              help='Rows/columns per similarity block (tune to CPU cache)')
+@click.option('--num-threads', default=None, type=int,
+              help='BLAS threads for the similarity computation (default: library setting)')
+@click.option('--mode', type=click.Choice(['threshold', 'topk']), default='threshold', show_default=True,
+              help='threshold: all pairs above --similarity-threshold; topk: k nearest neighbours per chat')
+@click.option('--top-k', default=10, show_default=True, help='Neighbours per chat in topk mode')
+@click.option('--min-similarity', default=0.5, show_default=True,
+              help='Minimum similarity for a neighbour edge in topk mode')
+@click.option('--ann-method', type=click.Choice(['auto', 'hnsw', 'exact']), default='auto', show_default=True,
+              help='Neighbour search in topk mode (auto uses HNSW when hnswlib is installed)')
+@click.option('--force', is_flag=True, help='Recompute all pairs instead of only new/changed chats')
+def main(embeddings_file: str, similarity_threshold: float, block_size: int, num_threads: Optional[int],
+         mode: str, top_k: int, min_similarity: float, ann_method: str, force: bool):
     """Calculate chat similarities from pre-computed chat summary embeddings."""
     
-    calculator = ChatSimilarityCalculator(embeddings_file)
+    calculator = ChatSimilarityCalculator(embeddings_file, block_size=block_size, num_threads=num_threads,
+                                          mode=mode, top_k=top_k, min_similarity=min_similarity,
+                                          ann_method=ann_method)
     stats = calculator.process(similarity_threshold, force)
     
     if stats['status'] == 'success':
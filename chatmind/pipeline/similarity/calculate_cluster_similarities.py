@@ -5,6 +5,7 @@ Cluster Similarity Calculator
 Calculates cluster-level similarities using pre-computed cluster summary embeddings.
 Uses embeddings from positioning step to avoid duplicate computation.
 Uses modular directory structure: data/processed/similarity/
+Edges are stored as a CSR .npz edge list with a single artifact checksum.
 """
 
 import json
@@ -18,6 +19,17 @@ import click
 from tqdm import tqdm
 import logging
 from datetime import datetime
+import sys
+
+# Import shared similarity engine and edge storage
+try:
+    from .similarity_engine import SimilarityEngine
+    from .sparse_edges import save_sparse_edges
+except ImportError:
+    # Fallback for direct execution
+    sys.path.append(str(Path(__file__).parent))
+    from similarity_engine import SimilarityEngine
+    from sparse_edges import save_sparse_edges
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -26,8 +38,10 @@ logger = logging.getLogger(__name__)
 class ClusterSimilarityCalculator:
     """Calculate cluster similarities from pre-computed cluster summary embeddings."""
     
-    def __init__(self, embeddings_file: str = "data/processed/positioning/cluster_summary_embeddings.jsonl"):
+    def __init__(self, embeddings_file: str = "data/processed/positioning/cluster_summary_embeddings.jsonl",
+                 block_size: int = 1024, num_threads: Optional[int] = None):
         self.embeddings_file = Path(embeddings_file)
+        self.engine = SimilarityEngine(block_size=block_size, num_threads=num_threads)
         
         # Use modular directory structure
         self.output_dir = Path("data/processed/similarity")
@@ -105,54 +119,28 @@ class ClusterSimilarityCalculator:
         """Calculate similarities between all cluster pairs."""
         logger.info(f"🔗 Calculating cluster similarities (threshold: {similarity_threshold})...")
         
-        cluster_ids = list(cluster_embeddings.keys())
-        n = len(cluster_ids)
         similarities = []
         
-        # Calculate similarities for all pairs
-        for i in tqdm(range(n), desc="Calculating similarities"):
-            id1 = cluster_ids[i]
-            v1 = cluster_embeddings[id1]
-            norm1 = np.linalg.norm(v1)
-            
-            if norm1 == 0:
-                continue
-                
-            for j in range(i + 1, n):
-                id2 = cluster_ids[j]
-                v2 = cluster_embeddings[id2]
-                norm2 = np.linalg.norm(v2)
-                
-                if norm2 == 0:
-                    continue
-                    
-                # Calculate cosine similarity
-                sim = float(np.dot(v1, v2) / (norm1 * norm2))
-                
-                if sim >= similarity_threshold:
-                    similarities.append({
-                        'cluster1_id': id1,
-                        'cluster2_id': id2,
-                        'similarity': sim,
-                        'hash': self._generate_content_hash({
-                            'cluster1_id': id1,
-                            'cluster2_id': id2,
-                            'similarity': sim
-                        })
-                    })
+        # Blocked, vectorized cosine similarity over normalized embeddings
+        for id1, id2, sim in self.engine.threshold_edges(cluster_embeddings, similarity_threshold):
+            similarities.append({
+                'cluster1_id': id1,
+                'cluster2_id': id2,
+                'similarity': sim
+            })
         
         logger.info(f"✅ Found {len(similarities)} cluster similarity relationships")
         return similarities
     
-    def save_similarities(self, similarities: List[Dict]) -> None:
-        """Save similarity relationships."""
-        output_file = self.output_dir / "cluster_similarities.jsonl"
+    def save_similarities(self, similarities: List[Dict]) -> str:
+        """Save similarity relationships as a sparse edge list and return its checksum."""
+        output_file = self.output_dir / "cluster_similarities.npz"
         
-        with jsonlines.open(output_file, 'w') as writer:
-            for sim in similarities:
-                writer.write(sim)
+        edges = ((sim['cluster1_id'], sim['cluster2_id'], sim['similarity']) for sim in similarities)
+        edge_count, checksum = save_sparse_edges(output_file, edges)
         
-        logger.info(f"💾 Saved {len(similarities)} cluster similarities to {output_file}")
+        logger.info(f"💾 Saved {edge_count} cluster similarities to {output_file} (sha256 {checksum[:12]})")
+        return checksum
     
     def process(self, similarity_threshold: float = 0.8, force_reprocess: bool = False) -> Dict:
         """Main processing function."""
@@ -178,7 +166,7 @@ class ClusterSimilarityCalculator:
         similarities = self.calculate_similarities(cluster_embeddings, similarity_threshold)
         
         # Save results
-        self.save_similarities(similarities)
+        edges_checksum = self.save_similarities(similarities)
         
         # Save hashes for tracking
         self._save_processed_cluster_hashes(cluster_hashes)
@@ -188,6 +176,7 @@ class ClusterSimilarityCalculator:
             'status': 'success',
             'clusters_processed': len(cluster_embeddings),
             'similarities_found': len(similarities),
+            'edges_checksum': edges_checksum,
             'similarity_threshold': similarity_threshold,
             'avg_similarity': np.mean([s['similarity'] for s in similarities]) if similarities else 0,
             'high_similarities': len([s for s in similarities if s['similarity'] > 0.9]),
@@ -213,11 +202,15 @@ class ClusterSimilarityCalculator:
               help='Input file with cluster summary embeddings from positioning step')
 @click.option('--similarity-threshold', default=0.8, show_default=True,
               help='Similarity threshold [0,1]')
+@click.option('--block-size', default=1024, show_default=True,
+              help='Rows/columns per similarity block (tune to CPU cache)')
+@click.option('--num-threads', default=None, type=int,
+              help='BLAS threads for the similarity computation (default: library setting)')
 @click.option('--force', is_flag=True, help='Force reprocess even if already done')
-def main(embeddings_file: str, similarity_threshold: float, force: bool):
+def main(embeddings_file: str, similarity_threshold: float, block_size: int, num_threads: Optional[int], force: bool):
     """Calculate cluster similarities from pre-computed cluster summary embeddings."""
     
-    calculator = ClusterSimilarityCalculator(embeddings_file)
+    calculator = ClusterSimilarityCalculator(embeddings_file, block_size=block_size, num_threads=num_threads)
     stats = calculator.process(similarity_threshold, force)
     
     if stats['status'] == 'success':
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Similarity Engine
+
+Shared cosine similarity computation for the chat and cluster similarity steps.
+Vectors are normalized once and compared in cache-sized tiles with NumPy BLAS,
+so the all-pairs pass does no per-pair Python work. A top-k neighbour mode
+builds an HNSW index (hnswlib) when available for near-linear graph building.
+"""
+
+import contextlib
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+import logging
+
+import numpy as np
+
+try:
+    from threadpoolctl import threadpool_limits
+    THREADPOOLCTL_AVAILABLE = True
+except ImportError:
+    THREADPOOLCTL_AVAILABLE = False
+
+try:
+    import hnswlib
+    HNSWLIB_AVAILABLE = True
+except ImportError:
+    HNSWLIB_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+
+class SimilarityEngine:
+    """Blocked, thresholded cosine similarity over a set of embeddings."""
+
+    def __init__(self, block_size: int = 1024, num_threads: Optional[int] = None,
+                 dtype: type = np.float32):
+        self.block_size = max(1, int(block_size))
+        self.num_threads = num_threads
+        self.dtype = dtype
+
+    def _thread_limit(self):
+        """Limit BLAS threads for the duration of a computation if requested."""
+        if self.num_threads and THREADPOOLCTL_AVAILABLE:
+            return threadpool_limits(limits=self.num_threads, user_api='blas')
+        if self.num_threads:
+            logger.warning("threadpoolctl not available, ignoring num_threads")
+        return contextlib.nullcontext()
+
+    def normalize(self, embeddings: Dict[str, np.ndarray]) -> Tuple[List[str], np.ndarray]:
+        """Stack embeddings into a unit-norm matrix, dropping zero vectors."""
+        ids = list(embeddings.keys())
+        if not ids:
+            return [], np.zeros((0, 0), dtype=self.dtype)
+
+        matrix = np.asarray([embeddings[item_id] for item_id in ids], dtype=self.dtype)
+        norms = np.linalg.norm(matrix, axis=1)
+        valid = norms > 0
+        if not valid.all():
+            logger.warning(f"Skipping {int((~valid).sum())} zero-norm embeddings")
+
+        matrix = matrix[valid] / norms[valid, None]
+        ids = [item_id for item_id, keep in zip(ids, valid) if keep]
+        return ids, matrix
+
+    def iter_threshold_blocks(self, matrix: np.ndarray,
+                              threshold: float) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """Yield (rows, cols, similarities) for all pairs i < j above the threshold.
+
+        The upper triangle of matrix @ matrix.T is computed one
+        block_size x block_size tile at a time.
+        """
+        n = matrix.shape[0]
+        step = self.block_size
+
+        with self._thread_limit():
+            for row_start in range(0, n, step):
+                row_block = matrix[row_start:row_start + step]
+                for col_start in range(row_start, n, step):
+                    sims = row_block @ matrix[col_start:col_start + step].T
+                    mask = sims >= threshold
+                    if col_start == row_start:
+                        # Diagonal tile: keep only pairs with i < j
+                        mask = np.triu(mask, k=1)
+                    rows, cols = np.nonzero(mask)
+                    if rows.size:
+                        yield rows + row_start, cols + col_start, sims[rows, cols]
+
+    def iter_query_threshold_blocks(self, matrix: np.ndarray, query_idx: np.ndarray,
+                                    threshold: float) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """Yield (rows, cols, similarities) for query rows against every row of the matrix.
+
+        Self pairs are skipped and a pair of two query rows is yielded once
+        (with row < col), so the output can be merged with edges between
+        non-query rows without duplicates.
+        """
+        n = matrix.shape[0]
+        step = self.block_size
+        is_query = np.zeros(n, dtype=bool)
+        is_query[query_idx] = True
+
+        with self._thread_limit():
+            for q_start in range(0, len(query_idx), step):
+                rows_idx = query_idx[q_start:q_start + step]
+                row_block = matrix[rows_idx]
+                for col_start in range(0, n, step):
+                    cols_idx = np.arange(col_start, min(col_start + step, n))
+                    sims = row_block @ matrix[cols_idx].T
+                    mask = sims >= threshold
+                    # Drop self pairs and the second copy of query-query pairs
+                    mask &= ~(is_query[cols_idx][None, :] & (cols_idx[None, :] <= rows_idx[:, None]))
+                    rows, cols = np.nonzero(mask)
+                    if rows.size:
+                        yield rows_idx[rows], cols_idx[cols], sims[rows, cols]
+
+    def query_threshold_edges(self, embeddings: Dict[str, np.ndarray], query_ids: Set[str],
+                              threshold: float) -> Iterator[Tuple[str, str, float]]:
+        """Yield (query_id, other_id, similarity) for pairs involving a query item above the threshold."""
+        ids, matrix = self.normalize(embeddings)
+        query_idx = np.array([i for i, item_id in enumerate(ids) if item_id in query_ids], dtype=np.int64)
+        if query_idx.size == 0:
+            return
+        for rows, cols, sims in self.iter_query_threshold_blocks(matrix, query_idx, threshold):
+            for i, j, sim in zip(rows.tolist(), cols.tolist(), sims.tolist()):
+                yield ids[i], ids[j], sim
+
+    def threshold_edges(self, embeddings: Dict[str, np.ndarray],
+                        threshold: float) -> Iterator[Tuple[str, str, float]]:
+        """Yield (id1, id2, similarity) for every pair at or above the threshold."""
+        ids, matrix = self.normalize(embeddings)
+        for rows, cols, sims in self.iter_threshold_blocks(matrix, threshold):
+            for i, j, sim in zip(rows.tolist(), cols.tolist(), sims.tolist()):
+                yield ids[i], ids[j], sim
+
+    def _exact_topk(self, matrix: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Exact top-k neighbours (excluding self) computed one row block at a time."""
+        n = matrix.shape[0]
+        labels = np.zeros((n, k), dtype=np.int64)
+        scores = np.zeros((n, k), dtype=matrix.dtype)
+
+        with self._thread_limit():
+            for row_start in range(0, n, self.block_size):
+                row_end = min(row_start + self.block_size, n)
+                sims = matrix[row_start:row_end] @ matrix.T
+                sims[np.arange(row_end - row_start), np.arange(row_start, row_end)] = -np.inf
+                top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+                labels[row_start:row_end] = top
+                scores[row_start:row_end] = np.take_along_axis(sims, top, axis=1)
+        return labels, scores
+
+    def _hnsw_topk(self, matrix: np.ndarray, k: int, ef: int, m: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Approximate top-k neighbours (excluding self) from an in-process HNSW index."""
+        n, dim = matrix.shape
+        index = hnswlib.Index(space='ip', dim=dim)
+        index.init_index(max_elements=n, ef_construction=max(ef, k + 1), M=m)
+        index.set_num_threads(self.num_threads or -1)
+        index.add_items(matrix, np.arange(n))
+        index.set_ef(max(ef, k + 1))
+
+        # Query k + 1 so the point itself can be dropped
+        labels, distances = index.knn_query(matrix, k=min(k + 1, n))
+        scores = 1.0 - distances  # 'ip' distance is 1 - dot product
+        self_match = labels == np.arange(n)[:, None]
+        # Drop the self match, or the furthest neighbour if self was not returned
+        drop = np.where(self_match.any(axis=1), self_match.argmax(axis=1), labels.shape[1] - 1)
+        keep = np.ones_like(labels, dtype=bool)
+        keep[np.arange(n), drop] = False
+        return labels[keep].reshape(n, -1)[:, :k], scores[keep].reshape(n, -1)[:, :k]
+
+    def topk_edges(self, embeddings: Dict[str, np.ndarray], k: int = 10,
+                   min_similarity: float = 0.5, method: str = 'auto',
+                   ef: int = 100, m: int = 16) -> Iterator[Tuple[str, str, float]]:
+        """Yield undirected (id1, id2, similarity) edges of the top-k neighbour graph.
+
+        Candidate edges are each item's k nearest neighbours at or above
+        min_similarity. After symmetrizing, edges are kept strongest first
+        while both endpoints have fewer than k, so no item has more than k
+        edges and the graph has at most n * k / 2. method is 'hnsw', 'exact'
+        or 'auto' (HNSW when hnswlib is installed, exact blocked search
+        otherwise).
+        """
+        ids, matrix = self.normalize(embeddings)
+        n = len(ids)
+        k = min(k, n - 1)
+        if k <= 0:
+            return
+
+        if method == 'hnsw' and not HNSWLIB_AVAILABLE:
+            logger.warning("hnswlib not available, falling back to exact top-k search")
+        if method != 'exact' and HNSWLIB_AVAILABLE:
+            logger.info(f"Building HNSW index over {n} embeddings (k={k}, ef={ef}, M={m})")
+            labels, scores = self._hnsw_topk(matrix, k, ef, m)
+        else:
+            logger.info(f"Running exact blocked top-k search over {n} embeddings (k={k})")
+            labels, scores = self._exact_topk(matrix, k)
+
+        # Symmetrize: keep each undirected pair once with its best score
+        edges = {}
+        rows, cols = np.nonzero(scores >= min_similarity)
+        for i, j, sim in zip(rows.tolist(), labels[rows, cols].tolist(), scores[rows, cols].tolist()):
+            if i == j:
+                continue
+            pair = (i, j) if i < j else (j, i)
+            if sim > edges.get(pair, -np.inf):
+                edges[pair] = sim
+
+        # Reverse edges would push a popular item past k; cap every degree at k
+        degree = np.zeros(n, dtype=np.int64)
+        kept = []
+        for (i, j), sim in sorted(edges.items(), key=lambda edge: (-edge[1], edge[0])):
+            if degree[i] < k and degree[j] < k:
+                degree[i] += 1
+                degree[j] += 1
+                kept.append(((i, j), sim))
+
+        for (i, j), sim in sorted(kept):
+            yield ids[i], ids[j], float(sim)
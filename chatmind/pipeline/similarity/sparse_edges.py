@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Sparse Edge Storage
+
+Compact binary storage for similarity edges. Edges are kept as a CSR matrix
+(indptr/indices/data) over an id table in a single .npz file, with one
+SHA256 checksum for the whole artifact written next to it.
+"""
+
+import hashlib
+import os
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Tuple
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+
+
+def checksum_path(edges_file: Path) -> Path:
+    """Path of the checksum file stored next to an edge file."""
+    return edges_file.with_name(edges_file.name + ".sha256")
+
+
+def file_checksum(path: Path) -> str:
+    """SHA256 of a file's bytes."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_checksum(edges_file: Path) -> Optional[str]:
+    """Read the stored checksum for an edge file, if present."""
+    path = checksum_path(edges_file)
+    if path.exists():
+        return path.read_text().strip()
+    return None
+
+
+def save_sparse_edges(edges_file: Path, edges: Iterable[Tuple[str, str, float]]) -> Tuple[int, str]:
+    """Write (id1, id2, similarity) edges as CSR .npz and return (edge count, checksum)."""
+    edges_file = Path(edges_file)
+    id1s, id2s, sims = [], [], []
+    for id1, id2, sim in edges:
+        id1s.append(id1)
+        id2s.append(id2)
+        sims.append(sim)
+
+    ids = sorted(set(id1s) | set(id2s))
+    index = {item_id: i for i, item_id in enumerate(ids)}
+    rows = np.fromiter((index[i] for i in id1s), dtype=np.int64, count=len(id1s))
+    cols = np.fromiter((index[i] for i in id2s), dtype=np.int64, count=len(id2s))
+    data = np.asarray(sims, dtype=np.float32)
+
+    order = np.lexsort((cols, rows))
+    rows, cols, data = rows[order], cols[order], data[order]
+    indptr = np.zeros(len(ids) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=len(ids)), out=indptr[1:])
+
+    # Write to a temp file first so readers never see a partial artifact
+    tmp_file = edges_file.with_name(edges_file.name + ".tmp")
+    with open(tmp_file, 'wb') as f:
+        np.savez_compressed(
+            f,
+            ids=np.asarray(ids, dtype=str),
+            indptr=indptr,
+            indices=cols.astype(np.int32),
+            data=data,
+            format_version=np.int32(FORMAT_VERSION)
+        )
+    os.replace(tmp_file, edges_file)
+
+    checksum = file_checksum(edges_file)
+    checksum_path(edges_file).write_text(checksum + "\n")
+    return len(data), checksum
+
+
+def load_sparse_edges(edges_file: Path, verify: bool = True) -> Tuple[List[str], np.ndarray, np.ndarray, np.ndarray]:
+    """Load a CSR edge file as (ids, rows, cols, similarities)."""
+    edges_file = Path(edges_file)
+    if verify:
+        expected = read_checksum(edges_file)
+        if expected and expected != file_checksum(edges_file):
+            raise ValueError(f"Checksum mismatch for {edges_file}")
+
+    with np.load(edges_file, allow_pickle=False) as npz:
+        ids = npz['ids'].tolist()
+        indptr = npz['indptr']
+        cols = npz['indices'].astype(np.int64)
+        data = npz['data']
+    rows = np.repeat(np.arange(len(ids)), np.diff(indptr))
+    return ids, rows, cols, data
+
+
+def iter_sparse_edges(edges_file: Path, verify: bool = True) -> Iterator[Tuple[str, str, float]]:
+    """Yield (id1, id2, similarity) edges from a CSR edge file."""
+    ids, rows, cols, data = load_sparse_edges(edges_file, verify)
+    for i, j, sim in zip(rows.tolist(), cols.tolist(), data.tolist()):
+        yield ids[i], ids[j], sim
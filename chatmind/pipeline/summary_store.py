@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Summary Store
+
+Chat and cluster summaries keyed by chat_id / cluster_id in a SQLite file
+(<step dir>/chat_summaries.sqlite, <step dir>/cluster_summaries.sqlite).
+The summarizers used to rewrite one JSON dict with every summary on each
+run, and every reader loaded all of it. With the store:
+
+- a run writes only the summaries it created or changed (unchanged ones are
+  recognized by their hash and skipped),
+- readers look up single summaries or subsets by key, or iterate over all
+  of them without holding the file's JSON in memory at once.
+
+SummaryStore is a read-only Mapping, so code that used the loaded dict
+keeps working. A <name>.json file found next to the store (from an older
+run, or written by scripts/generate_sample_data.py) is imported on open and
+renamed to <name>.json.migrated.
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections.abc import Mapping
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def summary_hash(summary: Dict) -> str:
+    return hashlib.sha256(json.dumps(summary, sort_keys=True).encode()).hexdigest()
+
+
+class SummaryStore(Mapping):
+    """SQLite-backed summaries keyed by chat_id or cluster_id."""
+
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+
+        # One connection shared by worker threads, serialized by a lock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS summaries ("
+            " key TEXT PRIMARY KEY,"
+            " summary TEXT NOT NULL,"
+            " summary_hash TEXT NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def __getitem__(self, key: str) -> Dict:
+        with self._lock:
+            row = self._conn.execute("SELECT summary FROM summaries WHERE key = ?", (str(key),)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return json.loads(row[0])
+
+    def __contains__(self, key: object) -> bool:
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM summaries WHERE key = ?", (str(key),)).fetchone() is not None
+
+    def __iter__(self) -> Iterator[str]:
+        with self._lock:
+            keys = [row[0] for row in self._conn.execute("SELECT key FROM summaries ORDER BY key")]
+        return iter(keys)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM summaries").fetchone()[0]
+
+    def items(self, batch_size: int = 500) -> Iterator[Tuple[str, Dict]]:
+        """All (key, summary) pairs in key order, fetched in batches."""
+        last_key = ''
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT key, summary FROM summaries WHERE key > ? ORDER BY key LIMIT ?",
+                    (last_key, batch_size)).fetchall()
+            if not rows:
+                return
+            for key, summary in rows:
+                yield key, json.loads(summary)
+            last_key = rows[-1][0]
+
+    def get_many(self, keys: Iterable[str], batch_size: int = 500) -> Dict[str, Dict]:
+        """Summaries of the given keys; keys without a summary are left out."""
+        keys = list(dict.fromkeys(str(key) for key in keys))
+        found = {}
+        for start in range(0, len(keys), batch_size):
+            batch = keys[start:start + batch_size]
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT key, summary FROM summaries WHERE key IN ({','.join('?' * len(batch))})",
+                    batch).fetchall()
+            found.update((key, json.loads(summary)) for key, summary in rows)
+        return found
+
+    def put_many(self, summaries: Dict[str, Dict]) -> int:
+        """Insert or replace summaries in one transaction; returns how many were new or changed."""
+        now = time.time()
+        rows = [(str(key), json.dumps(summary, ensure_ascii=False), summary_hash(summary), now)
+                for key, summary in summaries.items()]
+        with self._lock:
+            before = self._conn.total_changes
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT INTO summaries (key, summary, summary_hash, updated_at) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET summary = excluded.summary, "
+                    "summary_hash = excluded.summary_hash, updated_at = excluded.updated_at "
+                    "WHERE summaries.summary_hash != excluded.summary_hash",
+                    rows
+                )
+            return self._conn.total_changes - before
+
+    def import_json(self, json_file: Path) -> int:
+        """Import a legacy JSON dict of summaries and rename the file to *.migrated."""
+        json_file = Path(json_file)
+        with open(json_file, 'r') as f:
+            summaries = json.load(f)
+        written = self.put_many(summaries)
+        json_file.replace(json_file.with_name(json_file.name + '.migrated'))
+        logger.info(f"Imported {len(summaries)} summaries from {json_file} into {self.db_path}")
+        return written
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def open_summary_store(step_dir: Path, name: str, create: bool = True) -> Optional[SummaryStore]:
+    """Open <step_dir>/<name>.sqlite, importing <step_dir>/<name>.json if present.
+
+    With create=False (readers), returns None when neither file exists.
+    """
+    step_dir = Path(step_dir)
+    db_path = step_dir / f"{name}.sqlite"
+    legacy_file = step_dir / f"{name}.json"
+    if not create and not db_path.exists() and not legacy_file.exists():
+        return None
+
+    store = SummaryStore(db_path)
+    if legacy_file.exists():
+        try:
+            store.import_json(legacy_file)
+        except (OSError, ValueError, sqlite3.Error) as e:
+            logger.warning(f"Failed to import {legacy_file}: {e}")
+    return store
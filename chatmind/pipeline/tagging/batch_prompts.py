@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Batched Tagging Helpers
+
+Packs several short messages from the same conversation into one tagging
+prompt that returns a JSON array of tag sets, so the instructions and
+conversation context are sent once per batch instead of once per message.
+Used by the local and cloud message taggers; callers fall back to
+per-message prompts when a batch response cannot be parsed.
+"""
+
+import json
+import re
+from typing import Callable, Dict, List, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def make_batches(items: List[Dict], batch_size: int, max_chars: int = 6000,
+                 max_item_chars: int = 1500,
+                 group_key: Callable[[Dict], str] = lambda item: item.get('chat_id', ''),
+                 text_of: Callable[[Dict], str] = lambda item: item.get('content', '')) -> List[List[Dict]]:
+    """Split items into order-preserving batches.
+
+    A batch only holds consecutive items with the same group key (conversation),
+    at most batch_size items and max_chars of text. Items longer than
+    max_item_chars always get a batch of their own.
+    """
+    batches: List[List[Dict]] = []
+    current: List[Dict] = []
+    current_chars = 0
+    current_key = None
+
+    for item in items:
+        key = group_key(item)
+        size = len(text_of(item) or '')
+        if (current and (key != current_key or len(current) >= batch_size
+                         or current_chars + size > max_chars or size > max_item_chars)):
+            batches.append(current)
+            current, current_chars = [], 0
+        current.append(item)
+        current_chars += size
+        current_key = key
+        if size > max_item_chars:
+            batches.append(current)
+            current, current_chars = [], 0
+
+    if current:
+        batches.append(current)
+    return batches
+
+
+def format_numbered_messages(texts: List[str]) -> str:
+    """Render messages as a numbered list for a batch prompt."""
+    return "\n\n".join(f"[{i}] {text}" for i, text in enumerate(texts, 1))
+
+
+def parse_batch_response(response: str, expected: int) -> Optional[List[Optional[Dict]]]:
+    """Parse a JSON array of tag sets, one per numbered message.
+
+    Elements may carry an "index" (1-based) field; otherwise array order is
+    used. Returns a list of length expected (missing entries are None), or
+    None when no usable array can be found.
+    """
+    if not response:
+        return None
+
+    text = response.strip()
+    # Strip markdown code fences
+    fence = re.search(r"```(?:json)?\s*(.*?)```", text, re.DOTALL)
+    if fence:
+        text = fence.group(1).strip()
+
+    start = text.find('[')
+    end = text.rfind(']')
+    if start == -1 or end <= start:
+        return None
+
+    try:
+        data = json.loads(text[start:end + 1])
+    except json.JSONDecodeError as e:
+        logger.debug(f"Batch response is not a valid JSON array: {e}")
+        return None
+
+    if not isinstance(data, list):
+        return None
+
+    results: List[Optional[Dict]] = [None] * expected
+    for position, entry in enumerate(data):
+        if not isinstance(entry, dict):
+            continue
+        index = entry.get('index')
+        slot = index - 1 if isinstance(index, int) and 1 <= index <= expected else position
+        if 0 <= slot < expected and results[slot] is None:
+            results[slot] = entry
+
+    if all(result is None for result in results):
+        return None
+    return results
@@ -14,17 +14,28 @@ from pathlib import Path
 from typing import Dict, List, Tuple, Optional, Set
 from datetime import datetime
 import click
-from tqdm import tqdm
 import logging
 import pickle
 import hashlib
+import threading
 import time
+import re
+import unicodedata
+from collections import defaultdict, Counter
 import openai
 
 # Import pipeline configuration
 import sys
 sys.path.append(str(Path(__file__).parent.parent.parent))
 from config import get_openai_config
+from worker_pool import AdaptiveRateLimiter, map_ordered
+from llm_cache import open_prompt_cache, cached_chat_completion
+from run_journal import RunJournal, atomic_write
+from prompt_budget import estimate_tokens
+from work_scheduler import WorkScheduler, PRIORITIES, latest_timestamp
+from tagging.batch_prompts import make_batches, format_numbered_messages, parse_batch_response
+from triage import ChatTriage
+from batch_jobs import BatchJobStore, BATCH_MODES, SUBMITTERS, CHAT_COMPLETIONS, batch_request, completion_text
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -39,13 +50,31 @@ class EnhancedMessageTagger:
                  max_retries: int = 3,
                  delay_between_calls: float = 1.0,
                  enable_validation: bool = True,
-                 enable_conversation_context: bool = True):
+                 enable_conversation_context: bool = True,
+                 max_workers: int = 1,
+                 batch_size: int = 1,
+                 triage: Optional[ChatTriage] = None,
+                 scheduler: Optional[WorkScheduler] = None):
         self.model = model
         self.temperature = temperature
         self.max_retries = max_retries
         self.delay_between_calls = delay_between_calls
         self.enable_validation = enable_validation
         self.enable_conversation_context = enable_conversation_context
+        self.max_workers = max(1, max_workers)
+        # Messages per tagging prompt; 1 keeps one prompt per message
+        self.batch_size = max(1, batch_size)
+        self.batch_stats = {'batch_calls': 0, 'batched_messages': 0, 'batch_fallbacks': 0}
+        # Batches are tagged from worker threads
+        self._batch_stats_lock = threading.Lock()
+        # Optional chat triage: trivial conversations skip the context analysis
+        # and their messages are tagged with one prompt per conversation
+        self.triage = triage
+        # Conversation order and the per-run time/token budget
+        self.scheduler = scheduler or WorkScheduler()
+        
+        # Adaptive pacing replaces fixed sleeps; delay_between_calls sets the starting rate
+        self.rate_limiter = AdaptiveRateLimiter.from_delay(delay_between_calls)
         
         # Initialize OpenAI client
         import os
@@ -54,6 +83,8 @@ class EnhancedMessageTagger:
             logger.error("OPENAI_API_KEY environment variable not set")
             raise ValueError("OPENAI_API_KEY environment variable not set")
         self.client = openai.OpenAI(api_key=api_key)
+        # Response cache, opened next to the processed outputs in process_messages_to_tags
+        self.cache = None
     
     def _generate_message_hash(self, message: Dict) -> str:
         """Generate a hash for a message to track if it's been processed."""
@@ -81,7 +112,7 @@ class EnhancedMessageTagger:
     def _save_processed_message_hashes(self, hashes: set, hash_file: Path) -> None:
         """Save hashes of processed messages."""
         try:
-            with open(hash_file, 'wb') as f:
+            with atomic_write(hash_file) as tmp_file, open(tmp_file, 'wb') as f:
                 pickle.dump(hashes, f)
             logger.info(f"Saved {len(hashes)} processed message hashes")
         except Exception as e:
@@ -103,6 +134,42 @@ class EnhancedMessageTagger:
         except Exception as e:
             logger.error(f"Failed to save metadata: {e}")
     
+    def _paced_create(self, **request):
+        """Call the OpenAI API, paced by the adaptive rate limiter."""
+        self.rate_limiter.acquire()
+        try:
+            response = self.client.chat.completions.create(**request)
+        except openai.RateLimitError:
+            self.rate_limiter.on_throttle()
+            raise
+        self.rate_limiter.on_success()
+        return response
+    
+    def _create_completion(self, messages: List[Dict], accept) -> str:
+        """Get a chat completion's text, from the response cache when possible.
+        
+        Only responses that accept(text) approves are cached, so a malformed
+        reply is asked for again instead of being replayed from the cache.
+        """
+        return cached_chat_completion(
+            self._paced_create, self.cache, self.model, messages, self.temperature,
+            accept=accept
+        )
+    
+    def _parse_json_object(self, text: str) -> Optional[Dict]:
+        """The JSON object in a response, or None if there is no valid one."""
+        json_text = text.strip()
+        if not json_text.startswith('{'):
+            start = json_text.find('{')
+            end = json_text.rfind('}')
+            if start != -1 and end != -1:
+                json_text = json_text[start:end+1]
+        try:
+            result = json.loads(json_text)
+        except json.JSONDecodeError:
+            return None
+        return result if isinstance(result, dict) else None
+    
     def analyze_conversation(self, messages: List[Dict]) -> Dict:
         """
         Analyze conversation at the conversation level to understand context.
@@ -138,26 +205,13 @@ class EnhancedMessageTagger:
             }}
             """
             
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": "You are an expert conversation classifier."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=self.temperature,
-            )
-            
-            choice = response.choices[0]
-            raw = choice.message.content or ''
-            json_text = raw.strip()
-            
-            if not json_text.startswith('{'):
-                start = json_text.find('{')
-                end = json_text.rfind('}')
-                if start != -1 and end != -1:
-                    json_text = json_text[start:end+1]
-            
-            result = json.loads(json_text)
+            raw = self._create_completion([
+                {"role": "system", "content": "You are an expert conversation classifier."},
+                {"role": "user", "content": prompt}
+            ], accept=lambda text: self._parse_json_object(text) is not None)
+            result = self._parse_json_object(raw)
+            if result is None:
+                raise ValueError(f"No JSON object in response: {raw[:200]}")
             logger.info(f"Conversation analysis: {result.get('primary_domain', 'unknown')} domain")
             return result
             
@@ -165,6 +219,52 @@ class EnhancedMessageTagger:
             logger.warning(f"Failed to analyze conversation: {e}")
             return {}
     
+    def _sanitize_text(self, text: str) -> str:
+        """Sanitize text to remove problematic Unicode characters."""
+        if not text:
+            return text
+        
+        # Remove or replace problematic Unicode characters
+        # Replace common problematic characters
+        replacements = {
+            '\u2028': '\n',  # Line separator
+            '\u2029': '\n',  # Paragraph separator
+            '\u200b': '',    # Zero-width space
+            '\u200c': '',    # Zero-width non-joiner
+            '\u200d': '',    # Zero-width joiner
+            '\u2060': '',    # Word joiner
+            '\u2061': '',    # Function application
+            '\u2062': '',    # Invisible times
+            '\u2063': '',    # Invisible separator
+            '\u2064': '',    # Invisible plus
+            '\u2066': '',    # Left-to-right isolate
+            '\u2067': '',    # Right-to-left isolate
+            '\u2068': '',    # First strong isolate
+            '\u2069': '',    # Pop directional isolate
+            '\u206a': '',    # Inhibit symmetric swapping
+            '\u206b': '',    # Activate symmetric swapping
+            '\u206c': '',    # Inhibit arabic form shaping
+            '\u206d': '',    # Activate arabic form shaping
+            '\u206e': '',    # National digit shapes
+            '\u206f': '',    # Nominal digit shapes
+        }
+        
+        # Apply replacements
+        for old, new in replacements.items():
+            text = text.replace(old, new)
+        
+        # Remove other control characters except newlines and tabs
+        text = re.sub(r'[\x00-\x08\x0b\x0c\x0e-\x1f\x7f-\x9f]', '', text)
+        
+        # Normalize Unicode
+        text = unicodedata.normalize('NFKC', text)
+        
+        # Remove excessive whitespace
+        text = re.sub(r'\s+', ' ', text)
+        text = text.strip()
+        
+        return text
+    
     def _get_tags_from_gpt(self, text: str, conversation_context: str = "") -> Dict:
         """Get tags from GPT for a single message."""
         sanitized_text = self._sanitize_text(text)
@@ -195,42 +295,30 @@ class EnhancedMessageTagger:
         
         for attempt in range(self.max_retries):
             try:
-                response = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=[
-                        {"role": "system", "content": "You are an expert content tagger."},
-                        {"role": "user", "content": prompt}
-                    ],
-                    temperature=self.temperature,
-                )
-                
-                choice = response.choices[0]
-                raw = choice.message.content or ''
-                json_text = raw.strip()
-                
-                if not json_text.startswith('{'):
-                    start = json_text.find('{')
-                    end = json_text.rfind('}')
-                    if start != -1 and end != -1:
-                        json_text = json_text[start:end+1]
-                
-                result = json.loads(json_text)
+                raw = self._create_completion([
+                    {"role": "system", "content": "You are an expert content tagger."},
+                    {"role": "user", "content": prompt}
+                ], accept=self._is_valid_tagging_response)
+                result = self._parse_json_object(raw)
                 
                 # Validate result
-                if self._validate_enhanced_result(result):
+                if result is not None and self._validate_enhanced_result(result):
                     return result
                 else:
                     logger.warning(f"Invalid result on attempt {attempt + 1}, retrying...")
                     
             except Exception as e:
                 logger.warning(f"API call failed on attempt {attempt + 1}: {e}")
-                if attempt < self.max_retries - 1:
-                    time.sleep(self.delay_between_calls)
         
         # Return fallback if all attempts failed
         logger.error(f"All attempts failed for message, using fallback")
         return self._get_enhanced_fallback_tags()
     
+    def _is_valid_tagging_response(self, text: str) -> bool:
+        """Whether a response holds a valid tagging result (and may be cached)."""
+        result = self._parse_json_object(text)
+        return result is not None and self._validate_enhanced_result(result)
+    
     def _validate_enhanced_result(self, result: Dict) -> bool:
         """Validate the enhanced tagging result."""
         required_fields = ['tags', 'domain', 'complexity', 'confidence']
@@ -270,6 +358,24 @@ class EnhancedMessageTagger:
             'confidence': 0.0
         }
     
+    def _context_string(self, conversation_context: Optional[Dict]) -> str:
+        """Render conversation context for a tagging prompt."""
+        if not conversation_context:
+            return ""
+        return f"Domain: {conversation_context.get('primary_domain', 'unknown')}, Topics: {', '.join(conversation_context.get('key_topics', []))}"
+    
+    def _build_tagged_message(self, message: Dict, tagging_result: Dict) -> Dict:
+        """Merge a tagging result into a message record."""
+        return {
+            **message,
+            'tags': tagging_result.get('tags', []),
+            'domain': tagging_result.get('domain', 'unknown'),
+            'complexity': tagging_result.get('complexity', 'unknown'),
+            'confidence': tagging_result.get('confidence', 0.0),
+            'tagging_model': self.model,
+            'tagging_timestamp': int(time.time())
+        }
+    
     def tag_message(self, message: Dict, conversation_context: Dict = None) -> Dict:
         """Tag a single message."""
         content = message.get('content', '')
@@ -282,50 +388,77 @@ class EnhancedMessageTagger:
                 'confidence': 0.0
             }
         
-        # Get conversation context string
-        context_str = ""
-        if conversation_context:
-            context_str = f"Domain: {conversation_context.get('primary_domain', 'unknown')}, Topics: {', '.join(conversation_context.get('key_topics', []))}"
-        
         # Get tags from GPT
-        tagging_result = self._get_tags_from_gpt(content, context_str)
+        tagging_result = self._get_tags_from_gpt(content, self._context_string(conversation_context))
         
-        # Create tagged message
-        tagged_message = {
-            **message,
-            'tags': tagging_result.get('tags', []),
-            'domain': tagging_result.get('domain', 'unknown'),
-            'complexity': tagging_result.get('complexity', 'unknown'),
-            'confidence': tagging_result.get('confidence', 0.0),
-            'tagging_model': self.model,
-            'tagging_timestamp': int(time.time())
-        }
-        
-        return tagged_message
+        return self._build_tagged_message(message, tagging_result)
     
-    def process_messages_to_tags(self, chats_file: Path, output_file: Path, force_reprocess: bool = False) -> Dict:
-        """Process messages from chats file to tagged messages."""
-        logger.info("🚀 Starting cloud API message tagging...")
+    def _batch_prompt(self, texts: List[str], conversation_context: str = "") -> List[Dict]:
+        """Chat messages of a prompt that tags several numbered messages at once."""
+        context_line = f"Context: {self._sanitize_text(conversation_context)}\n" if conversation_context else ""
+        prompt = f"""
+        Analyze each numbered message and provide tags in JSON format.
         
-        # Setup output directory
-        output_dir = output_file.parent
-        output_dir.mkdir(parents=True, exist_ok=True)
+        {context_line}
+        Messages:
+        {format_numbered_messages(texts)}
         
-        # Load existing tagged messages
-        existing_messages = []
-        if output_file.exists() and not force_reprocess:
-            with jsonlines.open(output_file) as reader:
-                for message in reader:
-                    existing_messages.append(message)
-            logger.info(f"Loaded {len(existing_messages)} existing tagged messages")
+        Return a JSON array with exactly one object per message, in order:
+        [
+            {{"index": 1, "tags": ["#tag1", "#tag2", "#tag3"], "domain": "technical|personal|medical|business|creative", "complexity": "beginner|intermediate|advanced", "confidence": 0.85}}
+        ]
         
-        # Load processed hashes
-        hash_file = output_dir / "hashes.pkl"
-        processed_hashes = set()
-        if not force_reprocess:
-            processed_hashes = self._load_processed_message_hashes(hash_file)
+        Guidelines:
+        - Use descriptive tags starting with #
+        - Choose appropriate domain
+        - Assess complexity level
+        - Provide confidence score (0-1)
+        """
+        return [
+            {"role": "system", "content": "You are an expert content tagger."},
+            {"role": "user", "content": prompt}
+        ]
+    
+    def _get_batch_tags_from_gpt(self, texts: List[str], conversation_context: str = "") -> Optional[List[Optional[Dict]]]:
+        """Tag several messages with one prompt; returns one result (or None) per message."""
+        try:
+            raw = self._create_completion(self._batch_prompt(texts, conversation_context),
+                                          accept=lambda text: parse_batch_response(text, len(texts)) is not None)
+        except Exception as e:
+            logger.warning(f"Batch API call failed: {e}")
+            return None
+        
+        return parse_batch_response(raw, len(texts))
+    
+    def tag_message_batch(self, messages: List[Dict], conversation_context: Dict = None) -> List[Dict]:
+        """Tag messages from one conversation with a single prompt.
         
-        # Extract messages from chats
+        Messages whose entry is missing or invalid in the batch response are
+        re-tagged one at a time with tag_message.
+        """
+        if len(messages) == 1:
+            return [self.tag_message(messages[0], conversation_context)]
+        
+        texts = [self._sanitize_text(message.get('content', '')) for message in messages]
+        results = self._get_batch_tags_from_gpt(texts, self._context_string(conversation_context))
+        with self._batch_stats_lock:
+            self.batch_stats['batch_calls'] += 1
+        
+        tagged = []
+        for i, message in enumerate(messages):
+            result = results[i] if results else None
+            if result is not None and self._validate_enhanced_result(result):
+                tagged.append(self._build_tagged_message(message, result))
+                with self._batch_stats_lock:
+                    self.batch_stats['batched_messages'] += 1
+            else:
+                with self._batch_stats_lock:
+                    self.batch_stats['batch_fallbacks'] += 1
+                tagged.append(self.tag_message(message, conversation_context))
+        return tagged
+    
+    def _load_conversations(self, chats_file: Path) -> Dict[str, List[Dict]]:
+        """User and assistant messages with content, with their chat context, grouped by conversation."""
         messages = []
         with jsonlines.open(chats_file) as reader:
             for chat in reader:
@@ -345,61 +478,161 @@ class EnhancedMessageTagger:
         
         logger.info(f"Loaded {len(messages)} messages from chats")
         
-        # Group messages by conversation
         conversation_groups = defaultdict(list)
         for message in messages:
             chat_id = message.get('chat_id', 'unknown')
             conversation_groups[chat_id].append(message)
+        return conversation_groups
+    
+    def process_messages_to_tags(self, chats_file: Path, output_file: Path, force_reprocess: bool = False) -> Dict:
+        """Process messages from chats file to tagged messages."""
+        logger.info("🚀 Starting cloud API message tagging...")
         
-        # Process conversations
-        new_tagged_messages = []
-        for chat_id, messages in conversation_groups.items():
-            logger.info(f"Processing conversation {chat_id} with {len(messages)} messages")
-            
-            # Analyze conversation first
-            conversation_context = self.analyze_conversation(messages)
-            
-            # Tag messages with conversation context
-            for message in tqdm(messages, desc=f"Tagging messages in {chat_id}"):
-                message_hash = self._generate_message_hash(message)
-                
-                # Skip if already processed
-                if message_hash in processed_hashes and not force_reprocess:
-                    continue
-                
-                try:
-                    tagged_message = self.tag_message(message, conversation_context)
-                    new_tagged_messages.append(tagged_message)
-                    processed_hashes.add(message_hash)
-                    
-                    # Add delay between API calls
-                    time.sleep(self.delay_between_calls)
-                    
-                except Exception as e:
-                    logger.error(f"Failed to tag message {message.get('message_id', 'unknown')}: {e}")
-                    # Add fallback tags
-                    fallback_message = {
-                        **message,
-                        'tags': ['#error'],
-                        'domain': 'unknown',
-                        'complexity': 'unknown',
-                        'confidence': 0.0,
-                        'tagging_model': 'fallback',
-                        'tagging_timestamp': int(time.time())
-                    }
-                    new_tagged_messages.append(fallback_message)
-                    processed_hashes.add(message_hash)
+        # Setup output directory
+        output_dir = output_file.parent
+        output_dir.mkdir(parents=True, exist_ok=True)
+        if self.cache is None:
+            self.cache = open_prompt_cache(output_dir.parent)
+        
+        # Load existing tagged messages
+        existing_messages = []
+        if output_file.exists() and not force_reprocess:
+            with jsonlines.open(output_file) as reader:
+                for message in reader:
+                    existing_messages.append(message)
+            logger.info(f"Loaded {len(existing_messages)} existing tagged messages")
+        
+        # Load processed hashes
+        hash_file = output_dir / "hashes.pkl"
+        processed_hashes = set()
+        if not force_reprocess:
+            processed_hashes = self._load_processed_message_hashes(hash_file)
+        
+        # Recover messages journaled by an interrupted run; those are done
+        journal = RunJournal(output_dir / "tags.journal.jsonl")
+        existing_hashes = {self._generate_message_hash(message) for message in existing_messages}
+        recovered_messages = []
+        for record in journal.replay():
+            if record['hash'] not in existing_hashes and record['hash'] not in processed_hashes:
+                recovered_messages.append(record['result'])
+            processed_hashes.add(record['hash'])
+        
+        # Extract messages from chats, grouped by conversation
+        conversation_groups = self._load_conversations(chats_file)
+        
+        # Only conversations with untagged messages need analysis and tagging
+        pending_groups = {}
+        for chat_id, chat_messages in conversation_groups.items():
+            pending = [
+                message for message in chat_messages
+                if self._generate_message_hash(message) not in processed_hashes
+            ]
+            if pending:
+                pending_groups[chat_id] = (chat_messages, pending)
+        
+        logger.info(f"Tagging {sum(len(p) for _, p in pending_groups.values())} messages "
+                    f"from {len(pending_groups)} conversations with {self.max_workers} workers")
+        
+        # Highest-priority conversations first
+        chat_ids = self.scheduler.order(
+            list(pending_groups.keys()),
+            ids=lambda chat_id: [chat_id],
+            timestamp=lambda chat_id: latest_timestamp(pending_groups[chat_id][0]),
+            size=lambda chat_id: sum(len(m.get('content', '')) for m in pending_groups[chat_id][1])
+        )
+        
+        trivial_chats = set()
+        if self.triage:
+            trivial_chats = {chat_id for chat_id in chat_ids if self.triage.assess(pending_groups[chat_id][0])}
+        
+        def analyze(chat_id: str) -> Optional[Dict]:
+            # None once the run's budget is spent; the conversation is then left for the next run
+            chat_messages = pending_groups[chat_id][0]
+            if chat_id in trivial_chats:
+                if self.enable_conversation_context:
+                    self.triage.record_saved()
+                return {}
+            if self.enable_conversation_context and not self.scheduler.try_start(
+                    sum(estimate_tokens(m.get('content', '')[:500]) for m in chat_messages[:10])):
+                return None
+            started = time.perf_counter()
+            context = self.analyze_conversation(chat_messages)
+            if self.triage and self.enable_conversation_context:
+                self.triage.record_llm(time.perf_counter() - started)
+            return context
+        
+        # Analyze conversations first
+        contexts = map_ordered(analyze, chat_ids, max_workers=self.max_workers,
+                               desc="Analyzing conversations")
+        conversation_contexts = dict(zip(chat_ids, contexts))
+        
+        # Tag messages with conversation context, batch_size short messages per prompt
+        work_items = []
+        for chat_id in chat_ids:
+            if conversation_contexts[chat_id] is None:
+                continue
+            pending = pending_groups[chat_id][1]
+            trivial = chat_id in trivial_chats
+            if trivial:
+                # One prompt for the whole conversation instead of batch_size messages per prompt
+                batches = make_batches(pending, len(pending), max_item_chars=self.triage.max_chars)
+                self.triage.record_saved(len(make_batches(pending, self.batch_size)) - len(batches))
+            else:
+                batches = make_batches(pending, self.batch_size)
+            for batch in batches:
+                work_items.append((batch, conversation_contexts[chat_id], trivial))
+        
+        def fallback_message(message: Dict) -> Dict:
+            return {
+                **message,
+                'tags': ['#error'],
+                'domain': 'unknown',
+                'complexity': 'unknown',
+                'confidence': 0.0,
+                'tagging_model': 'fallback',
+                'tagging_timestamp': int(time.time())
+            }
+        
+        def tag_batch(item: Tuple[List[Dict], Dict, bool]) -> List[Dict]:
+            batch, conversation_context, trivial = item
+            if not self.scheduler.try_start(sum(estimate_tokens(m.get('content', '')) for m in batch)):
+                return []
+            try:
+                started = time.perf_counter()
+                tagged_batch = self.tag_message_batch(batch, conversation_context)
+                if self.triage and not trivial:
+                    self.triage.record_llm(time.perf_counter() - started)
+            except Exception as e:
+                logger.error(f"Failed to tag {len(batch)} message(s) starting at {batch[0].get('message_id', 'unknown')}: {e}")
+                # Add fallback tags
+                tagged_batch = [fallback_message(message) for message in batch]
+            for message, tagged in zip(batch, tagged_batch):
+                journal.append(self._generate_message_hash(message), tagged)
+            return tagged_batch
+        
+        # Results come back in input order, so output and hashes are deterministic;
+        # each batch is journaled as soon as it completes
+        with journal:
+            batch_results = map_ordered(tag_batch, work_items, max_workers=self.max_workers,
+                                        desc="Tagging messages")
+        new_tagged_messages = recovered_messages + [tagged for batch in batch_results for tagged in batch]
+        for (batch, _, _), tagged_batch in zip(work_items, batch_results):
+            # Batches deferred by the budget stay unprocessed
+            if tagged_batch:
+                for message in batch:
+                    processed_hashes.add(self._generate_message_hash(message))
         
         # Combine existing and new messages
         all_tagged_messages = existing_messages + new_tagged_messages
         
         # Save tagged messages
-        with jsonlines.open(output_file, mode='w') as writer:
+        with atomic_write(output_file) as tmp_file, jsonlines.open(tmp_file, mode='w') as writer:
             for message in all_tagged_messages:
                 writer.write(message)
         
-        # Save hashes and metadata
+        # Save hashes and metadata; the journal is no longer needed
         self._save_processed_message_hashes(processed_hashes, hash_file)
+        journal.finish()
         
         # Calculate statistics
         all_tags = []
@@ -418,13 +651,21 @@ class EnhancedMessageTagger:
             'status': 'success',
             'total_messages': len(all_tagged_messages),
             'new_messages': len(new_tagged_messages),
+            'recovered_messages': len(recovered_messages),
             'existing_messages': len(existing_messages),
             'total_tags': len(all_tags),
             'unique_tags': len(set(all_tags)),
             'avg_tags_per_message': len(all_tags) / max(1, len(all_tagged_messages)),
             'domain_distribution': dict(Counter(domains)),
             'complexity_distribution': dict(Counter(complexities)),
-            'avg_confidence': sum(confidences) / max(1, len(confidences))
+            'avg_confidence': sum(confidences) / max(1, len(confidences)),
+            'max_workers': self.max_workers,
+            'rate_limiter': self.rate_limiter.get_stats(),
+            'llm_cache': self.cache.get_stats() if self.cache else None,
+            'batch_size': self.batch_size,
+            **self.batch_stats,
+            'triage': self.triage.get_stats() if self.triage else None,
+            'scheduler': self.scheduler.get_stats()
         }
         
         metadata_file = output_dir / "metadata.json"
@@ -437,7 +678,108 @@ class EnhancedMessageTagger:
         logger.info(f"  Unique tags: {stats['unique_tags']}")
         logger.info(f"  Avg tags per message: {stats['avg_tags_per_message']:.2f}")
         logger.info(f"  Avg confidence: {stats['avg_confidence']:.2f}")
+        if self.triage:
+            logger.info(f"  Triaged: {self.triage.describe()}")
+        self.scheduler.log_stats()
+        
+        return stats
+    
+    def submit_batch_jobs(self, chats_file: Path, output_file: Path, jobs: BatchJobStore) -> Dict:
+        """Write the tagging prompts of all untagged messages into batch jobs and submit them.
+        
+        Batch prompts carry no conversation context, which would take a round
+        trip of its own; trivial chats are still tagged with one prompt each.
+        """
+        logger.info("🚀 Submitting cloud API message tagging as batch jobs...")
+        processed_hashes = self._load_processed_message_hashes(output_file.parent / "hashes.pkl")
+        # Messages waiting in earlier jobs are not submitted again
+        skipped_hashes = processed_hashes | jobs.open_hashes()
+        
+        requests = []
+        for chat_messages in self._load_conversations(chats_file).values():
+            pending = [
+                message for message in chat_messages
+                if self._generate_message_hash(message) not in skipped_hashes
+            ]
+            if not pending:
+                continue
+            if self.triage and self.triage.assess(chat_messages):
+                batches = make_batches(pending, len(pending), max_item_chars=self.triage.max_chars)
+            else:
+                batches = make_batches(pending, self.batch_size)
+            for batch in batches:
+                texts = [self._sanitize_text(message.get('content', '')) for message in batch]
+                body = {'model': self.model, 'messages': self._batch_prompt(texts), 'temperature': self.temperature}
+                requests.append(batch_request('tags', [self._generate_message_hash(m) for m in batch], body,
+                                              messages=batch))
+        
+        logger.info(f"Writing {len(requests)} tagging prompts for "
+                    f"{sum(len(request['hashes']) for request in requests)} messages into batch jobs")
+        submitted = jobs.submit(CHAT_COMPLETIONS, requests)
+        jobs.log_stats()
+        return {'status': 'success', 'submitted_jobs': [job.id for job in submitted],
+                'batch_jobs': jobs.get_stats()}
+    
+    def ingest_batch_jobs(self, output_file: Path, jobs: BatchJobStore) -> Dict:
+        """Add the tags from finished batch jobs to the output and hashes, as an interactive run would.
+        
+        Messages without a valid result stay untagged and are picked up by the
+        next submission or interactive run.
+        """
+        logger.info("🚀 Ingesting cloud API message tagging batch jobs...")
+        ready = jobs.collect()
+        if not ready:
+            jobs.log_stats()
+            return {'status': 'success', 'new_messages': 0, 'batch_jobs': jobs.get_stats()}
+        
+        output_dir = output_file.parent
+        output_dir.mkdir(parents=True, exist_ok=True)
+        hash_file = output_dir / "hashes.pkl"
+        processed_hashes = self._load_processed_message_hashes(hash_file)
+        existing_messages = []
+        if output_file.exists():
+            with jsonlines.open(output_file) as reader:
+                existing_messages = list(reader)
+        
+        new_tagged_messages = []
+        failed = 0
+        for job in ready:
+            for entry, body, error in job.results():
+                messages = entry['messages']
+                results = parse_batch_response(completion_text(body), len(messages)) if body else None
+                if error:
+                    logger.warning(f"Batch request {entry['custom_id']} failed: {error}")
+                for message, message_hash, result in zip(messages, entry['hashes'], results or [None] * len(messages)):
+                    # Tagged meanwhile by an interactive run
+                    if message_hash in processed_hashes:
+                        continue
+                    if result is not None and self._validate_enhanced_result(result):
+                        new_tagged_messages.append(self._build_tagged_message(message, result))
+                        processed_hashes.add(message_hash)
+                    else:
+                        failed += 1
+        
+        all_tagged_messages = existing_messages + new_tagged_messages
+        with atomic_write(output_file) as tmp_file, jsonlines.open(tmp_file, mode='w') as writer:
+            for message in all_tagged_messages:
+                writer.write(message)
+        self._save_processed_message_hashes(processed_hashes, hash_file)
+        jobs.mark_ingested(ready, len(new_tagged_messages), failed)
         
+        stats = {
+            'status': 'success',
+            'total_messages': len(all_tagged_messages),
+            'new_messages': len(new_tagged_messages),
+            'existing_messages': len(existing_messages),
+            'failed_messages': failed,
+            'batch_jobs': jobs.get_stats()
+        }
+        self._save_metadata(stats, output_dir / "metadata.json")
+        
+        logger.info("✅ Cloud API batch tagging ingested!")
+        logger.info(f"  New messages: {stats['new_messages']}")
+        logger.info(f"  Failed messages: {failed}")
+        jobs.log_stats()
         return stats
 
 
@@ -449,9 +791,27 @@ class EnhancedMessageTagger:
               default='../../data/processed/tagging/tags.jsonl',
               help='Output JSONL file for tagged messages')
 @click.option('--model', default='gpt-3.5-turbo', help='OpenAI model to use')
+@click.option('--max-workers', default=1, type=int, help='Number of concurrent API requests')
+@click.option('--batch-size', default=1, type=int, help='Short messages per tagging prompt (1 disables batching)')
+@click.option('--triage/--no-triage', default=False,
+              help='Tag trivial chats (few, short or repeated turns) with one prompt and no context analysis (off by default)')
+@click.option('--priority', default='file', type=click.Choice(PRIORITIES),
+              help='Order of chats: file order, most recent first or shortest first')
+@click.option('--pin', 'pins', multiple=True, help='Chat ID to tag before all others (repeatable)')
+@click.option('--time-budget', default=None, type=float, help='Stop starting new API calls after this many minutes')
+@click.option('--token-budget', default=None, type=int, help='Stop starting new API calls after about this many prompt tokens')
+@click.option('--batch-mode', default=None, type=click.Choice(BATCH_MODES),
+              help='Submit the prompts of untagged messages as batch jobs, or ingest finished batch jobs')
+@click.option('--batch-submitter', default='openai', type=click.Choice(SUBMITTERS),
+              help='Where batch jobs go: the OpenAI Batch API or a local directory')
+@click.option('--batch-dir', default=None,
+              help='Exchange directory of the local batch submitter (default: $CHATMIND_BATCH_DIR or <processed>/batch_exchange)')
 @click.option('--force', is_flag=True, help='Force reprocess all messages')
 @click.option('--check-only', is_flag=True, help='Only check setup, don\'t process')
-def main(input_file: str, output_file: str, model: str, force: bool, check_only: bool):
+def main(input_file: str, output_file: str, model: str, max_workers: int, batch_size: int, triage: bool,
+         priority: str, pins: Tuple[str, ...], time_budget: Optional[float], token_budget: Optional[int],
+         batch_mode: Optional[str], batch_submitter: str, batch_dir: Optional[str],
+         force: bool, check_only: bool):
     """Tag messages using OpenAI API."""
     
     if check_only:
@@ -482,7 +842,9 @@ def main(input_file: str, output_file: str, model: str, force: bool, check_only:
         return 0
     
     # Initialize tagger
-    tagger = EnhancedMessageTagger(model=model)
+    scheduler = WorkScheduler.from_options(priority, pins, time_budget, token_budget)
+    tagger = EnhancedMessageTagger(model=model, max_workers=max_workers, batch_size=batch_size,
+                                   triage=ChatTriage() if triage else None, scheduler=scheduler)
     
     # Process messages
     input_path = Path(input_file)
@@ -492,7 +854,14 @@ def main(input_file: str, output_file: str, model: str, force: bool, check_only:
         logger.error(f"Input file not found: {input_file}")
         return 1
     
-    stats = tagger.process_messages_to_tags(input_path, output_path, force)
+    if batch_mode == 'submit':
+        stats = tagger.submit_batch_jobs(input_path, output_path,
+                                         BatchJobStore.from_options(output_path.parent, batch_submitter, batch_dir))
+    elif batch_mode == 'ingest':
+        stats = tagger.ingest_batch_jobs(output_path,
+                                         BatchJobStore.from_options(output_path.parent, batch_submitter, batch_dir))
+    else:
+        stats = tagger.process_messages_to_tags(input_path, output_path, force)
     
     if stats['status'] == 'success':
         logger.info("✅ Cloud API tagging successful!")
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+Embedding Fast-Path Tagger
+
+Tags messages without an LLM call when their chunk embeddings are close
+enough to the master tag list. The master tags are embedded once (and
+cached next to the tagging outputs); each message is represented by the
+mean of its chunk embeddings from the embedding step, matched to chunks by
+message_hash.
+
+Two scoring modes:
+- prototype: cosine similarity against one vector per master tag. When
+  earlier LLM-tagged messages are available, each prototype is pulled
+  towards the centroid of the messages the LLM gave that tag.
+- knn: similarity-weighted tag votes from the k nearest LLM-tagged messages.
+
+Only confident messages are served by the fast path; everything else is
+left for the LLM tagger.
+"""
+
+import hashlib
+import json
+import re
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import logging
+
+import jsonlines
+import numpy as np
+
+try:
+    from sentence_transformers import SentenceTransformer
+    SENTENCE_TRANSFORMERS_AVAILABLE = True
+except ImportError:
+    SENTENCE_TRANSFORMERS_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MASTER_LIST = "data/tags_masterlist/comprehensive_generic_tags.json"
+
+
+def normalize_tag(tag: str) -> str:
+    """Lowercase '#tag-name' form used to compare fast-path and LLM tags."""
+    tag = re.sub(r'[\s_]+', '-', str(tag).strip().lower().lstrip('#'))
+    return '#' + tag.strip('-')
+
+
+def tag_agreement(fast_tags: List[str], llm_tags: List[str]) -> Tuple[float, float]:
+    """(Jaccard overlap, precision of the fast-path tags) against the LLM tags."""
+    fast = {normalize_tag(t) for t in fast_tags}
+    llm = {normalize_tag(t) for t in llm_tags}
+    if not fast and not llm:
+        return 1.0, 1.0
+    jaccard = len(fast & llm) / len(fast | llm)
+    precision = len(fast & llm) / len(fast) if fast else 0.0
+    return jaccard, precision
+
+
+class FastPathTagClassifier:
+    """Scores message embeddings against the master tag list."""
+
+    def __init__(self,
+                 processed_dir: str = "data/processed",
+                 master_list_path: str = DEFAULT_MASTER_LIST,
+                 model_name: str = "all-MiniLM-L6-v2",
+                 method: str = "prototype",
+                 threshold: float = 0.5,
+                 margin: float = 0.05,
+                 top_k: int = 3,
+                 neighbors: int = 10):
+        if method not in ('prototype', 'knn'):
+            raise ValueError(f"Unknown fast-path method: {method}")
+        self.processed_dir = Path(processed_dir)
+        self.master_list_path = Path(master_list_path)
+        self.model_name = model_name
+        self.method = method
+        self.threshold = threshold
+        self.margin = margin
+        self.top_k = max(1, top_k)
+        self.neighbors = max(1, neighbors)
+
+        self.tags: List[str] = []
+        self.tag_matrix: Optional[np.ndarray] = None
+        self.message_vectors: Dict[str, np.ndarray] = {}
+        # Labelled examples (LLM-tagged messages) for knn and prototype refinement
+        self._example_matrix: Optional[np.ndarray] = None
+        self._example_tags: List[List[str]] = []
+        self.ready = False
+
+    @staticmethod
+    def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+        return matrix / np.where(norms == 0, 1.0, norms)
+
+    def _load_master_tags(self) -> List[str]:
+        with open(self.master_list_path, 'r') as f:
+            return sorted({normalize_tag(tag) for tag in json.load(f)})
+
+    def _embed_master_tags(self, tags: List[str]) -> np.ndarray:
+        """Embed tag names once; cached in tagging/tag_embeddings.npz per model and tag list."""
+        digest = hashlib.sha256(json.dumps([self.model_name, tags]).encode()).hexdigest()
+        cache_file = self.processed_dir / "tagging" / "tag_embeddings.npz"
+        if cache_file.exists():
+            cached = np.load(cache_file, allow_pickle=False)
+            if str(cached['digest']) == digest:
+                return cached['vectors']
+
+        model = SentenceTransformer(self.model_name)
+        texts = [tag.lstrip('#').replace('-', ' ') for tag in tags]
+        vectors = self._normalize_rows(np.asarray(model.encode(texts, show_progress_bar=False), dtype=np.float32))
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        np.savez(cache_file, digest=np.array(digest), vectors=vectors)
+        logger.info(f"Embedded {len(tags)} master tags with {self.model_name}")
+        return vectors
+
+    def _load_message_vectors(self, embeddings_file: Path) -> Dict[str, np.ndarray]:
+        """Mean chunk embedding per message_hash."""
+        sums: Dict[str, np.ndarray] = {}
+        counts: Dict[str, int] = defaultdict(int)
+        with jsonlines.open(embeddings_file) as reader:
+            for chunk in reader:
+                message_hash = chunk.get('message_hash')
+                embedding = chunk.get('embedding')
+                if not message_hash or not embedding:
+                    continue
+                vector = np.asarray(embedding, dtype=np.float32)
+                sums[message_hash] = sums[message_hash] + vector if message_hash in sums else vector
+                counts[message_hash] += 1
+        return {h: v / counts[h] for h, v in sums.items()}
+
+    def load(self, embeddings_file: Optional[Path] = None, tagged_messages: Optional[List[Dict]] = None) -> bool:
+        """Prepare tag and message vectors; returns False if the fast path cannot run."""
+        embeddings_file = Path(embeddings_file or self.processed_dir / "embedding" / "embeddings.jsonl")
+        if not SENTENCE_TRANSFORMERS_AVAILABLE:
+            logger.warning("Sentence Transformers not available, fast path disabled")
+            return False
+        if not self.master_list_path.exists():
+            logger.warning(f"Master tag list not found: {self.master_list_path}, fast path disabled")
+            return False
+        if not embeddings_file.exists():
+            logger.warning(f"Chunk embeddings not found: {embeddings_file}, fast path disabled")
+            return False
+
+        self.message_vectors = self._load_message_vectors(embeddings_file)
+        if not self.message_vectors:
+            logger.warning("No message embeddings found, fast path disabled")
+            return False
+
+        self.tags = self._load_master_tags()
+        self.tag_matrix = self._embed_master_tags(self.tags)
+        dims = next(iter(self.message_vectors.values())).shape[0]
+        if self.tag_matrix.shape[1] != dims:
+            logger.warning(f"Chunk embeddings have {dims} dimensions but {self.model_name} produces "
+                           f"{self.tag_matrix.shape[1]}; fast path disabled (use the local embedder)")
+            return False
+
+        self._load_examples(tagged_messages or [])
+        if self.method == 'knn' and self._example_matrix is None:
+            logger.warning("No LLM-tagged messages with embeddings yet, falling back to prototype scoring")
+            self.method = 'prototype'
+
+        self.ready = True
+        logger.info(f"⚡ Fast path ready: {len(self.tags)} master tags, "
+                    f"{len(self.message_vectors)} message embeddings, method={self.method}")
+        return True
+
+    def _load_examples(self, tagged_messages: List[Dict]) -> None:
+        """Use earlier LLM tag entries as labelled examples."""
+        master = set(self.tags)
+        vectors, labels = [], []
+        for entry in tagged_messages:
+            if entry.get('tag_source') == 'fast_path':
+                continue
+            vector = self.message_vectors.get(entry.get('message_hash', ''))
+            tags = [t for t in (normalize_tag(t) for t in entry.get('tags', [])) if t in master]
+            if vector is not None and tags:
+                vectors.append(vector)
+                labels.append(tags)
+        if not vectors:
+            return
+
+        self._example_matrix = self._normalize_rows(np.vstack(vectors))
+        self._example_tags = labels
+
+        # Pull each prototype halfway towards the centroid of its labelled messages
+        index = {tag: i for i, tag in enumerate(self.tags)}
+        members: Dict[int, List[int]] = defaultdict(list)
+        for row, tags in enumerate(labels):
+            for tag in tags:
+                members[index[tag]].append(row)
+        for tag_row, rows in members.items():
+            centroid = self._example_matrix[rows].mean(axis=0)
+            self.tag_matrix[tag_row] = 0.5 * self.tag_matrix[tag_row] + 0.5 * centroid
+        self.tag_matrix = self._normalize_rows(self.tag_matrix)
+        logger.info(f"Refined {len(members)} tag prototypes from {len(labels)} LLM-tagged messages")
+
+    def _tag_scores(self, vector: np.ndarray) -> np.ndarray:
+        if self.method == 'knn':
+            similarities = self._example_matrix @ vector
+            nearest = np.argsort(-similarities)[:self.neighbors]
+            index = {tag: i for i, tag in enumerate(self.tags)}
+            votes = np.zeros(len(self.tags), dtype=np.float32)
+            weight = 0.0
+            for row in nearest:
+                sim = max(float(similarities[row]), 0.0)
+                weight += sim
+                for tag in self._example_tags[row]:
+                    votes[index[tag]] += sim
+            return votes / weight if weight else votes
+        return self.tag_matrix @ vector
+
+    def classify(self, message_hash: str) -> Optional[Dict]:
+        """Return {'tags', 'score', 'margin'} for a confident message, else None.
+
+        A message is confident when its best tag scores at least threshold
+        and the selected tags are separated from the next-best tag by at
+        least margin.
+        """
+        if not self.ready:
+            return None
+        vector = self.message_vectors.get(message_hash)
+        if vector is None:
+            return None
+
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            return None
+        scores = self._tag_scores(vector / norm)
+        order = np.argsort(-scores)
+        selected = [i for i in order[:self.top_k] if scores[i] >= self.threshold]
+        if not selected:
+            return None
+
+        next_best = float(scores[order[len(selected)]]) if len(order) > len(selected) else 0.0
+        margin = float(scores[selected[-1]]) - next_best
+        if margin < self.margin:
+            return None
+
+        return {
+            'tags': [self.tags[i] for i in selected],
+            'score': round(float(scores[selected[0]]), 4),
+            'margin': round(margin, 4)
+        }
@@ -10,18 +10,25 @@ import json
 import logging
 from typing import Dict, List, Optional, Tuple
 from pathlib import Path
+import threading
 import time
-from tqdm import tqdm
 from collections import defaultdict, Counter
-import requests
 import subprocess
 import sys
 import os
 from datetime import datetime
 
+sys.path.append(str(Path(__file__).parent.parent.parent))
+from llm_client import LocalLLMClient, LLMClientError
+from json_stream import JSONStreamScanner
+from worker_pool import AdaptiveRateLimiter, map_ordered
+from llm_cache import open_prompt_cache
+from tagging.batch_prompts import make_batches, parse_batch_response
+
 from chatmind.tagger.cloud_api.enhanced_prompts import get_enhanced_prompt, conversation_level_prompt, validation_prompt
 from chatmind.tagger.local.local_prompts import (
-    get_gemma_tagging_prompt, get_gemma_conversation_prompt, get_gemma_validation_prompt
+    get_gemma_tagging_prompt, get_gemma_batch_tagging_prompt, get_gemma_conversation_prompt,
+    get_gemma_validation_prompt
 )
 
 # Create logs directory if it doesn't exist
@@ -61,14 +68,36 @@ class LocalEnhancedChunkTagger:
                  delay_between_calls: float = 0.1,  # Fast for Gemma-2B
                  enable_validation: bool = True,
                  enable_conversation_context: bool = True,
-                 ollama_url: str = "http://localhost:11434"):
+                 ollama_url: Optional[str] = None,
+                 max_concurrency: Optional[int] = None,
+                 max_workers: int = 1,
+                 batch_size: int = 1,
+                 llm_client: Optional[LocalLLMClient] = None):
         self.model = model
         self.temperature = temperature
         self.max_retries = max_retries
         self.delay_between_calls = delay_between_calls
         self.enable_validation = enable_validation
         self.enable_conversation_context = enable_conversation_context
-        self.ollama_url = ollama_url
+        self.max_workers = max(1, max_workers)
+        # Chunks per tagging prompt; 1 keeps one prompt per chunk
+        self.batch_size = max(1, batch_size)
+        
+        # Adaptive pacing replaces the fixed sleep between calls; delay_between_calls sets the starting rate
+        self.rate_limiter = AdaptiveRateLimiter.from_delay(delay_between_calls)
+        
+        # Shared pooled client (keep-alive, bounded concurrency, jittered retries)
+        self.llm_client = llm_client or LocalLLMClient(
+            model=model,
+            base_url=ollama_url,
+            max_concurrency=max_concurrency or self.max_workers,
+            max_retries=max_retries,
+            timeout=60,
+            rate_limiter=self.rate_limiter,
+            cache=open_prompt_cache()
+        )
+        # The client resolves the URL (argument, $OLLAMA_URL or the default)
+        self.ollama_url = self.llm_client.base_url
         
         # Statistics tracking
         self.stats = {
@@ -77,12 +106,27 @@ class LocalEnhancedChunkTagger:
             'failed_calls': 0,
             'validation_failures': 0,
             'conversation_analyses': 0,
-            'chunks_tagged': 0
+            'chunks_tagged': 0,
+            'batch_calls': 0,
+            'batched_chunks': 0,
+            'batch_fallbacks': 0
         }
+        # Batches are tagged from worker threads
+        self._stats_lock = threading.Lock()
+    
+    def _count(self, *keys: str) -> None:
+        """Increment stats counters (called from worker threads)."""
+        with self._stats_lock:
+            for key in keys:
+                self.stats[key] += 1
+    
+    def _stats_snapshot(self) -> Dict:
+        with self._stats_lock:
+            return self.stats.copy()
     
     def _call_local_model(self, prompt: str, system_prompt: str = "") -> str:
         """
-        Call local model via Ollama API with retries and better error handling.
+        Call local model via the shared Ollama client.
         
         Args:
             prompt: The user prompt
@@ -95,67 +139,32 @@ class LocalEnhancedChunkTagger:
         logger.debug(f"Prompt length: {len(prompt)} chars")
         logger.debug(f"System prompt: {system_prompt[:100] if system_prompt else 'None'}...")
         
-        for attempt in range(self.max_retries):
-            try:
-                # Prepare messages
-                messages = []
-                if system_prompt:
-                    messages.append({"role": "system", "content": system_prompt})
-                messages.append({"role": "user", "content": prompt})
-                
-                logger.debug(f"API call attempt {attempt + 1}/{self.max_retries}")
-                logger.debug(f"Request URL: {self.ollama_url}/api/chat")
-                logger.debug(f"Request payload: model={self.model}, temperature={self.temperature}")
-                
-                # Call Ollama API
-                response = requests.post(
-                    f"{self.ollama_url}/api/chat",
-                    json={
-                        "model": self.model,
-                        "messages": messages,
-                        "temperature": self.temperature,
-                        "stream": False
-                    },
-                    timeout=60  # 60 second timeout
-                )
-                
-                logger.debug(f"Response status: {response.status_code}")
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    content = result.get('message', {}).get('content', '')
-                    
-                    logger.debug(f"Response content length: {len(content)} chars")
-                    logger.debug(f"Response preview: {content[:200]}...")
-                    
-                    if not content or content.strip() == "":
-                        logger.warning(f"Empty response from model (attempt {attempt + 1}/{self.max_retries})")
-                        if attempt < self.max_retries - 1:
-                            time.sleep(self.delay_between_calls * 2)  # Longer delay for empty responses
-                            continue
-                        else:
-                            raise Exception("Model returned empty response after all retries")
-                    
-                    self.stats['successful_calls'] += 1
-                    logger.debug(f"Successful API call (attempt {attempt + 1})")
-                    return content
-                else:
-                    logger.error(f"Ollama API error: {response.status_code} - {response.text}")
-                    self.stats['failed_calls'] += 1
-                    if attempt < self.max_retries - 1:
-                        time.sleep(self.delay_between_calls)
-                        continue
-                    else:
-                        raise Exception(f"API call failed: {response.status_code}")
-                        
-            except Exception as e:
-                logger.error(f"Error calling local model (attempt {attempt + 1}/{self.max_retries}): {e}")
-                self.stats['failed_calls'] += 1
-                if attempt < self.max_retries - 1:
-                    time.sleep(self.delay_between_calls)
-                    continue
-                else:
-                    raise
+        self._count('total_calls')
+        try:
+            # Only cache responses that hold a valid JSON object; malformed ones are asked for again
+            content = self.llm_client.chat(prompt, system_prompt=system_prompt, temperature=self.temperature,
+                                           accept=self._has_json_object,
+                                           json_stream=lambda: JSONStreamScanner(root='{', max_tokens=512))
+        except LLMClientError as e:
+            logger.error(f"Error calling local model: {e}")
+            self._count('failed_calls')
+            raise
+        
+        logger.debug(f"Response content length: {len(content)} chars")
+        logger.debug(f"Response preview: {content[:200]}...")
+        self._count('successful_calls')
+        return content
+    
+    def _has_json_object(self, response: str) -> bool:
+        """Whether a response holds a JSON object that parses without repairs."""
+        start = response.find('{')
+        end = response.rfind('}')
+        if start == -1 or end <= start:
+            return False
+        try:
+            return isinstance(json.loads(response[start:end + 1]), dict)
+        except json.JSONDecodeError:
+            return False
     
     def _extract_json_from_response(self, response: str) -> Dict:
         """Extract JSON from model response, handling various formats with robust fallbacks."""
@@ -322,7 +331,7 @@ class LocalEnhancedChunkTagger:
             response = self._call_local_model(prompt, system_prompt)
             result = self._extract_json_from_response(response)
             
-            self.stats['conversation_analyses'] += 1
+            self._count('conversation_analyses')
             logger.info(f"Conversation analysis: {result.get('primary_domain', 'unknown')} domain")
             logger.debug(f"Conversation analysis result: {result}")
             return result
@@ -365,7 +374,7 @@ class LocalEnhancedChunkTagger:
             reasoning = result.get('reasoning', 'No issues found')
             
             if not is_valid:
-                self.stats['validation_failures'] += 1
+                self._count('validation_failures')
             
             return is_valid, suggested_tags, reasoning
             
@@ -394,15 +403,11 @@ class LocalEnhancedChunkTagger:
         logger.debug(f"Chunk content length: {len(content)}")
         logger.debug(f"Chunk title: {title}")
         
-        # Combine title and content for better context
-        full_text = f"Title: {title}\n\nContent: {content}" if title else content
+        full_text = self._chunk_text(chunk)
         
         # Get conversation context string
-        context_str = ""
-        if conversation_context:
-            domain = conversation_context.get('primary_domain', '')
-            topics = conversation_context.get('key_topics', [])
-            context_str = f"Domain: {domain}, Topics: {', '.join(topics[:3])}"
+        context_str = self._context_string(conversation_context)
+        if context_str:
             logger.debug(f"Conversation context: {context_str}")
         
         # Get initial tags from local model
@@ -418,35 +423,7 @@ class LocalEnhancedChunkTagger:
             result = self._extract_json_from_response(response)
             
             logger.debug(f"Initial tagging result: {result}")
-            
-            # Validate tags if enabled
-            if self.enable_validation:
-                logger.debug("Running tag validation")
-                is_valid, suggested_tags, reasoning = self.validate_tags(
-                    full_text, result.get('tags', []), context_str
-                )
-                
-                if not is_valid:
-                    logger.info(f"Tag validation failed: {reasoning}")
-                    result['tags'] = suggested_tags
-                    result['validation_issues'] = [reasoning]
-            
-            # Enhance chunk with tags and metadata
-            enhanced_chunk = {
-                **chunk,
-                'tags': result.get('tags', []),
-                'category': result.get('category', ''),
-                'domain': result.get('domain', ''),
-                'confidence': result.get('confidence', 'medium'),
-                'tagging_model': f"local-{self.model}",
-                'tagging_timestamp': int(time.time()),
-                'conversation_context': conversation_context,
-                'local_model_stats': self.stats.copy()
-            }
-            
-            self.stats['chunks_tagged'] += 1
-            logger.debug(f"Successfully tagged chunk {chunk_id} with {len(result.get('tags', []))} tags")
-            return enhanced_chunk
+            return self._finish_tagged_chunk(chunk, result, full_text, context_str, conversation_context)
             
         except Exception as e:
             logger.error(f"Failed to tag chunk {chunk_id}: {e}")
@@ -463,6 +440,101 @@ class LocalEnhancedChunkTagger:
                 'error': str(e)
             }
     
+    def _finish_tagged_chunk(self, chunk: Dict, result: Dict, full_text: str, context_str: str,
+                             conversation_context: Optional[Dict]) -> Dict:
+        """Validate a tagging result (if enabled) and merge it into the chunk."""
+        # Validate tags if enabled
+        if self.enable_validation:
+            logger.debug("Running tag validation")
+            is_valid, suggested_tags, reasoning = self.validate_tags(
+                full_text, result.get('tags', []), context_str
+            )
+            
+            if not is_valid:
+                logger.info(f"Tag validation failed: {reasoning}")
+                result['tags'] = suggested_tags
+                result['validation_issues'] = [reasoning]
+        
+        # Enhance chunk with tags and metadata
+        enhanced_chunk = {
+            **chunk,
+            'tags': result.get('tags', []),
+            'category': result.get('category', ''),
+            'domain': result.get('domain', ''),
+            'confidence': result.get('confidence', 'medium'),
+            'tagging_model': f"local-{self.model}",
+            'tagging_timestamp': int(time.time()),
+            'conversation_context': conversation_context,
+            'local_model_stats': self._stats_snapshot()
+        }
+        
+        self._count('chunks_tagged')
+        chunk_id = chunk.get('message_id', chunk.get('id', 'unknown'))
+        logger.debug(f"Successfully tagged chunk {chunk_id} with {len(result.get('tags', []))} tags")
+        return enhanced_chunk
+    
+    def tag_chunk_batch(self, chunks: List[Dict], conversation_context: Dict = None) -> List[Dict]:
+        """
+        Tag several chunks from one conversation with a single prompt.
+        
+        Chunks whose entry is missing or unusable in the batch response (or
+        all of them, when the JSON array does not parse) are re-tagged one
+        at a time with tag_chunk.
+        
+        Args:
+            chunks: Chunks from the same conversation
+            conversation_context: Optional conversation context
+        
+        Returns:
+            List of tagged chunks, in input order
+        """
+        if len(chunks) == 1:
+            return [self.tag_chunk(chunks[0], conversation_context)]
+        
+        full_texts = [self._chunk_text(chunk) for chunk in chunks]
+        context_str = self._context_string(conversation_context)
+        
+        results = None
+        try:
+            prompt = get_gemma_batch_tagging_prompt(full_texts, context_str)
+            response = self.llm_client.chat(
+                prompt, temperature=self.temperature,
+                accept=lambda r: parse_batch_response(r, len(chunks)) is not None,
+                json_stream=lambda: JSONStreamScanner(root='[', max_tokens=200 * len(chunks))
+            )
+            self._count('total_calls', 'successful_calls', 'batch_calls')
+            results = parse_batch_response(response, len(chunks))
+        except LLMClientError as e:
+            logger.warning(f"Batch tagging call failed, falling back to per-chunk prompts: {e}")
+            self._count('failed_calls')
+        
+        tagged_chunks = []
+        for i, chunk in enumerate(chunks):
+            result = results[i] if results else None
+            if result and isinstance(result.get('tags'), list) and result['tags']:
+                tagged_chunks.append(self._finish_tagged_chunk(
+                    chunk, result, full_texts[i], context_str, conversation_context
+                ))
+                self._count('batched_chunks')
+            else:
+                self._count('batch_fallbacks')
+                tagged_chunks.append(self.tag_chunk(chunk, conversation_context))
+        return tagged_chunks
+    
+    def _chunk_text(self, chunk: Dict) -> str:
+        """Combine title and content for better context."""
+        content = chunk.get('content', '')
+        title = chunk.get('title', '')
+        return f"Title: {title}\n\nContent: {content}" if title else content
+    
+    def _context_string(self, conversation_context: Optional[Dict]) -> str:
+        """Render conversation context for a tagging prompt."""
+        if not conversation_context:
+            return ""
+        domain = conversation_context.get('primary_domain', '')
+        topics = conversation_context.get('key_topics', [])
+        return f"Domain: {domain}, Topics: {', '.join(topics[:3])}"
+    
     def tag_conversation_chunks(self, chunks: List[Dict]) -> List[Dict]:
         """
         Tag all chunks in a conversation with context awareness.
@@ -486,40 +558,38 @@ class LocalEnhancedChunkTagger:
         conversation_context = self.analyze_conversation(chunks)
         logger.debug(f"Conversation context for {conv_id}: {conversation_context}")
         
-        # Tag each chunk with conversation context
-        tagged_chunks = []
-        error_count = 0
-        success_count = 0
+        # Tag chunks with conversation context, batch_size short chunks per prompt
+        def fallback_chunk(chunk: Dict, error: Exception) -> Dict:
+            return {
+                **chunk,
+                'tags': ['#error', '#chunk-tagging-failed'],
+                'category': 'Error in chunk tagging',
+                'domain': 'unknown',
+                'confidence': 'low',
+                'tagging_model': f"local-{self.model}-fallback",
+                'tagging_timestamp': int(time.time()),
+                'error': str(error)
+            }
         
-        for i, chunk in enumerate(tqdm(chunks, desc=f"Tagging chunks in {conv_id}")):
-            logger.debug(f"Processing chunk {i+1}/{len(chunks)} in conversation {conv_id}")
-            
+        def tag_batch(batch: List[Dict]) -> List[Tuple[Dict, bool]]:
+            logger.debug(f"Processing {len(batch)} chunk(s) in conversation {conv_id}")
             try:
-                tagged_chunk = self.tag_chunk(chunk, conversation_context)
-                tagged_chunks.append(tagged_chunk)
-                success_count += 1
-                
-                # Log progress every 10 chunks
-                if (i + 1) % 10 == 0:
-                    logger.info(f"Progress: {i+1}/{len(chunks)} chunks tagged in {conv_id}")
-                
+                return [(tagged_chunk, True) for tagged_chunk in self.tag_chunk_batch(batch, conversation_context)]
             except Exception as e:
-                logger.error(f"Failed to tag chunk {i+1} in conversation {conv_id}: {e}")
-                error_count += 1
-                # Add fallback chunk
-                tagged_chunks.append({
-                    **chunk,
-                    'tags': ['#error', '#chunk-tagging-failed'],
-                    'category': 'Error in chunk tagging',
-                    'domain': 'unknown',
-                    'confidence': 'low',
-                    'tagging_model': f"local-{self.model}-fallback",
-                    'tagging_timestamp': int(time.time()),
-                    'error': str(e)
-                })
-            
-            # Add delay between calls
-            time.sleep(self.delay_between_calls)
+                logger.error(f"Failed to tag {len(batch)} chunk(s) in conversation {conv_id}: {e}")
+                # Add fallback chunks
+                return [(fallback_chunk(chunk, e), False) for chunk in batch]
+        
+        batches = make_batches(chunks, self.batch_size, group_key=lambda chunk: conv_id,
+                               text_of=self._chunk_text)
+        
+        # Up to max_workers prompts in flight; results come back in chunk order
+        batch_results = map_ordered(tag_batch, batches, max_workers=self.max_workers,
+                                    desc=f"Tagging chunks in {conv_id}")
+        results = [result for batch in batch_results for result in batch]
+        tagged_chunks = [tagged_chunk for tagged_chunk, _ in results]
+        success_count = sum(1 for _, ok in results if ok)
+        error_count = len(results) - success_count
         
         logger.info(f"Completed tagging conversation {conv_id}: {success_count} success, {error_count} errors")
         return tagged_chunks
@@ -575,25 +645,23 @@ class LocalEnhancedChunkTagger:
             'confidence_distribution': dict(confidence_counts),
             'validation_issues': validation_issues,
             'potential_issues': potential_issues,
-            'local_model_stats': self.stats
+            'local_model_stats': self.stats,
+            'llm_metrics': self.llm_client.get_metrics()
         }
     
     def check_model_availability(self) -> bool:
         """Check if the local model is available."""
         try:
-            response = requests.get(f"{self.ollama_url}/api/tags")
-            if response.status_code == 200:
-                models = response.json().get('models', [])
-                available_models = [model['name'] for model in models]
-                if self.model in available_models:
-                    logger.info(f"✅ Model {self.model} is available")
-                    return True
-                else:
-                    logger.warning(f"❌ Model {self.model} not found. Available: {available_models}")
-                    return False
+            available_models = self.llm_client.list_models()
+            if self.model in available_models:
+                logger.info(f"✅ Model {self.model} is available")
+                return True
             else:
-                logger.error(f"❌ Cannot connect to Ollama at {self.ollama_url}")
+                logger.warning(f"❌ Model {self.model} not found. Available: {available_models}")
                 return False
+        except LLMClientError as e:
+            logger.error(f"❌ Cannot connect to Ollama at {self.ollama_url}: {e}")
+            return False
         except Exception as e:
             logger.error(f"❌ Error checking model availability: {e}")
             return False
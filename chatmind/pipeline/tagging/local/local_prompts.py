@@ -6,6 +6,8 @@ Clean, direct prompts designed for Gemma-2B to return valid JSON.
 Uses instruction format optimized for Gemma's behavior.
 """
 
+from tagging.batch_prompts import format_numbered_messages
+
 def get_gemma_tagging_prompt(chunk_text: str, conversation_context: str = "") -> str:
     """
     Optimized prompt for Gemma-2B model to return JSON tags.
@@ -41,6 +43,44 @@ Return ONLY this JSON format:
 }}"""
 
 
+def get_gemma_batch_tagging_prompt(chunk_texts: list, conversation_context: str = "") -> str:
+    """
+    Prompt for tagging several chunks from one conversation in a single call.
+    
+    Args:
+        chunk_texts: The chunk texts to be tagged, in order
+        conversation_context: Optional context about the overall conversation
+    
+    Returns:
+        Prompt string asking for a JSON array with one entry per chunk
+    """
+    
+    context_info = f"\nContext: {conversation_context}" if conversation_context else ""
+    numbered = format_numbered_messages(chunk_texts)
+    
+    return f"""You are a content classifier. Return ONLY a valid JSON array.
+
+IMPORTANT: No explanations, no conversational text, no additional content.
+IMPORTANT: Do not start with "Sure," "Here's," or similar phrases.
+IMPORTANT: Return exactly one object per numbered text, in the same order.
+
+Tag each text with 3-5 relevant hashtags and a category:
+
+{context_info}
+Texts:
+{numbered}
+
+Return ONLY this JSON format:
+[
+  {{
+    "index": 1,
+    "tags": ["#specific-tag1", "#specific-tag2", "#specific-tag3"],
+    "category": "Specific category name",
+    "domain": "technical|personal|medical|business|creative"
+  }}
+]"""
+
+
 def get_gemma_conversation_prompt(conversation_text: str) -> str:
     """
     Optimized prompt for conversation-level analysis with Gemma-2B.
@@ -10,15 +10,29 @@ import json
 import jsonlines
 import click
 from pathlib import Path
-from typing import Dict, List, Set, Optional
+from collections import defaultdict
+from typing import Dict, List, Set, Optional, Tuple
 import logging
-from tqdm import tqdm
 import hashlib
 import pickle
 from datetime import datetime
 import subprocess
+import threading
 import time
 import re
+import sys
+
+sys.path.append(str(Path(__file__).parent.parent.parent))
+from llm_client import LocalLLMClient, LLMClientError
+from json_stream import JSONStreamScanner
+from worker_pool import AdaptiveRateLimiter, map_ordered
+from llm_cache import open_prompt_cache
+from run_journal import RunJournal, atomic_write
+from prompt_budget import estimate_tokens
+from work_scheduler import WorkScheduler, PRIORITIES
+from tagging.batch_prompts import make_batches, format_numbered_messages, parse_batch_response
+from tagging.fast_path import FastPathTagClassifier, tag_agreement
+from triage import ChatTriage
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -29,9 +43,40 @@ class LocalEnhancedMessageTagger:
     
     def __init__(self, 
                  model: str = "gemma:2b",
-                 processed_dir: str = "data/processed"):
+                 processed_dir: str = "data/processed",
+                 ollama_url: Optional[str] = None,
+                 max_concurrency: Optional[int] = None,
+                 max_workers: int = 1,
+                 batch_size: int = 1,
+                 fast_path: Optional[FastPathTagClassifier] = None,
+                 fast_path_sample_rate: float = 0.05,
+                 triage: Optional[ChatTriage] = None,
+                 scheduler: Optional[WorkScheduler] = None):
         self.model = model
         self.processed_dir = Path(processed_dir)
+        self.max_workers = max(1, max_workers)
+        # Messages per tagging prompt; 1 keeps one prompt per message
+        self.batch_size = max(1, batch_size)
+        self.batch_stats = {'batch_calls': 0, 'batched_messages': 0, 'batch_fallbacks': 0}
+        # Batches are tagged from worker threads
+        self._batch_stats_lock = threading.Lock()
+        # Optional embedding classifier that tags confident messages without the LLM;
+        # a sample of those is still sent to the LLM to measure agreement
+        self.fast_path = fast_path
+        self.fast_path_sample_rate = fast_path_sample_rate
+        # Optional chat triage: messages of trivial chats are tagged with one prompt per chat
+        self.triage = triage
+        # Message order (by chat) and the per-run time/token budget
+        self.scheduler = scheduler or WorkScheduler()
+        self.rate_limiter = AdaptiveRateLimiter.from_delay(0)
+        self.llm_client = LocalLLMClient(
+            model=model,
+            base_url=ollama_url,
+            max_concurrency=max_concurrency or self.max_workers,
+            timeout=60,
+            rate_limiter=self.rate_limiter,
+            cache=open_prompt_cache(self.processed_dir)
+        )
         
         # Use modular directory structure
         self.tagging_dir = self.processed_dir / "tagging"
@@ -113,7 +158,7 @@ class LocalEnhancedMessageTagger:
         """Save hashes of processed messages."""
         hash_file = self.tagging_dir / "hashes.pkl"
         try:
-            with open(hash_file, 'wb') as f:
+            with atomic_write(hash_file) as tmp_file, open(tmp_file, 'wb') as f:
                 pickle.dump(hashes, f)
             logger.info(f"Saved {len(hashes)} processed message hashes")
         except Exception as e:
@@ -204,47 +249,28 @@ Focus on the most relevant tags and topics. Keep tags specific and actionable.""
 
         return prompt
     
-    def _call_ollama(self, prompt: str, max_retries: int = 3) -> Optional[str]:
-        """Call Ollama API to generate tags."""
-        for attempt in range(max_retries):
-            try:
-                # Prepare the request for modern Ollama API
-                request_data = {
-                    "model": self.model,
-                    "messages": [
-                        {"role": "user", "content": prompt}
-                    ],
-                    "stream": False,
-                    "options": {
-                        "temperature": 0.3,
-                        "top_p": 0.9,
-                        "num_predict": 300
-                    }
-                }
-                
-                # Call Ollama using requests instead of subprocess
-                import requests
-                response = requests.post(
-                    "http://localhost:11434/api/chat",
-                    json=request_data,
-                    timeout=60
-                )
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    return result.get('message', {}).get('content', '').strip()
-                else:
-                    logger.warning(f"Ollama API call failed (attempt {attempt + 1}): {response.status_code} - {response.text}")
-                    
-            except requests.exceptions.Timeout:
-                logger.warning(f"Ollama call timed out (attempt {attempt + 1})")
-            except Exception as e:
-                logger.warning(f"Ollama call error (attempt {attempt + 1}): {e}")
-            
-            if attempt < max_retries - 1:
-                time.sleep(2 ** attempt)  # Exponential backoff
+    def _call_ollama(self, prompt: str, num_predict: int = 300, accept=None,
+                     json_root: str = '{') -> Optional[str]:
+        """Call Ollama through the shared client to generate tags.
         
-        return None
+        The response is streamed and generation stops as soon as the JSON
+        object (or array, for batches) closes.
+        """
+        try:
+            response = self.llm_client.chat(
+                prompt,
+                options={
+                    "temperature": 0.3,
+                    "top_p": 0.9,
+                    "num_predict": num_predict
+                },
+                accept=accept or (lambda r: self._extract_json_from_response(r) is not None),
+                json_stream=lambda: JSONStreamScanner(root=json_root, max_tokens=num_predict)
+            )
+            return response.strip()
+        except LLMClientError as e:
+            logger.warning(f"Ollama call failed: {e}")
+            return None
     
     def _extract_json_from_response(self, response: str) -> Optional[Dict]:
         """Extract JSON from LLM response."""
@@ -280,30 +306,172 @@ Focus on the most relevant tags and topics. Keep tags specific and actionable.""
         tag_data = self._extract_json_from_response(response)
         
         if tag_data:
-            # Create minimal tag entry with only hashes and tags
-            message_hash = self._generate_message_hash(message)
-            tag_entry = {
-                'message_hash': message_hash,
-                'message_id': message.get('message_id', ''),
-                'chat_id': message.get('chat_id', ''),
-                'tags': tag_data.get('tags', []),
-                'topics': tag_data.get('topics', []),
-                'domain': tag_data.get('domain', 'other'),
-                'complexity': tag_data.get('complexity', 'medium'),
-                'sentiment': tag_data.get('sentiment', 'neutral'),
-                'intent': tag_data.get('intent', 'other'),
-                'tagged_at': datetime.now().isoformat()
-            }
-            return tag_entry
+            return self._build_tag_entry(message, tag_data)
         else:
             logger.warning(f"Failed to extract tags for message {message.get('message_id', 'unknown')}")
             return None
     
+    def _build_tag_entry(self, message: Dict, tag_data: Dict) -> Dict:
+        """Create minimal tag entry with only hashes and tags."""
+        return {
+            'message_hash': self._generate_message_hash(message),
+            'message_id': message.get('message_id', ''),
+            'chat_id': message.get('chat_id', ''),
+            'tags': tag_data.get('tags', []),
+            'topics': tag_data.get('topics', []),
+            'domain': tag_data.get('domain', 'other'),
+            'complexity': tag_data.get('complexity', 'medium'),
+            'sentiment': tag_data.get('sentiment', 'neutral'),
+            'intent': tag_data.get('intent', 'other'),
+            'tagged_at': datetime.now().isoformat()
+        }
+    
+    def _build_fast_path_entry(self, message: Dict, result: Dict) -> Dict:
+        """Tag entry for a message served by the embedding fast path."""
+        entry = self._build_tag_entry(message, {'tags': result['tags']})
+        entry['tag_source'] = 'fast_path'
+        entry['fast_path_score'] = result['score']
+        return entry
+    
+    def _in_agreement_sample(self, message_hash: str) -> bool:
+        """Deterministic sample of fast-path messages that are also sent to the LLM."""
+        return int(message_hash[:8], 16) / 0xFFFFFFFF < self.fast_path_sample_rate
+    
+    def _apply_fast_path(self, messages: List[Dict], existing_tags: List[Dict]) -> Tuple[Dict[int, Dict], Dict[int, Dict], Dict]:
+        """Split messages into fast-path entries and LLM work.
+        
+        Returns (entries by message index, fast-path results for sampled
+        messages by index, stats). Messages not in the first dict go to the LLM.
+        """
+        entries: Dict[int, Dict] = {}
+        sampled: Dict[int, Dict] = {}
+        if not self.fast_path or not self.fast_path.load(tagged_messages=existing_tags):
+            return entries, sampled, {'fast_path_enabled': False}
+        
+        for i, message in enumerate(messages):
+            message_hash = self._generate_message_hash(message)
+            result = self.fast_path.classify(message_hash)
+            if not result:
+                continue
+            if self._in_agreement_sample(message_hash):
+                sampled[i] = result
+            else:
+                entries[i] = self._build_fast_path_entry(message, result)
+        
+        confident = len(entries) + len(sampled)
+        logger.info(f"⚡ Fast path: {confident}/{len(messages)} messages confident, "
+                    f"{len(sampled)} of them also sent to the LLM for agreement")
+        return entries, sampled, {
+            'fast_path_enabled': True,
+            'fast_path_method': self.fast_path.method,
+            'fast_path_threshold': self.fast_path.threshold,
+            'fast_path_messages': len(entries),
+            'fast_path_confident': confident,
+            'fast_path_fraction': confident / len(messages) if messages else 0.0
+        }
+    
+    def _generate_batch_tagging_prompt(self, messages: List[Dict]) -> str:
+        """Generate one prompt that tags several messages from the same conversation."""
+        texts = [
+            f"(Role: {message.get('role', '')}) {self._sanitize_text(message.get('content', '').strip())}"
+            for message in messages
+        ]
+        
+        return f"""You are an AI assistant that tags conversation messages with relevant topics and categories.
+
+Messages:
+{format_numbered_messages(texts)}
+
+Please provide a JSON array with exactly one object per message, in order:
+[
+    {{
+        "index": 1,
+        "tags": ["tag1", "tag2", "tag3"],
+        "topics": ["topic1", "topic2"],
+        "domain": "technology|health|business|personal|education|entertainment|other",
+        "complexity": "low|medium|high",
+        "sentiment": "positive|negative|neutral",
+        "intent": "question|statement|request|explanation|other"
+    }}
+]
+
+Guidelines:
+- tags: 3-5 specific hashtag-style tags (e.g., "#python", "#cooking", "#health")
+- topics: 2-3 broader topics or themes
+- domain: primary category of the content
+- complexity: technical or conceptual difficulty level
+- sentiment: emotional tone of the message
+- intent: what the speaker is trying to accomplish
+
+Focus on the most relevant tags and topics. Keep tags specific and actionable."""
+    
+    def _tag_message_batch(self, messages: List[Dict]) -> List[Optional[Dict]]:
+        """Tag messages from one conversation with a single prompt.
+        
+        Falls back to one prompt per message for any message whose entry is
+        missing from the batch response (or when the array does not parse).
+        """
+        if len(messages) == 1:
+            return [self._tag_message(messages[0])]
+        
+        results = None
+        response = self._call_ollama(
+            self._generate_batch_tagging_prompt(messages),
+            num_predict=150 * len(messages),
+            accept=lambda r: parse_batch_response(r, len(messages)) is not None,
+            json_root='['
+        )
+        if response:
+            results = parse_batch_response(response, len(messages))
+        with self._batch_stats_lock:
+            self.batch_stats['batch_calls'] += 1
+        
+        entries = []
+        for i, message in enumerate(messages):
+            tag_data = results[i] if results else None
+            if tag_data and isinstance(tag_data.get('tags'), list):
+                entries.append(self._build_tag_entry(message, tag_data))
+                with self._batch_stats_lock:
+                    self.batch_stats['batched_messages'] += 1
+            else:
+                with self._batch_stats_lock:
+                    self.batch_stats['batch_fallbacks'] += 1
+                entries.append(self._tag_message(message))
+        return entries
+    
+    def _make_batches(self, messages: List[Dict], all_messages: List[Dict]) -> Tuple[List[List[Dict]], Set[int]]:
+        """Tagging batches, and the indices of those that belong to trivial chats.
+        
+        Without triage this is make_batches with the configured batch size.
+        With triage, the pending messages of a trivial chat share one prompt.
+        """
+        if not self.triage:
+            return make_batches(messages, self.batch_size), set()
+        
+        chat_messages = defaultdict(list)
+        for message in all_messages:
+            chat_messages[message.get('chat_id')].append(message)
+        pending = defaultdict(list)
+        for message in messages:
+            pending[message.get('chat_id')].append(message)
+        
+        batches, trivial = [], set()
+        for chat_id, group in pending.items():
+            if self.triage.assess(chat_messages[chat_id]):
+                chat_batches = make_batches(group, len(group), max_item_chars=self.triage.max_chars)
+                # LLM calls the chat would have taken with the configured batch size
+                self.triage.record_saved(len(make_batches(group, self.batch_size)) - len(chat_batches))
+                trivial.update(range(len(batches), len(batches) + len(chat_batches)))
+            else:
+                chat_batches = make_batches(group, self.batch_size)
+            batches.extend(chat_batches)
+        return batches, trivial
+    
     def _save_tagged_messages(self, tagged_messages: List[Dict]) -> None:
         """Save tagged messages to JSONL file."""
         tagged_messages_file = self.tagging_dir / "tags.jsonl"
         
-        with jsonlines.open(tagged_messages_file, 'w') as writer:
+        with atomic_write(tagged_messages_file) as tmp_file, jsonlines.open(tmp_file, 'w') as writer:
             for entry in tagged_messages:
                 writer.write(entry)
         
@@ -346,17 +514,66 @@ Focus on the most relevant tags and topics. Keep tags specific and actionable.""
             logger.warning("No messages found")
             return {'status': 'no_messages'}
         
-        # Identify new messages
+        # Recover entries journaled by an interrupted run; those messages are done
+        journal = RunJournal(self.tagging_dir / "tags.journal.jsonl")
+        existing_hashes = {entry.get('message_hash') for entry in existing_tags}
+        recovered_entries = []
+        for record in journal.replay():
+            if record['hash'] not in existing_hashes and record['hash'] not in processed_hashes:
+                recovered_entries.append(record['result'])
+            processed_hashes.add(record['hash'])
+        
+        # Identify new messages, highest-priority chats first
         new_messages = self._identify_new_messages(all_messages, processed_hashes)
+        new_messages = self.scheduler.order_messages(new_messages)
         
-        if not new_messages and not force_reprocess:
+        if not new_messages and not recovered_entries and not force_reprocess:
             logger.info("No new messages to process")
             return {'status': 'no_new_messages'}
         
-        # Tag new messages
-        new_tag_entries = []
-        for message in tqdm(new_messages, desc="Tagging messages"):
-            tag_entry = self._tag_message(message)
+        # Serve confident messages from the embedding fast path
+        fast_entries, sampled, fast_path_stats = self._apply_fast_path(new_messages, existing_tags)
+        llm_indices = [i for i in range(len(new_messages)) if i not in fast_entries]
+        llm_messages = [new_messages[i] for i in llm_indices]
+        
+        batches, trivial_batches = self._make_batches(llm_messages, all_messages)
+        
+        def tag_batch(item: Tuple[int, List[Dict]]) -> List[Optional[Dict]]:
+            index, batch = item
+            # Once the run's budget is spent, leave messages untagged for the next run
+            if not self.scheduler.try_start(sum(estimate_tokens(m.get('content', '')) for m in batch)):
+                return [None] * len(batch)
+            started = time.perf_counter()
+            entries = self._tag_message_batch(batch)
+            if self.triage and index not in trivial_batches:
+                self.triage.record_llm(time.perf_counter() - started)
+            for entry in entries:
+                if entry:
+                    journal.append(entry['message_hash'], entry)
+            return entries
+        
+        # Tag the rest (up to max_workers in flight, results kept in message order),
+        # journaling every entry as soon as it is produced
+        with journal:
+            for entry in fast_entries.values():
+                journal.append(entry['message_hash'], entry)
+            batch_results = map_ordered(tag_batch, list(enumerate(batches)), max_workers=self.max_workers,
+                                        desc="Tagging messages")
+        llm_results = [entry for batch in batch_results for entry in batch]
+        tag_results = [fast_entries.get(i) for i in range(len(new_messages))]
+        for i, entry in zip(llm_indices, llm_results):
+            tag_results[i] = entry
+        
+        if sampled:
+            scores = [tag_agreement(sampled[i]['tags'], tag_results[i]['tags'])
+                      for i in sampled if tag_results[i]]
+            if scores:
+                fast_path_stats['agreement_sample_size'] = len(scores)
+                fast_path_stats['agreement_jaccard'] = sum(s[0] for s in scores) / len(scores)
+                fast_path_stats['agreement_precision'] = sum(s[1] for s in scores) / len(scores)
+        
+        new_tag_entries = list(recovered_entries)
+        for message, tag_entry in zip(new_messages, tag_results):
             if tag_entry:
                 new_tag_entries.append(tag_entry)
                 message_hash = self._generate_message_hash(message)
@@ -364,6 +581,9 @@ Focus on the most relevant tags and topics. Keep tags specific and actionable.""
         
         if not new_tag_entries and not force_reprocess:
             logger.info("No new tag entries generated")
+            # Keep the last run's stats, but record what this run deferred
+            self.scheduler.update_metadata(self.tagging_dir / "metadata.json")
+            self.scheduler.log_stats()
             return {'status': 'no_tagged_messages'}
         
         # Combine existing and new tag entries
@@ -372,16 +592,26 @@ Focus on the most relevant tags and topics. Keep tags specific and actionable.""
         # Save tag entries
         self._save_tagged_messages(all_tag_entries)
         
-        # Save hashes and metadata
+        # Save hashes and metadata; the journal is no longer needed
         self._save_processed_message_hashes(processed_hashes)
+        journal.finish()
         
         # Calculate statistics
         stats = {
             'status': 'success',
             'total_tag_entries': len(all_tag_entries),
             'new_tag_entries': len(new_tag_entries),
+            'recovered_tag_entries': len(recovered_entries),
             'existing_tag_entries': len(existing_tags),
-            'model_used': self.model
+            'model_used': self.model,
+            'max_workers': self.max_workers,
+            'llm_metrics': self.llm_client.get_metrics(),
+            'rate_limiter': self.rate_limiter.get_stats(),
+            'batch_size': self.batch_size,
+            **self.batch_stats,
+            **fast_path_stats,
+            'triage': self.triage.get_stats() if self.triage else None,
+            'scheduler': self.scheduler.get_stats()
         }
         
         self._save_metadata(stats)
@@ -390,6 +620,16 @@ Focus on the most relevant tags and topics. Keep tags specific and actionable.""
         logger.info(f"  Total tag entries: {stats['total_tag_entries']}")
         logger.info(f"  New tag entries: {stats['new_tag_entries']}")
         logger.info(f"  Model used: {stats['model_used']}")
+        if fast_path_stats.get('fast_path_enabled'):
+            logger.info(f"  Fast path: {stats['fast_path_fraction']:.1%} of new messages")
+            if 'agreement_jaccard' in stats:
+                logger.info(f"  Fast path agreement with LLM: Jaccard {stats['agreement_jaccard']:.2f}, "
+                            f"precision {stats['agreement_precision']:.2f} "
+                            f"on {stats['agreement_sample_size']} messages")
+        if self.triage:
+            logger.info(f"  Triaged: {self.triage.describe()}")
+        self.scheduler.log_stats()
+        self.llm_client.log_metrics()
         
         return stats
 
@@ -402,11 +642,42 @@ Focus on the most relevant tags and topics. Keep tags specific and actionable.""
               default='data/processed/tagging/tagged_messages.jsonl',
               help='Output JSONL file for tagged messages')
 @click.option('--model', default='gemma:2b', help='Ollama model to use')
+@click.option('--ollama-url', default=None, help='Ollama server URL (default: $OLLAMA_URL or http://localhost:11434)')
+@click.option('--max-concurrency', default=None, type=int, help='Maximum concurrent Ollama requests (default: $OLLAMA_MAX_CONCURRENCY or 1)')
+@click.option('--max-workers', default=1, type=int, help='Number of messages tagged concurrently')
+@click.option('--batch-size', default=1, type=int, help='Short messages per tagging prompt (1 disables batching)')
+@click.option('--fast-path', is_flag=True, help='Tag confident messages from chunk embeddings without the LLM')
+@click.option('--fast-path-method', default='prototype', type=click.Choice(['prototype', 'knn']),
+              help='Score messages against tag prototypes or nearest LLM-tagged messages')
+@click.option('--fast-path-threshold', default=0.5, type=float, help='Minimum tag similarity for the fast path')
+@click.option('--fast-path-sample-rate', default=0.05, type=float,
+              help='Fraction of fast-path messages also tagged by the LLM to measure agreement')
+@click.option('--triage/--no-triage', default=False,
+              help='Tag the messages of trivial chats (few, short or repeated turns) with one prompt per chat (off by default)')
+@click.option('--priority', default='file', type=click.Choice(PRIORITIES),
+              help='Order of chats: file order, most recent first or shortest first')
+@click.option('--pin', 'pins', multiple=True, help='Chat ID to tag before all others (repeatable)')
+@click.option('--time-budget', default=None, type=float, help='Stop starting new LLM calls after this many minutes')
+@click.option('--token-budget', default=None, type=int, help='Stop starting new LLM calls after about this many prompt tokens')
 @click.option('--force', is_flag=True, help='Force reprocess all messages (ignore state)')
-def main(input_file: str, output_file: str, model: str, force: bool):
+def main(input_file: str, output_file: str, model: str, ollama_url: Optional[str],
+         max_concurrency: Optional[int], max_workers: int, batch_size: int, fast_path: bool,
+         fast_path_method: str, fast_path_threshold: float, fast_path_sample_rate: float, triage: bool,
+         priority: str, pins: Tuple[str, ...], time_budget: Optional[float], token_budget: Optional[int],
+         force: bool):
     """Tag messages using local LLMs."""
     
-    tagger = LocalEnhancedMessageTagger(model=model)
+    classifier = None
+    if fast_path:
+        classifier = FastPathTagClassifier(method=fast_path_method, threshold=fast_path_threshold)
+    
+    tagger = LocalEnhancedMessageTagger(model=model, ollama_url=ollama_url,
+                                        max_concurrency=max_concurrency, max_workers=max_workers,
+                                        batch_size=batch_size, fast_path=classifier,
+                                        fast_path_sample_rate=fast_path_sample_rate,
+                                        triage=ChatTriage() if triage else None,
+                                        scheduler=WorkScheduler.from_options(priority, pins, time_budget,
+                                                                             token_budget))
     
     result = tagger.process_messages_to_tags(
         chats_file=Path(input_file),
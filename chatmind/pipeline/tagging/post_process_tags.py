@@ -11,7 +11,7 @@ import json
 import jsonlines
 import re
 from pathlib import Path
-from typing import Dict, List, Set, Tuple
+from typing import Dict, List, Optional, Set, Tuple
 import logging
 from collections import Counter
 import click
@@ -21,14 +21,69 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+def edit_distance(a: str, b: str, max_distance: int) -> int:
+    """Levenshtein distance, or max_distance + 1 as soon as it is known to be larger."""
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous = current
+    return previous[-1]
+
+
+class NGramIndex:
+    """Character bigram index for bounded edit-distance lookups.
+    
+    Each edit changes at most two bigrams, so a word within distance k of
+    the query must share at least len(bigrams(query)) - 2k of them; only
+    those candidates are compared with the (early-exit) edit distance.
+    """
+    
+    def __init__(self, words: List[str]):
+        self.words = list(words)
+        self.postings: Dict[str, List[int]] = {}
+        for i, word in enumerate(self.words):
+            for gram in self._bigrams(word):
+                self.postings.setdefault(gram, []).append(i)
+    
+    @staticmethod
+    def _bigrams(word: str) -> Set[str]:
+        return {word[i:i + 2] for i in range(len(word) - 1)}
+    
+    def search(self, word: str, max_distance: int) -> List[Tuple[int, str]]:
+        """All (distance, word) pairs within max_distance, closest first."""
+        grams = self._bigrams(word)
+        shared = Counter()
+        for gram in grams:
+            for i in self.postings.get(gram, ()):
+                shared[i] += 1
+        
+        required = len(grams) - 2 * max_distance
+        matches = []
+        for i, count in shared.items():
+            if count < required:
+                continue
+            distance = edit_distance(word, self.words[i], max_distance)
+            if distance <= max_distance:
+                matches.append((distance, self.words[i]))
+        return sorted(matches)
+
+
 class GemmaOptimizedTagPostProcessor:
     """Post-processes tags optimized for Gemma-2B's clean output."""
     
     def __init__(self, master_list_path: str = "../../data/tags_masterlist/comprehensive_generic_tags.json"):
         self.master_list_path = Path(master_list_path)
         self.master_tags = self.load_master_tags()
+        self._build_match_index()
         self.missing_tags = Counter()
         self.mapped_tags = Counter()
+        self.fuzzy_matches = Counter()
         self.domain_fixes = Counter()
         
     def load_master_tags(self) -> Set[str]:
@@ -64,6 +119,40 @@ class GemmaOptimizedTagPostProcessor:
         
         return tag
     
+    @staticmethod
+    def compact_tag(tag: str) -> str:
+        """Tag with hyphens/underscores/spaces removed (#web-dev -> #webdev)."""
+        return re.sub(r'[-_\s]+', '', tag)
+    
+    def _build_match_index(self) -> None:
+        """Index the master list by compact form and build the bigram index for fuzzy lookups."""
+        self.compact_index = {}
+        for master_tag in sorted(self.master_tags):
+            self.compact_index.setdefault(self.compact_tag(master_tag), master_tag)
+        self.fuzzy_index = NGramIndex(list(self.compact_index))
+        self._match_cache: Dict[str, Tuple[str, bool]] = {}
+    
+    @staticmethod
+    def _fuzzy_budget(compact: str) -> int:
+        """Edit distance allowed for a typo; short tags are matched exactly only."""
+        length = len(compact) - 1  # without the '#'
+        if length < 5:
+            return 0
+        return 1 if length <= 8 else 2
+    
+    def _fuzzy_match(self, compact: str) -> Optional[str]:
+        """Closest master tag within the edit-distance budget (via the bigram index), if unambiguous."""
+        budget = self._fuzzy_budget(compact)
+        if not budget:
+            return None
+        # Typos rarely hit the first letter; requiring it avoids #cats -> #bats style mappings
+        candidates = [(d, c) for d, c in self.fuzzy_index.search(compact, budget) if c[:2] == compact[:2]]
+        if not candidates:
+            return None
+        if len(candidates) > 1 and candidates[0][0] == candidates[1][0]:
+            return None
+        return self.compact_index[candidates[0][1]]
+    
     def fix_domain_field(self, domain: str) -> str:
         """Fix Gemma-2B's domain field which sometimes includes the full enum."""
         if not domain:
@@ -88,23 +177,41 @@ class GemmaOptimizedTagPostProcessor:
     
     def find_best_match(self, tag: str, master_tags: Set[str]) -> str:
         """Find the best matching tag in master list."""
+        if master_tags is not self.master_tags:
+            # Ad-hoc master list: exact and compact-form matches only
+            normalized_tag = self.normalize_tag(tag)
+            if normalized_tag in master_tags:
+                return normalized_tag
+            index = {self.compact_tag(t): t for t in sorted(master_tags, reverse=True)}
+            return index.get(self.compact_tag(normalized_tag), normalized_tag)
+        
+        if tag not in self._match_cache:
+            self._match_cache[tag] = self._resolve_tag(tag)
+        result, fuzzy = self._match_cache[tag]
+        if fuzzy:
+            self.fuzzy_matches[f"{self.normalize_tag(tag)} -> {result}"] += 1
+        return result
+    
+    def _resolve_tag(self, tag: str) -> Tuple[str, bool]:
+        """Match a tag against the master index; returns (tag, matched by fuzzy lookup)."""
         normalized_tag = self.normalize_tag(tag)
         
         # Exact match (master list is already normalized)
-        if normalized_tag in master_tags:
-            return normalized_tag
+        if normalized_tag in self.master_tags:
+            return normalized_tag, False
         
-        # Try to find semantic matches by removing hyphens/underscores/spaces
-        # This handles cases like #webdev -> #web-dev
-        semantic_normalized = re.sub(r'[-_\s]+', '', normalized_tag)
+        # Match with hyphens/underscores/spaces removed (#webdev -> #web-dev)
+        compact = self.compact_tag(normalized_tag)
+        if compact in self.compact_index:
+            return self.compact_index[compact], False
         
-        for master_tag in master_tags:
-            master_semantic = re.sub(r'[-_\s]+', '', master_tag)
-            if semantic_normalized == master_semantic:
-                return master_tag
+        # Near-miss spellings (#javascipt -> #javascript)
+        match = self._fuzzy_match(compact)
+        if match is not None:
+            return match, True
         
         # No match found - return the normalized tag
-        return normalized_tag
+        return normalized_tag, False
     
     def process_message_tags(self, message: Dict) -> Dict:
         """Process tags for a single message."""
@@ -218,6 +325,7 @@ class GemmaOptimizedTagPostProcessor:
             'domain_fixes': domain_fixes_count,
             'missing_tags': dict(self.missing_tags),
             'mapped_tags': dict(self.mapped_tags),
+            'fuzzy_matches': dict(self.fuzzy_matches),
             'domain_fixes_breakdown': dict(self.domain_fixes)
         }
     
@@ -231,6 +339,7 @@ class GemmaOptimizedTagPostProcessor:
             'missing_tags': dict(self.missing_tags),
             'total_missing_occurrences': sum(self.missing_tags.values()),
             'unique_missing_tags': len(self.missing_tags),
+            'fuzzy_matches': dict(self.fuzzy_matches),
             'domain_fixes': dict(self.domain_fixes)
         }
         
@@ -280,6 +389,7 @@ class GemmaOptimizedTagPostProcessor:
         
         # Reload master tags
         self.master_tags = self.load_master_tags()
+        self._build_match_index()
 
 
 @click.command()
@@ -367,6 +477,7 @@ def main(input_file: str, output_file: str, missing_report: str,
     logger.info(f"  New tags mapped to master list: {stats['total_mapped']}")
     logger.info(f"  New tags not in master list: {stats['total_unmapped']}")
     logger.info(f"  Domain fields fixed: {stats['domain_fixes']}")
+    logger.info(f"  Tags resolved by fuzzy match: {sum(stats['fuzzy_matches'].values())}")
     logger.info(f"  Unique missing tags: {len(stats['missing_tags'])}")
     
     if stats['missing_tags']:
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Triage of Trivial Conversations
+
+Many chats are one or two quick turns ("convert this to JSON", "fix typo").
+They do not need the full LLM treatment, so the tagging and summarization
+steps check each chat first:
+
+- A chat is trivial when its distinct user/assistant turns are few
+  (max_turns) and short (max_chars in total). Turns repeated verbatim
+  (regenerated answers, "continue" loops) are counted once, so a long but
+  repetitive chat can be trivial too.
+- Trivial chats get a template summary built from their own text instead of
+  an LLM summary, and their messages are tagged with one prompt per chat.
+
+The triage stats report the share of chats triaged out and an estimate of
+the LLM time saved: the avoided LLM work times the average time the same
+work took for the chats that were sent to the LLM in this run.
+"""
+
+import re
+import threading
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Optional
+
+TRIVIAL_MAX_TURNS = 4
+TRIVIAL_MAX_CHARS = 2000
+
+CODE_BLOCK = re.compile(r"```")
+WORD = re.compile(r"[A-Za-z][A-Za-z+#.-]{3,}")
+STOPWORDS = {
+    'this', 'that', 'with', 'from', 'have', 'what', 'when', 'where', 'which', 'would', 'could',
+    'should', 'there', 'their', 'about', 'into', 'your', 'yours', 'here', 'they', 'them', 'then',
+    'than', 'will', 'just', 'like', 'make', 'some', 'also', 'does', 'doing', 'been', 'being',
+    'please', 'thanks', 'thank', 'sure', 'okay', 'want', 'need', 'know', 'more', 'very', 'these',
+    'those', 'only', 'each', 'other', 'following', 'below', 'above', 'using', 'used', 'help'
+}
+
+
+def _normalize(text: str) -> str:
+    return re.sub(r'\s+', ' ', text.strip().lower())
+
+
+def _first_sentence(text: str, limit: int = 200) -> str:
+    text = re.sub(r'\s+', ' ', CODE_BLOCK.split(text)[0]).strip() or re.sub(r'\s+', ' ', text).strip()
+    sentence = re.split(r'(?<=[.!?])\s', text, maxsplit=1)[0]
+    return sentence if len(sentence) <= limit else sentence[:limit].rstrip() + '...'
+
+
+def keywords(text: str, limit: int = 3) -> List[str]:
+    """Most frequent content words of text, ties in order of first appearance."""
+    words = [w.lower().strip('.-') for w in WORD.findall(text)]
+    counts = Counter(w for w in words if w not in STOPWORDS and len(w) > 3)
+    return [word for word, _ in counts.most_common(limit)]
+
+
+class ChatTriage:
+    """Detects trivial chats and keeps the triage stats of one run."""
+
+    def __init__(self, max_turns: int = TRIVIAL_MAX_TURNS, max_chars: int = TRIVIAL_MAX_CHARS):
+        self.max_turns = max_turns
+        self.max_chars = max_chars
+        self._lock = threading.Lock()
+        self.assessed = 0
+        self.reasons: Counter = Counter()
+        # LLM work done for non-trivial chats in this run, to estimate the time saved
+        self.llm_units = 0
+        self.llm_seconds = 0.0
+        self.saved_units = 0
+
+    def assess(self, messages: List[Dict]) -> Optional[str]:
+        """Why a chat is trivial ('empty', 'short' or 'repetitive'), or None if it needs the LLM."""
+        turns = [msg.get('content', '') for msg in messages
+                 if msg.get('role') in ('user', 'assistant') and msg.get('content', '').strip()]
+        distinct = list(dict.fromkeys(_normalize(turn) for turn in turns))
+        reason = None
+        if not distinct:
+            reason = 'empty'
+        elif len(distinct) <= self.max_turns and sum(len(turn) for turn in distinct) <= self.max_chars:
+            reason = 'short' if len(distinct) == len(turns) else 'repetitive'
+        with self._lock:
+            self.assessed += 1
+            if reason:
+                self.reasons[reason] += 1
+        return reason
+
+    def record_llm(self, seconds: float, units: int = 1) -> None:
+        """LLM work (in calls or chats) done for a non-trivial chat, and how long it took."""
+        with self._lock:
+            self.llm_units += units
+            self.llm_seconds += seconds
+
+    def record_saved(self, units: int = 1) -> None:
+        """LLM work (in the same units) a trivial chat did not need."""
+        with self._lock:
+            self.saved_units += units
+
+    def template_summary(self, chat: Dict, reason: str) -> Dict:
+        """Chat summary built from the chat's own text, in the LLM summary format."""
+        messages = chat.get('messages', [])
+        user_turns = [m.get('content', '') for m in messages if m.get('role') == 'user' and m.get('content', '').strip()]
+        assistant_turns = [m.get('content', '') for m in messages
+                           if m.get('role') == 'assistant' and m.get('content', '').strip()]
+        text = "\n".join(user_turns + assistant_turns)
+        has_code = bool(CODE_BLOCK.search(text))
+
+        if user_turns:
+            summary = f"Short conversation: {_first_sentence(user_turns[0])}"
+        else:
+            summary = f"Short conversation: {chat.get('title') or 'untitled'}"
+        return {
+            'summary': summary,
+            'key_topics': keywords("\n".join(user_turns) or text) or ['general'],
+            'participants': sorted({m.get('role') for m in messages if m.get('role') in ('user', 'assistant')}),
+            'conversation_type': 'problem_solving' if has_code else 'other',
+            'key_decisions': [],
+            'outcomes': _first_sentence(assistant_turns[-1]) if assistant_turns else 'No reply',
+            'complexity': 'beginner',
+            'domain': 'technical' if has_code else 'other',
+            'confidence': 0.4,
+            'chat_id': chat.get('content_hash', chat.get('chat_id', 'unknown')),
+            'message_count': len(messages),
+            'timestamp': datetime.now().isoformat(),
+            'model': 'template',
+            'processing_method': 'triaged',
+            'triage_reason': reason,
+            'duration_minutes': None
+        }
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            triaged = sum(self.reasons.values())
+            seconds_per_unit = self.llm_seconds / self.llm_units if self.llm_units else None
+            return {
+                'max_turns': self.max_turns,
+                'max_chars': self.max_chars,
+                'assessed_chats': self.assessed,
+                'triaged_chats': triaged,
+                'triaged_fraction': triaged / self.assessed if self.assessed else 0.0,
+                'reasons': dict(self.reasons),
+                'llm_seconds_per_unit': round(seconds_per_unit, 2) if seconds_per_unit is not None else None,
+                'estimated_llm_seconds_saved': (round(seconds_per_unit * self.saved_units, 1)
+                                                if seconds_per_unit is not None else None)
+            }
+
+    def describe(self) -> str:
+        """One-line report for the step's summary log."""
+        stats = self.get_stats()
+        saved = stats['estimated_llm_seconds_saved']
+        return (f"{stats['triaged_chats']}/{stats['assessed_chats']} chats "
+                f"({stats['triaged_fraction']:.1%}), "
+                + (f"about {saved:.0f}s of LLM time saved" if saved is not None
+                   else "LLM time saved unknown (no LLM work to compare with)"))
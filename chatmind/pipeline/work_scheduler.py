@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Work Scheduler
+
+Orders the work items of the LLM steps (tagging, chat and cluster
+summarization) and enforces a per-run budget.
+
+- Priority: 'file' keeps input order, 'recent' puts the newest chats first,
+  'shortest' puts the cheapest items first. Chats pinned by ID always go
+  first, in the order given.
+- Budget: a time budget (seconds since the step started) and/or a token
+  budget (prompt tokens from prompt_budget.estimate_tokens, the one estimate
+  the LLM steps share). Once either is spent, no new items are
+  started. Deferred items are simply not marked as processed, so the next
+  run picks them up - in priority order again.
+
+Items are grouped into units (a chat, or a cluster) so that messages of one
+conversation stay together for batching and conversation context.
+"""
+
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, TypeVar
+import logging
+
+from run_journal import atomic_write
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+PRIORITIES = ('file', 'recent', 'shortest')
+
+
+def parse_timestamp(value: Any) -> float:
+    """Epoch seconds from an epoch number, numeric string or ISO date (0 if unknown)."""
+    if value is None or value == '':
+        return 0.0
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        pass
+    try:
+        return datetime.fromisoformat(str(value).replace('Z', '+00:00')).timestamp()
+    except ValueError:
+        return 0.0
+
+
+def latest_timestamp(records: Iterable[Dict], fields=('update_time', 'create_time', 'timestamp')) -> float:
+    """Most recent timestamp found in any of fields across records."""
+    latest = 0.0
+    for record in records:
+        for field in fields:
+            latest = max(latest, parse_timestamp(record.get(field)))
+    return latest
+
+
+class WorkScheduler:
+    """Priority ordering plus a time/token budget for one run of an LLM step."""
+
+    def __init__(self,
+                 priority: str = 'file',
+                 pinned_ids: Optional[Iterable[str]] = None,
+                 time_budget: Optional[float] = None,
+                 token_budget: Optional[int] = None):
+        """
+        priority: 'file', 'recent' or 'shortest'.
+        pinned_ids: chat (or cluster) IDs processed before everything else.
+        time_budget: seconds after which no new items start (None = unlimited).
+        token_budget: estimated prompt tokens after which no new items start (None = unlimited).
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority: {priority}")
+        self.priority = priority
+        self.pinned_ids = list(dict.fromkeys(pinned_ids or []))
+        self.time_budget = time_budget
+        self.token_budget = token_budget
+
+        self._started = time.monotonic()
+        self._lock = threading.Lock()
+        self.tokens_used = 0
+        self.scheduled = 0
+        self.deferred = 0
+        self.exhausted_reason = ''
+
+    @classmethod
+    def from_options(cls, priority: str = 'file', pins: Iterable[str] = (),
+                     time_budget_minutes: Optional[float] = None,
+                     token_budget: Optional[int] = None) -> 'WorkScheduler':
+        """Build from CLI options; --pin values may also be comma-separated."""
+        pinned = [pin.strip() for value in pins for pin in value.split(',') if pin.strip()]
+        time_budget = time_budget_minutes * 60 if time_budget_minutes else None
+        return cls(priority=priority, pinned_ids=pinned, time_budget=time_budget,
+                   token_budget=token_budget or None)
+
+    def order(self, units: List[T],
+              ids: Callable[[T], Iterable[str]],
+              timestamp: Callable[[T], float],
+              size: Callable[[T], int]) -> List[T]:
+        """Return units in processing order (stable, so ties keep input order).
+
+        ids gives the IDs a unit can be pinned by (chat ID, cluster ID, the
+        chats in a cluster), timestamp its recency and size its cost.
+        """
+        pin_rank = {pin: rank for rank, pin in enumerate(self.pinned_ids)}
+
+        def key(unit: T):
+            ranks = [pin_rank[i] for i in ids(unit) if i in pin_rank]
+            pinned = min(ranks) if ranks else len(pin_rank)
+            if self.priority == 'recent':
+                return (pinned, -timestamp(unit))
+            if self.priority == 'shortest':
+                return (pinned, size(unit))
+            return (pinned, 0)
+
+        if self.priority == 'file' and not pin_rank:
+            return list(units)
+        return sorted(units, key=key)
+
+    def order_messages(self, messages: List[Dict]) -> List[Dict]:
+        """Order messages chat by chat, keeping each chat's messages in their original order."""
+        chats: Dict[str, List[Dict]] = OrderedDict()
+        for message in messages:
+            chats.setdefault(message.get('chat_id', 'unknown'), []).append(message)
+        ordered = self.order(
+            list(chats.values()),
+            ids=lambda chat: [chat[0].get('chat_id', 'unknown')],
+            timestamp=latest_timestamp,
+            size=lambda chat: sum(len(m.get('content', '')) for m in chat)
+        )
+        return [message for chat in ordered for message in chat]
+
+    def order_chats(self, chats: List[Dict]) -> List[Dict]:
+        """Order chat records from chats.jsonl."""
+        return self.order(
+            chats,
+            ids=lambda chat: [chat.get('content_hash', chat.get('chat_id', 'unknown'))],
+            timestamp=lambda chat: max(latest_timestamp([chat]), latest_timestamp(chat.get('messages', []))),
+            size=lambda chat: sum(len(m.get('content', '')) for m in chat.get('messages', []))
+        )
+
+    def order_clusters(self, clusters: Dict[str, List[Dict]]) -> List[Tuple[str, List[Dict]]]:
+        """Order (cluster_id, chunks) pairs; a cluster is pinned by its own ID or any of its chats."""
+        return self.order(
+            list(clusters.items()),
+            ids=lambda item: [item[0]] + [chunk.get('chat_id', '') for chunk in item[1]],
+            timestamp=lambda item: latest_timestamp(item[1]),
+            size=lambda item: sum(len(chunk.get('content', '')) for chunk in item[1])
+        )
+
+    def try_start(self, tokens: int = 0) -> bool:
+        """Admit one work item of about tokens prompt tokens; False once the budget is spent.
+
+        Safe to call from worker threads. Items already running are never
+        interrupted; a budget only stops new items from starting.
+        """
+        with self._lock:
+            if not self.exhausted_reason:
+                if self.time_budget is not None and time.monotonic() - self._started >= self.time_budget:
+                    self.exhausted_reason = f"time budget of {self.time_budget / 60:.1f} min"
+                elif self.token_budget is not None and self.tokens_used >= self.token_budget:
+                    self.exhausted_reason = f"token budget of {self.token_budget} tokens"
+                if self.exhausted_reason:
+                    logger.warning(f"⏳ {self.exhausted_reason.capitalize()} reached; "
+                                   f"remaining items are deferred to the next run")
+            if self.exhausted_reason:
+                self.deferred += 1
+                return False
+            self.tokens_used += tokens
+            self.scheduled += 1
+            return True
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                'priority': self.priority,
+                'pinned_ids': len(self.pinned_ids),
+                'time_budget_seconds': self.time_budget,
+                'token_budget': self.token_budget,
+                'scheduled_items': self.scheduled,
+                'deferred_items': self.deferred,
+                'estimated_tokens': self.tokens_used,
+                'elapsed_seconds': round(time.monotonic() - self._started, 1),
+                'budget_exhausted': self.exhausted_reason or None
+            }
+
+    def update_metadata(self, metadata_file: Path) -> None:
+        """Record this run's scheduler stats in a step's metadata.json, for runs with no new output.
+
+        Only the 'scheduler' stats are replaced; the rest of the last
+        productive run's stats is kept. The file is only touched when this
+        run or the recorded one deferred items, since the pipeline reads
+        deferred_items to decide whether to run the step again.
+        """
+        metadata_file = Path(metadata_file)
+        try:
+            with open(metadata_file, 'r') as f:
+                metadata = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            metadata = {'timestamp': datetime.now().isoformat(), 'stats': {}}
+        stats = metadata.setdefault('stats', {})
+        recorded = (stats.get('scheduler') or {}).get('deferred_items', 0)
+        if not self.deferred and not recorded:
+            return
+        stats['scheduler'] = self.get_stats()
+        metadata['scheduler_updated_at'] = datetime.now().isoformat()
+        try:
+            with atomic_write(metadata_file) as tmp_file, open(tmp_file, 'w') as f:
+                json.dump(metadata, f, indent=2)
+        except OSError as e:
+            logger.error(f"Failed to update scheduler stats in {metadata_file}: {e}")
+
+    def log_stats(self) -> None:
+        if self.deferred:
+            logger.info(f"  Scheduler ({self.priority} first): {self.scheduled} items run, "
+                        f"{self.deferred} deferred ({self.exhausted_reason})")
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Worker Pool
+
+Bounded concurrent execution for LLM-bound pipeline steps. Work items are run
+on a thread pool with a fixed number of in-flight requests and results are
+returned in input order, so output files and hash bookkeeping stay
+deterministic. An adaptive (AIMD) rate limiter replaces fixed sleeps between
+calls: it speeds up while requests succeed and backs off when the server
+throttles.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+from typing import Callable, Iterable, List, Optional, TypeVar
+import logging
+
+from tqdm import tqdm
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+R = TypeVar('R')
+M = TypeVar('M')
+P = TypeVar('P')
+
+
+class AdaptiveRateLimiter:
+    """Thread-safe request pacer with additive increase / multiplicative decrease."""
+
+    def __init__(self, initial_rate: float = 5.0, min_rate: float = 0.2,
+                 max_rate: float = 50.0, increase: float = 0.5, decrease: float = 0.5):
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.rate = min(max(initial_rate, min_rate), max_rate)
+        self.increase = increase
+        self.decrease = decrease
+        self.throttle_events = 0
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_delay(cls, delay_between_calls: float, **kwargs) -> 'AdaptiveRateLimiter':
+        """Build a limiter whose starting rate matches a fixed per-call delay."""
+        max_rate = kwargs.get('max_rate', 50.0)
+        initial_rate = 1.0 / delay_between_calls if delay_between_calls > 0 else max_rate
+        return cls(initial_rate=initial_rate, **kwargs)
+
+    def acquire(self) -> None:
+        """Block until the caller may start its next request."""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + 1.0 / self.rate
+        wait = slot - now
+        if wait > 0:
+            time.sleep(wait)
+
+    def on_success(self) -> None:
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_throttle(self) -> None:
+        """Halve the rate and push the next slot out after a throttled request."""
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            self._next_slot = max(self._next_slot, time.monotonic() + 1.0 / self.rate)
+            self.throttle_events += 1
+        logger.debug(f"Rate limited, slowing to {self.rate:.2f} requests/s")
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {'current_rate': round(self.rate, 3), 'throttle_events': self.throttle_events}
+
+
+def map_ordered(func: Callable[[T], R], items: Iterable[T], max_workers: int = 1,
+                desc: Optional[str] = None) -> List[R]:
+    """Apply func to every item with up to max_workers in flight, keeping input order.
+
+    With max_workers <= 1 the items are processed serially on the calling
+    thread, which keeps the old behaviour (and tracebacks) for debugging.
+    """
+    items = list(items)
+    if max_workers <= 1 or len(items) <= 1:
+        return [func(item) for item in tqdm(items, desc=desc, disable=desc is None)]
+
+    results: List[Optional[R]] = [None] * len(items)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(func, item): i for i, item in enumerate(items)}
+        with tqdm(total=len(items), desc=desc, disable=desc is None) as progress:
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+                progress.update(1)
+    return results
+
+
+
+def map_reduce_ordered(plan: Callable[[T], Optional[List[M]]], map_func: Callable[[M], P],
+                       reduce_func: Callable[[T, List[P]], R], jobs: Iterable[T], max_workers: int = 1,
+                       desc: Optional[str] = None) -> List[Optional[R]]:
+    """Two-stage execution of jobs on one pool of max_workers, keeping job order.
+
+    plan(job) returns the job's map items, or None to skip the job (its
+    result is None). The map items of all jobs share the pool, and a job's
+    reduce_func(job, map_results) is queued as soon as its own map items are
+    done rather than after the whole map stage. Jobs are planned lazily on
+    the calling thread, with at most 2 x max_workers jobs in progress, so
+    planning (and any budget check in it) happens close to execution.
+
+    After the first error (in plan, a map item or a reduce) no new jobs are
+    planned; jobs already in progress still finish before the error is
+    raised. A job with a failed map item is not reduced.
+
+    With max_workers <= 1 jobs run serially on the calling thread.
+    """
+    jobs = list(jobs)
+    results: List[Optional[R]] = [None] * len(jobs)
+    if max_workers <= 1:
+        for i, job in enumerate(tqdm(jobs, desc=desc, disable=desc is None)):
+            items = plan(job)
+            if items is not None:
+                results[i] = reduce_func(job, [map_func(item) for item in items])
+        return results
+
+    window = max(2, 2 * max_workers)
+    in_progress = threading.Semaphore(window)
+    errors: List[BaseException] = []
+    lock = threading.Lock()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor, \
+            tqdm(total=len(jobs), desc=desc, disable=desc is None) as progress:
+
+        def job_done() -> None:
+            progress.update(1)
+            in_progress.release()
+
+        def run_reduce(i: int, job: T, map_results: List[P]) -> None:
+            try:
+                results[i] = reduce_func(job, map_results)
+            except BaseException as e:
+                with lock:
+                    errors.append(e)
+            finally:
+                job_done()
+
+        def queue_reduce(i: int, job: T, map_results: List[P]) -> None:
+            try:
+                executor.submit(run_reduce, i, job, map_results)
+            except RuntimeError:
+                # The pool is shutting down; reduce on this thread rather than losing the result
+                run_reduce(i, job, map_results)
+
+        def collector(i: int, job: T, count: int) -> Callable:
+            """Done-callback for job i's map futures; queues the reduce after the last one."""
+            map_results: List[Optional[P]] = [None] * count
+            remaining = [count]
+            failed = [False]
+
+            def on_mapped(k: int, future) -> None:
+                if future.exception() is not None:
+                    with lock:
+                        errors.append(future.exception())
+                        failed[0] = True
+                else:
+                    map_results[k] = future.result()
+                with lock:
+                    remaining[0] -= 1
+                    last = remaining[0] == 0
+                if last:
+                    if failed[0]:
+                        job_done()
+                    else:
+                        queue_reduce(i, job, map_results)
+
+            return on_mapped
+
+        try:
+            for i, job in enumerate(jobs):
+                in_progress.acquire()
+                if errors:
+                    in_progress.release()
+                    break
+                try:
+                    items = plan(job)
+                except BaseException:
+                    in_progress.release()
+                    raise
+                if items is None:
+                    job_done()
+                    continue
+                if not items:
+                    queue_reduce(i, job, [])
+                    continue
+
+                on_mapped = collector(i, job, len(items))
+                for k, item in enumerate(items):
+                    executor.submit(map_func, item).add_done_callback(partial(on_mapped, k))
+        finally:
+            # Wait for every job in progress to be reduced, also when planning failed,
+            # so their reduces still run before the pool shuts down
+            for _ in range(window):
+                in_progress.acquire()
+
+    if errors:
+        raise errors[0]
+    return results
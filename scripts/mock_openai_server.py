@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the OpenAI chat completions API that enforces
+requests/min and tokens/min limits, for exercising the cloud steps' async
+request pool without an API key or real rate limits.
+
+Usage:
+  # Serve on port 8089; point the cloud steps at it
+  python scripts/mock_openai_server.py --rpm 300 --tpm 60000 --latency 0.8
+  OPENAI_BASE_URL=http://127.0.0.1:8089/v1 OPENAI_API_KEY=mock \\
+      python chatmind/pipeline/chat_summarization/cloud_api/cloud_chat_summarizer.py \\
+      --requests-per-minute 300 --tokens-per-minute 60000 --max-workers 16
+
+  # Send 200 requests through the pool against an in-process server and report throughput
+  python scripts/mock_openai_server.py --benchmark 200 --max-in-flight 16
+
+  # Answer the batch jobs waiting in the local batch submitter's directory
+  python scripts/mock_openai_server.py --complete-batches data/processed/batch_exchange
+
+Requests over a limit get a 429 with retry-after-ms / retry-after and
+x-ratelimit-* headers, like the real API. Completions are a fixed JSON
+summary that satisfies both summarizers, or a tag set per message for
+batched tagging prompts. GET /stats returns counters.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import re
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Deque, Dict, List, Optional, Tuple
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+sys.path.append(str(PROJECT_ROOT / "chatmind" / "pipeline"))
+
+WINDOW_SECONDS = 60.0
+COMPLETION = {
+    "summary": "Mock summary of the conversation content.",
+    "key_topics": ["mock", "rate limits"],
+    "participants": ["user", "assistant"],
+    "conversation_type": "other",
+    "key_decisions": [],
+    "outcomes": "None",
+    "complexity": "beginner",
+    "domain": "technical",
+    "sample_questions": ["What is a mock?"],
+    "confidence": 0.5
+}
+TAG_SET = {"tags": ["#mock"], "domain": "technical", "complexity": "beginner", "confidence": 0.5}
+NUMBERED_MESSAGE = re.compile(r"^\s*\[(\d+)\] ", re.MULTILINE)
+EMBEDDING_DIMENSION = 1536
+
+
+def mock_completion(request: Dict) -> str:
+    """Completion text for a request: one tag set per numbered message, else the fixed summary."""
+    prompt = "\n".join(m.get("content") or "" for m in request.get("messages", []))
+    numbers = [int(n) for n in NUMBERED_MESSAGE.findall(prompt)]
+    if "JSON array" in prompt and numbers:
+        return json.dumps([{"index": i, **TAG_SET} for i in range(1, max(numbers) + 1)])
+    return json.dumps(COMPLETION)
+
+
+def mock_embedding(text: str) -> List[float]:
+    """Deterministic unit vector for a text."""
+    rng = random.Random(hashlib.sha256(text.encode()).hexdigest())
+    vector = [rng.gauss(0, 1) for _ in range(EMBEDDING_DIMENSION)]
+    norm = sum(x * x for x in vector) ** 0.5
+    return [x / norm for x in vector]
+
+
+class RateWindow:
+    """Sliding one-minute window of (time, tokens) for admitted requests."""
+
+    def __init__(self, rpm: Optional[int], tpm: Optional[int]):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.entries: Deque[Tuple[float, int]] = deque()
+        self.tokens = 0
+        self.lock = threading.Lock()
+        self.stats = {"served": 0, "throttled": 0, "tokens": 0}
+
+    def admit(self, tokens: int) -> Optional[float]:
+        """None if the request is admitted, else seconds until it would be."""
+        with self.lock:
+            now = time.monotonic()
+            while self.entries and now - self.entries[0][0] >= WINDOW_SECONDS:
+                self.tokens -= self.entries.popleft()[1]
+            waits = []
+            if self.rpm and len(self.entries) >= self.rpm:
+                waits.append(self.entries[0][0] + WINDOW_SECONDS - now)
+            if self.tpm and self.tokens + tokens > self.tpm and self.entries:
+                # Wait until enough old requests leave the window
+                freed = 0
+                for started, used in self.entries:
+                    freed += used
+                    if self.tokens - freed + tokens <= self.tpm:
+                        waits.append(started + WINDOW_SECONDS - now)
+                        break
+            if waits:
+                self.stats["throttled"] += 1
+                return max(0.001, max(waits))
+            self.entries.append((now, tokens))
+            self.tokens += tokens
+            self.stats["served"] += 1
+            self.stats["tokens"] += tokens
+            return None
+
+
+def make_handler(window: RateWindow, latency: float):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _reply(self, status: int, body: Dict, headers: Optional[Dict[str, str]] = None) -> None:
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path.rstrip("/").endswith("/stats"):
+                self._reply(200, window.stats)
+            else:
+                self._reply(404, {"error": {"message": "not found"}})
+
+        def do_POST(self):
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._reply(404, {"error": {"message": "not found"}})
+                return
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            prompt_tokens = sum(len(m.get("content") or "") // 4 + 4 for m in request.get("messages", []))
+            completion = mock_completion(request)
+            completion_tokens = len(completion) // 4
+            # Like the API, max_tokens counts against the token limit on admission
+            wait = window.admit(prompt_tokens + (request.get("max_tokens") or completion_tokens))
+            if wait is not None:
+                self._reply(429, {"error": {"message": "Rate limit reached (mock)", "type": "requests",
+                                            "code": "rate_limit_exceeded"}},
+                            {"retry-after-ms": str(int(wait * 1000)), "retry-after": str(max(1, round(wait))),
+                             "x-ratelimit-reset-requests": f"{wait:.3f}s"})
+                return
+            time.sleep(latency)
+            self._reply(200, {
+                "id": f"chatcmpl-mock-{window.stats['served']}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", "mock"),
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": completion}}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                          "total_tokens": prompt_tokens + completion_tokens}
+            })
+
+    return Handler
+
+
+def serve(port: int, rpm: Optional[int], tpm: Optional[int], latency: float) -> ThreadingHTTPServer:
+    window = RateWindow(rpm, tpm)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(window, latency))
+    server.daemon_threads = True
+    server.window = window
+    return server
+
+
+class MockAPIError(Exception):
+    """HTTP error with the attributes the pool reads from OpenAI's errors."""
+
+    def __init__(self, status_code: int, headers: Dict[str, str], message: str):
+        super().__init__(f"{status_code}: {message}")
+        self.status_code = status_code
+        self.response = SimpleNamespace(headers=headers)
+
+
+def _namespace(value):
+    if isinstance(value, dict):
+        return SimpleNamespace(**{key: _namespace(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return [_namespace(item) for item in value]
+    return value
+
+
+def urllib_sender(base_url: str):
+    """Async send() for the pool using only the standard library (when openai is not installed)."""
+    def post(request: Dict):
+        req = urllib.request.Request(f"{base_url}/chat/completions", data=json.dumps(request).encode(),
+                                     headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(req, timeout=60) as response:
+                return _namespace(json.loads(response.read()))
+        except urllib.error.HTTPError as e:
+            raise MockAPIError(e.code, dict(e.headers), e.read().decode(errors="replace"))
+
+    async def send(**request):
+        return await asyncio.to_thread(post, request)
+    return send
+
+
+def benchmark(args: argparse.Namespace) -> None:
+    from async_request_pool import AsyncRequestPool, OPENAI_AVAILABLE
+    from worker_pool import map_ordered
+
+    server = serve(0, args.rpm, args.tpm, args.latency)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+    send = None if OPENAI_AVAILABLE else urllib_sender(base_url)
+    pool = AsyncRequestPool(args.rpm, args.tpm, args.max_in_flight, base_url=base_url, send=send)
+    request = {"model": "gpt-4o-mini", "max_tokens": 300,
+               "messages": [{"role": "user", "content": "Summarize this conversation. " * 40}]}
+
+    started = time.monotonic()
+    map_ordered(lambda _: pool.create(**request), range(args.benchmark), max_workers=args.max_in_flight)
+    elapsed = time.monotonic() - started
+    stats = pool.get_stats()
+    pool.close()
+    server.shutdown()
+
+    print(f"{args.benchmark} requests in {elapsed:.1f}s with {args.max_in_flight} in flight "
+          f"({'openai client' if send is None else 'stdlib client'})")
+    print(f"  achieved: {stats['achieved_requests_per_minute']} requests/min, "
+          f"{stats['achieved_tokens_per_minute']} tokens/min "
+          f"(limits {args.rpm or '-'} / {args.tpm or '-'})")
+    print(f"  one at a time would take about {args.benchmark * args.latency:.1f}s at {args.latency}s latency")
+    print(f"  429s from the server: {server.window.stats['throttled']}, "
+          f"retries: {stats['retries']}, failed: {stats['failed']}")
+
+
+def complete_batches(directory: Path) -> int:
+    """Write an output file for every job in the local batch submitter's directory that has none."""
+    completed = 0
+    for input_file in sorted(directory.glob("*.input.jsonl")):
+        output_file = input_file.with_name(input_file.name.replace(".input.jsonl", ".output.jsonl"))
+        if output_file.exists():
+            continue
+        with open(input_file, encoding="utf-8") as f_in, open(output_file, "w", encoding="utf-8") as f_out:
+            for number, line in enumerate(f_in):
+                if not line.strip():
+                    continue
+                request = json.loads(line)
+                body = request["body"]
+                if request["url"].endswith("/embeddings"):
+                    inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+                    tokens = sum(len(text) // 4 for text in inputs)
+                    response = {"object": "list", "model": body.get("model", "mock"),
+                                "data": [{"object": "embedding", "index": i, "embedding": mock_embedding(text)}
+                                         for i, text in enumerate(inputs)],
+                                "usage": {"prompt_tokens": tokens, "total_tokens": tokens}}
+                else:
+                    completion = mock_completion(body)
+                    response = {"id": f"chatcmpl-batch-{number}", "object": "chat.completion",
+                                "created": int(time.time()), "model": body.get("model", "mock"),
+                                "choices": [{"index": 0, "finish_reason": "stop",
+                                             "message": {"role": "assistant", "content": completion}}]}
+                f_out.write(json.dumps({"id": f"batch_req_{number}", "custom_id": request["custom_id"],
+                                        "response": {"status_code": 200, "request_id": f"req_{number}",
+                                                     "body": response},
+                                        "error": None}) + "\n")
+        completed += 1
+        print(f"✅ Completed batch job {input_file.name}")
+    return completed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--rpm", type=int, default=300, help="Requests per minute before 429s")
+    parser.add_argument("--tpm", type=int, default=60000, help="Tokens per minute before 429s")
+    parser.add_argument("--latency", type=float, default=0.8, help="Seconds each completion takes")
+    parser.add_argument("--benchmark", type=int, default=0,
+                        help="Run this many requests through the async request pool and exit")
+    parser.add_argument("--max-in-flight", type=int, default=16, help="Pool concurrency for --benchmark")
+    parser.add_argument("--complete-batches", metavar="DIR", default=None,
+                        help="Answer the jobs in a local batch submitter directory and exit")
+    args = parser.parse_args()
+
+    if args.complete_batches:
+        print(f"{complete_batches(Path(args.complete_batches))} batch job(s) completed")
+        return
+    if args.benchmark:
+        benchmark(args)
+        return
+
+    server = serve(args.port, args.rpm, args.tpm, args.latency)
+    print(f"✅ Mock OpenAI API on http://127.0.0.1:{args.port}/v1 "
+          f"(limits {args.rpm} requests/min, {args.tpm} tokens/min, {args.latency}s latency)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()